@@ -38,3 +38,50 @@ CREATE TABLE `sb_users_token` (
   KEY `user_id_idx` (`user_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=1 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
 
+
+
+
+CREATE TABLE `sb_extraction_results` (
+  `id` bigint NOT NULL AUTO_INCREMENT,
+  `run_id` char(32) NOT NULL,
+  `request_type` enum('EXTRACTION','VERIFICATION','ANALYSIS') NOT NULL,
+  `content_hash` char(64) NOT NULL,
+  `options` varchar(100) NOT NULL,
+  `file_name` varchar(255) DEFAULT NULL,
+  `page` int NOT NULL,
+  `shipment_id` varchar(50) DEFAULT NULL,
+  `delivery_id` varchar(50) DEFAULT NULL,
+  `company_id` varchar(50) DEFAULT NULL,
+  `company_match` tinyint(1) DEFAULT NULL,
+  `degraded` tinyint(1) NOT NULL DEFAULT '0',
+  `result` json NOT NULL,
+  `user_id` bigint DEFAULT NULL,
+  `run_info` json DEFAULT NULL,
+  `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `updated_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `shipment_id_idx` (`shipment_id`),
+  KEY `delivery_id_idx` (`delivery_id`),
+  KEY `company_id_idx` (`company_id`),
+  KEY `user_id_idx` (`user_id`),
+  KEY `content_hash_idx` (`content_hash`,`request_type`,`options`)
+) ENGINE=InnoDB AUTO_INCREMENT=1 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+
+
+
+
+CREATE TABLE `sb_batch_jobs` (
+  `id` char(32) NOT NULL,
+  `status` enum('QUEUED','RUNNING','DONE','FAILED') NOT NULL,
+  `options` varchar(100) NOT NULL,
+  `documents` int NOT NULL,
+  `completed` int NOT NULL DEFAULT '0',
+  `results` json NOT NULL,
+  `user_id` bigint DEFAULT NULL,
+  `worker` varchar(100) DEFAULT NULL,
+  `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `updated_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `user_id_idx` (`user_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+
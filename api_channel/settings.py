@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 load_dotenv()
@@ -29,8 +30,71 @@ DEBUG = False
 
 # 
 MODELS_PATH= envs.get('MODELS_PATH', 'trained_models')
+MODEL_WARMUP= envs.get('MODEL_WARMUP', 'True').lower() == 'true'
+MODEL_WARMUP_WORKERS= int(envs.get('MODEL_WARMUP_WORKERS', 4))
+MODEL_PRELOAD= envs.get('MODEL_PRELOAD', 'False').lower() == 'true'
+MODEL_RETRY_BACKOFF= float(envs.get('MODEL_RETRY_BACKOFF', 30))
+MODEL_POOL_SIZES= {name: int(size) for name, size in (item.split('=') for item in envs.get('MODEL_POOL_SIZES', '').split(',') if item)}
+IMAGE_MAX_PIXELS= int(envs.get('IMAGE_MAX_PIXELS', 150000000))
+IMAGE_MAX_SIDE= int(envs.get('IMAGE_MAX_SIDE', 2400))
+SCRATCH_DIR= envs.get('SCRATCH_DIR') or os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'sb-scratch')
+SCRATCH_QUOTA_MB= int(envs.get('SCRATCH_QUOTA_MB', 512))
+SCRATCH_MAX_AGE= int(envs.get('SCRATCH_MAX_AGE', 3600))
+BATCH_SCRATCH_QUOTA_MB= int(envs.get('BATCH_SCRATCH_QUOTA_MB', 1024))
+BATCH_MAX_DOCUMENTS= int(envs.get('BATCH_MAX_DOCUMENTS', 100))
+BATCH_DOWNLOAD_WORKERS= int(envs.get('BATCH_DOWNLOAD_WORKERS', 8))
+BATCH_JOB_WORKERS= int(envs.get('BATCH_JOB_WORKERS', 1))
+OCR_REC_BATCH_NUM= int(envs.get('OCR_REC_BATCH_NUM', 16))
+OCR_ANGLE_CLS= envs.get('OCR_ANGLE_CLS', 'always').lower()
+OCR_BATCH_MAX_IMAGES= int(envs.get('OCR_BATCH_MAX_IMAGES', 8))
+OCR_BATCH_WINDOW_MS= float(envs.get('OCR_BATCH_WINDOW_MS', 0))
+# uploads Django spools to a file (larger than FILE_UPLOAD_MAX_MEMORY_SIZE) stay off the scratch tmpfs, where no quota
+# would charge them; the request copies the upload into its workspace (see 'store_chunks')
+FILE_UPLOAD_TEMP_DIR = envs.get('FILE_UPLOAD_TEMP_DIR') or None
+STUB_MODELS= envs.get('STUB_MODELS', 'False').lower() == 'true'
+STUB_MODEL_LATENCY_MS= {name: float(ms) for name, ms in (item.split('=') for item in envs.get('STUB_MODEL_LATENCY_MS', '').split(',') if item)}
+CPU_CORE_BUDGET= int(envs.get('CPU_CORE_BUDGET', 0))
+CPU_AFFINITY= envs.get('CPU_AFFINITY', 'False').lower() == 'true'
+DEFAULT_PIPELINE_MODE= envs.get('DEFAULT_PIPELINE_MODE', 'balanced')
+RESULTS_STORE= envs.get('RESULTS_STORE', 'True').lower() == 'true'
+DUPLICATE_PAGE_DETECTION= envs.get('DUPLICATE_PAGE_DETECTION', 'True').lower() == 'true'
+DUPLICATE_PAGE_TOLERANCE= int(envs.get('DUPLICATE_PAGE_TOLERANCE', 6))
+PIPELINE_QUEUE_SIZE= int(envs.get('PIPELINE_QUEUE_SIZE', 2))
+ROI_EXTRACTION= envs.get('ROI_EXTRACTION', 'True').lower() == 'true'
+ROI_DEFAULT_REGION= envs.get('ROI_DEFAULT_REGION', '0,0,1,0.35')
+ROI_STORE_PATH= envs.get('ROI_STORE_PATH', '')
+ROI_TEMPLATE_TOLERANCE= int(envs.get('ROI_TEMPLATE_TOLERANCE', 10))
+ROI_MIN_SAMPLES= int(envs.get('ROI_MIN_SAMPLES', 2))
+ROI_MAX_AREA= float(envs.get('ROI_MAX_AREA', 0.5))
+ROI_MARGIN= float(envs.get('ROI_MARGIN', 0.03))
+PIPELINE_STAGE_WORKERS= {name: int(workers) for name, workers in (item.split('=') for item in envs.get('PIPELINE_STAGE_WORKERS', 'render=1,classify=1,extract=1,stamps=1').split(',') if item)}
+REQUEST_DEADLINE= float(envs.get('REQUEST_DEADLINE', 240))
+DEGRADE_SKIP_STAMPS_AT= float(envs.get('DEGRADE_SKIP_STAMPS_AT', 60))
+DEGRADE_REGEX_ONLY_AT= float(envs.get('DEGRADE_REGEX_ONLY_AT', 30))
+DEGRADE_PARTIAL_AT= float(envs.get('DEGRADE_PARTIAL_AT', 10))
+VERIFICATION_PAGE_ORDER= envs.get('VERIFICATION_PAGE_ORDER', 'reverse').lower()
+VERIFICATION_MATCH_THRESHOLD= float(envs.get('VERIFICATION_MATCH_THRESHOLD', 0.7))
+METACLIP_IDLE_TIMEOUT= int(envs.get('METACLIP_IDLE_TIMEOUT', 0))
+PROFILING_ADMIN_TOKEN= envs.get('PROFILING_ADMIN_TOKEN', '')
+PROFILING_SAMPLE_RATE= float(envs.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_INTERVAL_MS= float(envs.get('PROFILING_INTERVAL_MS', 5))
+PROFILES_PATH= envs.get('PROFILES_PATH', 'profiles')
+PROFILES_MAX= int(envs.get('PROFILES_MAX', 100))
+ASYNC_VIEWS= envs.get('ASYNC_VIEWS', 'False').lower() == 'true'
+ASYNC_INFERENCE_WORKERS= int(envs.get('ASYNC_INFERENCE_WORKERS', 1))
+ASYNC_HTTP_TIMEOUT= float(envs.get('ASYNC_HTTP_TIMEOUT', 60))
+ASYNC_HTTP_MAX_CONNECTIONS= int(envs.get('ASYNC_HTTP_MAX_CONNECTIONS', 100))
 PINECONE_API_KEY= envs.get('PINECONE_API_KEY', '')
 PINECONE_INDEX_NAME= envs.get('PINECONE_INDEX_NAME', '')
+PINECONE_NAMESPACE= envs.get('PINECONE_NAMESPACE', 'namespace')
+STAMP_NAMESPACE_PATH= envs.get('STAMP_NAMESPACE_PATH', '')
+STAMP_CATALOGUE_PATH= envs.get('STAMP_CATALOGUE_PATH', '')
+STAMP_CATALOGUE_RERANK= int(envs.get('STAMP_CATALOGUE_RERANK', 32))
+REFERENCE_CACHE_TTL= int(envs.get('REFERENCE_CACHE_TTL', 3600))
+REFERENCE_CACHE_MAX_VECTORS= int(envs.get('REFERENCE_CACHE_MAX_VECTORS', 1000))
+STAMP_CROP_CACHE_SIZE= int(envs.get('STAMP_CROP_CACHE_SIZE', 2048))
+STAMP_CROP_CACHE_TOLERANCE= int(envs.get('STAMP_CROP_CACHE_TOLERANCE', 0))
+STAMP_CROP_CACHE_PATH= envs.get('STAMP_CROP_CACHE_PATH', '')
 
 
 
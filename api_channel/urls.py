@@ -21,7 +21,8 @@ from django.conf.urls.static import static
 from drf_yasg.views import get_schema_view
 from django.views.static import serve
 from drf_yasg import openapi
-from data_extraction.views import DataExtraction, AddStamp, VerificationStamp
+from data_extraction.views import DataExtraction, AddStamp, VerificationStamp, ModelReadiness, Metrics, ExtractionResults, DocumentAnalysis, Profiles, ProfileDownload, BatchDataExtraction, BatchJob
+from data_extraction.async_views import AsyncDataExtraction, AsyncAddStamp, AsyncVerificationStamp
 from django.conf import settings
 
 
@@ -40,9 +41,17 @@ urlpatterns = [
          cache_timeout=0), name='schema-swagger-ui'),
     path('admin/', admin.site.urls),
     path('auth/', include('users.urls')),
-    path('GetDetails',DataExtraction.as_view() , name='Data Extraction'),
-    path('AddStamp',AddStamp.as_view() , name='Add Stamp'),
-    path('StampVerification',VerificationStamp.as_view() , name='Stamp Verification'),
+    path('GetDetails',(AsyncDataExtraction if settings.ASYNC_VIEWS else DataExtraction).as_view() , name='Data Extraction'),
+    path('GetDetailsBatch',BatchDataExtraction.as_view() , name='Batch Data Extraction'),
+    path('GetDetailsBatch/<str:job_id>',BatchJob.as_view() , name='Batch Job'),
+    path('AddStamp',(AsyncAddStamp if settings.ASYNC_VIEWS else AddStamp).as_view() , name='Add Stamp'),
+    path('StampVerification',(AsyncVerificationStamp if settings.ASYNC_VIEWS else VerificationStamp).as_view() , name='Stamp Verification'),
+    path('Analyze',DocumentAnalysis.as_view() , name='Document Analysis'),
+    path('GetResults',ExtractionResults.as_view() , name='Extraction Results'),
+    path('health/ready',ModelReadiness.as_view() , name='Model Readiness'),
+    path('metrics',Metrics.as_view() , name='Metrics'),
+    path('profiles',Profiles.as_view() , name='Profiles'),
+    path('profiles/<str:request_id>',ProfileDownload.as_view() , name='Profile Download'),
 
 
     re_path(r'^static/(?P<path>.*)$', serve,{'document_root': settings.STATIC_ROOT})
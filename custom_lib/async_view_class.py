@@ -0,0 +1,33 @@
+from asgiref.sync import sync_to_async
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from custom_lib.authentication import UserAuthentication
+from custom_lib.logger import Log
+
+
+class AsyncAuthView(View):
+    """
+    Base of the async views: the request logging of 'LoggingMixin' and the token check of 'UserAuthentication'
+    (run on a thread, as it queries the database), around async handlers.
+
+    Notes:
+    - DRF views are synchronous, so these are plain Django views: the handlers read 'request.POST'/'request.FILES'
+      and 'request.GET' and return 'json_response' or 'stream_response' responses. Errors are raised as
+      ValueError(<code>) and rendered by 'ErrorHandlerMiddleware' as for the DRF views.
+    """
+
+    authentication = UserAuthentication()
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        log = Log(request, app_name=self.__module__.split(".")[0], class_name=self.__class__.__name__)
+        request.logObj = log
+        log.print_log("START")
+        await sync_to_async(self.authentication.authenticate)(request)
+        response = await super().dispatch(request, *args, **kwargs)
+        log.print_log("END")
+        return response
@@ -1,4 +1,5 @@
 import json,traceback
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from custom_lib.helper import get_error_msg
 from django.http import  JsonResponse, response
 from rest_framework import status
@@ -6,13 +7,24 @@ from rest_framework import status
 
 
 class ErrorHandlerMiddleware:
+    # async capable, so async views are not switched to a single sync thread under ASGI
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         response = self.get_response(request)
         return response
 
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
     def process_exception(self, request, exception):
         error = str(exception)
         print(error)
@@ -26,7 +38,7 @@ class ErrorHandlerMiddleware:
         if  str(error_code).isdigit():
             err_msg=err_msg or get_error_msg(error_code)
             standard_status = status.HTTP_400_BAD_REQUEST
-            if int(error_code) in [50012,50004]:
+            if int(error_code) in [50012,50004,50020]:
                 standard_status = status.HTTP_401_UNAUTHORIZED
             response = JsonResponse({"errorCode": int(error_code),"errorMessage":err_msg}, status=standard_status)
         else:
@@ -59,9 +59,15 @@ def create_swagger_params(name, required=True, type='string',header_type="header
         swagger_type = openapi.TYPE_INTEGER
     elif type == "bool":
         swagger_type = openapi.TYPE_BOOLEAN
+    elif type == "file":
+        swagger_type = openapi.TYPE_FILE
+    elif type == "array":
+        swagger_type = openapi.TYPE_ARRAY
     
     if header_type=="query":
         header=openapi.IN_QUERY
+    elif header_type=="form":
+        header=openapi.IN_FORM
     return openapi.Parameter(name, header, type=swagger_type, required=required,**extra)
 
 
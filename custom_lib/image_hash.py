@@ -0,0 +1,89 @@
+import numpy as np
+from PIL import Image, ImageOps
+
+
+def normalize_for_hash(image, size):
+    """
+    Normalises an image before hashing: grayscale, auto-contrast, resized to a square.
+
+    Parameters:
+    - image (PIL Image): The input image.
+    - size (int): Width and height of the normalised image.
+
+    Returns:
+    - np.ndarray: A (size, size) float32 array of pixel intensities.
+    """
+
+    gray = ImageOps.autocontrast(image.convert("L"))
+    return np.asarray(gray.resize((size, size), Image.LANCZOS), dtype=np.float32)
+
+
+def bits_to_int(bits):
+    """
+    Packs a boolean array into an unsigned integer, most significant bit first.
+    """
+
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def dhash(image, hash_size=8):
+    """
+    Computes the difference hash of an image (sign of the horizontal gradient of a tiny thumbnail).
+
+    Parameters:
+    - image (PIL Image): The input image.
+    - hash_size (int, optional): Hash side length; the hash has hash_size * hash_size bits. Default is 8.
+
+    Returns:
+    - int: The hash as an unsigned integer.
+    """
+
+    pixels = np.asarray(ImageOps.autocontrast(image.convert("L")).resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.float32)
+    return bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def dct_matrix(n):
+    """
+    Returns the orthonormal DCT-II matrix of size n.
+    """
+
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+def phash(image, hash_size=8, highfreq_factor=4):
+    """
+    Computes the perceptual hash of an image (sign of the low-frequency DCT coefficients against their median).
+
+    Parameters:
+    - image (PIL Image): The input image.
+    - hash_size (int, optional): Hash side length; the hash has hash_size * hash_size bits. Default is 8.
+    - highfreq_factor (int, optional): The image is resized to hash_size * highfreq_factor before the DCT. Default is 4.
+
+    Returns:
+    - int: The hash as an unsigned integer.
+
+    Notes:
+    - Robust to rescaling, JPEG artefacts and small brightness changes, so the same stamp cropped from
+      different scans hashes to the same or a nearby value.
+    """
+
+    size = hash_size * highfreq_factor
+    pixels = normalize_for_hash(image, size)
+    transform = dct_matrix(size)
+    low = (transform @ pixels @ transform.T)[:hash_size, :hash_size]
+    return bits_to_int(low > np.median(low))
+
+
+def hamming_distance(a, b):
+    """
+    Returns the number of differing bits between two hashes.
+    """
+
+    return bin(a ^ b).count("1")
@@ -1,3 +1,4 @@
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework.renderers import JSONRenderer
 from rest_framework.utils import json
 
@@ -15,3 +16,80 @@ class JSONResponseRenderer(JSONRenderer):
             response_dict['data']=data
         data = response_dict
         return json.dumps(data,default=str)
+
+
+def json_response(data, status=200):
+    """
+    Builds a JSON response in the same envelope as 'JSONResponseRenderer', for views that are not DRF views (async views).
+
+    Parameters:
+    - data: The response data.
+    - status (int, optional): The HTTP status. Default is 200.
+
+    Returns:
+    - HttpResponse: The rendered response.
+    """
+
+    return HttpResponse(JSONResponseRenderer().render(data), content_type="application/json", status=status)
+
+
+STREAM_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+
+def render_stream_event(event, stream_format):
+    """
+    Encodes one streaming event as an NDJSON line or a Server-Sent Events message.
+
+    Parameters:
+    - event (dict): The event, with keys 'event' and 'data'.
+    - stream_format (str): 'ndjson' or 'sse'.
+
+    Returns:
+    - str: The encoded event, including its trailing newline(s).
+    """
+
+    if stream_format == "sse":
+        return f"event: {event['event']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+    return json.dumps(event, default=str) + "\n"
+
+
+
+def stream_response(events, stream_format):
+    """
+    Builds a streaming HTTP response that sends each event as soon as it is produced.
+
+    Parameters:
+    - events (generator or async generator): The events to send. Async views must pass an async generator,
+      otherwise Django's ASGI handler reads the whole stream before sending it.
+    - stream_format (str): 'ndjson' or 'sse'.
+
+    Returns:
+    - StreamingHttpResponse: The response; closing it (e.g. on client disconnect) closes the event generator.
+    """
+
+    if hasattr(events, "__aiter__"):
+        content = (render_stream_event(event, stream_format) async for event in events)
+    else:
+        content = (render_stream_event(event, stream_format) for event in events)
+    response = StreamingHttpResponse(content, content_type=STREAM_CONTENT_TYPES[stream_format])
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def get_stream_format(request):
+    """
+    Returns the streaming format requested by the client, if any.
+
+    Parameters:
+    - request: The DRF or Django request.
+
+    Returns:
+    - str or None: 'ndjson' or 'sse' from the 'stream' query parameter, None for a regular JSON response.
+    """
+
+    stream_format = getattr(request, "query_params", request.GET).get("stream", "").lower()
+    return stream_format if stream_format in STREAM_CONTENT_TYPES else None
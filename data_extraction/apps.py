@@ -1,62 +1,141 @@
+import os
+import sys
 from django.apps import AppConfig
-from paddleocr import PaddleOCR
-from transformers import pipeline, AutoTokenizer, AutoModelForDocumentQuestionAnswering, AutoProcessor, AutoModelForZeroShotImageClassification
-from paddlenlp import Taskflow
-import torch
+import numpy as np
+from PIL import Image
 from custom_lib.logger import BaseLog
-from ultralytics import YOLO
-from api_channel.settings import MODELS_PATH
+from data_extraction.model_registry import ModelRegistry
+from data_extraction import cpu_budget
+from data_extraction.metrics import register_metrics
+from api_channel.settings import MODELS_PATH, MODEL_WARMUP, MODEL_WARMUP_WORKERS, MODEL_PRELOAD, MODEL_POOL_SIZES, METACLIP_IDLE_TIMEOUT, STUB_MODELS, OCR_REC_BATCH_NUM, OCR_ANGLE_CLS
 logger = BaseLog()
 
+device = "cpu"  # Force CPU mode for local development
+
+model_registry = ModelRegistry()
+register_metrics("modelPools", model_registry.pool_stats)
+
+
+def load_ocr_model():
+    from paddleocr import PaddleOCR
+    return PaddleOCR(use_angle_cls=OCR_ANGLE_CLS != "never", lang='en', use_gpu=False, cpu_threads=cpu_budget.model_threads(),
+                     rec_batch_num=OCR_REC_BATCH_NUM, cls_batch_num=OCR_REC_BATCH_NUM)
+
+
+def load_layoutlm_model():
+    from data_extraction.mmap_weights import mmap_weights_path, attach_mmap_weights
+    from transformers import pipeline, AutoTokenizer, AutoModelForDocumentQuestionAnswering
+    cpu_tokenizer = AutoTokenizer.from_pretrained(f"{MODELS_PATH}/cpu-model/tokenizers")
+    cpu_model = AutoModelForDocumentQuestionAnswering.from_pretrained(f"{MODELS_PATH}/cpu-model/model")
+    cpu_model.to(device)
+    if os.path.exists(mmap_weights_path("layoutlm")):
+        attach_mmap_weights(cpu_model.eval(), mmap_weights_path("layoutlm"))
+    return pipeline("document-question-answering", model=cpu_model, tokenizer=cpu_tokenizer, device=-1)
+
+
+def load_ernie_model():
+    from paddlenlp import Taskflow
+    return Taskflow("document_intelligence", lang="en", task_path= f"{MODELS_PATH}/gpu-model/model")
+
+
+def load_metaclip_model():
+    import torch
+    from data_extraction.mmap_weights import mmap_weights_path, attach_mmap_weights
+    from transformers import AutoProcessor, AutoModelForZeroShotImageClassification
+    metaClip_preprocess = AutoProcessor.from_pretrained("facebook/metaclip-b16-fullcc2.5b")
+    metaClip_inference = AutoModelForZeroShotImageClassification.from_pretrained(f"{MODELS_PATH}/metaClip/model", torch_dtype=torch.float32).to(device)
+    if os.path.exists(mmap_weights_path("metaclip")):
+        attach_mmap_weights(metaClip_inference.eval(), mmap_weights_path("metaclip"))
+    return metaClip_preprocess, metaClip_inference
+
+
+def load_stamp_detection_model():
+    from ultralytics import YOLO
+    stamp_detection_model = YOLO(f'{MODELS_PATH}/yoloV8/stamp_detection_model.pt')
+    stamp_detection_model.fuse()  # fuse now so workers inheriting the model do not each fuse a private copy
+    return stamp_detection_model
+
+
+def load_document_classifier_model():
+    from ultralytics import YOLO
+    document_classifier_model = YOLO(f'{MODELS_PATH}/yoloV8/document_classifier.pt')
+    document_classifier_model.fuse()
+    return document_classifier_model
+
+
+def warm_up_ocr(ocr_inference):
+    ocr_inference.ocr(np.full((64, 256, 3), 255, dtype=np.uint8))
+
+
+def warm_up_layoutlm(cpu_model_pipe):
+    cpu_model_pipe(Image.new("RGB", (256, 256), "white"), "what is No. Embarque?", word_boxes=[("0", [0, 0, 10, 10])])
+
+
+def warm_up_metaclip(metaclip):
+    import torch
+    metaClip_preprocess, metaClip_inference = metaclip
+    with torch.no_grad():
+        metaClip_inference.get_image_features(**metaClip_preprocess(images=Image.new("RGB", (224, 224), "white"), return_tensors="pt"))
+
+
+def warm_up_yolo(yolo_model):
+    yolo_model(np.full((640, 640, 3), 255, dtype=np.uint8), verbose=False)
+
+
+def model_loader(name, load_model):
+    """
+    Returns the loader of a model, or of its stub when STUB_MODELS is set (see 'stub_models.stub_loader').
+    """
+
+    if STUB_MODELS:
+        from data_extraction.stub_models import stub_loader
+        return stub_loader(name)
+    return load_model
+
+
+model_registry.register("paddleocr", model_loader("paddleocr", load_ocr_model), warmup=warm_up_ocr, fork_safe=False, pool_size=MODEL_POOL_SIZES.get("paddleocr", 1))
+model_registry.register("layoutlm", model_loader("layoutlm", load_layoutlm_model), warmup=warm_up_layoutlm, pool_size=MODEL_POOL_SIZES.get("layoutlm", 1))
+model_registry.register("ernie", model_loader("ernie", load_ernie_model), required=False, preload=False, pool_size=MODEL_POOL_SIZES.get("ernie", 1))
+model_registry.register("metaclip", model_loader("metaclip", load_metaclip_model), warmup=warm_up_metaclip, idle_timeout=METACLIP_IDLE_TIMEOUT, required=False, pool_size=MODEL_POOL_SIZES.get("metaclip", 1))
+model_registry.register("stamp_detection", model_loader("stamp_detection", load_stamp_detection_model), warmup=warm_up_yolo, pool_size=MODEL_POOL_SIZES.get("stamp_detection", 1))
+model_registry.register("document_classifier", model_loader("document_classifier", load_document_classifier_model), warmup=warm_up_yolo, pool_size=MODEL_POOL_SIZES.get("document_classifier", 1))
+
+
+def is_serving_process():
+    """
+    Checks whether the current process serves HTTP requests (and therefore needs the models warm).
+
+    Returns:
+    - bool: False for 'manage.py' commands other than 'runserver', True otherwise.
+    """
+
+    if os.path.basename(sys.argv[0]) == "manage.py":
+        return len(sys.argv) > 1 and sys.argv[1] == "runserver"
+    return True
+
+
+def after_fork():
+    """
+    Re-initialises per-process state in a worker forked from a preloading master.
+
+    Notes:
+    - Called from the gunicorn 'post_fork' hook after 'cpu_budget.apply_cpu_budget' has sized the worker's thread
+      pools. The registry warms the inherited models and loads PaddleOCR, whose Paddle predictor is not shared across fork.
+    """
+
+    model_registry.after_fork(max_workers=MODEL_WARMUP_WORKERS)
+
 
 class DocQueryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'data_extraction'
 
     def ready(self):
-        try:
-            global stamp_detection_model, document_classifier_model, ocr_inference, cpu_model_pipe, gpu_model_pipe, metaClip_preprocess, metaClip_inference
-            device = "cpu"  # Force CPU mode for local development
-            
-            # Initialize None for models not loaded in CPU mode
-            gpu_model_pipe = None
-            metaClip_preprocess = None
-            metaClip_inference = None
-
-            cpu_model_directory = f"{MODELS_PATH}/cpu-model/model"
-            cpu_model_tokenizer_directory = f"{MODELS_PATH}/cpu-model/tokenizers"
-            clip_directory = f"{MODELS_PATH}/metaClip/model"
-
-            # Load OCR model
-            ocr_inference = PaddleOCR(use_angle_cls=True, lang='en', use_gpu=False)
-            logger.print("✅ OCR model loaded successfully (CPU mode).")
-
-            # Load CPU model for document QA
-            cpu_tokenizer = AutoTokenizer.from_pretrained(cpu_model_tokenizer_directory)
-            cpu_model = AutoModelForDocumentQuestionAnswering.from_pretrained(cpu_model_directory)
-            cpu_model.to(device) 
-            cpu_model_pipe = pipeline("document-question-answering", model=cpu_model, tokenizer=cpu_tokenizer, device=-1)
-            logger.print("✅ LayoutLM CPU model loaded successfully.")
-
-            # GPU model - DISABLED for CPU mode
-            # gpu_model_pipe = Taskflow("document_intelligence", lang="en", task_path= f"{MODELS_PATH}/gpu-model/model")
-            logger.print("⚠️  GPU model disabled (CPU mode active).")
-
-            # MetaCLIP - Load if available, otherwise skip
-            try:
-                metaClip_preprocess = AutoProcessor.from_pretrained("facebook/metaclip-b16-fullcc2.5b")
-                metaClip_inference = AutoModelForZeroShotImageClassification.from_pretrained(clip_directory, torch_dtype=torch.float32).to(device)
-                logger.print("✅ Image similarity model loaded successfully.")
-            except Exception as clip_error:
-                logger.print(f"⚠️  MetaCLIP model not loaded: {str(clip_error)}")
-                metaClip_preprocess = None
-                metaClip_inference = None
-
-            # Load YOLO models
-            stamp_detection_model = YOLO(f'{MODELS_PATH}/yoloV8/stamp_detection_model.pt')
-            document_classifier_model = YOLO(f'{MODELS_PATH}/yoloV8/document_classifier.pt')
-            logger.print("✅ YOLO models loaded successfully.")
-
-
-        except Exception as e:
-            logger.print(f"❌ Error loading model: {str(e)}")
+        if not is_serving_process():
+            return
+        if cpu_budget.current_budget is None:
+            cpu_budget.apply_cpu_budget()
+        if MODEL_PRELOAD:
+            model_registry.preload_for_fork(max_workers=MODEL_WARMUP_WORKERS)
+        elif MODEL_WARMUP:
+            model_registry.start_warm_up(max_workers=MODEL_WARMUP_WORKERS)
@@ -0,0 +1,115 @@
+import asyncio
+import functools
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from django.db import close_old_connections
+from api_channel.settings import ASYNC_INFERENCE_WORKERS, ASYNC_HTTP_TIMEOUT, ASYNC_HTTP_MAX_CONNECTIONS
+from data_extraction.metrics import register_metrics
+
+_http_clients = weakref.WeakKeyDictionary()
+
+
+def get_http_client():
+    """
+    Returns the async HTTP client of the running event loop, shared by every async request of the worker.
+
+    Returns:
+    - httpx.AsyncClient: The client; its connection pool (ASYNC_HTTP_MAX_CONNECTIONS) is reused across requests.
+    """
+
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(timeout=ASYNC_HTTP_TIMEOUT, follow_redirects=True, limits=httpx.Limits(max_connections=ASYNC_HTTP_MAX_CONNECTIONS))
+        _http_clients[loop] = client
+    return client
+
+
+class InferenceExecutor:
+    """
+    Bounded thread pool that runs the CPU-bound model calls of the async views off the event loop.
+
+    Notes:
+    - At most 'workers' model calls run at once per worker process, however many requests are in flight; the others
+      wait in the queue while their downloads and index calls keep progressing on the event loop.
+    - Each task closes the database connections it left unusable, as Django does at the end of a request.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = max(workers, 1)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._wait_seconds = 0.0
+
+    def _call(self, fn, submitted_at):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._wait_seconds += time.monotonic() - submitted_at
+        try:
+            return fn()
+        finally:
+            close_old_connections()
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs a blocking call on the pool and waits for its result without blocking the event loop.
+
+        Parameters:
+        - fn (callable): The call, with its positional and keyword arguments.
+
+        Returns:
+        - The result of the call; its exception is raised here.
+        """
+
+        with self._lock:
+            self._queued += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, functools.partial(fn, *args, **kwargs), time.monotonic())
+
+    async def iterate(self, events):
+        """
+        Consumes a blocking generator on the pool, one item per task.
+
+        Parameters:
+        - events (generator): The generator, e.g. the events of a streamed pipeline.
+
+        Yields:
+        - The items of the generator. Streams share the pool page by page instead of holding a worker for a whole document.
+        """
+
+        done = object()
+        try:
+            while True:
+                event = await self.run(next, events, done)
+                if event is done:
+                    return
+                yield event
+        finally:
+            try:
+                await self.run(events.close)
+            except ValueError:
+                # a cancelled read is still running on the pool; the generator is closed when it is garbage-collected
+                pass
+
+    def stats(self):
+        """
+        Returns the pool metrics reported by the metrics endpoint.
+        """
+
+        with self._lock:
+            return {"workers": self.workers, "queued": self._queued, "running": self._running, "completed": self._completed,
+                    "averageWaitMs": round(self._wait_seconds * 1000 / self._completed, 1) if self._completed else 0}
+
+
+inference_executor = InferenceExecutor(ASYNC_INFERENCE_WORKERS)
+register_metrics("asyncInference", inference_executor.stats)
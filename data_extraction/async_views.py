@@ -0,0 +1,181 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from custom_lib.async_view_class import AsyncAuthView
+from custom_lib.renderer import json_response, get_stream_format, stream_response
+from data_extraction.serializer import LoadInvoiceSerializer, AddStampSerializer, StampVerificationSerializer
+from data_extraction.services import download_store_docs_async
+from data_extraction.scratch import close_workspace
+from data_extraction.helper import data_extraction, verifying_company, data_extraction_stream, verifying_company_stream, add_stamp_async
+from data_extraction.async_runtime import inference_executor
+from data_extraction.deadline import Deadline
+from data_extraction.verification import VerificationOptions, early_exit_response
+from data_extraction.profiles import get_profile
+from data_extraction.results_store import EXTRACTION, VERIFICATION, file_content_hash, find_stored_results, store_results, store_stream, stored_events, stored_body, document_name
+from data_extraction.profiling import start_profile, run_profiled, profile_stream
+from stamp_detection.pinecone import prefetch_company_references
+from api_channel.settings import DEFAULT_PIPELINE_MODE
+
+
+def form_data(request):
+    """
+    Returns the form fields and uploaded files of a multipart request, as DRF's 'request.data' does.
+    """
+
+    data = request.POST.copy()
+    data.update(request.FILES)
+    return data
+
+
+async def iterate_events(events):
+    """
+    Passes the events of a generator that does not run models (e.g. stored results) to an async stream.
+    """
+
+    for event in events:
+        yield event
+
+
+def degraded_json_response(res, deadline):
+    """
+    Async-view counterpart of 'views.degraded_response'.
+    """
+
+    response = json_response(res)
+    if deadline.degradations:
+        response["X-Degradations"] = ",".join(deadline.degradations)
+    return response
+
+
+def profiled_json_response(response, profile):
+    """
+    Async-view counterpart of 'views.profiled_response'.
+    """
+
+    if profile is not None:
+        response["X-Profile-Id"] = profile.request_id
+    return response
+
+
+def stored_json_response(stored, doc_path, stream_format):
+    """
+    Async-view counterpart of 'views.stored_response'.
+    """
+
+    close_workspace(doc_path)
+    response = stream_response(iterate_events(stored_events(stored)), stream_format) if stream_format else json_response(stored_body(stored))
+    response["X-Reused-Result"] = "true"
+    return early_exit_response(response, stored["info"])
+
+
+class AsyncDataExtraction(AsyncAuthView):
+    """
+    Async variant of 'DataExtraction' (same parameters and responses).
+    """
+
+    async def post(self, request):
+
+        serializer = LoadInvoiceSerializer(data=form_data(request))
+
+        if not serializer.is_valid():
+            raise ValueError(50002)
+
+        data = serializer.validated_data
+        file_or_url = data.get('files') or data.get('url')
+        stamp = request.GET.get('boolStampDetection') or "False"
+        mode = (request.GET.get('mode') or DEFAULT_PIPELINE_MODE).lower()
+        profile = get_profile(mode)
+        reuse = (request.GET.get('reuse') or "False").lower() == "true"
+
+        stream_format = get_stream_format(request)
+        deadline = Deadline.from_request(request)
+
+        doc_path = await download_store_docs_async(file_or_url)
+        store = {"request_type": EXTRACTION, "content_hash": await asyncio.to_thread(file_content_hash, doc_path), "options": f"mode={mode};stamps={stamp.lower()}",
+                 "file_name": document_name(doc_path), "user_id": getattr(request, "user_id", None)}
+
+        stored = await sync_to_async(find_stored_results)(EXTRACTION, store["content_hash"], store["options"]) if reuse else None
+        if stored is not None:
+            return stored_json_response(stored, doc_path, stream_format)
+
+        request_profile = start_profile(request, EXTRACTION)
+
+        if stream_format:
+            return profiled_json_response(stream_response(inference_executor.iterate(store_stream(profile_stream(request_profile, data_extraction_stream(doc_path, is_stamp_details_required=stamp, deadline=deadline, profile=profile)), **store)), stream_format), request_profile)
+
+        try:
+            res = await inference_executor.run(run_profiled, request_profile, data_extraction, doc_path, is_stamp_details_required=stamp, deadline=deadline, profile=profile)
+        finally:
+            deadline.close()
+
+        await sync_to_async(store_results)(pages=res, degraded=bool(deadline.degradations), **store)
+
+        return profiled_json_response(degraded_json_response(res, deadline), request_profile)
+
+
+class AsyncAddStamp(AsyncAuthView):
+    """
+    Async variant of 'AddStamp' (same parameters and responses).
+    """
+
+    async def post(self, request):
+
+        serializer = AddStampSerializer(data=form_data(request))
+
+        if not serializer.is_valid():
+            raise ValueError(50002)
+
+        data = serializer.validated_data
+        file_or_url = data.get('files') or data.get('url')
+        company_id = data.get('companyId')
+
+        doc_path = await download_store_docs_async(file_or_url)
+
+        res = await add_stamp_async(doc_path, company_id)
+
+        return json_response(res)
+
+
+class AsyncVerificationStamp(AsyncAuthView):
+    """
+    Async variant of 'VerificationStamp' (same parameters and responses). The company's reference stamps are
+    fetched from the index on the event loop before the document goes to the inference executor.
+    """
+
+    async def post(self, request):
+
+        serializer = StampVerificationSerializer(data=form_data(request))
+
+        if not serializer.is_valid():
+            raise ValueError(50002)
+
+        data = serializer.validated_data
+        file_or_url = data.get('files') or data.get('url')
+        company_id = data.get("companyId")
+        reuse = (request.GET.get('reuse') or "False").lower() == "true"
+        stream_format = get_stream_format(request)
+        deadline = Deadline.from_request(request)
+        options = VerificationOptions.from_request(request)
+
+        doc_path = await download_store_docs_async(file_or_url)
+        store = {"request_type": VERIFICATION, "content_hash": await asyncio.to_thread(file_content_hash, doc_path), "options": options.key,
+                 "file_name": document_name(doc_path), "company_id": str(company_id), "user_id": getattr(request, "user_id", None)}
+
+        stored = await sync_to_async(find_stored_results)(VERIFICATION, store["content_hash"], store["options"], store["company_id"]) if reuse else None
+        if stored is not None:
+            return stored_json_response(stored, doc_path, stream_format)
+
+        await prefetch_company_references(company_id)
+
+        request_profile = start_profile(request, VERIFICATION)
+
+        if stream_format:
+            return profiled_json_response(stream_response(inference_executor.iterate(store_stream(profile_stream(request_profile, verifying_company_stream(doc_path, company_id, deadline=deadline, options=options)), **store)), stream_format), request_profile)
+
+        try:
+            res = await inference_executor.run(run_profiled, request_profile, verifying_company, doc_path, company_id, deadline=deadline, options=options)
+        finally:
+            deadline.close()
+
+        await sync_to_async(store_results)(pages=res, degraded=bool(deadline.degradations), info=options.run_info, **store)
+
+        return profiled_json_response(early_exit_response(degraded_json_response(res, deadline), options.run_info), request_profile)
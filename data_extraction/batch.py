@@ -0,0 +1,448 @@
+import os
+import socket
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from django.db import DatabaseError, connection
+from custom_lib.helper import get_error_msg
+from custom_lib.logger import BaseLog
+from data_extraction.helper import device
+from data_extraction.metrics import register_metrics
+from data_extraction.models import BatchJobModel
+from data_extraction.results_store import EXTRACTION, file_content_hash, find_stored_results, store_results
+from data_extraction.scratch import ScratchBudget, open_workspace, close_workspace, pin_workspace, process_alive
+from data_extraction.services import download_store_docs, iter_batch_file_operation, store_chunks, DOWNLOAD_CHUNK_SIZE
+from api_channel.settings import BATCH_MAX_DOCUMENTS, BATCH_DOWNLOAD_WORKERS, BATCH_JOB_WORKERS
+logger = BaseLog()
+
+ZIP_EXTENSION = ".zip"
+QUEUED, RUNNING, DONE, FAILED = "QUEUED", "RUNNING", "DONE", "FAILED"
+
+job_executor = ThreadPoolExecutor(max_workers=BATCH_JOB_WORKERS, thread_name_prefix="batch-job")
+
+_lock = threading.Lock()
+_counters = {"batches": 0, "documents": 0, "failedDocuments": 0, "jobsSubmitted": 0, "jobsActive": 0}
+# whether this worker process looked for the jobs of dead workers yet (see 'check_orphaned_jobs')
+_orphans_checked = False
+
+
+def batch_stats():
+    """
+    Returns the batch counters of this worker process: batches, documents, failed documents and jobs.
+    """
+
+    with _lock:
+        return dict(_counters)
+
+register_metrics("batch", batch_stats)
+
+
+def _count(**values):
+    with _lock:
+        for key, value in values.items():
+            _counters[key] += value
+
+
+def store_batch_documents(files, urls):
+    """
+    Stores the documents of a batch concurrently, each in its own scratch workspace, expanding ZIP archives.
+
+    Parameters:
+    - files (list): The uploaded files.
+    - urls (list): The https URLs to download.
+
+    Returns:
+    - list: The documents in input order (archive members in archive order), as dicts with 'document' (1-based
+      index), 'fileName' and either 'path' and 'contentHash' or the 'errorCode' of a document that could not be stored.
+
+    Notes:
+    - Up to BATCH_DOWNLOAD_WORKERS uploads and downloads are stored at the same time. A failed download fails only
+      its document.
+    - The documents share one scratch quota (BATCH_SCRATCH_QUOTA_MB, see 'ScratchBudget'); a document that does not
+      fit fails with 50023.
+
+    Exceptions:
+    - ValueError(50024): The batch has more than BATCH_MAX_DOCUMENTS documents once its archives are expanded.
+    """
+
+    inputs = list(files) + list(urls)
+    budget = ScratchBudget()
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_DOWNLOAD_WORKERS, len(inputs))), thread_name_prefix="batch-download") as executor:
+        futures = [executor.submit(store_input, input_file, budget) for input_file in inputs]
+
+    documents, error = [], None
+    for future in futures:
+        try:
+            documents.extend(future.result())
+        except ValueError as e:
+            error = error or e
+    if error is None and len(documents) > BATCH_MAX_DOCUMENTS:
+        error = ValueError(50024)
+    if error is not None:
+        release_batch_documents(documents)
+        raise error
+
+    for index, document in enumerate(documents, start=1):
+        document["document"] = index
+    return documents
+
+
+def store_input(input_file, budget=None):
+    """
+    Stores one uploaded file or URL of a batch, charging it to the batch's scratch 'budget'.
+
+    Returns:
+    - list: The stored document, or the members of a ZIP archive (see 'store_batch_documents').
+    """
+
+    name = input_file.name if hasattr(input_file, 'read') else str(input_file).split('/')[-1]
+    try:
+        doc_path = download_store_docs(input_file, budget)
+    except ValueError as e:
+        return [{"fileName": name, "errorCode": error_code_of(e)}]
+
+    if doc_path.lower().endswith(ZIP_EXTENSION):
+        return expand_zip(doc_path, name, budget)
+    return [stored_document(doc_path, name)]
+
+
+def expand_zip(zip_path, name, budget=None):
+    """
+    Extracts the files of a ZIP archive into one scratch workspace each, then removes the archive.
+
+    Parameters:
+    - zip_path (str): The stored archive.
+    - name (str): The archive's file name; members are named '<archive>/<member>'.
+    - budget (ScratchBudget, optional): The scratch quota of the batch, shared by the archive and its members.
+
+    Returns:
+    - list: The members as documents (see 'store_batch_documents'), or one document with error 50026 if the
+      archive cannot be read.
+
+    Notes:
+    - Folders, hidden files and '__MACOSX' entries are skipped. Each member is extracted in chunks charged to its
+      workspace quota and the batch's, so a member larger than SCRATCH_QUOTA_MB, or one that no longer fits in the
+      batch quota or in SCRATCH_DIR, fails (50023).
+    """
+
+    documents = []
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            members = [member for member in archive.infolist() if not member.is_dir() and not member.filename.startswith("__MACOSX/")
+                       and not os.path.basename(member.filename).startswith(".")]
+            if len(members) > BATCH_MAX_DOCUMENTS:
+                raise ValueError(50024)
+            for member in members:
+                documents.append(extract_member(archive, member, f"{name}/{member.filename}", budget))
+        return documents
+
+    except zipfile.BadZipFile as e:
+        logger.print(f"batch: cannot read archive {name}: {str(e)}")
+        release_batch_documents(documents)
+        return [{"fileName": name, "errorCode": 50026}]
+
+    except ValueError:
+        release_batch_documents(documents)
+        raise
+
+    finally:
+        close_workspace(zip_path)
+
+
+def extract_member(archive, member, name, budget=None):
+    """
+    Extracts one member of a ZIP archive into a new scratch workspace.
+
+    Returns:
+    - dict: The stored document, or its 'errorCode' (50023 over quota or out of space, 50026 unreadable, e.g. encrypted).
+    """
+
+    workspace = open_workspace(budget)
+    doc_path = workspace.new_file(member.filename)
+    try:
+        with archive.open(member) as source:
+            store_chunks(workspace, doc_path, iter(lambda: source.read(DOWNLOAD_CHUNK_SIZE), b""))
+    except ValueError as e:
+        workspace.close()
+        return {"fileName": name, "errorCode": error_code_of(e)}
+    except Exception as e:
+        logger.print(f"batch: cannot extract {name}: {str(e)}")
+        workspace.close()
+        return {"fileName": name, "errorCode": 50026}
+    return stored_document(doc_path, name)
+
+
+def stored_document(doc_path, name):
+    return {"fileName": name, "path": doc_path, "contentHash": file_content_hash(doc_path)}
+
+
+def release_batch_documents(documents):
+    """
+    Removes the scratch workspaces of the stored documents of a batch.
+    """
+
+    for document in documents:
+        if document.get("path"):
+            close_workspace(document["path"])
+
+
+def error_code_of(e):
+    return int(str(e)) if str(e).isdigit() else 50001
+
+
+def document_result(document, pages=None, error_code=0):
+    """
+    Builds the result of one batch document in the envelope of a '/GetDetails' response ('ResponseFormatSerializer'),
+    with the document's index and file name.
+    """
+
+    return {"document": document["document"], "fileName": document["fileName"], "errorCode": error_code,
+            "errorMessage": get_error_msg(error_code) if error_code else "Success", "data": pages or []}
+
+
+def iter_batch_extraction(documents, is_stamp_details_required="False", deadline=None, profile=None, options="", user_id=None, reuse=False):
+    """
+    Extracts the data of the documents of a batch through one shared page pipeline.
+
+    Parameters:
+    - documents (list): The stored documents (see 'store_batch_documents').
+    - is_stamp_details_required (str, optional): Whether stamp details are required. Default is "False".
+    - deadline (Deadline, optional): The deadline of the whole batch; cancelled if the stream is closed early.
+    - profile (dict, optional): The pipeline profile of the requested mode.
+    - options (str, optional): The options the results are stored under (see 'store_results').
+    - user_id (int, optional): The authenticated user.
+    - reuse (bool, optional): Answer documents processed before with the same options from the results store.
+
+    Yields:
+    - dict: One 'document' event per document as soon as it is done ('document_result'; documents that could not
+      be stored or are reused come first), then a 'summary' event ({'documents', 'failedDocuments', 'pages', 'duration', 'degradations'}).
+
+    Notes:
+    - Each document's results are stored like a '/GetDetails' result, and its workspace is removed as soon as it is
+      done. Every workspace is removed when the generator ends or is closed.
+    """
+
+    start_time = time.time()
+    by_index = {document["document"]: document for document in documents}
+    failed = 0
+    pages = 0
+    _count(batches=1, documents=len(documents))
+
+    try:
+        for document in documents:
+            if "errorCode" in document:
+                failed += 1
+                yield {"event": "document", "data": document_result(document, error_code=document["errorCode"])}
+
+        stored = []
+        for document in (document for document in documents if "path" in document):
+            reused = find_stored_results(EXTRACTION, document["contentHash"], options) if reuse else None
+            if reused is None:
+                stored.append(document)
+                continue
+            close_workspace(document["path"])
+            pages += len(reused["pages"])
+            yield {"event": "document", "data": {**document_result(document, pages=reused["pages"]), "reused": True}}
+
+        for event in iter_batch_file_operation(stored, device, is_stamp_details_required, deadline, profile):
+            document = by_index[event["data"]["document"]]
+            close_workspace(document["path"])
+
+            if event["event"] == "error":
+                failed += 1
+                yield {"event": "document", "data": document_result(document, error_code=event["data"]["errorCode"])}
+                continue
+
+            pages += len(event["data"]["pages"])
+            store_results(EXTRACTION, document["contentHash"], event["data"]["pages"], options, file_name=document["fileName"][:255],
+                          user_id=user_id, degraded=bool(deadline and deadline.degradations))
+            yield {"event": "document", "data": document_result(document, pages=event["data"]["pages"])}
+
+        yield {"event": "summary", "data": {"documents": len(documents), "failedDocuments": failed, "pages": pages,
+                                            "duration": time.time() - start_time, "degradations": deadline.degradations if deadline else []}}
+
+    except GeneratorExit:
+        if deadline:
+            deadline.cancel()
+        raise
+
+    finally:
+        _count(failedDocuments=failed)
+        if deadline:
+            deadline.close()
+        release_batch_documents(documents)
+
+
+def batch_extraction(documents, is_stamp_details_required="False", deadline=None, profile=None, options="", user_id=None, reuse=False):
+    """
+    Extracts the data of the documents of a batch (see 'iter_batch_extraction').
+
+    Returns:
+    - list: The result of every document, in document order.
+    """
+
+    events = iter_batch_extraction(documents, is_stamp_details_required, deadline, profile, options, user_id, reuse)
+    return sorted((event["data"] for event in events if event["event"] == "document"), key=lambda result: result["document"])
+
+
+def batch_extraction_stream(documents, is_stamp_details_required="False", deadline=None, profile=None, options="", user_id=None, reuse=False):
+    """
+    Streaming variant of 'batch_extraction': the 'document' and 'summary' events of 'iter_batch_extraction', or a
+    final 'error' event if the batch fails part-way.
+    """
+
+    try:
+        yield from iter_batch_extraction(documents, is_stamp_details_required, deadline, profile, options, user_id, reuse)
+    except Exception as e:
+        logger.print(f"batch: failed: {str(e)}")
+        error_code = error_code_of(e)
+        yield {"event": "error", "data": {"errorCode": error_code, "errorMessage": get_error_msg(error_code)}}
+
+
+def submit_batch_job(documents, is_stamp_details_required="False", profile=None, options="", user_id=None, reuse=False):
+    """
+    Queues a batch as a job that runs in the background of this worker process.
+
+    Returns:
+    - dict: The new job: 'jobId', 'status' (QUEUED) and 'documents'. Poll it with 'get_batch_job'.
+
+    Notes:
+    - Jobs run one after another on BATCH_JOB_WORKERS threads, without a deadline. Their progress and results are kept
+      in the 'sb_batch_jobs' table, so any worker can answer the polling requests.
+    - The job records its worker process ('current_worker'), so the job is marked FAILED if that process dies
+      (see 'check_orphaned_jobs'). Its document workspaces are pinned: they do not expire while the job waits or runs.
+
+    Exceptions:
+    - ValueError(50001): The job could not be recorded.
+    """
+
+    check_orphaned_jobs()
+    job_id = uuid.uuid4().hex
+    try:
+        BatchJobModel.objects.create(id=job_id, status=QUEUED, options=options, documents=len(documents), completed=0, results=[], user_id=user_id,
+                                     worker=current_worker())
+    except DatabaseError as e:
+        logger.print(f"batch: could not record job: {str(e)}")
+        release_batch_documents(documents)
+        raise ValueError(50001)
+
+    for document in documents:
+        if document.get("path"):
+            pin_workspace(document["path"])
+    _count(jobsSubmitted=1)
+    job_executor.submit(run_batch_job, job_id, documents, is_stamp_details_required, profile, options, user_id, reuse)
+    return {"jobId": job_id, "status": QUEUED, "documents": len(documents)}
+
+
+def run_batch_job(job_id, documents, is_stamp_details_required, profile, options, user_id, reuse):
+    """
+    Runs a queued batch job, recording every finished document in its row.
+    """
+
+    _count(jobsActive=1)
+    jobs = BatchJobModel.objects.filter(id=job_id)
+    results = []
+    try:
+        jobs.update(status=RUNNING)
+        for event in iter_batch_extraction(documents, is_stamp_details_required, None, profile, options, user_id, reuse):
+            if event["event"] == "document":
+                results.append(event["data"])
+                jobs.update(completed=len(results), results=sorted(results, key=lambda result: result["document"]))
+        jobs.update(status=DONE)
+
+    except Exception as e:
+        logger.print(f"batch: job {job_id} failed: {str(e)}")
+        try:
+            jobs.update(status=FAILED)
+        except DatabaseError:
+            pass
+
+    finally:
+        _count(jobsActive=-1)
+        release_batch_documents(documents)
+        connection.close()
+
+
+def get_batch_job(job_id, user_id=None):
+    """
+    Returns the status and the finished document results of a batch job of the user.
+
+    Exceptions:
+    - ValueError(50025): No job of the user has this ID.
+    """
+
+    check_orphaned_jobs()
+    job = BatchJobModel.objects.filter(id=job_id, user_id=user_id).values("id", "status", "documents", "completed", "results", "created_at", "updated_at").first()
+    if job is None:
+        raise ValueError(50025)
+    return {"jobId": job["id"], "status": job["status"], "documents": job["documents"], "completed": job["completed"],
+            "results": job["results"], "createdAt": job["created_at"], "updatedAt": job["updated_at"]}
+
+
+def process_started(pid):
+    """
+    Returns the start time of a process (clock ticks since boot, from /proc), '' where /proc cannot tell, or None if
+    the process does not exist.
+    """
+
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except FileNotFoundError:
+        return None
+    except (OSError, IndexError):
+        return "" if process_alive(pid) else None
+
+
+def current_worker(pid=None):
+    """
+    Identifies a worker process as '<host>:<pid>:<start time>'. The start time tells a new process that reuses the
+    PID of a dead worker (e.g. after a container restart) apart from it.
+    """
+
+    pid = pid or os.getpid()
+    return f"{socket.gethostname()}:{pid}:{process_started(pid)}"
+
+
+def fail_orphaned_jobs():
+    """
+    Marks FAILED the QUEUED and RUNNING jobs of worker processes of this host that no longer run (e.g. a worker killed
+    or restarted mid-job); their documents were in that worker's scratch workspaces.
+
+    Returns:
+    - int: The number of jobs marked FAILED.
+
+    Notes:
+    - Jobs of other hosts are left alone: only their own workers can tell whether they still run.
+    """
+
+    host = socket.gethostname()
+    try:
+        orphaned = []
+        for job_id, worker in BatchJobModel.objects.filter(status__in=[QUEUED, RUNNING], worker__startswith=f"{host}:").values_list("id", "worker"):
+            pid = worker.rsplit(":", 2)[1]
+            if pid.isdigit() and worker != current_worker(int(pid)):
+                orphaned.append(job_id)
+        if orphaned:
+            BatchJobModel.objects.filter(id__in=orphaned, status__in=[QUEUED, RUNNING]).update(status=FAILED)
+            logger.print(f"batch: marked {len(orphaned)} jobs of dead workers as FAILED")
+        return len(orphaned)
+    except DatabaseError as e:
+        logger.print(f"batch: could not check for orphaned jobs: {str(e)}")
+        return 0
+
+
+def check_orphaned_jobs():
+    """
+    Runs 'fail_orphaned_jobs' once per worker process, on its first job submission or poll, so the jobs of a worker
+    that died are marked FAILED once a worker of the same host handles jobs again.
+    """
+
+    global _orphans_checked
+    with _lock:
+        if _orphans_checked:
+            return
+        _orphans_checked = True
+    fail_orphaned_jobs()
@@ -0,0 +1,103 @@
+import os
+from custom_lib.logger import BaseLog
+from api_channel.settings import CPU_CORE_BUDGET, CPU_AFFINITY
+logger = BaseLog()
+
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS"]
+
+current_budget = None
+
+
+def available_cores():
+    """
+    Returns the CPU cores this process may run on.
+
+    Returns:
+    - list: The sorted core IDs from the scheduler affinity mask (or 0..cpu_count-1 where unavailable).
+    """
+
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_cpu_budget(worker_index, workers, core_budget=None):
+    """
+    Computes the share of the core budget that belongs to one worker.
+
+    Parameters:
+    - worker_index (int): Index of the worker, 0-based (taken modulo 'workers').
+    - workers (int): Number of workers sharing the budget.
+    - core_budget (int, optional): Total cores for all workers. Defaults to CPU_CORE_BUDGET, or every available core.
+
+    Returns:
+    - dict: A dictionary containing:
+    - threads (int): Intra-op threads for every model library in this worker (at least 1).
+    - cores (list): The cores reserved for this worker, used when CPU affinity is enabled.
+    """
+
+    cores = available_cores()
+    core_budget = min(core_budget or CPU_CORE_BUDGET or len(cores), len(cores))
+    workers = max(workers, 1)
+    threads = max(core_budget // workers, 1)
+
+    start = (worker_index % workers) * threads % max(core_budget, 1)
+    worker_cores = [cores[(start + offset) % core_budget] for offset in range(threads)]
+    return {"threads": threads, "cores": worker_cores}
+
+
+def apply_cpu_budget(worker_index=0, workers=1, core_budget=None, affinity=None):
+    """
+    Sizes the thread pools of torch, Paddle and OpenMP/MKL (also read by OpenMP builds of ONNX Runtime) to this worker's share of the core budget.
+
+    Parameters:
+    - worker_index (int, optional): Index of the worker, 0-based. Default is 0.
+    - workers (int, optional): Number of workers sharing the budget. Default is 1.
+    - core_budget (int, optional): Total cores for all workers. Defaults to CPU_CORE_BUDGET.
+    - affinity (bool, optional): Pin the worker to its cores. Defaults to CPU_AFFINITY.
+
+    Returns:
+    - dict: The applied budget (see 'plan_cpu_budget').
+
+    Notes:
+    - Must run before the first inference in the process (gunicorn 'post_fork', or app start-up otherwise),
+      because OpenMP reads its environment once. PaddleOCR picks the thread count up when it is loaded.
+    """
+
+    global current_budget
+
+    budget = plan_cpu_budget(worker_index, workers, core_budget)
+    threads = budget["threads"]
+
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # inter-op pool can only be sized before its first use
+        pass
+    except ImportError:
+        pass
+
+    if affinity is None:
+        affinity = CPU_AFFINITY
+    if affinity and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, budget["cores"])
+
+    current_budget = budget
+    logger.print(f"CPU budget: worker {worker_index % max(workers, 1)}/{workers} -> {threads} threads, cores {budget['cores']}")
+    return budget
+
+
+def model_threads():
+    """
+    Returns the thread count model libraries should be configured with in this process.
+
+    Returns:
+    - int: The threads of the applied budget, or of a single-worker budget when none was applied yet.
+    """
+
+    return (current_budget or plan_cpu_budget(0, 1))["threads"]
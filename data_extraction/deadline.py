@@ -0,0 +1,145 @@
+import socket
+import threading
+import time
+from custom_lib.logger import BaseLog
+from api_channel.settings import REQUEST_DEADLINE, DEGRADE_SKIP_STAMPS_AT, DEGRADE_REGEX_ONLY_AT, DEGRADE_PARTIAL_AT
+logger = BaseLog()
+
+SKIP_STAMP_DETECTION = "stampDetectionSkipped"
+SKIP_LAYOUTLM = "layoutlmSkipped"
+PARTIAL_PAGES = "partialPages"
+
+# seconds of a REQUEST_DEADLINE budget that must remain for a stage to run; below it the stage is degraded. A shorter
+# budget scales them down in proportion (see 'Deadline').
+DEGRADATION_THRESHOLDS = {
+    SKIP_STAMP_DETECTION: DEGRADE_SKIP_STAMPS_AT,
+    SKIP_LAYOUTLM: DEGRADE_REGEX_ONLY_AT,
+    PARTIAL_PAGES: DEGRADE_PARTIAL_AT,
+}
+
+
+class Deadline:
+    """
+    Time budget of one request, carried through every stage of the extraction pipeline.
+
+    Notes:
+    - As the remaining budget shrinks the pipeline degrades in stages: stamp detection is skipped first, then the
+      LayoutLM ladder (regex over PaddleOCR only), and finally no further pages are processed (partial result).
+    - A cancelled deadline (client disconnected) denies every stage.
+    - The degradations applied to the request are collected in 'degradations', in the order they first occurred.
+    - The thresholds are DEGRADATION_THRESHOLDS for a full REQUEST_DEADLINE budget and the same share of a shorter
+      budget, so a request with a short 'deadline' starts undegraded too.
+    """
+
+    def __init__(self, budget=REQUEST_DEADLINE):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self.thresholds = {degradation: min(threshold, threshold * budget / REQUEST_DEADLINE) if REQUEST_DEADLINE > 0 else threshold
+                           for degradation, threshold in DEGRADATION_THRESHOLDS.items()}
+        self.degradations = []
+        self._cancelled = threading.Event()
+        self._watcher_stop = threading.Event()
+
+    @classmethod
+    def from_request(cls, request):
+        """
+        Creates the deadline of a request, honouring a shorter 'deadline' query parameter (seconds).
+
+        Parameters:
+        - request: The DRF or Django request.
+
+        Returns:
+        - Deadline: The deadline, never longer than REQUEST_DEADLINE.
+
+        Raises:
+        - ValueError(50002): The 'deadline' parameter is not a number or is below 1 second.
+        """
+
+        query_params = getattr(request, "query_params", request.GET)
+        if "deadline" not in query_params:
+            return cls(REQUEST_DEADLINE)
+        try:
+            budget = float(query_params["deadline"])
+        except ValueError:
+            raise ValueError(50002)
+        if not budget >= 1:
+            raise ValueError(50002)
+        return cls(min(budget, REQUEST_DEADLINE))
+
+    def remaining(self):
+        """
+        Returns the seconds left in the budget (0 once cancelled).
+        """
+
+        if self._cancelled.is_set():
+            return 0
+        return max(self.expires_at - time.monotonic(), 0)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """
+        Cancels the request, e.g. because the client disconnected.
+        """
+
+        if not self._cancelled.is_set():
+            self._cancelled.set()
+            logger.print("deadline: request cancelled")
+
+    def allow(self, degradation, applied=None):
+        """
+        Checks whether the stage guarded by a degradation may still run.
+
+        Parameters:
+        - degradation (str): One of SKIP_STAMP_DETECTION, SKIP_LAYOUTLM or PARTIAL_PAGES.
+        - applied (list, optional): A per-page list the degradation is appended to when the stage is denied.
+
+        Returns:
+        - bool: True if enough budget remains for the stage, False if it must be degraded.
+        """
+
+        if self.remaining() > self.thresholds[degradation]:
+            return True
+
+        if degradation not in self.degradations:
+            self.degradations.append(degradation)
+            logger.print(f"deadline: {degradation} ({self.remaining():.1f}s left)")
+        if applied is not None and degradation not in applied:
+            applied.append(degradation)
+        return False
+
+    def watch_client(self, request, interval=1.0):
+        """
+        Cancels the deadline as soon as the client closes its connection.
+
+        Parameters:
+        - request: The Django or DRF request. Only gunicorn exposes the client socket; elsewhere this is a no-op.
+        - interval (float, optional): Seconds between connection checks. Default is 1.
+        """
+
+        client_socket = request.META.get("gunicorn.socket")
+        if client_socket is None:
+            return
+
+        def watch():
+            while not self._watcher_stop.wait(interval):
+                try:
+                    if client_socket.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b"":
+                        self.cancel()
+                        return
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    self.cancel()
+                    return
+
+        threading.Thread(target=watch, name="client-disconnect-watcher", daemon=True).start()
+
+    def close(self):
+        """
+        Stops watching the client connection once the request is finished.
+        """
+
+        self._watcher_stop.set()
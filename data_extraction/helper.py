@@ -1,12 +1,17 @@
-from data_extraction.services import pdf_file_operation, image_file_operation, delete_path
-from stamp_detection.pinecone import insert_new_stamp_image_company_name
-from stamp_detection.services import file_type_detection, pdf_file_operation_for_stamp_id_verification, image_file_operation_for_stamp_id_verfication
+import asyncio
+from data_extraction.services import pdf_file_operation, image_file_operation, iter_pdf_file_operation, iter_image_file_operation
+from stamp_detection.pinecone import insert_new_stamp_image_company_name, insert_new_stamp_image_company_name_async
+from stamp_detection.services import file_type_detection, pdf_file_operation_for_stamp_id_verification, image_file_operation_for_stamp_id_verfication, iter_pdf_file_operation_for_stamp_id_verification, iter_image_file_operation_for_stamp_id_verification
+from custom_lib.helper import get_error_msg
+from data_extraction.scratch import close_workspace
+from data_extraction.image_normalization import normalize_image, release_normalized_image
+from data_extraction.verification import VerificationOptions
+from api_channel.settings import VERIFICATION_MATCH_THRESHOLD
 import pandas as pd
 import glob
 from custom_lib.logger import BaseLog
 import os
 import time
-import paddle
 logger = BaseLog()
 
 # Force CPU mode for local development (disable GPU auto-detection)
@@ -14,13 +19,15 @@ device = "cpu"
 logger.print(f"✅ Using device for Data Extraction: {device} (forced for compatibility)")
 
 
-def data_extraction(doc_path, is_stamp_details_required="False"):
+def data_extraction(doc_path, is_stamp_details_required="False", deadline=None, profile=None):
     """
     Orchestrates the data extraction process for different file types.
 
     Parameters:
     - doc_path (str): The path to the document file.
     - is_stamp_details_required (str, optional): Indicates whether stamp details should be extracted (default: "False").
+    - deadline (Deadline, optional): The request deadline carried through every stage of the pipeline.
+    - profile (dict, optional): The pipeline profile of the requested mode (see 'get_profile').
 
     Returns:
     - list or dict: The extracted data, structured as either a list (for multi-page documents) or a dictionary. The exact structure depends on the specific file operation functions called.
@@ -47,7 +54,7 @@ def data_extraction(doc_path, is_stamp_details_required="False"):
         file_operations = {"Image": image_file_operation, "PDF": pdf_file_operation}
 
         if file_type in file_operations:
-            res = file_operations[file_type](doc_path, device=use_device, is_stamp_details_required= is_stamp_details_required)
+            res = file_operations[file_type](doc_path, device=use_device, is_stamp_details_required= is_stamp_details_required, deadline=deadline, profile=profile)
             return res
         else:
             logger.print(f"Unsupported file type: {file_type}")
@@ -58,18 +65,122 @@ def data_extraction(doc_path, is_stamp_details_required="False"):
         raise e
     
     finally:
-        delete_path(doc_path)
+        close_workspace(doc_path)
     
     
 
 
-def verifying_company(doc_path, company_id):
+def data_extraction_stream(doc_path, is_stamp_details_required="False", deadline=None, profile=None):
+    """
+    Streaming variant of 'data_extraction': returns the per-page events instead of the final list.
+
+    Parameters:
+    - doc_path (str): The path to the document file.
+    - is_stamp_details_required (str, optional): Indicates whether stamp details should be extracted (default: "False").
+    - deadline (Deadline, optional): The request deadline; it is cancelled if the client stops reading the stream.
+    - profile (dict, optional): The pipeline profile of the requested mode (see 'get_profile').
+
+    Returns:
+    - generator: 'page', 'progress' and 'summary' events (see 'iter_pdf_file_operation'), or an 'error' event
+      if processing fails part-way.
+
+    Raises:
+    - ValueError: If an unsupported file type is encountered (raised before streaming starts).
+    """
+
+    file_operations = {"Image": iter_image_file_operation, "PDF": iter_pdf_file_operation}
+    file_type = detect_file_type_or_cleanup(doc_path)
+    return stream_with_cleanup(file_operations[file_type](doc_path, device=device, is_stamp_details_required=is_stamp_details_required, deadline=deadline, profile=profile), doc_path, deadline)
+
+
+
+def verifying_company_stream(doc_path, company_id, deadline=None, options=None):
+    """
+    Streaming variant of 'verifying_company': returns the per-page events instead of the final list.
+
+    Parameters:
+    - doc_path (str): The path to the document file.
+    - company_id (int): The ID of the company to verify.
+    - deadline (Deadline, optional): The request deadline; it is cancelled if the client stops reading the stream.
+    - options (VerificationOptions, optional): The page order, match threshold and early exit of the request.
+
+    Returns:
+    - generator: 'page', 'progress' and 'summary' events (see 'iter_pdf_file_operation_for_stamp_id_verification'),
+      or an 'error' event if processing fails part-way.
+
+    Raises:
+    - ValueError: If an unsupported file type is encountered (raised before streaming starts).
+    """
+
+    file_operations = {"Image": iter_image_file_operation_for_stamp_id_verification, "PDF": iter_pdf_file_operation_for_stamp_id_verification}
+    file_type = detect_file_type_or_cleanup(doc_path)
+    return stream_with_cleanup(file_operations[file_type](doc_path, company_id, deadline, options), doc_path, deadline)
+
+
+
+def detect_file_type_or_cleanup(doc_path):
+    """
+    Detects the file type of a document, deleting the document if the type is unsupported.
+
+    Parameters:
+    - doc_path (str): The path to the document file.
+
+    Returns:
+    - str: 'Image' or 'PDF'.
+
+    Raises:
+    - ValueError: If an unsupported file type is encountered.
+    """
+
+    try:
+        return file_type_detection(doc_path)
+    except Exception as e:
+        logger.print(f"Error processing document: {doc_path}")
+        close_workspace(doc_path)
+        raise e
+
+
+
+def stream_with_cleanup(events, doc_path, deadline=None):
+    """
+    Passes events through, turning a failure into a final 'error' event and deleting the document at the end.
+
+    Parameters:
+    - events (generator): The events of a file operation.
+    - doc_path (str): The path to the document file, deleted once the stream ends or is closed.
+    - deadline (Deadline, optional): Cancelled when the stream is closed early (client disconnected) and closed at the end.
+
+    Yields:
+    - dict: The events, possibly followed by {'event': 'error', 'data': {'errorCode', 'errorMessage'}}.
+    """
+
+    try:
+        yield from events
+    except GeneratorExit:
+        if deadline:
+            deadline.cancel()
+        raise
+    except Exception as e:
+        logger.print(f"Error processing document: {doc_path}: {str(e)}")
+        error_code = int(str(e)) if str(e).isdigit() else 50001
+        yield {"event": "error", "data": {"errorCode": error_code, "errorMessage": get_error_msg(error_code)}}
+    finally:
+        if deadline:
+            deadline.close()
+        close_workspace(doc_path)
+
+
+
+def verifying_company(doc_path, company_id, deadline=None, options=None):
     """
     Verifies the company associated with a document by checking for stamp ID matches.
 
     Parameters:
     - doc_path (str): The path to the document file.
     - company_id (int): The ID of the company to verify.
+    - deadline (Deadline, optional): The request deadline; once it is nearly spent the remaining PDF pages are skipped.
+    - options (VerificationOptions, optional): The page order, match threshold and early exit of the request; with
+      'stopOnFirstMatch' the matched and skipped PDF pages are recorded in it.
 
     Returns:
     - list or dict: The verification results, structured as either a list (for multi-page documents) or a dictionary. The exact structure depends on the specific file operation functions called.
@@ -94,8 +205,10 @@ def verifying_company(doc_path, company_id):
 
         file_operations = {"Image": image_file_operation_for_stamp_id_verfication, "PDF": pdf_file_operation_for_stamp_id_verification}
 
-        if file_type in file_operations:
-            res = file_operations[file_type](doc_path, company_id)
+        if file_type == "PDF":
+            return pdf_file_operation_for_stamp_id_verification(doc_path, company_id, deadline, options)
+        elif file_type in file_operations:
+            res = file_operations[file_type](doc_path, company_id, match_threshold=(options or VerificationOptions()).match_threshold)
             return res
         else:
             logger.print(f"Unsupported file type: {file_type}")
@@ -106,7 +219,76 @@ def verifying_company(doc_path, company_id):
         raise e
     
     finally:
-        delete_path(doc_path)
+        close_workspace(doc_path)
+
+
+
+def document_analysis(doc_path, company_id, deadline=None, profile=None, match_threshold=VERIFICATION_MATCH_THRESHOLD):
+    """
+    Extracts the IDs of a document, identifies its stamps and verifies them against a company in one pass.
+
+    Parameters:
+    - doc_path (str): The path to the document file.
+    - company_id (str): The ID of the company to verify.
+    - deadline (Deadline, optional): The request deadline carried through every stage of the pipeline.
+    - profile (dict, optional): The pipeline profile of the requested mode (see 'get_profile').
+    - match_threshold (float, optional): Cosine similarity above which a stamp matches the company, as for
+      '/StampVerification'. Defaults to VERIFICATION_MATCH_THRESHOLD.
+
+    Returns:
+    - list: One entry per relevant page with the fields of 'data_extraction' (stamp details included) and the
+      'verification' result of 'verifying_company'.
+
+    Raises:
+    - ValueError: If an unsupported file type is encountered.
+
+    Notes:
+    - Every page is rendered, classified, stamp-detected and embedded once for both results (see 'analyze_stamps').
+    """
+
+    try:
+
+        file_type = file_type_detection(doc_path)
+
+        file_operations = {"Image": image_file_operation, "PDF": pdf_file_operation}
+
+        if file_type in file_operations:
+            return file_operations[file_type](doc_path, device=device, is_stamp_details_required="True", deadline=deadline, profile=profile, company_id=company_id, match_threshold=match_threshold)
+        else:
+            logger.print(f"Unsupported file type: {file_type}")
+            raise ValueError(50007)
+
+    except Exception as e:
+        logger.print(f"Error processing document: {doc_path}")
+        raise e
+
+    finally:
+        close_workspace(doc_path)
+
+
+
+def document_analysis_stream(doc_path, company_id, deadline=None, profile=None, match_threshold=VERIFICATION_MATCH_THRESHOLD):
+    """
+    Streaming variant of 'document_analysis': returns the per-page events instead of the final list.
+
+    Parameters:
+    - doc_path (str): The path to the document file.
+    - company_id (str): The ID of the company to verify.
+    - deadline (Deadline, optional): The request deadline; it is cancelled if the client stops reading the stream.
+    - profile (dict, optional): The pipeline profile of the requested mode (see 'get_profile').
+    - match_threshold (float, optional): As in 'document_analysis'.
+
+    Returns:
+    - generator: 'page', 'progress' and 'summary' events (see 'iter_pdf_file_operation'), or an 'error' event
+      if processing fails part-way.
+
+    Raises:
+    - ValueError: If an unsupported file type is encountered (raised before streaming starts).
+    """
+
+    file_operations = {"Image": iter_image_file_operation, "PDF": iter_pdf_file_operation}
+    file_type = detect_file_type_or_cleanup(doc_path)
+    return stream_with_cleanup(file_operations[file_type](doc_path, device=device, is_stamp_details_required="True", deadline=deadline, profile=profile, company_id=company_id, match_threshold=match_threshold), doc_path, deadline)
 
 
 
@@ -123,7 +305,8 @@ def add_stamp(doc_path, company_id):
 
     Notes:
     - Uses 'file_type_detection' to determine the type of the document.
-    - If the document type is 'Image', inserts a new stamp image into the database and returns the stamp ID.
+    - If the document type is 'Image', inserts a new stamp image into the database and returns the stamp ID. The image
+      is embedded upright and downscaled (see 'normalize_image').
     - Raises a ValueError if the document type is unsupported.
 
     Exceptions:
@@ -136,7 +319,11 @@ def add_stamp(doc_path, company_id):
 
         if file_type == "Image":
             logger.print("Please wait for around 15 seconds")
-            stamp_id = insert_new_stamp_image_company_name(doc_path, company_id)
+            normalized = normalize_image(doc_path)
+            try:
+                stamp_id = insert_new_stamp_image_company_name(normalized["path"], company_id)
+            finally:
+                release_normalized_image(normalized)
             res = {"stampId": stamp_id, "companyId": company_id}
             return res
 
@@ -148,7 +335,31 @@ def add_stamp(doc_path, company_id):
         raise e
     
     finally:
-        delete_path(doc_path)
+        close_workspace(doc_path)
+
+
+async def add_stamp_async(doc_path, company_id):
+    """
+    Async variant of 'add_stamp' for the async views (see 'insert_new_stamp_image_company_name_async').
+    """
+    try:
+
+        if file_type_detection(doc_path) != "Image":
+            raise ValueError(50008)
+
+        normalized = await asyncio.to_thread(normalize_image, doc_path)
+        try:
+            stamp_id = await insert_new_stamp_image_company_name_async(normalized["path"], company_id)
+        finally:
+            release_normalized_image(normalized)
+        return {"stampId": stamp_id, "companyId": company_id}
+
+    except Exception as e:
+        logger.print(f"Error processing document: {doc_path}")
+        raise e
+
+    finally:
+        close_workspace(doc_path)
 
 
 
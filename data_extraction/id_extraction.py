@@ -0,0 +1,189 @@
+import bisect
+import itertools
+import math
+import numbers
+import re
+
+# ID rules: (field, rule name, pattern of the whole digit token, weight). Tokens are digit runs between non-word
+# characters, as '\b\d+\b' finds them.
+ID_RULES = [
+    ("shipmentId", "47", r"0{0,2}47\d*", 1.0),
+    ("deliveryId", "85", r"0?85\d*", 1.0),
+    ("deliveryId", "820", r"820\d+", 0.8),
+]
+ID_FIELDS = ("shipmentId", "deliveryId")
+MIN_LENGTH = 7
+EXPECTED_LENGTH = 10
+
+# keywords labelling each field on the documents; a word starting with one is an anchor of the field
+ANCHORS = {"shipmentId": ("embarque", "shipment"), "deliveryId": ("entrega", "remisi", "delivery")}
+# a page with 'Orde' in its first characters is an order, whose numbers are not shipment IDs
+SHIPMENT_VETO = re.compile(r"Orde")
+SHIPMENT_VETO_CHARS = 300
+
+# weights of the score components; each component is between 0 and 1
+WEIGHTS = {"rule": 0.35, "length": 0.15, "anchor": 0.35, "position": 0.15}
+# anchor distance (in line heights with boxes, in characters without) at which the anchor score halves
+ANCHOR_REACH_LINES = 10
+ANCHOR_REACH_CHARS = 40
+# neutral anchor score when the page has no anchor of the field
+NO_ANCHOR = 0.5
+
+# the digits an ID rule match can start with; keep in step with ID_RULES
+ID_FIRST_DIGITS = "048"
+
+ID_PATTERN = re.compile("|".join(f"(?P<rule{index}>{pattern})" for index, (_, _, pattern, _) in enumerate(ID_RULES)))
+# one pass over the text finds every ID rule match (a whole digit token) and every anchor keyword; the leading
+# lookahead lets the regex engine skip to the characters a match can start with
+SCAN_PATTERN = re.compile(
+    f"(?=[{ID_FIRST_DIGITS}{''.join(sorted({keyword[0] for keywords in ANCHORS.values() for keyword in keywords}))}])\\b"
+    + r"(?:(?:" + ID_PATTERN.pattern + r")\b|" + "|".join(f"(?P<anchor_{field}>{'|'.join(keywords)})" for field, keywords in ANCHORS.items()) + ")",
+    re.IGNORECASE)
+
+
+def ocr_rows(ocr):
+    """
+    Returns the text of OCR output and the position of its rows.
+
+    Parameters:
+    - ocr: The OCR output: text, PaddleOCR lines ([box, (text, score)]) or (word, [x0, y0, x1, y1]) word boxes.
+
+    Returns:
+    - tuple: (text, row starts, row boxes). The text has one row per line or word; 'row starts' are the offsets of
+      the rows in it and 'row boxes' their boxes as given. Both are None for plain text.
+    """
+
+    if isinstance(ocr, str):
+        return ocr, None, None
+    if ocr and isinstance(ocr[0][0], str):
+        texts, boxes = [word for word, _ in ocr], [box for _, box in ocr]
+    else:
+        texts, boxes = [text for _, (text, _) in ocr or []], [box for box, _ in ocr or []]
+    starts = list(itertools.accumulate((len(text) + 1 for text in texts[:-1]), initial=0)) if texts else []
+    return "\n".join(texts), starts, boxes
+
+
+def match_box(start, end, starts, boxes, text):
+    """
+    Returns the (x0, y0, x1, y1) box of the characters start:end of the OCR text: their share of their row's box, by
+    character offset.
+    """
+
+    row = bisect.bisect_right(starts, start) - 1
+    row_end = starts[row + 1] - 1 if row + 1 < len(starts) else len(text)
+    box = boxes[row]
+    if not isinstance(box[0], numbers.Number):
+        xs, ys = [point[0] for point in box], [point[1] for point in box]
+        box = (min(xs), min(ys), max(xs), max(ys))
+    width = (box[2] - box[0]) / max(row_end - starts[row], 1)
+    return (box[0] + width * (start - starts[row]), box[1], box[0] + width * (end - starts[row]), box[3])
+
+
+def id_rule(value):
+    """
+    Returns the ID rule (see ID_RULES) a digit token matches, or None.
+    """
+
+    match = ID_PATTERN.fullmatch(value)
+    return ID_RULES[int(match.lastgroup[len("rule"):])] if match else None
+
+
+def is_valid_id(field, value):
+    """
+    Checks whether a value is a valid ID of a field: one digit token of at least MIN_LENGTH digits matching a rule
+    of the field.
+    """
+
+    rule = id_rule(value) if value.isdigit() and len(value) >= MIN_LENGTH else None
+    return rule is not None and rule[0] == field
+
+
+def anchor_distance(candidate, anchor):
+    """
+    Returns the distance from an anchor keyword to a candidate, relative to the anchor reach: in anchor line heights
+    with boxes, in characters without. A candidate left of or above its anchor counts twice as far, since values
+    follow their labels.
+    """
+
+    if candidate["box"] is not None:
+        box, anchor_box = candidate["box"], anchor["box"]
+        height = max(anchor_box[3] - anchor_box[1], 1)
+        dx = ((box[0] + box[2]) - (anchor_box[0] + anchor_box[2])) / 2 / height
+        dy = ((box[1] + box[3]) - (anchor_box[1] + anchor_box[3])) / 2 / height
+        return math.hypot(dx if dx >= 0 else 2 * dx, dy if dy >= 0 else 2 * dy) / ANCHOR_REACH_LINES
+    distance = candidate["start"] - anchor["end"]
+    return (distance if distance >= 0 else 2 * max(anchor["start"] - candidate["end"], 0)) / ANCHOR_REACH_CHARS
+
+
+def rank_candidates(ocr, fields=ID_FIELDS):
+    """
+    Ranks the ID candidates of OCR output in one pass over its text.
+
+    Parameters:
+    - ocr: The OCR output (see 'ocr_rows'); with boxes, anchor distances are measured on the page.
+    - fields (tuple, optional): The fields to rank. Defaults to both IDs.
+
+    Returns:
+    - dict: Maps each field to its candidates, best first: dicts with 'value', 'confidence' (0-1), 'rule', 'anchor'
+      (the nearest anchor keyword or None), 'box' and the component 'scores'. A value found more than once is
+      listed once, with its best score.
+
+    Notes:
+    - A candidate is a digit token of at least MIN_LENGTH digits matching an ID rule. Its confidence is the weighted
+      sum (WEIGHTS) of the rule weight, its length (EXPECTED_LENGTH digits scores 1), the distance to the nearest
+      anchor of its field (NO_ANCHOR if the page has none) and its position in the text (earlier is better, as the
+      first match was before).
+    - Candidates of a rule with a lower weight (the '820' delivery rule) rank after every candidate of a full-weight
+      rule of the field, as the '820' rule was only a fallback before.
+    - Shipment IDs are not read from a page with 'Orde' in its first SHIPMENT_VETO_CHARS characters.
+    """
+
+    text, starts, boxes = ocr_rows(ocr)
+    anchors = {field: [] for field in fields}
+    candidates = {field: [] for field in fields}
+    for match in SCAN_PATTERN.finditer(text):
+        group = match.lastgroup
+        found = {"value": match.group(), "start": match.start(), "end": match.end(),
+                 "box": match_box(match.start(), match.end(), starts, boxes, text) if boxes else None}
+        if group.startswith("anchor_"):
+            if group[len("anchor_"):] in anchors:
+                anchors[group[len("anchor_"):]].append(found)
+        elif len(found["value"]) >= MIN_LENGTH:
+            field, rule, _, weight = ID_RULES[int(group[len("rule"):])]
+            if field in candidates:
+                candidates[field].append({**found, "rule": rule, "weight": weight})
+
+    if "shipmentId" in candidates and SHIPMENT_VETO.search(text, 0, SHIPMENT_VETO_CHARS):
+        candidates["shipmentId"] = []
+
+    ranked = {}
+    for field in fields:
+        best = {}
+        for candidate in candidates[field]:
+            distances = [(anchor_distance(candidate, anchor), anchor["value"]) for anchor in anchors[field]]
+            distance, anchor = min(distances) if distances else (None, None)
+            scores = {
+                "rule": candidate["weight"],
+                "length": max(0.0, 1 - abs(len(candidate["value"]) - EXPECTED_LENGTH) / EXPECTED_LENGTH),
+                "anchor": 1 / (1 + distance) if anchor else NO_ANCHOR,
+                "position": 1 - candidate["start"] / max(len(text), 1),
+            }
+            confidence = sum(WEIGHTS[name] * score for name, score in scores.items())
+            value = candidate["value"]
+            if value not in best or confidence > best[value]["confidence"]:
+                best[value] = {"value": value, "confidence": round(confidence, 4), "rule": candidate["rule"], "anchor": anchor,
+                               "box": candidate["box"], "scores": {name: round(score, 4) for name, score in scores.items()}}
+        ranked[field] = sorted(best.values(), key=lambda candidate: (-candidate["scores"]["rule"], -candidate["confidence"]))
+    return ranked
+
+
+def extract_ids(ocr):
+    """
+    Returns the best shipment and delivery ID of OCR output (see 'rank_candidates').
+
+    Returns:
+    - dict: 'shipmentId' and 'deliveryId', each the best candidate or "" if there is none.
+    """
+
+    ranked = rank_candidates(ocr)
+    return {field: ranked[field][0]["value"] if ranked[field] else "" for field in ID_FIELDS}
@@ -0,0 +1,143 @@
+import threading
+import time
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+from custom_lib.logger import BaseLog
+from data_extraction.metrics import register_metrics
+from data_extraction.scratch import scratch_file, track_scratch_file, remove_scratch_file
+from api_channel.settings import IMAGE_MAX_PIXELS, IMAGE_MAX_SIDE
+logger = BaseLog()
+
+EXIF_ORIENTATION = 0x0112
+
+_lock = threading.Lock()
+_counters = {"images": 0, "rewritten": 0, "downscaled": 0, "rotated": 0, "rejected": 0, "seconds": 0.0}
+
+
+def normalization_stats():
+    """
+    Returns the normalization counters: images checked, rewritten (downscaled, rotated or converted to RGB), rejected
+    as too large, and the total time spent.
+    """
+
+    with _lock:
+        return {**_counters, "seconds": round(_counters["seconds"], 3)}
+
+register_metrics("imageNormalization", normalization_stats)
+
+
+def _count(**values):
+    with _lock:
+        for key, value in values.items():
+            _counters[key] += value
+
+
+def normalize_image(image_path, max_side=IMAGE_MAX_SIDE):
+    """
+    Prepares an input image once for every model stage: EXIF orientation applied, RGB, long side at most 'max_side'.
+
+    Parameters:
+    - image_path (str): The path to the uploaded image.
+    - max_side (int, optional): The longest side the models get. Defaults to IMAGE_MAX_SIDE.
+
+    Returns:
+    - dict: The normalized image:
+    - path (str): The image the stages read; the original path when it needed no change.
+    - size (tuple): Its (width, height).
+    - originalSize (tuple): The (width, height) of the original, upright as displayed (EXIF orientation applied).
+    - scale (tuple): The (x, y) factors from normalized to original coordinates (see 'to_original_boxes').
+    - temporary (bool): Whether 'path' is a temporary file to delete with 'release_normalized_image'.
+
+    Exceptions:
+    - ValueError(50022): The image has more than IMAGE_MAX_PIXELS pixels (checked from the header, before decoding),
+      or more than Pillow's own decompression bomb limit ('Image.MAX_IMAGE_PIXELS', left at its default).
+
+    Notes:
+    - JPEGs are decoded straight at a reduced size ('draft'), so a 50 MP phone photo is never decoded at full size.
+    - The rewritten image is a PNG, like the rendered PDF pages.
+    - An image Pillow cannot read is passed on unchanged, so the stages handle it as before.
+    - The rewritten image goes to the scratch workspace of the original (see 'scratch_file').
+    """
+
+    start_time = time.time()
+    try:
+        return _normalize(image_path, max_side, start_time)
+    except Image.DecompressionBombError:
+        _count(images=1, rejected=1)
+        raise ValueError(50022)
+    except (OSError, SyntaxError) as e:
+        logger.print(f"image normalization skipped for {image_path}: {str(e)}")
+        return {"path": image_path, "size": None, "originalSize": None, "scale": (1.0, 1.0), "temporary": False}
+
+
+def _normalize(image_path, max_side, start_time):
+    with Image.open(image_path) as image:
+        width, height = image.size
+        if width * height > IMAGE_MAX_PIXELS:
+            _count(images=1, rejected=1)
+            logger.print(f"image rejected: {width}x{height} exceeds IMAGE_MAX_PIXELS={IMAGE_MAX_PIXELS}")
+            raise ValueError(50022)
+
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        downscale = max(width, height) > max_side
+        if not downscale and orientation == 1 and image.mode == "RGB":
+            _count(images=1, seconds=time.time() - start_time)
+            return {"path": image_path, "size": (width, height), "originalSize": (width, height), "scale": (1.0, 1.0), "temporary": False}
+
+        if downscale:
+            image.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=3.0)
+        image = ImageOps.exif_transpose(image).convert("RGB")
+
+    original_size = (height, width) if orientation in (5, 6, 7, 8) else (width, height)
+    normalized_path = scratch_file(image_path, '.png')
+    cv2.imwrite(normalized_path, cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR))
+    try:
+        track_scratch_file(normalized_path)
+    except ValueError:
+        remove_scratch_file(normalized_path)
+        raise
+
+    _count(images=1, rewritten=1, downscaled=int(downscale), rotated=int(orientation != 1), seconds=time.time() - start_time)
+    return {"path": normalized_path, "size": image.size, "originalSize": original_size,
+            "scale": (original_size[0] / image.size[0], original_size[1] / image.size[1]), "temporary": True}
+
+
+def release_normalized_image(normalized):
+    """
+    Deletes the temporary file of a normalized image, if one was written.
+    """
+
+    if normalized and normalized["temporary"]:
+        remove_scratch_file(normalized["path"])
+
+
+def to_original_boxes(boxes, normalized):
+    """
+    Maps [x1, y1, x2, y2] boxes from the normalized image to the original image.
+
+    Parameters:
+    - boxes (list): Boxes in normalized pixel coordinates.
+    - normalized (dict): The result of 'normalize_image'.
+
+    Returns:
+    - list: The boxes in original pixel coordinates (unchanged when the image was not downscaled).
+    """
+
+    scale_x, scale_y = normalized["scale"]
+    if scale_x == 1 and scale_y == 1:
+        return boxes
+    return [[box[0] * scale_x, box[1] * scale_y, box[2] * scale_x, box[3] * scale_y] for box in boxes]
+
+
+def to_original_stamp_data(stamp_data, normalized):
+    """
+    Maps the stamp boxes of a page result ('stampDetails' and the 'verification' boxes) to original coordinates.
+    """
+
+    for details in stamp_data.get("stampDetails", []):
+        details["boundingBoxCoordinates"] = to_original_boxes([details["boundingBoxCoordinates"]], normalized)[0]
+    verification = stamp_data.get("verification", stamp_data)
+    if "boundingBoxCoordinates" in verification:
+        verification["boundingBoxCoordinates"] = to_original_boxes(verification["boundingBoxCoordinates"], normalized)
+    return stamp_data
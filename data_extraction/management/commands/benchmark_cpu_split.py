@@ -0,0 +1,76 @@
+import multiprocessing
+import time
+from django.core.management.base import BaseCommand
+from data_extraction.cpu_budget import available_cores
+
+
+def run_worker(worker_index, workers, core_budget, image_path, iterations, ready, results):
+    """
+    Runs the page workload in one benchmark worker process with its share of the core budget.
+
+    Parameters:
+    - worker_index (int): Index of the worker.
+    - workers (int): Number of workers in this configuration.
+    - core_budget (int): Total cores shared by the workers.
+    - image_path (str): The page image used as workload.
+    - iterations (int): Number of pages processed by the worker.
+    - ready (multiprocessing.Barrier): Released once every worker has loaded its models.
+    - results (multiprocessing.Queue): Receives the worker's elapsed time.
+    """
+
+    import django
+    django.setup()
+    from data_extraction.cpu_budget import apply_cpu_budget
+    apply_cpu_budget(worker_index, workers, core_budget)
+
+    from data_extraction.apps import model_registry
+    from data_extraction.services import initialize_number_extraction_model
+    from stamp_detection.services import document_classifer
+    model_registry.warm_up(names=["layoutlm", "paddleocr", "stamp_detection", "document_classifier"])
+
+    ready.wait()
+    start_time = time.time()
+    for _ in range(iterations):
+        document_classifer(image_path)
+        initialize_number_extraction_model(image_path, "what is No. Embarque?", "cpu")
+        model_registry.get("paddleocr").ocr(image_path)
+        model_registry.get("stamp_detection")(image_path, verbose=False)
+    results.put(time.time() - start_time)
+
+
+class Command(BaseCommand):
+    help = "Benchmarks workers x threads splits of the CPU core budget on one page image and reports the best split."
+
+    def add_arguments(self, parser):
+        parser.add_argument("image_path", help="A representative page image.")
+        parser.add_argument("--cores", type=int, default=len(available_cores()), help="Core budget to split. Defaults to all available cores.")
+        parser.add_argument("--workers", default="", help="Comma separated worker counts to try. Defaults to every divisor of the core budget.")
+        parser.add_argument("--iterations", type=int, default=5, help="Pages processed by each worker.")
+
+    def handle(self, *args, **options):
+        cores = options["cores"]
+        worker_counts = [int(w) for w in options["workers"].split(",") if w] or [w for w in range(1, cores + 1) if cores % w == 0]
+        context = multiprocessing.get_context("spawn")
+
+        rows = []
+        for workers in worker_counts:
+            ready = context.Barrier(workers)
+            results = context.Queue()
+            processes = [
+                context.Process(target=run_worker, args=(index, workers, cores, options["image_path"], options["iterations"], ready, results))
+                for index in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            elapsed = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+
+            pages = workers * options["iterations"]
+            throughput = pages / max(elapsed)
+            latency = sum(elapsed) / pages
+            rows.append((workers, max(cores // workers, 1), throughput, latency))
+            self.stdout.write(f"workers={workers:<3} threads={max(cores // workers, 1):<3} throughput={throughput:.2f} pages/s  latency={latency:.2f} s/page")
+
+        best = max(rows, key=lambda row: row[2])
+        self.stdout.write(f"best split for {cores} cores: {best[0]} workers x {best[1]} threads (set --workers {best[0]} and CPU_CORE_BUDGET={cores})")
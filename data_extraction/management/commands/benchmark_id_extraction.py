@@ -0,0 +1,71 @@
+import random
+import re
+import time
+from django.core.management.base import BaseCommand
+from data_extraction.id_extraction import extract_ids
+
+FILLER = ["Cliente", "Direccion", "Fecha", "Cantidad", "Material", "Peso", "Total", "Planta", "Transportista", "Destino",
+          "Factura", "Lote", "Kg", "Pza", "Observaciones", "Firma", "Sello", "Recibido", "Conforme", "Pedido"]
+
+
+def legacy_ids(text):
+    """
+    The regex extraction that 'id_extraction' replaced: every rule rescans the whole text and the first match wins.
+    """
+
+    def extract_pattern(data, target_pattern, prefix_zeros=0):
+        for result in re.findall(fr'\b0{{0,{prefix_zeros}}}{target_pattern}\d*\b', ' '.join(data)):
+            if len(result) >= 7:
+                return result
+        return ""
+
+    shipment_id = "" if re.findall(r'Orde', text[:300]) else extract_pattern(re.findall(r'\b\d*47\d*\b', text), '47', prefix_zeros=2)
+    delivery_id = extract_pattern(re.findall(r'\b\d*85\d*\b', text), '85', prefix_zeros=1)
+    if len(delivery_id) < 7:
+        matches = re.findall(r"\b820\d{7}\b|\b820\d+\b", text)
+        delivery_id = matches[0] if matches and len(matches[0]) >= 7 else ""
+    return {"shipmentId": shipment_id if len(shipment_id) >= 7 else "", "deliveryId": delivery_id}
+
+
+def synthetic_page(rng, lines, decoys):
+    """
+    Builds the OCR output of a delivery note: filler lines, the labelled IDs half-way down and 'decoys' unlabelled
+    numbers that also pass the ID rules, some of them above the labels.
+
+    Returns:
+    - tuple: (PaddleOCR lines with boxes, expected IDs).
+    """
+
+    shipment_id, delivery_id = f"47{rng.randrange(10**8):08d}", f"85{rng.randrange(10**8):08d}"
+    rows = [" ".join(rng.choice(FILLER) if rng.random() < 0.8 else str(rng.randrange(10**6)) for _ in range(rng.randint(2, 8))) for _ in range(lines)]
+    for _ in range(decoys):
+        rows[rng.randrange(len(rows))] += f" Ref {rng.choice(['47', '85'])}{rng.randrange(10**8):08d}"
+    middle = len(rows) // 2
+    rows[middle:middle] = [f"No. Embarque: {shipment_id}", f"No. Entrega: {delivery_id}"]
+
+    ocr = [[[[20, 30 * i], [20 + 12 * len(row), 30 * i], [20 + 12 * len(row), 30 * i + 24], [20, 30 * i + 24]], (row, 0.95)] for i, row in enumerate(rows)]
+    return ocr, {"shipmentId": shipment_id, "deliveryId": delivery_id}
+
+
+class Command(BaseCommand):
+    help = "Microbenchmarks ID extraction over synthetic OCR output: the previous regex rescans against the single-pass engine on text and on boxed OCR lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=200, help="Synthetic pages.")
+        parser.add_argument("--lines", default="50,500,5000", help="Comma separated OCR lines per page to compare.")
+        parser.add_argument("--decoys", type=int, default=2, help="Unlabelled numbers per page that pass the ID rules.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic pages.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        for lines in [int(value) for value in options["lines"].split(",") if value]:
+            pages = [synthetic_page(rng, lines, options["decoys"]) for _ in range(options["pages"])]
+            texts = ["\n".join(text for _, (text, _) in ocr) for ocr, _ in pages]
+
+            for name, extract, inputs in [("legacy regex", legacy_ids, texts), ("engine, text", extract_ids, texts),
+                                          ("engine, boxes", extract_ids, [ocr for ocr, _ in pages])]:
+                start_time = time.perf_counter()
+                results = [extract(item) for item in inputs]
+                elapsed = time.perf_counter() - start_time
+                correct = sum(result == expected for result, (_, expected) in zip(results, pages))
+                self.stdout.write(f"lines={lines:<5} {name:<14} {elapsed / len(pages) * 1e6:>10.1f} us/page  both IDs correct={correct}/{len(pages)}")
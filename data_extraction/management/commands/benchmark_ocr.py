@@ -0,0 +1,68 @@
+import itertools
+import time
+from PIL import Image
+from django.core.management.base import BaseCommand
+from data_extraction.apps import model_registry
+from data_extraction.ocr_engine import ocr_images, as_bgr
+from data_extraction.id_extraction import extract_ids
+from data_extraction.services import number_fields_dict, roi_store
+
+
+def page_ids(lines):
+    ids = extract_ids(lines)
+    return ids["shipmentId"], ids["deliveryId"]
+
+
+def timed(fn, iterations):
+    """
+    Runs 'fn' 'iterations' times and returns (seconds per run, result of the last run).
+    """
+
+    start_time = time.time()
+    for _ in range(iterations):
+        result = fn()
+    return (time.time() - start_time) / iterations, result
+
+
+class Command(BaseCommand):
+    help = "Benchmarks PaddleOCR settings (recognition batch size, detection size, angle classifier) on page images, per page, batched across pages and on the ID region, and reports how many pages keep the IDs of the reference run."
+
+    def add_arguments(self, parser):
+        parser.add_argument("images", nargs="+", help="Page images (e.g. rendered PDF pages).")
+        parser.add_argument("--rec-batch-nums", default="6,16,32", help="Comma separated recognition batch sizes. 6 is the PaddleOCR default.")
+        parser.add_argument("--det-limit-side-lens", default="736,960,1280", help="Comma separated detection limit side lengths.")
+        parser.add_argument("--cls", default="on,off", help="Angle classifier settings to compare: on, off or both.")
+        parser.add_argument("--iterations", type=int, default=1, help="Runs per setting.")
+
+    def handle(self, *args, **options):
+        model_registry.warm_up(names=["paddleocr"])
+        pages = [as_bgr(path) for path in options["images"]]
+        regions = []
+        for path in options["images"]:
+            with Image.open(path) as image:
+                regions.append(roi_store.region(image.convert("RGB"), list(number_fields_dict), track=False)[1] or (0, 0, image.width, image.height))
+        crops = [page[y0:y1, x0:x1] for page, (x0, y0, x1, y1) in zip(pages, regions)]
+
+        rec_batch_nums = [int(value) for value in options["rec_batch_nums"].split(",") if value]
+        det_limits = [int(value) for value in options["det_limit_side_lens"].split(",") if value]
+        cls_settings = [value == "on" for value in options["cls"].split(",") if value]
+        iterations = max(options["iterations"], 1)
+
+        with model_registry.use("paddleocr") as model:
+            def run(images, rec_batch_num, det_limit, use_cls):
+                return ocr_images(model, images, [det_limit] * len(images), [use_cls] * len(images), rec_batch_num)
+
+            # reference: the most thorough setting, page by page
+            reference = [page_ids(run([page], 6, max(det_limits), True)[0]["lines"]) for page in pages]
+            self.stdout.write(f"{len(pages)} pages, reference IDs found on {sum(1 for ids in reference if all(ids))} pages")
+
+            for rec_batch_num, det_limit, use_cls in itertools.product(rec_batch_nums, det_limits, cls_settings):
+                per_page, results = timed(lambda: [run([page], rec_batch_num, det_limit, use_cls)[0] for page in pages], iterations)
+                batched, _ = timed(lambda: run(pages, rec_batch_num, det_limit, use_cls), iterations)
+                region, _ = timed(lambda: run(crops, rec_batch_num, det_limit, use_cls), iterations)
+                same = sum(1 for result, ids in zip(results, reference) if page_ids(result["lines"]) == ids)
+                self.stdout.write(
+                    f"rec_batch_num={rec_batch_num:<3} det_limit_side_len={det_limit:<5} cls={'on' if use_cls else 'off':<4}"
+                    f"per-page={per_page / len(pages):.3f} s/page  batched={batched / len(pages):.3f} s/page  "
+                    f"region={region / len(pages):.3f} s/page  same IDs={same}/{len(pages)}"
+                )
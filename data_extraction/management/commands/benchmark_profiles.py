@@ -0,0 +1,54 @@
+import time
+from django.core.management.base import BaseCommand
+from data_extraction.apps import model_registry
+from data_extraction.profiles import PIPELINE_PROFILES, get_profile
+from data_extraction.services import iter_pdf_file_operation, iter_image_file_operation, number_fields_dict
+from stamp_detection.services import file_type_detection
+
+
+def run_profile(doc_path, profile, stamp):
+    """
+    Runs the GetDetails pipeline on one document with a profile.
+
+    Parameters:
+    - doc_path (str): The document to process. It is not deleted.
+    - profile (dict): The pipeline profile.
+    - stamp (str): "True" to include stamp detection.
+
+    Returns:
+    - tuple: (elapsed seconds, number of ID fields extracted over all pages).
+    """
+
+    file_operations = {"Image": iter_image_file_operation, "PDF": iter_pdf_file_operation}
+    start_time = time.time()
+    fields = 0
+    for event in file_operations[file_type_detection(doc_path)](doc_path, "cpu", stamp, profile=profile):
+        if event["event"] == "page":
+            fields += sum(1 for key in number_fields_dict if event["data"].get(key))
+    return time.time() - start_time, fields
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the fast/balanced/accurate pipeline modes on sample documents and reports latency and extracted fields per mode."
+
+    def add_arguments(self, parser):
+        parser.add_argument("documents", nargs="+", help="PDF or image documents to process.")
+        parser.add_argument("--modes", default=",".join(PIPELINE_PROFILES), help="Comma separated modes to compare.")
+        parser.add_argument("--iterations", type=int, default=1, help="Runs per document and mode.")
+        parser.add_argument("--stamps", action="store_true", help="Include stamp detection.")
+
+    def handle(self, *args, **options):
+        model_registry.warm_up()
+        stamp = "True" if options["stamps"] else "False"
+
+        for mode in [m for m in options["modes"].split(",") if m]:
+            profile = get_profile(mode)
+            elapsed, fields = [], 0
+            for doc_path in options["documents"]:
+                for _ in range(options["iterations"]):
+                    duration, extracted = run_profile(doc_path, profile, stamp)
+                    elapsed.append(duration)
+                    fields += extracted
+
+            runs = len(elapsed)
+            self.stdout.write(f"mode={mode:<9} latency={sum(elapsed) / runs:.2f} s/document  max={max(elapsed):.2f} s  fields={fields / runs:.1f}/document")
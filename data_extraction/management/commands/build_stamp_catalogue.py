@@ -0,0 +1,55 @@
+import os
+import time
+import numpy as np
+import torch
+from django.core.management.base import BaseCommand, CommandError
+from data_extraction.apps import model_registry
+from stamp_detection.embedding_store import EmbeddingStore, STORE_DTYPES
+from stamp_detection.ingest import read_catalogue, stamp_vector_id, embed_catalogue, CompanyDeduplicator
+from stamp_detection.pinecone import active_namespace, namespace_pointer
+
+
+class Command(BaseCommand):
+    help = "Embeds a catalogue of stamp images into a local quantized stamp catalogue (see STAMP_CATALOGUE_PATH)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="A directory with one sub-directory of stamp images per company ID, or a CSV manifest with 'path' and 'company_id' columns.")
+        parser.add_argument("output", help="The catalogue directory to write.")
+        parser.add_argument("--namespace", help="The index namespace the catalogue stands in for; it is only used while that namespace is active. Defaults to the active namespace.")
+        parser.add_argument("--dtype", choices=STORE_DTYPES, default="int8", help="In-memory vector dtype.")
+        parser.add_argument("--batch-size", type=int, default=32, help="Images per MetaCLIP forward pass.")
+        parser.add_argument("--workers", type=int, default=2, help="Batches embedded in parallel, each on its own MetaCLIP copy; the CPU threads are split between them.")
+        parser.add_argument("--dedupe-threshold", type=float, default=0.98, help="Cosine similarity above which a stamp duplicates one its company already has.")
+
+    def handle(self, *args, **options):
+        items = read_catalogue(options["source"])
+        if not items:
+            raise CommandError(f"No stamp images found in {options['source']}")
+
+        workers = max(options["workers"], 1)
+        torch.set_num_threads(max((os.cpu_count() or 1) // workers, 1))
+        # one MetaCLIP copy per worker, otherwise the batches wait on a single instance
+        model_registry.set_pool_size("metaclip", workers)
+        model_registry.get("metaclip")
+
+        deduplicator = CompanyDeduplicator(options["dedupe_threshold"])
+        ids, company_ids, vectors = [], [], []
+        start_time = time.time()
+        for loaded, embeddings, unreadable in embed_catalogue(items, options["batch_size"], workers):
+            for (path, company_id), embedding in zip(loaded, embeddings):
+                if deduplicator.keep(company_id, embedding):
+                    ids.append(stamp_vector_id(path, company_id))
+                    company_ids.append(company_id)
+                    vectors.append(embedding)
+            for path, _ in unreadable:
+                self.stderr.write(f"unreadable stamp image: {path}")
+
+        if not vectors:
+            raise CommandError("None of the stamp images could be read.")
+
+        namespace = options["namespace"] or active_namespace()
+        store = EmbeddingStore.build(options["output"], ids, company_ids, np.stack(vectors), options["dtype"], namespace)
+        if namespace == namespace_pointer.get() and namespace_pointer.path:
+            namespace_pointer.touch()
+        self.stdout.write(f"{len(ids)} stamps of {len(set(company_ids))} companies ({len(items) - len(ids)} skipped, {len(store) - len(ids)} added with AddStamp) in {time.time() - start_time:.1f} s")
+        self.stdout.write(f"{options['output']}: namespace {namespace}, {store.dtype}, {store.memory_bytes() / 2**20:.2f} MiB in memory")
@@ -0,0 +1,22 @@
+import os
+from django.core.management.base import BaseCommand
+from data_extraction.apps import model_registry
+from data_extraction.mmap_weights import mmap_weights_path, save_mmap_weights
+
+
+class Command(BaseCommand):
+    help = "Exports the LayoutLM and MetaCLIP weights as memory-mappable safetensors files under MODELS_PATH/mmap."
+
+    def handle(self, *args, **options):
+        modules = {
+            "layoutlm": lambda: model_registry.get("layoutlm").model,
+            "metaclip": lambda: model_registry.get("metaclip")[1],
+        }
+
+        for name, get_module in modules.items():
+            path = mmap_weights_path(name)
+            temp_path = f"{path}.tmp"
+            save_mmap_weights(get_module(), temp_path)
+            # replace atomically so running workers keep mapping the previous file until they restart
+            os.replace(temp_path, path)
+            self.stdout.write(f"{name}: {path} ({os.path.getsize(path) / 2**20:.0f} MiB)")
@@ -0,0 +1,124 @@
+import datetime
+import os
+import time
+import torch
+from django.core.management.base import BaseCommand, CommandError
+from custom_lib.helper import get_error_msg
+from data_extraction.apps import model_registry
+from stamp_detection.ingest import read_catalogue, stamp_vector_id, embed_catalogue, CompanyDeduplicator, IngestState
+from stamp_detection.pinecone import index, fetch_company_reference_vectors, active_namespace, namespace_pointer
+
+
+def wait_for_vectors(namespace, expected, timeout):
+    """
+    Waits until the index reports at least 'expected' vectors in a namespace (upserts are eventually consistent).
+
+    Returns:
+    - int: The last reported vector count.
+    """
+
+    deadline = time.monotonic() + timeout
+    while True:
+        count = index.describe_index_stats().get("namespaces", {}).get(namespace, {}).get("vector_count", 0)
+        if count >= expected or time.monotonic() >= deadline:
+            return count
+        time.sleep(2)
+
+
+class Command(BaseCommand):
+    help = "Embeds a catalogue of stamp images in parallel batches and bulk-upserts them to the vector index; with --reindex the catalogue is indexed into a new namespace that --switch activates atomically."
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", nargs="?", help="A directory with one sub-directory of stamp images per company ID, or a CSV manifest with 'path' and 'company_id' columns.")
+        parser.add_argument("--batch-size", type=int, default=32, help="Images per MetaCLIP forward pass.")
+        parser.add_argument("--workers", type=int, default=2, help="Batches embedded in parallel, each on its own MetaCLIP copy; the CPU threads are split between them.")
+        parser.add_argument("--upsert-size", type=int, default=100, help="Vectors per index upsert request.")
+        parser.add_argument("--dedupe-threshold", type=float, default=0.98, help="Cosine similarity above which a stamp duplicates one its company already has.")
+        parser.add_argument("--reindex", action="store_true", help="Index the catalogue into a new namespace instead of the active one.")
+        parser.add_argument("--namespace", help="Target namespace. Defaults to the active namespace, or to 'stamps-<timestamp>' with --reindex.")
+        parser.add_argument("--switch", action="store_true", help="Make the target namespace active once every stamp is indexed.")
+        parser.add_argument("--activate", help="Only make this namespace active (e.g. to roll back a switch), without ingesting.")
+        parser.add_argument("--state", help="Progress file used to resume an interrupted run. Defaults to '<source>.ingest-state.json'.")
+        parser.add_argument("--restart", action="store_true", help="Ignore the progress of an earlier run.")
+        parser.add_argument("--wait", type=float, default=300, help="Seconds to wait for the index to report every upserted vector before switching.")
+
+    def handle(self, *args, **options):
+        if index is None:
+            raise CommandError("Pinecone is not configured (PINECONE_API_KEY / PINECONE_INDEX_NAME).")
+        if (options["switch"] or options["activate"]) and not namespace_pointer.path:
+            raise CommandError(get_error_msg(50019))
+
+        if options["activate"]:
+            state = namespace_pointer.switch(options["activate"])
+            self.stdout.write(f"active namespace: {state['namespace']} (previous: {state['previous']})")
+            return
+
+        if not options["source"]:
+            raise CommandError("A catalogue directory or CSV manifest is required.")
+
+        items = read_catalogue(options["source"])
+        state_path = options["state"] or f"{options['source'].rstrip(os.sep)}.ingest-state.json"
+        state = IngestState(state_path)
+        if options["restart"]:
+            state.remove()
+            state = IngestState(state_path)
+
+        if state.namespace is None:
+            state.namespace = options["namespace"] or (f"stamps-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}" if options["reindex"] else active_namespace())
+        elif options["namespace"] and options["namespace"] != state.namespace:
+            raise CommandError(f"{state_path} belongs to a run into namespace {state.namespace}; pass --restart to start over.")
+
+        pending = [item for item in items if item[0] not in state.done]
+        self.stdout.write(f"catalogue: {len(items)} stamps, {len(pending)} to ingest into namespace {state.namespace}")
+
+        workers = max(options["workers"], 1)
+        torch.set_num_threads(max((os.cpu_count() or 1) // workers, 1))
+        # one MetaCLIP copy per worker, otherwise the batches wait on a single instance
+        model_registry.set_pool_size("metaclip", workers)
+        model_registry.get("metaclip")
+
+        deduplicator = CompanyDeduplicator(options["dedupe_threshold"])
+        failed = []
+        processed = 0
+        start_time = time.time()
+
+        for loaded, embeddings, unreadable in embed_catalogue(pending, options["batch_size"], workers):
+            vectors = []
+            duplicates = 0
+            for (path, company_id), embedding in zip(loaded, embeddings):
+                if not deduplicator.seeded(company_id):
+                    deduplicator.seed(company_id, fetch_company_reference_vectors(company_id, embedding, namespace=state.namespace))
+                if deduplicator.keep(company_id, embedding):
+                    vectors.append((stamp_vector_id(path, company_id), embedding.tolist(), {"company_id": company_id}))
+                else:
+                    duplicates += 1
+
+            for i in range(0, len(vectors), options["upsert_size"]):
+                index.upsert(vectors=vectors[i:i + options["upsert_size"]], namespace=state.namespace)
+
+            state.record([path for path, _ in loaded], [vector_id for vector_id, _, _ in vectors], duplicates)
+            failed.extend(unreadable)
+            processed += len(loaded) + len(unreadable)
+
+            elapsed = time.time() - start_time
+            self.stdout.write(f"{processed}/{len(pending)} stamps  {processed / elapsed:.1f} stamps/s  vectors={len(state.vector_ids)}  duplicates={state.duplicates}  unreadable={len(failed)}")
+
+        state.compact()
+        for path, _ in failed:
+            self.stderr.write(f"unreadable stamp image: {path}")
+
+        if not options["switch"]:
+            if state.namespace == namespace_pointer.get() and namespace_pointer.path:
+                namespace_pointer.touch()
+            self.stdout.write(f"done: {len(state.vector_ids)} vectors in namespace {state.namespace}")
+            return
+
+        if failed or not state.vector_ids:
+            raise CommandError(f"Not switching to {state.namespace}: {len(failed)} unreadable stamps, {len(state.vector_ids)} vectors indexed.")
+
+        count = wait_for_vectors(state.namespace, len(state.vector_ids), options["wait"])
+        if count < len(state.vector_ids):
+            raise CommandError(f"Not switching: the index reports {count} of {len(state.vector_ids)} vectors in {state.namespace}. Re-run with --switch once they are visible.")
+
+        pointer = namespace_pointer.switch(state.namespace)
+        self.stdout.write(f"active namespace: {pointer['namespace']} (previous: {pointer['previous']}, roll back with --activate {pointer['previous']})")
@@ -0,0 +1,317 @@
+import json
+import os
+import random
+import shlex
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from PIL import Image, ImageDraw
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from data_extraction.management.commands.measure_worker_memory import read_smaps_rollup, child_pids
+
+ENDPOINTS = ("login", "GetDetails", "AddStamp", "StampVerification")
+DEFAULT_SERVER = "gunicorn api_channel.wsgi:application --workers 2 --threads 4 --bind 127.0.0.1:{port} --timeout 300"
+API_USER = "loadtest-api@example.com"
+LOGIN_USER = "loadtest-login@example.com"
+
+
+def percentile(values, q):
+    """
+    Returns the q-th percentile (nearest rank) of a list of values, or 0 for an empty list.
+    """
+
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+
+def parse_mix(text):
+    """
+    Parses 'endpoint=weight,...' into the request mix.
+    """
+
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ENDPOINTS:
+            raise CommandError(f"Unknown endpoint '{name}', expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def sample_documents(directory):
+    """
+    Draws a one-page invoice image and a stamp image to send when no documents are given.
+
+    Returns:
+    - tuple: (document path, stamp path).
+    """
+
+    page = Image.new("RGB", (1240, 1754), "white")
+    draw = ImageDraw.Draw(page)
+    draw.text((80, 80), "No. Embarque 4712345678", fill="black")
+    draw.text((80, 120), "No entrega 8512345678", fill="black")
+    for row in range(20):
+        draw.line((80, 300 + row * 50, 1160, 300 + row * 50), fill="gray")
+    draw.ellipse((800, 1300, 1100, 1600), outline="blue", width=12)
+    document_path = os.path.join(directory, "invoice.png")
+    page.save(document_path)
+
+    stamp = Image.new("RGB", (300, 300), "white")
+    ImageDraw.Draw(stamp).ellipse((10, 10, 290, 290), outline="blue", width=12)
+    stamp_path = os.path.join(directory, "stamp.png")
+    stamp.save(stamp_path)
+    return document_path, stamp_path
+
+
+def server_rss(pid):
+    """
+    Returns the resident memory in MiB of a server process and of each of its workers (direct children).
+    """
+
+    res = {}
+    for role, process_id in [("master", pid)] + [(f"worker-{child}", child) for child in child_pids(pid)]:
+        try:
+            res[role] = round(read_smaps_rollup(process_id)["Rss"], 1)
+        except (OSError, KeyError):
+            continue
+    return res
+
+
+class Recorder:
+    """
+    Collects the (endpoint, latency, status) of every request, per reporting interval and in total.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = []
+        self.interval_start = 0
+
+    def add(self, endpoint, latency, status):
+        with self.lock:
+            self.results.append((endpoint, latency, status))
+
+    def take_interval(self):
+        with self.lock:
+            results = self.results[self.interval_start:]
+            self.interval_start = len(self.results)
+        return results
+
+
+def summarize(results, elapsed):
+    """
+    Returns the throughput, latency percentiles (ms) and error rate of a list of results.
+    """
+
+    latencies = [latency * 1000 for _, latency, _ in results]
+    errors = sum(1 for _, _, status in results if not isinstance(status, int) or status >= 400)
+    return {"requests": len(results), "throughput": round(len(results) / elapsed, 2) if elapsed else 0,
+            "p50": round(percentile(latencies, 50), 1), "p95": round(percentile(latencies, 95), 1), "p99": round(percentile(latencies, 99), 1),
+            "max": round(max(latencies, default=0), 1), "errorRate": round(errors / len(results), 4) if results else 0,
+            "statuses": dict(Counter(str(status) for _, _, status in results))}
+
+
+class Command(BaseCommand):
+    # the command only drives HTTP; checking the URLs would import the views and the model stack in the client process
+    requires_system_checks = []
+    help = ("Drives login, GetDetails, AddStamp and StampVerification at a set concurrency or arrival rate and reports throughput, "
+            "tail latency, error rate and server RSS over time. By default it starts the app with STUB_MODELS, so no models or index are needed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", help="Base URL of a running server. If omitted, a server is started with STUB_MODELS=True.")
+        parser.add_argument("--server", default=DEFAULT_SERVER, help="Command that starts the server; '{port}' is replaced by --port.")
+        parser.add_argument("--port", type=int, default=8765, help="Port of the started server.")
+        parser.add_argument("--pid", type=int, help="PID of the server (master) process whose RSS to sample, with --url.")
+        parser.add_argument("--mix", default="login=1,GetDetails=4,AddStamp=1,StampVerification=4", help="Request mix as endpoint=weight pairs.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Concurrent client connections.")
+        parser.add_argument("--rate", type=float, default=0, help="Open-loop arrival rate in requests/s (Poisson arrivals). 0 runs a closed loop: every connection sends its next request as soon as the last one returns.")
+        parser.add_argument("--duration", type=float, default=60, help="Seconds of load; long durations make a soak test.")
+        parser.add_argument("--interval", type=float, default=5, help="Seconds between progress reports and RSS samples.")
+        parser.add_argument("--documents", nargs="*", default=[], help="Documents sent to GetDetails and StampVerification (default: a generated invoice page).")
+        parser.add_argument("--stamp", help="Stamp image sent to AddStamp (default: a generated stamp).")
+        parser.add_argument("--company-id", default="1000", help="Company of AddStamp and StampVerification requests.")
+        parser.add_argument("--stamps", action="store_true", help="Request stamp details from GetDetails.")
+        parser.add_argument("--password", default="LoadTest-123", help="Password of the load-test users, registered if missing.")
+        parser.add_argument("--timeout", type=float, default=300, help="Client timeout per request in seconds.")
+        parser.add_argument("--startup-timeout", type=float, default=120, help="Seconds to wait for the server to report ready.")
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the request mix and arrival times.")
+        parser.add_argument("--output", help="Write the full report (intervals, endpoints, RSS) to this JSON file.")
+        parser.add_argument("--max-error-rate", type=float, help="Fail if the overall error rate is above this fraction.")
+        parser.add_argument("--max-p99-ms", type=float, help="Fail if the overall p99 latency is above this many milliseconds.")
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options["mix"])
+        server = None
+        url, pid = options["url"], options["pid"]
+        if not url:
+            command = shlex.split(options["server"].format(port=options["port"]))
+            server = subprocess.Popen(command, cwd=settings.BASE_DIR, env={**os.environ, "STUB_MODELS": "True"})
+            url, pid = f"http://127.0.0.1:{options['port']}", server.pid
+
+        try:
+            self.wait_ready(url, server, options["startup_timeout"])
+            with tempfile.TemporaryDirectory() as directory:
+                document_path, stamp_path = sample_documents(directory)
+                files = {"document": [self.read(path) for path in options["documents"] or [document_path]], "stamp": self.read(options["stamp"] or stamp_path)}
+                token = self.login(url, API_USER, options["password"])
+                self.login(url, LOGIN_USER, options["password"])
+                report = self.run_load(url, token, mix, files, pid, options)
+        finally:
+            if server is not None:
+                server.terminate()
+                try:
+                    server.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+
+        total = report["total"]
+        if options["max_error_rate"] is not None and total["errorRate"] > options["max_error_rate"]:
+            raise CommandError(f"Error rate {total['errorRate']:.2%} is above {options['max_error_rate']:.2%}")
+        if options["max_p99_ms"] is not None and total["p99"] > options["max_p99_ms"]:
+            raise CommandError(f"p99 latency {total['p99']} ms is above {options['max_p99_ms']} ms")
+
+    @staticmethod
+    def read(path):
+        with open(path, "rb") as f:
+            return os.path.basename(path), f.read()
+
+    def wait_ready(self, url, server, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if server is not None and server.poll() is not None:
+                raise CommandError(f"The server exited with code {server.returncode}")
+            try:
+                if requests.get(f"{url}/health/ready", timeout=5).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        raise CommandError(f"The server at {url} was not ready after {timeout:.0f} s")
+
+    def login(self, url, email, password):
+        """
+        Registers a load-test user if needed and returns a fresh token. Logging in replaces the user's token, so the
+        token of the API user is only requested here and the 'login' requests of the mix use a second user.
+        """
+
+        requests.post(f"{url}/auth/register", json={"emailId": email, "password": password, "firstName": "Load", "lastName": "Test"}, timeout=30)
+        response = requests.post(f"{url}/auth/login", json={"emailId": email, "password": password}, timeout=30)
+        if response.status_code != 200:
+            raise CommandError(f"Login of {email} failed ({response.status_code}): {response.text[:200]}")
+        return response.json()["data"]["token"]
+
+    def send(self, session, url, token, endpoint, files, options, rng):
+        """
+        Sends one request of an endpoint and returns its HTTP status, or the exception name if it failed.
+        """
+
+        headers = {"Authorization": f"Bearer {token}"}
+        document = files["document"][rng.randrange(len(files["document"]))]
+        company = {"companyId": options["company_id"]}
+        try:
+            if endpoint == "login":
+                response = session.post(f"{url}/auth/login", json={"emailId": LOGIN_USER, "password": options["password"]}, timeout=options["timeout"])
+            elif endpoint == "GetDetails":
+                response = session.post(f"{url}/GetDetails", params={"boolStampDetection": str(options["stamps"])}, files={"files": document}, headers=headers, timeout=options["timeout"])
+            elif endpoint == "AddStamp":
+                response = session.post(f"{url}/AddStamp", data=company, files={"files": files["stamp"]}, headers=headers, timeout=options["timeout"])
+            else:
+                response = session.post(f"{url}/StampVerification", data=company, files={"files": document}, headers=headers, timeout=options["timeout"])
+            return response.status_code
+        except requests.RequestException as e:
+            return type(e).__name__
+
+    def run_load(self, url, token, mix, files, pid, options):
+        """
+        Runs the load for the configured duration and prints a report line per interval.
+
+        Notes:
+        - Closed loop (rate 0): each of the 'concurrency' connections sends requests back to back.
+        - Open loop: requests arrive at 'rate' per second whatever the response times. Latency is measured from the
+          scheduled arrival, so time spent waiting for a free connection counts (no coordinated omission).
+        """
+
+        recorder = Recorder()
+        sessions = threading.local()
+        endpoints, weights = list(mix), list(mix.values())
+        start_time = time.time()
+        end_time = start_time + options["duration"]
+        intervals, rss = [], []
+        stop = threading.Event()
+
+        def session():
+            if not hasattr(sessions, "session"):
+                sessions.session = requests.Session()
+            return sessions.session
+
+        def request(endpoint, scheduled, rng):
+            status = self.send(session(), url, token, endpoint, files, options, rng)
+            recorder.add(endpoint, time.time() - scheduled, status)
+
+        def closed_loop(worker):
+            rng = random.Random(options["seed"] * 1000 + worker)
+            while time.time() < end_time:
+                request(rng.choices(endpoints, weights)[0], time.time(), rng)
+
+        def monitor():
+            last = start_time
+            while not stop.wait(options["interval"]):
+                now = time.time()
+                results = recorder.take_interval()
+                memory = server_rss(pid) if pid else {}
+                summary = {"t": round(now - start_time, 1), **summarize(results, now - last), "rssMiB": memory}
+                intervals.append(summary)
+                if memory:
+                    rss.append((now - start_time, memory))
+                self.stdout.write(f"t={summary['t']:>7.1f}s  req={summary['requests']:<6} rps={summary['throughput']:<8} p50={summary['p50']:<8} p95={summary['p95']:<8} "
+                                  f"p99={summary['p99']:<8} errors={summary['errorRate']:.1%}  rss={sum(memory.values()):.0f} MiB")
+                last = now
+
+        if pid:
+            rss.append((0, server_rss(pid)))
+        monitor_thread = threading.Thread(target=monitor, name="load-test-monitor", daemon=True)
+        monitor_thread.start()
+
+        with ThreadPoolExecutor(max_workers=options["concurrency"], thread_name_prefix="load-test") as executor:
+            if options["rate"] > 0:
+                rng = random.Random(options["seed"])
+                scheduled = start_time
+                while scheduled < end_time:
+                    time.sleep(max(0, scheduled - time.time()))
+                    executor.submit(request, rng.choices(endpoints, weights)[0], scheduled, random.Random(rng.random()))
+                    scheduled += rng.expovariate(options["rate"])
+            else:
+                list(executor.map(closed_loop, range(options["concurrency"])))
+        elapsed = time.time() - start_time
+        stop.set()
+        monitor_thread.join()
+
+        results = recorder.results
+        report = {"url": url, "mix": mix, "concurrency": options["concurrency"], "rate": options["rate"], "duration": round(elapsed, 1),
+                  "total": summarize(results, elapsed), "endpoints": {}, "intervals": intervals, "rss": {}}
+
+        self.stdout.write(f"\n{'endpoint':<18} {'requests':>8} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'errors':>7}  (ms)")
+        for endpoint in endpoints + ["total"]:
+            summary = report["total"] if endpoint == "total" else summarize([result for result in results if result[0] == endpoint], elapsed)
+            if endpoint != "total":
+                report["endpoints"][endpoint] = summary
+            self.stdout.write(f"{endpoint:<18} {summary['requests']:>8} {summary['throughput']:>8} {summary['p50']:>8} {summary['p95']:>8} {summary['p99']:>8} "
+                              f"{summary['max']:>8} {summary['errorRate']:>7.1%}  {summary['statuses']}")
+
+        if rss:
+            for process in dict.fromkeys(process for _, memory in rss for process in memory):
+                samples = [memory[process] for _, memory in rss if process in memory]
+                report["rss"][process] = {"start": samples[0], "peak": max(samples), "end": samples[-1], "growth": round(samples[-1] - samples[0], 1)}
+                self.stdout.write(f"rss {process:<16} start={samples[0]:.0f} peak={max(samples):.0f} end={samples[-1]:.0f} growth={samples[-1] - samples[0]:+.0f} MiB")
+        return report
@@ -0,0 +1,68 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+
+SMAPS_FIELDS = ["Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty"]
+
+
+def read_smaps_rollup(pid):
+    """
+    Reads the memory totals of a process from /proc/<pid>/smaps_rollup.
+
+    Parameters:
+    - pid (int): The process ID.
+
+    Returns:
+    - dict: The smaps fields in MiB.
+    """
+
+    res = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in SMAPS_FIELDS:
+                res[key] = int(value.split()[0]) / 1024
+    return res
+
+
+def child_pids(pid):
+    """
+    Lists the direct children of a process (the gunicorn workers of a master).
+
+    Parameters:
+    - pid (int): The parent process ID.
+
+    Returns:
+    - list: The child process IDs.
+    """
+
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            children.extend(int(child) for child in f.read().split())
+    return children
+
+
+class Command(BaseCommand):
+    help = "Reports unique (private) vs shared resident memory of a gunicorn master and each of its workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("master_pid", type=int, help="PID of the gunicorn master process.")
+
+    def handle(self, *args, **options):
+        master_pid = options["master_pid"]
+        if not os.path.exists(f"/proc/{master_pid}"):
+            raise CommandError(f"No process with pid {master_pid}")
+
+        rows = [("master", master_pid)] + [("worker", pid) for pid in child_pids(master_pid)]
+        self.stdout.write(f"{'process':<8} {'pid':>8} {'rss':>10} {'pss':>10} {'shared':>10} {'unique':>10}  (MiB)")
+
+        total_unique = 0
+        for role, pid in rows:
+            mem = read_smaps_rollup(pid)
+            shared = mem["Shared_Clean"] + mem["Shared_Dirty"]
+            unique = mem["Private_Clean"] + mem["Private_Dirty"]
+            total_unique += unique
+            self.stdout.write(f"{role:<8} {pid:>8} {mem['Rss']:>10.0f} {mem['Pss']:>10.0f} {shared:>10.0f} {unique:>10.0f}")
+
+        workers = len(rows) - 1
+        self.stdout.write(f"total unique memory: {total_unique:.0f} MiB across {workers} workers")
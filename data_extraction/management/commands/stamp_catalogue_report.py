@@ -0,0 +1,71 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from stamp_detection.embedding_store import EmbeddingStore, STORE_DTYPES, quantize, approximate_scores
+
+# bytes per dimension of an embedding kept as a Python list of floats (8-byte pointer + 24-byte float object)
+PYTHON_LIST_BYTES = 32
+
+
+def evaluate(full, codes, scales, queries, rerank):
+    """
+    Measures how often quantized search with exact re-ranking finds the exact nearest neighbour.
+
+    Parameters:
+    - full (np.ndarray): The full-precision catalogue vectors.
+    - codes, scales: The quantized vectors (see 'quantize').
+    - queries (np.ndarray): Row indices used as queries; each query's own row is excluded (leave-one-out).
+    - rerank (int): Candidates re-scored at full precision.
+
+    Returns:
+    - tuple: (recall@1, mean search milliseconds).
+    """
+
+    hits, elapsed = 0, 0.0
+    for row in queries:
+        query = np.asarray(full[row], dtype=np.float32)
+        exact = full @ query
+        exact[row] = -np.inf
+        expected = int(np.argmax(exact))
+
+        start_time = time.perf_counter()
+        scores = approximate_scores(codes, scales, query)
+        scores[row] = -np.inf
+        depth = min(rerank, scores.shape[0] - 1)
+        candidates = np.sort(np.argpartition(-scores, depth - 1)[:depth])
+        rescored = full[candidates] @ query
+        rescored[candidates == row] = -np.inf
+        found = int(candidates[np.argmax(rescored)])
+        elapsed += time.perf_counter() - start_time
+
+        hits += found == expected
+    return hits / len(queries), elapsed * 1000 / len(queries)
+
+
+class Command(BaseCommand):
+    help = "Reports recall@1 against exact float32 search and the memory of each vector dtype on a local stamp catalogue."
+
+    def add_arguments(self, parser):
+        parser.add_argument("catalogue", help="The catalogue directory (see build_stamp_catalogue).")
+        parser.add_argument("--dtypes", default=",".join(STORE_DTYPES), help="Comma separated dtypes to compare.")
+        parser.add_argument("--rerank", default="1,8,32,128", help="Comma separated re-rank depths to compare.")
+        parser.add_argument("--queries", type=int, default=500, help="Catalogue stamps used as leave-one-out queries.")
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the query sample.")
+
+    def handle(self, *args, **options):
+        store = EmbeddingStore.load(options["catalogue"])
+        if len(store) < 2:
+            raise CommandError("The catalogue needs at least two stamps.")
+
+        full = np.asarray(store.full, dtype=np.float32)
+        count, dim = full.shape
+        queries = np.random.default_rng(options["seed"]).choice(count, size=min(options["queries"], count), replace=False)
+        self.stdout.write(f"{count} stamps x {dim} dims, {len(queries)} leave-one-out queries")
+        self.stdout.write(f"{'python list':<12} {'-':>8} {count * dim * PYTHON_LIST_BYTES / 2**20:>10.2f} MiB")
+
+        for dtype in [d for d in options["dtypes"].split(",") if d]:
+            codes, scales = quantize(full, dtype)
+            memory = codes.nbytes + store.norms.nbytes + (scales.nbytes if scales is not None else 0)
+            for rerank in [int(r) for r in options["rerank"].split(",") if r]:
+                recall, latency = evaluate(full, codes, scales, queries, rerank)
+                self.stdout.write(f"{dtype:<12} rerank={rerank:<5} {memory / 2**20:>10.2f} MiB  recall@1={recall:.4f}  search={latency:.2f} ms")
@@ -0,0 +1,125 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+from PIL import Image
+from django.core.management.base import BaseCommand, CommandError
+from data_extraction.apps import model_registry
+
+
+def probe_paddleocr(model, image_path):
+    return [(word[1][0], word[0]) for line in model.ocr(image_path) or [] for word in line or []]
+
+
+def probe_layoutlm(model, image_path):
+    with Image.open(image_path) as image:
+        return [(answer.get("answer"), answer.get("score")) for answer in model(image.convert("RGB"), "what is Shipment Number?")]
+
+
+def probe_metaclip(model, image_path):
+    import torch
+    metaClip_preprocess, metaClip_inference = model
+    with Image.open(image_path) as image, torch.no_grad():
+        return metaClip_inference.get_image_features(**metaClip_preprocess(images=image.convert("RGB"), return_tensors="pt"))[0].numpy()
+
+
+def probe_yolo_boxes(model, image_path):
+    return model(image_path, verbose=False)[0].boxes.data.cpu().numpy()
+
+
+def probe_yolo_probs(model, image_path):
+    return model(image_path, verbose=False)[0].probs.data.cpu().numpy()
+
+
+PROBES = {
+    "paddleocr": probe_paddleocr,
+    "layoutlm": probe_layoutlm,
+    "metaclip": probe_metaclip,
+    "stamp_detection": probe_yolo_boxes,
+    "document_classifier": probe_yolo_probs,
+}
+
+
+def same_output(a, b, tolerance=1e-3):
+    """
+    Compares two probe outputs, allowing 'tolerance' on floats (thread counts change the summation order).
+    """
+
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return np.shape(a) == np.shape(b) and np.allclose(a, b, atol=tolerance)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(same_output(x, y, tolerance) for x, y in zip(a, b))
+    if isinstance(a, float) and isinstance(b, float):
+        return abs(a - b) <= tolerance
+    return a == b
+
+
+class Command(BaseCommand):
+    help = "Calls the models from many threads at once and checks every output against a single-threaded reference."
+
+    def add_arguments(self, parser):
+        parser.add_argument("images", nargs="+", help="Page images used as inputs.")
+        parser.add_argument("--models", default=",".join(PROBES), help="Comma separated models to stress.")
+        parser.add_argument("--threads", type=int, default=8, help="Concurrent calling threads.")
+        parser.add_argument("--rounds", type=int, default=5, help="Calls per model and image.")
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the call order.")
+        parser.add_argument("--unsafe", action="store_true", help="Call the shared model instances without the access layer, to show what it prevents.")
+
+    def handle(self, *args, **options):
+        names = [name for name in options["models"].split(",") if name]
+        unknown = [name for name in names if name not in PROBES]
+        if unknown:
+            raise CommandError(f"Unknown models: {', '.join(unknown)}")
+
+        model_registry.warm_up(names=names)
+        names = [name for name in names if model_registry.status()[name]["status"] == model_registry.READY]
+        if not names:
+            raise CommandError("None of the models could be loaded.")
+
+        @contextmanager
+        def shared(name):
+            yield model_registry.get(name)
+
+        access = shared if options["unsafe"] else model_registry.use
+
+        reference = {}
+        for name in names:
+            for image_path in options["images"]:
+                with model_registry.use(name) as model:
+                    reference[name, image_path] = PROBES[name](model, image_path)
+
+        calls = [(name, image_path) for name in names for image_path in options["images"]] * options["rounds"]
+        random.Random(options["seed"]).shuffle(calls)
+        counts = {name: {"calls": 0, "mismatches": 0, "errors": 0} for name in names}
+        lock = threading.Lock()
+
+        def call(item):
+            name, image_path = item
+            try:
+                with access(name) as model:
+                    result = "mismatches" if not same_output(PROBES[name](model, image_path), reference[item]) else None
+            except Exception as e:
+                self.stderr.write(f"{name} failed on {image_path}: {str(e)}")
+                result = "errors"
+            with lock:
+                counts[name]["calls"] += 1
+                if result:
+                    counts[name][result] += 1
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=options["threads"]) as executor:
+            list(executor.map(call, calls))
+        elapsed = time.time() - start_time
+
+        pools = model_registry.pool_stats()
+        for name in names:
+            pool = pools.get(name, {})
+            self.stdout.write(f"{name:<20} calls={counts[name]['calls']:<5} mismatches={counts[name]['mismatches']:<4} errors={counts[name]['errors']:<4} "
+                              f"instances={pool.get('instances', '-')} contended={pool.get('contended', '-')} waitSeconds={pool.get('waitSeconds', '-')} maxWaitSeconds={pool.get('maxWaitSeconds', '-')}")
+        self.stdout.write(f"{len(calls)} calls on {options['threads']} threads in {elapsed:.1f} s ({len(calls) / elapsed:.1f} calls/s)")
+
+        failures = sum(count["mismatches"] + count["errors"] for count in counts.values())
+        if failures and not options["unsafe"]:
+            raise CommandError(f"{failures} calls returned a different output than the single-threaded reference.")
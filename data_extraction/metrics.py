@@ -0,0 +1,40 @@
+import threading
+from custom_lib.logger import BaseLog
+logger = BaseLog()
+
+_collectors = {}
+_lock = threading.Lock()
+
+
+def register_metrics(name, collector):
+    """
+    Registers a metrics collector reported by the metrics endpoint.
+
+    Parameters:
+    - name (str): The key of the collector's section in the report.
+    - collector (callable): Returns a JSON-serialisable dict of the current values.
+    """
+
+    with _lock:
+        _collectors[name] = collector
+
+
+def collect_metrics():
+    """
+    Collects the current values of every registered collector in this worker process.
+
+    Returns:
+    - dict: Maps collector names to their values; a failing collector reports its error instead.
+    """
+
+    with _lock:
+        collectors = dict(_collectors)
+
+    res = {}
+    for name, collector in collectors.items():
+        try:
+            res[name] = collector()
+        except Exception as e:
+            logger.print(f"metrics: collector {name} failed: {str(e)}")
+            res[name] = {"error": str(e)}
+    return res
@@ -0,0 +1,125 @@
+import json
+import os
+import numpy as np
+import torch
+from custom_lib.logger import BaseLog
+logger = BaseLog()
+
+# safetensors dtype -> (numpy dtype used to view the raw bytes, torch dtype of the tensor)
+SAFETENSORS_DTYPES = {
+    "F64": (np.float64, torch.float64),
+    "F32": (np.float32, torch.float32),
+    "F16": (np.float16, torch.float16),
+    "BF16": (np.int16, torch.bfloat16),
+    "I64": (np.int64, torch.int64),
+    "I32": (np.int32, torch.int32),
+    "I16": (np.int16, torch.int16),
+    "I8": (np.int8, torch.int8),
+    "U8": (np.uint8, torch.uint8),
+    "BOOL": (np.bool_, torch.bool),
+}
+
+
+def mmap_weights_path(name):
+    """
+    Returns the path of the memory-mappable weight file of a model under MODELS_PATH.
+
+    Parameters:
+    - name (str): The registered model name.
+
+    Returns:
+    - str: The '<MODELS_PATH>/mmap/<name>.safetensors' path.
+    """
+
+    from api_channel.settings import MODELS_PATH
+    return os.path.join(MODELS_PATH, "mmap", f"{name}.safetensors")
+
+
+def save_mmap_weights(module, path):
+    """
+    Saves the weights of a torch module as a safetensors file that can later be memory-mapped.
+
+    Parameters:
+    - module (torch.nn.Module): The module whose state dict is saved.
+    - path (str): The destination file.
+    """
+
+    from safetensors.torch import save_model
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    save_model(module, path)
+
+
+def load_mmap_state(path):
+    """
+    Maps a safetensors file into memory and returns its tensors without copying them.
+
+    Parameters:
+    - path (str): The safetensors file.
+
+    Returns:
+    - dict: Maps state dict keys to tensors backed by a private (copy-on-write) mapping of the file.
+
+    Notes:
+    - The tensors share the page cache with every other process mapping the same file, so the weights
+      are resident once per machine instead of once per worker as long as nothing writes to them.
+    """
+
+    with open(path, "rb") as f:
+        header_length = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_length))
+
+    data_start = 8 + header_length
+    buffer = np.memmap(path, dtype=np.uint8, mode="c")
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        np_dtype, torch_dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        array = buffer[data_start + start:data_start + end].view(np_dtype).reshape(info["shape"])
+        tensor = torch.from_numpy(array)
+        tensors[name] = tensor.view(torch_dtype) if torch_dtype == torch.bfloat16 else tensor
+    return tensors
+
+
+def attach_mmap_weights(module, path):
+    """
+    Replaces the parameters and buffers of a loaded module with memory-mapped tensors of the same values.
+
+    Parameters:
+    - module (torch.nn.Module): The module to rebind, in inference mode.
+    - path (str): The safetensors file written by 'save_mmap_weights' for this module.
+
+    Returns:
+    - torch.nn.Module: The same module, whose weights now live in the mapped file.
+
+    Notes:
+    - Tied weights stored once in the file are rebound everywhere the original tensor was used.
+    - The previously allocated weights are released once nothing else references them.
+    """
+
+    tensors = load_mmap_state(path)
+    replaced = {}
+
+    for key, tensor in tensors.items():
+        owner_name, _, attr = key.rpartition(".")
+        owner = module.get_submodule(owner_name) if owner_name else module
+        store = owner._parameters if owner._parameters.get(attr) is not None else owner._buffers
+        old = store.get(attr)
+        if old is None:
+            continue
+        if old.shape != tensor.shape or old.dtype != tensor.dtype:
+            raise ValueError(f"mmap weight '{key}' does not match the model ({tuple(tensor.shape)} vs {tuple(old.shape)})")
+        new = torch.nn.Parameter(tensor, requires_grad=False) if store is owner._parameters else tensor
+        store[attr] = new
+        replaced[id(old)] = (old, new)
+
+    for submodule in module.modules():
+        for store in (submodule._parameters, submodule._buffers):
+            for attr, value in store.items():
+                if value is not None and id(value) in replaced:
+                    store[attr] = replaced[id(value)][1]
+
+    logger.print(f"memory-mapped {len(tensors)} tensors from {path}")
+    return module
@@ -0,0 +1,425 @@
+import gc
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from data_extraction.profiling import span
+from custom_lib.logger import BaseLog
+from api_channel.settings import MODEL_RETRY_BACKOFF
+logger = BaseLog()
+
+
+class ModelPool:
+    """
+    Instances of one model, each used by at most one thread at a time.
+
+    Notes:
+    - The pool starts with the registry's instance and grows up to 'size' instances, loading a copy only when every
+      instance is busy. With size 1 the pool is a lock around the model.
+    - Counts acquisitions, the acquisitions that had to wait ('contended') and the time spent waiting, so a model
+      that serialises requests shows up in the metrics.
+    """
+
+    def __init__(self, model, size, load_instance):
+        self.size = max(size, 1)
+        self._load_instance = load_instance
+        self._free = [model]
+        self._instances = 1
+        self._condition = threading.Condition()
+        self._stats = {"acquisitions": 0, "contended": 0, "waitSeconds": 0.0, "maxWaitSeconds": 0.0, "busySeconds": 0.0}
+        self._in_use = 0
+
+    def acquire(self):
+        """
+        Checks out a free instance, loading a new copy if the pool may still grow, otherwise waiting for one.
+
+        Returns:
+        - tuple: (instance, monotonic time it was checked out) to pass to 'release'.
+        """
+
+        start_time = time.monotonic()
+        with self._condition:
+            contended = not self._free
+            while not self._free and self._instances >= self.size:
+                self._condition.wait()
+            if self._free:
+                instance = self._free.pop()
+                self._take(start_time, contended)
+                return instance, time.monotonic()
+            # reserve the slot of the copy loaded below
+            self._instances += 1
+
+        try:
+            instance = self._load_instance()
+        except Exception:
+            with self._condition:
+                self._instances -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._take(start_time, contended)
+        return instance, time.monotonic()
+
+    def _take(self, start_time, contended):
+        wait = time.monotonic() - start_time
+        self._in_use += 1
+        self._stats["acquisitions"] += 1
+        self._stats["contended"] += contended
+        self._stats["waitSeconds"] += wait
+        self._stats["maxWaitSeconds"] = max(self._stats["maxWaitSeconds"], wait)
+
+    def release(self, instance, acquired_at):
+        with self._condition:
+            self._free.append(instance)
+            self._in_use -= 1
+            self._stats["busySeconds"] += time.monotonic() - acquired_at
+            self._condition.notify()
+
+    def resize(self, size):
+        """
+        Changes the most instances the pool may hold. Loaded copies above a smaller size are kept.
+        """
+
+        with self._condition:
+            self.size = max(size, 1)
+            self._condition.notify_all()
+
+    @property
+    def in_use(self):
+        return self._in_use
+
+    def stats(self):
+        with self._condition:
+            stats = {key: round(value, 3) if isinstance(value, float) else value for key, value in self._stats.items()}
+            stats.update({"size": self.size, "instances": self._instances, "inUse": self._in_use})
+        return stats
+
+
+class ModelRegistry:
+    """
+    Registry of the inference models, loaded on first use or by a background warm-up.
+
+    Notes:
+    - Each model is registered with a loader and an optional warm-up function; nothing is loaded at import time.
+    - 'get' loads a model on first use (one loader per model runs at a time) and records its last use. A model that
+      failed to load is retried on use once 'retry_backoff' seconds have passed since the failure.
+    - Models are not safe to call from several threads at once: inference goes through 'use', which checks out an
+      instance of the model's 'ModelPool' (a lock by default, or up to 'pool_size' copies). Requests waiting on
+      different models run in parallel.
+    - 'start_warm_up' loads the registered models in parallel on a background thread and runs one dummy
+      inference per model so the first request does not pay for kernel initialisation.
+    - Models registered with an 'idle_timeout' are unloaded after that many idle seconds and reloaded on next use.
+    - In preload mode ('preload_for_fork' in the gunicorn master, 'after_fork' in each worker) the fork-safe models
+      are loaded once before fork and shared copy-on-write; warm-up inference only runs in the workers.
+    """
+
+    NOT_LOADED = "not_loaded"
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+    def __init__(self, retry_backoff=MODEL_RETRY_BACKOFF):
+        self.retry_backoff = retry_backoff
+        self._specs = {}
+        self._models = {}
+        self._status = {}
+        self._errors = {}
+        self._failed_at = {}
+        self._last_used = {}
+        self._load_locks = {}
+        self._pools = {}
+        self._warmed = set()
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def register(self, name, loader, warmup=None, idle_timeout=0, required=True, preload=True, fork_safe=True, pool_size=1):
+        """
+        Registers a model loader.
+
+        Parameters:
+        - name (str): The name used to fetch the model.
+        - loader (callable): Returns the loaded model object.
+        - warmup (callable, optional): Receives the loaded model and runs one dummy inference.
+        - idle_timeout (int, optional): Seconds without use after which the model is unloaded. 0 keeps it loaded.
+        - required (bool, optional): Whether the model must be ready for the service to report readiness.
+        - preload (bool, optional): Whether the model is loaded by the background warm-up.
+        - fork_safe (bool, optional): Whether the loaded model may be inherited by forked workers.
+        - pool_size (int, optional): Instances of the model that may run at once (see 'use'). Default is 1.
+        """
+
+        self._specs[name] = {"loader": loader, "warmup": warmup, "idle_timeout": idle_timeout, "required": required, "preload": preload, "fork_safe": fork_safe, "pool_size": pool_size}
+        self._status[name] = self.NOT_LOADED
+        self._load_locks[name] = threading.Lock()
+
+    def get(self, name):
+        """
+        Returns a loaded model, loading it first if needed.
+
+        Parameters:
+        - name (str): The registered model name.
+
+        Returns:
+        - object: The model.
+
+        Raises:
+        - ValueError(50028): The model failed to load, now or less than 'retry_backoff' seconds ago.
+        """
+
+        self._last_used[name] = time.monotonic()
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._load_locks[name]:
+            if name not in self._models and not self._backing_off(name):
+                self._load(name)
+        self._last_used[name] = time.monotonic()
+        model = self._models.get(name)
+        if model is None:
+            raise ValueError(50028)
+        return model
+
+    def _backing_off(self, name):
+        return self._status[name] == self.FAILED and time.monotonic() - self._failed_at[name] < self.retry_backoff
+
+    @contextmanager
+    def use(self, name):
+        """
+        Checks out an instance of a model for the calling thread only.
+
+        Parameters:
+        - name (str): The registered model name.
+
+        Yields:
+        - object: The model instance. It is returned to the pool when the block exits; other threads asking for the
+          same model wait until then or get another copy.
+
+        Raises:
+        - ValueError(50028): The model is not available (see 'get').
+        """
+
+        model = self.get(name)
+
+        with self._lock:
+            pool = self._pools.get(name)
+            if pool is None:
+                pool = self._pools[name] = ModelPool(model, self._specs[name]["pool_size"], lambda: self._load_instance(name))
+
+        with span(f"wait:{name}"):
+            instance, acquired_at = pool.acquire()
+        try:
+            with span(f"model:{name}"):
+                yield instance
+        finally:
+            pool.release(instance, acquired_at)
+            self._last_used[name] = time.monotonic()
+
+    def set_pool_size(self, name, size):
+        """
+        Changes how many instances of a model may run at once (see 'register'), for example to match the worker
+        threads of a batch command. Copies are loaded when the instances are busy.
+        """
+
+        with self._lock:
+            self._specs[name]["pool_size"] = size
+            pool = self._pools.get(name)
+        if pool is not None:
+            pool.resize(size)
+
+    def _load_instance(self, name):
+        spec = self._specs[name]
+        start_time = time.time()
+        instance = spec["loader"]()
+        if spec["warmup"]:
+            try:
+                spec["warmup"](instance)
+            except Exception as e:
+                logger.print(f"⚠️  Warm-up inference failed for a {name} copy: {str(e)}")
+        logger.print(f"✅ {name} model copy loaded in {time.time() - start_time:.1f}s.")
+        return instance
+
+    def pool_stats(self):
+        """
+        Returns the contention metrics of the model pools in use.
+
+        Returns:
+        - dict: Maps model names to their 'ModelPool' stats.
+        """
+
+        with self._lock:
+            pools = dict(self._pools)
+        return {name: pool.stats() for name, pool in pools.items()}
+
+    def _load(self, name, warm=True):
+        spec = self._specs[name]
+        self._status[name] = self.LOADING
+        start_time = time.time()
+        try:
+            model = spec["loader"]()
+            if warm:
+                self._run_warmup(name, model)
+            with self._lock:
+                self._models[name] = model
+                self._status[name] = self.READY
+                self._errors.pop(name, None)
+            logger.print(f"✅ {name} model loaded in {time.time() - start_time:.1f}s.")
+        except Exception as e:
+            self._status[name] = self.FAILED
+            self._errors[name] = str(e)
+            self._failed_at[name] = time.monotonic()
+            logger.print(f"❌ Error loading {name} model: {str(e)}")
+
+    def _run_warmup(self, name, model):
+        warmup = self._specs[name]["warmup"]
+        if warmup and name not in self._warmed:
+            try:
+                warmup(model)
+            except Exception as e:
+                logger.print(f"⚠️  Warm-up inference failed for {name}: {str(e)}")
+        self._warmed.add(name)
+
+    def unload(self, name):
+        """
+        Drops a loaded model so its memory can be reclaimed; it is reloaded on next use.
+
+        Parameters:
+        - name (str): The registered model name. A model with an instance in use is kept.
+        """
+
+        with self._load_locks[name]:
+            with self._lock:
+                pool = self._pools.get(name)
+                if pool is not None and pool.in_use:
+                    return
+                self._pools.pop(name, None)
+                model = self._models.pop(name, None)
+                if model is not None:
+                    self._status[name] = self.NOT_LOADED
+                    self._warmed.discard(name)
+        if model is not None:
+            del model
+            gc.collect()
+            logger.print(f"{name} model unloaded after being idle.")
+
+    def warm_up(self, names=None, max_workers=4):
+        """
+        Loads models in parallel and blocks until all of them are loaded or failed.
+
+        Parameters:
+        - names (list, optional): The models to load. Defaults to every model registered with preload=True.
+        - max_workers (int, optional): Number of models loaded concurrently. Default is 4.
+        """
+
+        names = names or [name for name, spec in self._specs.items() if spec["preload"]]
+
+        def load_and_warm(name):
+            try:
+                self._run_warmup(name, self.get(name))
+            except ValueError:
+                pass
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-warmup") as executor:
+            list(executor.map(load_and_warm, names))
+
+    def preload_for_fork(self, max_workers=4):
+        """
+        Loads every fork-safe preloaded model in parallel, without warm-up inference, before the workers fork.
+
+        Parameters:
+        - max_workers (int, optional): Number of models loaded concurrently. Default is 4.
+
+        Notes:
+        - No inference runs in the master, so torch/paddle thread pools are first created inside each worker.
+        - The garbage collector is frozen afterwards so collections in the workers do not touch (and copy)
+          the pages holding the inherited model objects.
+        """
+
+        names = [name for name, spec in self._specs.items() if spec["preload"] and spec["fork_safe"]]
+
+        def load(name):
+            with self._load_locks[name]:
+                if name not in self._models:
+                    self._load(name, warm=False)
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-preload") as executor:
+            list(executor.map(load, names))
+        gc.collect()
+        gc.freeze()
+
+    def after_fork(self, max_workers=4):
+        """
+        Prepares the registry inherited by a forked worker: fresh locks, warm-up of inherited models and
+        loading of the models that are not fork-safe.
+
+        Parameters:
+        - max_workers (int, optional): Number of models loaded concurrently. Default is 4.
+        """
+
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in self._specs}
+        self._pools = {}
+        self._reaper = None
+        self.start_warm_up(max_workers=max_workers)
+
+    def start_warm_up(self, max_workers=4):
+        """
+        Starts the parallel warm-up on a daemon thread and the idle reaper, returning immediately.
+
+        Parameters:
+        - max_workers (int, optional): Number of models loaded concurrently. Default is 4.
+        """
+
+        threading.Thread(target=self.warm_up, kwargs={"max_workers": max_workers}, name="model-warmup", daemon=True).start()
+        self.start_idle_reaper()
+
+    def start_idle_reaper(self, interval=30):
+        """
+        Starts a daemon thread that unloads models idle for longer than their 'idle_timeout'.
+
+        Parameters:
+        - interval (int, optional): Seconds between idle checks. Default is 30.
+        """
+
+        if self._reaper or not any(spec["idle_timeout"] for spec in self._specs.values()):
+            return
+
+        def reap():
+            while True:
+                time.sleep(interval)
+                now = time.monotonic()
+                for name, spec in self._specs.items():
+                    if spec["idle_timeout"] and name in self._models and now - self._last_used.get(name, now) > spec["idle_timeout"]:
+                        self.unload(name)
+
+        self._reaper = threading.Thread(target=reap, name="model-idle-reaper", daemon=True)
+        self._reaper.start()
+
+    def status(self):
+        """
+        Returns the load state of every registered model.
+
+        Returns:
+        - dict: Maps model names to a dict with 'status', 'required' and, on failure, 'error'.
+        """
+
+        res = {}
+        for name, spec in self._specs.items():
+            res[name] = {"status": self._status[name], "required": spec["required"]}
+            if name in self._errors:
+                res[name]["error"] = self._errors[name]
+        return res
+
+    def is_ready(self):
+        """
+        Checks whether every required preloaded model is loaded or was unloaded only because it was idle.
+
+        Returns:
+        - bool: True if the service can answer requests without loading a required model, False otherwise.
+        """
+
+        for name, spec in self._specs.items():
+            if not (spec["required"] and spec["preload"]):
+                continue
+            if self._status[name] != self.READY and not (spec["idle_timeout"] and name in self._last_used and self._status[name] == self.NOT_LOADED):
+                return False
+        return True
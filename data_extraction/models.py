@@ -1,3 +1,53 @@
 from django.db import models
+from custom_lib.base_model import BaseFields
 
-# Create your models here.
+REQUEST_TYPE_CHOICES = (
+    ('EXTRACTION', 'EXTRACTION'),
+    ('VERIFICATION', 'VERIFICATION'),
+    ('ANALYSIS', 'ANALYSIS'),
+)
+
+
+class ExtractionResultModel(BaseFields):
+    id = models.BigAutoField(primary_key=True)
+    run_id = models.CharField(max_length=32)
+    request_type = models.CharField(max_length=12, choices=REQUEST_TYPE_CHOICES)
+    content_hash = models.CharField(max_length=64)
+    options = models.CharField(max_length=100)
+    file_name = models.CharField(max_length=255, blank=True, null=True)
+    page = models.IntegerField()
+    shipment_id = models.CharField(max_length=50, blank=True, null=True)
+    delivery_id = models.CharField(max_length=50, blank=True, null=True)
+    company_id = models.CharField(max_length=50, blank=True, null=True)
+    company_match = models.BooleanField(blank=True, null=True)
+    degraded = models.BooleanField(default=False)
+    result = models.JSONField()
+    user_id = models.BigIntegerField(blank=True, null=True)
+    run_info = models.JSONField(blank=True, null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'sb_extraction_results'
+
+
+BATCH_STATUS_CHOICES = (
+    ('QUEUED', 'QUEUED'),
+    ('RUNNING', 'RUNNING'),
+    ('DONE', 'DONE'),
+    ('FAILED', 'FAILED'),
+)
+
+
+class BatchJobModel(BaseFields):
+    id = models.CharField(max_length=32, primary_key=True)
+    status = models.CharField(max_length=10, choices=BATCH_STATUS_CHOICES)
+    options = models.CharField(max_length=100)
+    documents = models.IntegerField()
+    completed = models.IntegerField(default=0)
+    results = models.JSONField(default=list)
+    user_id = models.BigIntegerField(blank=True, null=True)
+    worker = models.CharField(max_length=100, blank=True, null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'sb_batch_jobs'
@@ -0,0 +1,313 @@
+import copy
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+import cv2
+import numpy as np
+from PIL import Image
+from custom_lib.logger import BaseLog
+from data_extraction.apps import model_registry
+from data_extraction.metrics import register_metrics
+from data_extraction.profiles import get_profile
+from data_extraction.scratch import workspace_of
+from api_channel.settings import OCR_REC_BATCH_NUM, OCR_ANGLE_CLS, OCR_BATCH_MAX_IMAGES, OCR_BATCH_WINDOW_MS, MODEL_POOL_SIZES
+logger = BaseLog()
+
+ROTATED_LABEL = "180"
+# an OCR pass must classify at least this many text lines, none upside down, to mark its document upright
+UPRIGHT_MIN_LINES = 5
+MAX_DOCUMENTS = 1024
+
+_lock = threading.Lock()
+# document key -> True once its text lines are known to be upright (see 'angle_cls_required')
+_upright = OrderedDict()
+_counters = {"requests": 0, "images": 0, "batches": 0, "crops": 0, "classifiedCrops": 0, "clsSkippedImages": 0,
+             "uprightDocuments": 0, "detSeconds": 0.0, "clsSeconds": 0.0, "recSeconds": 0.0}
+
+
+def ocr_stats():
+    """
+    Returns the OCR counters: requests, images, model batches, text crops recognised and classified, images whose
+    angle classification was skipped, and the time spent in detection, classification and recognition.
+    """
+
+    with _lock:
+        return {key: round(value, 3) if isinstance(value, float) else value for key, value in _counters.items()}
+
+register_metrics("ocr", ocr_stats)
+
+
+def _count(**values):
+    with _lock:
+        for key, value in values.items():
+            _counters[key] += value
+
+
+def paddle_helpers():
+    """
+    Returns PaddleOCR's box sorting and crop functions, or None if this PaddleOCR version does not expose them.
+    """
+
+    try:
+        from tools.infer.predict_system import sorted_boxes
+        from tools.infer.utility import get_rotate_crop_image, get_minarea_rect_crop
+    except ImportError:
+        return None
+    return sorted_boxes, get_rotate_crop_image, get_minarea_rect_crop
+
+
+def set_det_limit_side_len(model, limit_side_len):
+    for op in model.text_detector.preprocess_op:
+        if hasattr(op, "limit_side_len"):
+            op.limit_side_len = limit_side_len
+
+
+def ocr_images(model, images, det_limit_side_len, cls, rec_batch_num=OCR_REC_BATCH_NUM):
+    """
+    Runs PaddleOCR on several images at once: text detection per image, then angle classification and recognition
+    over the text crops of every image together, in batches of 'rec_batch_num' crops.
+
+    Parameters:
+    - model (PaddleOCR): A checked-out OCR instance.
+    - images (list): BGR images (arrays).
+    - det_limit_side_len (list): The detection limit side length of each image.
+    - cls (list): Whether the text crops of each image go through the angle classifier.
+    - rec_batch_num (int, optional): Text crops per recognition (and classification) forward pass.
+
+    Returns:
+    - list: For each image, a dict with 'lines' (the [box, (text, score)] lines of 'PaddleOCR.ocr', in reading order)
+      and 'rotated' (the lines the classifier turned upside down, None if it did not run).
+
+    Notes:
+    - A model without PaddleOCR's detector and recogniser (e.g. a stub) runs 'ocr' once per image.
+    """
+
+    helpers = paddle_helpers() if hasattr(model, "text_detector") else None
+    if helpers is None:
+        _count(batches=1)
+        return [{"lines": (model.ocr(image, cls=use_cls) or [None])[0] or [], "rotated": None} for image, use_cls in zip(images, cls)]
+    sorted_boxes, get_rotate_crop_image, get_minarea_rect_crop = helpers
+    crop = get_minarea_rect_crop if getattr(model.args, "det_box_type", "quad") == "poly" else get_rotate_crop_image
+
+    start_time = time.time()
+    boxes, crops, owners = [], [], []
+    for index, (image, limit_side_len) in enumerate(zip(images, det_limit_side_len)):
+        set_det_limit_side_len(model, limit_side_len)
+        dt_boxes, _ = model.text_detector(image)
+        dt_boxes = sorted_boxes(dt_boxes) if dt_boxes is not None and len(dt_boxes) else []
+        boxes.append(dt_boxes)
+        for box in dt_boxes:
+            crops.append(crop(image, copy.deepcopy(box)))
+            owners.append(index)
+    det_seconds = time.time() - start_time
+
+    start_time = time.time()
+    rotated = [0 if use_cls and getattr(model, "text_classifier", None) else None for use_cls in cls]
+    classified = [k for k, owner in enumerate(owners) if rotated[owner] is not None]
+    if classified:
+        model.text_classifier.cls_batch_num = rec_batch_num
+        turned, angles, _ = model.text_classifier([crops[k] for k in classified])
+        for k, image, (label, score) in zip(classified, turned, angles):
+            crops[k] = image
+            if ROTATED_LABEL in label and score > model.args.cls_thresh:
+                rotated[owners[k]] += 1
+    cls_seconds = time.time() - start_time
+
+    start_time = time.time()
+    model.text_recognizer.rec_batch_num = rec_batch_num
+    recognised, _ = model.text_recognizer(crops) if crops else ([], 0)
+    rec_seconds = time.time() - start_time
+
+    results = [{"lines": [], "rotated": count} for count in rotated]
+    texts = iter(recognised)
+    for index, dt_boxes in enumerate(boxes):
+        for box in dt_boxes:
+            text, score = next(texts)[:2]
+            if score >= model.drop_score:
+                results[index]["lines"].append([box.tolist(), (text, score)])
+
+    _count(batches=1, crops=len(crops), classifiedCrops=len(classified), detSeconds=det_seconds, clsSeconds=cls_seconds, recSeconds=rec_seconds)
+    return results
+
+
+class OCRBatcher:
+    """
+    Runs the OCR calls of concurrent callers (pipeline workers, requests) together, so the text crops of their pages
+    share recognition batches (see 'ocr_images').
+
+    Notes:
+    - One dispatcher thread per PaddleOCR instance (MODEL_POOL_SIZES) takes the next call and every call queued
+      behind it, up to 'max_images' images, and waits up to 'window' seconds for more. A call that arrives while the
+      model is idle therefore starts at once with the default window of 0.
+    - Dispatchers start with the first call.
+    """
+
+    def __init__(self, max_images=OCR_BATCH_MAX_IMAGES, window=OCR_BATCH_WINDOW_MS / 1000, workers=MODEL_POOL_SIZES.get("paddleocr", 1)):
+        self.max_images = max(max_images, 1)
+        self.window = max(window, 0)
+        self.workers = max(workers, 1)
+        self._queue = queue.Queue()
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def submit(self, images, det_limit_side_len, cls):
+        """
+        Runs OCR on images with the next batch.
+
+        Returns:
+        - list: The result of each image (see 'ocr_images').
+        """
+
+        with self._start_lock:
+            if not self._started:
+                for worker in range(self.workers):
+                    threading.Thread(target=self._dispatch, name=f"ocr-batcher-{worker}", daemon=True).start()
+                self._started = True
+
+        future = Future()
+        self._queue.put({"images": images, "det_limit_side_len": det_limit_side_len, "cls": cls, "future": future})
+        return future.result()
+
+    def _dispatch(self):
+        while True:
+            calls = [self._queue.get()]
+            size = len(calls[0]["images"])
+            until = time.monotonic() + self.window
+            while size < self.max_images:
+                try:
+                    timeout = until - time.monotonic()
+                    call = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                calls.append(call)
+                size += len(call["images"])
+            self._run(calls)
+
+    def _run(self, calls):
+        try:
+            with model_registry.use("paddleocr") as model:
+                results = ocr_images(model, [image for call in calls for image in call["images"]],
+                                     [limit for call in calls for limit in call["det_limit_side_len"]],
+                                     [use_cls for call in calls for use_cls in call["cls"]])
+        except Exception as e:
+            for call in calls:
+                call["future"].set_exception(e)
+            return
+
+        offset = 0
+        for call in calls:
+            call["future"].set_result(results[offset:offset + len(call["images"])])
+            offset += len(call["images"])
+
+
+batcher = OCRBatcher()
+
+
+def document_key(image):
+    """
+    Returns the key of the document an image belongs to: its scratch workspace (one per request document), or None.
+    """
+
+    if isinstance(image, str):
+        workspace = workspace_of(image)
+        return workspace.path if workspace is not None else None
+    return None
+
+
+def angle_cls_required(document):
+    """
+    Checks whether the text lines of a document's images must go through the angle classifier.
+
+    Notes:
+    - OCR_ANGLE_CLS=always (the default) always runs it. With the opt-in OCR_ANGLE_CLS=auto the classifier runs until
+      one OCR pass of the document finds at least UPRIGHT_MIN_LINES lines and none upside down; the document's later
+      pages and regions skip it, so an upside-down page of a mixed-orientation scan may lose its IDs.
+    """
+
+    if OCR_ANGLE_CLS in ("always", "never"):
+        return OCR_ANGLE_CLS == "always"
+    with _lock:
+        return document is None or document not in _upright
+
+
+def learn_orientation(document, result):
+    if document is None or result["rotated"] != 0 or len(result["lines"]) < UPRIGHT_MIN_LINES:
+        return
+    with _lock:
+        if document not in _upright:
+            _counters["uprightDocuments"] += 1
+        _upright[document] = True
+        _upright.move_to_end(document)
+        while len(_upright) > MAX_DOCUMENTS:
+            _upright.popitem(last=False)
+
+
+def as_bgr(image):
+    """
+    Returns a model input (path, PIL Image or RGB array as read by PIL, BGR array as read by OpenCV) as a BGR array.
+    """
+
+    if isinstance(image, str):
+        return cv2.imread(image)
+    if isinstance(image, Image.Image):
+        return cv2.cvtColor(np.array(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+    return image
+
+
+def run_ocr(images, profile=None, document=None):
+    """
+    Runs OCR on whole images (pages or crops) of one document.
+
+    Parameters:
+    - images (list): Image paths, PIL Images or BGR arrays.
+    - profile (dict, optional): The pipeline profile; sets the detection limit side length. Defaults to the default mode.
+    - document (str, optional): The document key used to remember its orientation. Defaults to the scratch
+      workspace of the first image path.
+
+    Returns:
+    - list: For each image, its [box, (text, score)] lines in reading order, as 'PaddleOCR.ocr' returns them.
+    """
+
+    profile = profile or get_profile()
+    document = document or document_key(images[0]) if images else None
+    use_cls = angle_cls_required(document)
+    arrays = [as_bgr(image) for image in images]
+    _count(requests=1, images=len(arrays), clsSkippedImages=0 if use_cls else len(arrays))
+
+    limits = [profile["ocr_det_limit_side_len"]] * len(arrays)
+    if OCR_BATCH_MAX_IMAGES > 1:
+        results = batcher.submit(arrays, limits, [use_cls] * len(arrays))
+    else:
+        with model_registry.use("paddleocr") as model:
+            results = ocr_images(model, arrays, limits, [use_cls] * len(arrays))
+
+    for result in results:
+        learn_orientation(document, result)
+    return [result["lines"] for result in results]
+
+
+def ocr_regions(image, regions, profile=None, document=None):
+    """
+    Runs OCR on regions of a page only.
+
+    Parameters:
+    - image: The page (path, PIL Image or BGR array).
+    - regions (list): Pixel boxes (x0, y0, x1, y1) of the page.
+    - profile (dict, optional): The pipeline profile (see 'run_ocr').
+    - document (str, optional): The document key (see 'run_ocr'). Defaults to the workspace of a page path.
+
+    Returns:
+    - list: For each region, its [box, (text, score)] lines, with boxes in page coordinates.
+
+    Notes:
+    - The regions are recognised in one call, so their text crops share recognition batches.
+    """
+
+    page = as_bgr(image)
+    document = document or document_key(image)
+    crops = [page[int(y0):int(y1), int(x0):int(x1)] for x0, y0, x1, y1 in regions]
+    results = run_ocr(crops, profile, document) if crops else []
+    return [[[[[x + region[0], y + region[1]] for x, y in box], text] for box, text in lines] for region, lines in zip(regions, results)]
+
@@ -0,0 +1,100 @@
+import threading
+import numpy as np
+from PIL import Image
+from custom_lib.image_hash import dhash, hamming_distance
+from api_channel.settings import DUPLICATE_PAGE_TOLERANCE
+
+# width of the grayscale copy used to confirm a duplicate; fine enough to tell single digits apart
+CONFIRM_WIDTH = 600
+# a pixel differs when its intensity changes by more than this
+PIXEL_DIFF_LEVEL = 64
+# side of the blocks in which differing pixels are counted
+DIFF_BLOCK = 16
+
+
+def page_fingerprint(image, hash_size=16):
+    """
+    Computes a cheap fingerprint of a rendered page.
+
+    Parameters:
+    - image (PIL Image): The rendered page.
+    - hash_size (int, optional): Side length of the hash; the hash has hash_size * hash_size bits. Default is 16.
+
+    Returns:
+    - dict: A dictionary containing:
+    - size (tuple): The rendered (width, height).
+    - hash (int): The difference hash of a thumbnail, used to find candidate duplicates.
+    - pixels (np.ndarray): A CONFIRM_WIDTH wide grayscale copy, used to confirm a candidate.
+    """
+
+    gray = image.convert("L")
+    height = max(round(CONFIRM_WIDTH * image.height / image.width), 1)
+    pixels = np.asarray(gray.resize((CONFIRM_WIDTH, height), Image.BILINEAR, reducing_gap=2.0), dtype=np.uint8)
+
+    thumbnail = Image.fromarray(pixels)
+    thumbnail.thumbnail((128, 128))
+    return {"size": image.size, "hash": dhash(thumbnail, hash_size), "pixels": pixels}
+
+
+class PageDeduplicator:
+    """
+    Finds pages of a document that duplicate an earlier page (e.g. the carrier and receiver copies of a scan bundle).
+
+    Notes:
+    - Candidates are earlier pages whose rendered size differs by at most 1% and whose hash differs by at most
+      'tolerance' bits. A candidate is confirmed only if no DIFF_BLOCK x DIFF_BLOCK block of the grayscale copies
+      has more than 'max_diff' differing pixels: the difference is judged locally, so pages of the same form that
+      differ only in one ID, stamp or signature are never merged.
+    """
+
+    def __init__(self, tolerance=DUPLICATE_PAGE_TOLERANCE, max_diff=4):
+        self.tolerance = tolerance
+        self.max_diff = max_diff
+        self._pages = []
+        self._lock = threading.Lock()
+
+    def find(self, fingerprint, before=None):
+        """
+        Returns the index of the first earlier page matching a fingerprint.
+
+        Parameters:
+        - fingerprint (dict): The fingerprint of the page (see 'page_fingerprint').
+        - before (int, optional): Only pages with a lower index are considered (pages may be recorded out of order).
+
+        Returns:
+        - int or None: The 1-based index of the earlier page, or None if the page is new.
+        """
+
+        width, height = fingerprint["size"]
+        with self._lock:
+            pages = sorted(self._pages, key=lambda recorded: recorded[0])
+        for page_index, earlier in pages:
+            if before is not None and page_index >= before:
+                continue
+            earlier_width, earlier_height = earlier["size"]
+            if abs(width - earlier_width) > earlier_width * 0.01 or abs(height - earlier_height) > earlier_height * 0.01:
+                continue
+            if hamming_distance(fingerprint["hash"], earlier["hash"]) > self.tolerance:
+                continue
+            if self._same_pixels(fingerprint["pixels"], earlier["pixels"]):
+                return page_index
+        return None
+
+    def add(self, page_index, fingerprint):
+        """
+        Records a processed page so later duplicates can reuse its result.
+
+        Parameters:
+        - page_index (int): The 1-based page index.
+        - fingerprint (dict): The fingerprint of the page.
+        """
+
+        with self._lock:
+            self._pages.append((page_index, fingerprint))
+
+    def _same_pixels(self, pixels, earlier):
+        rows = min(pixels.shape[0], earlier.shape[0]) // DIFF_BLOCK * DIFF_BLOCK
+        cols = pixels.shape[1] // DIFF_BLOCK * DIFF_BLOCK
+        diff = np.abs(pixels[:rows, :cols].astype(np.int16) - earlier[:rows, :cols].astype(np.int16)) > PIXEL_DIFF_LEVEL
+        blocks = diff.reshape(rows // DIFF_BLOCK, DIFF_BLOCK, cols // DIFF_BLOCK, DIFF_BLOCK).sum(axis=(1, 3))
+        return blocks.max(initial=0) <= self.max_diff
@@ -0,0 +1,216 @@
+import queue
+import threading
+import time
+from data_extraction.profiling import current_profile, bind_thread, span
+from custom_lib.logger import BaseLog
+logger = BaseLog()
+
+_DONE = object()
+
+
+class PipelineMetrics:
+    """
+    Per-stage counters shared by every pipeline run in this worker process.
+
+    Notes:
+    - 'depth' is the number of pages currently waiting in front of the stage and 'maxDepth' its high-water mark;
+      a stage whose input queue stays full is the bottleneck.
+    - 'busySeconds' is the time spent in the stage function, 'idleSeconds' the time its workers waited for input
+      and 'blockedSeconds' the time they waited for room in the next queue (backpressure).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def _stage(self, name):
+        if name not in self._stages:
+            self._stages[name] = {"depth": 0, "maxDepth": 0, "processed": 0, "busySeconds": 0.0, "idleSeconds": 0.0, "blockedSeconds": 0.0}
+        return self._stages[name]
+
+    def enqueued(self, name):
+        with self._lock:
+            stage = self._stage(name)
+            stage["depth"] += 1
+            stage["maxDepth"] = max(stage["maxDepth"], stage["depth"])
+
+    def dequeued(self, name):
+        with self._lock:
+            self._stage(name)["depth"] -= 1
+
+    def add(self, name, key, value):
+        with self._lock:
+            self._stage(name)[key] += value
+
+    def stats(self):
+        """
+        Returns the counters of every stage and the current bottleneck.
+
+        Returns:
+        - dict: 'stages' maps stage names to their counters; 'bottleneck' is the stage with the highest busy time.
+        """
+
+        with self._lock:
+            stages = {name: {key: round(value, 3) if isinstance(value, float) else value for key, value in stage.items()} for name, stage in self._stages.items()}
+        bottleneck = max(stages, key=lambda name: stages[name]["busySeconds"], default=None)
+        return {"stages": stages, "bottleneck": bottleneck}
+
+
+class PipelineStage:
+    """
+    One stage of a 'StagedPipeline'.
+
+    Parameters:
+    - name (str): The stage name used in metrics.
+    - fn (callable): Receives the item (a dict) and updates it in place.
+    - workers (int, optional): Number of threads running the stage. Default is 1.
+    """
+
+    def __init__(self, name, fn, workers=1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(workers, 1)
+
+
+class StagedPipeline:
+    """
+    Runs items through a chain of stages on worker threads connected by bounded queues.
+
+    Notes:
+    - Each stage has its own threads, so one page can be rendered while the previous one is classified and an
+      earlier one is extracted. Inference and poppler release the GIL, so the stages overlap on separate cores.
+    - Queues hold at most 'queue_size' items: a fast stage blocks once the next stage falls behind (backpressure),
+      which bounds the number of rendered pages held in memory.
+    - Items marked with 'skip' pass through the remaining stages untouched.
+    - 'run' yields the items in input order. Closing the generator stops the workers; an exception raised by a
+      stage stops the pipeline and is re-raised by 'run'.
+    - When the request is profiled, the stage threads are profiled with it and each stage call is a timing span.
+    """
+
+    def __init__(self, stages, queue_size=2, metrics=None):
+        self.stages = stages
+        self.queue_size = max(queue_size, 1)
+        self.metrics = metrics or PipelineMetrics()
+
+    def run(self, items):
+        """
+        Processes items through every stage.
+
+        Parameters:
+        - items (iterable): The input items (dicts).
+
+        Yields:
+        - dict: The processed items, in input order.
+        """
+
+        stop = threading.Event()
+        queues = [queue.Queue(self.queue_size) for _ in self.stages] + [queue.Queue(self.queue_size)]
+        names = [stage.name for stage in self.stages] + ["assemble"]
+        remaining = [stage.workers for stage in self.stages]
+        remaining_lock = threading.Lock()
+        threads = []
+        profile = current_profile()
+
+        def put(index, entry):
+            start_time = time.monotonic()
+            while not stop.is_set():
+                try:
+                    queues[index].put(entry, timeout=0.1)
+                except queue.Full:
+                    continue
+                if entry is not _DONE and entry[0] != "error":
+                    self.metrics.enqueued(names[index])
+                if index > 0:
+                    self.metrics.add(names[index - 1], "blockedSeconds", time.monotonic() - start_time)
+                return True
+            return False
+
+        def feed():
+            try:
+                for seq, item in enumerate(items):
+                    if not put(0, (seq, item)):
+                        return
+            except Exception as e:
+                put(len(self.stages), ("error", e))
+                stop.set()
+                return
+            for _ in range(self.stages[0].workers):
+                put(0, _DONE)
+
+        def work(index):
+            stage = self.stages[index]
+            while not stop.is_set():
+                start_time = time.monotonic()
+                try:
+                    entry = queues[index].get(timeout=0.1)
+                except queue.Empty:
+                    self.metrics.add(stage.name, "idleSeconds", time.monotonic() - start_time)
+                    continue
+                self.metrics.add(stage.name, "idleSeconds", time.monotonic() - start_time)
+
+                if entry is _DONE:
+                    with remaining_lock:
+                        remaining[index] -= 1
+                        last = remaining[index] == 0
+                    if last:
+                        for _ in range(self.stages[index + 1].workers if index + 1 < len(self.stages) else 1):
+                            put(index + 1, _DONE)
+                    return
+
+                self.metrics.dequeued(stage.name)
+                seq, item = entry
+                if not item.get("skip"):
+                    start_time = time.monotonic()
+                    try:
+                        with span(stage.name):
+                            stage.fn(item)
+                    except Exception as e:
+                        logger.print(f"pipeline: stage {stage.name} failed: {str(e)}")
+                        put(len(self.stages), ("error", e))
+                        stop.set()
+                        return
+                    finally:
+                        self.metrics.add(stage.name, "busySeconds", time.monotonic() - start_time)
+                        self.metrics.add(stage.name, "processed", 1)
+                put(index + 1, (seq, item))
+
+        threads.append(threading.Thread(target=bind_thread(feed, profile), name="pipeline-feed", daemon=True))
+        for index, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                threads.append(threading.Thread(target=bind_thread(work, profile), args=(index,), name=f"pipeline-{stage.name}-{worker}", daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        pending = {}
+        next_seq = 0
+        output = queues[-1]
+        try:
+            while True:
+                try:
+                    entry = output.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if entry is _DONE:
+                    break
+                if entry[0] == "error":
+                    raise entry[1]
+                self.metrics.dequeued("assemble")
+                seq, item = entry
+                pending[seq] = item
+                while next_seq in pending:
+                    yield pending.pop(next_seq)
+                    next_seq += 1
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join(timeout=5)
+            # items still queued when the run was stopped no longer count towards the depth
+            for index, name in enumerate(names):
+                while True:
+                    try:
+                        entry = queues[index].get_nowait()
+                    except queue.Empty:
+                        break
+                    if entry is not _DONE and entry[0] != "error":
+                        self.metrics.dequeued(name)
@@ -0,0 +1,34 @@
+from api_channel.settings import DEFAULT_PIPELINE_MODE
+
+# Quality/speed tiers of the GetDetails pipeline, selected per request with the 'mode' query parameter.
+# - dpi: PDF render resolution.
+# - max_queries: LayoutLM questions tried per field (None runs the full ladder of 'number_fields_dict').
+# - paddleocr_fallback: whether PaddleOCR + regex runs when LayoutLM leaves a field empty.
+# - yolo_imgsz: input size of the stamp detection model.
+# - stamp_confidence: minimum confidence of a detected stamp box.
+# - ocr_det_limit_side_len: longest side PaddleOCR's text detector works on; larger pages are scaled down.
+PIPELINE_PROFILES = {
+    "fast": {"dpi": 150, "max_queries": 1, "paddleocr_fallback": False, "yolo_imgsz": 480, "stamp_confidence": 0.5, "ocr_det_limit_side_len": 736},
+    "balanced": {"dpi": 200, "max_queries": None, "paddleocr_fallback": True, "yolo_imgsz": 640, "stamp_confidence": 0.35, "ocr_det_limit_side_len": 960},
+    "accurate": {"dpi": 300, "max_queries": None, "paddleocr_fallback": True, "yolo_imgsz": 1024, "stamp_confidence": 0.25, "ocr_det_limit_side_len": 1280},
+}
+
+
+def get_profile(mode=None):
+    """
+    Returns the pipeline profile of a mode.
+
+    Parameters:
+    - mode (str, optional): 'fast', 'balanced' or 'accurate'. Defaults to DEFAULT_PIPELINE_MODE.
+
+    Returns:
+    - dict: The profile settings.
+
+    Raises:
+    - ValueError: If the mode is unknown.
+    """
+
+    mode = (mode or DEFAULT_PIPELINE_MODE).lower()
+    if mode not in PIPELINE_PROFILES:
+        raise ValueError(50018)
+    return PIPELINE_PROFILES[mode]
@@ -0,0 +1,347 @@
+import hmac
+import json
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from api_channel.settings import PROFILING_ADMIN_TOKEN, PROFILING_SAMPLE_RATE, PROFILING_INTERVAL_MS, PROFILES_PATH, PROFILES_MAX
+from custom_lib.logger import BaseLog
+logger = BaseLog()
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_FILES = {"speedscope": "speedscope.json", "folded": "flamegraph.folded", "timing": "timing.json"}
+MAX_STACK_DEPTH = 128
+
+# thread ident -> profile of the request the thread is working for; empty unless a profiled request is running
+_thread_profiles = {}
+
+
+def is_admin(request):
+    """
+    Checks the admin profiling token sent in the 'X-Profile' header.
+
+    Returns:
+    - bool: True if PROFILING_ADMIN_TOKEN is set and the header matches it.
+    """
+
+    token = request.headers.get(PROFILE_HEADER, "")
+    return bool(PROFILING_ADMIN_TOKEN) and hmac.compare_digest(token.encode(), PROFILING_ADMIN_TOKEN.encode())
+
+
+def start_profile(request, kind):
+    """
+    Starts profiling a request if an admin asked for it or it is sampled.
+
+    Parameters:
+    - request: The DRF or Django request.
+    - kind (str): The request type (see 'results_store').
+
+    Returns:
+    - RequestProfile or None: The running profile, or None (the common case, which costs one header lookup).
+    """
+
+    if is_admin(request):
+        trigger = "header"
+    elif PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE:
+        trigger = "sampled"
+    else:
+        return None
+    return RequestProfile(kind, {"path": request.path, "userId": getattr(request, "user_id", None), "trigger": trigger})
+
+
+def current_profile():
+    """
+    Returns the profile of the request the calling thread works for, if it is profiled.
+    """
+
+    return _thread_profiles.get(threading.get_ident()) if _thread_profiles else None
+
+
+@contextmanager
+def span(name):
+    """
+    Times a block into the timing tree of the current request's profile; does nothing when it is not profiled.
+
+    Parameters:
+    - name (str): The span name, e.g. a pipeline stage or a model.
+    """
+
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+    with profile.span(name):
+        yield
+
+
+def bind_thread(fn, profile):
+    """
+    Returns 'fn' wrapped so the thread running it works for 'profile' (e.g. a pipeline stage thread), or 'fn' itself without a profile.
+    """
+
+    if profile is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        with profile.attached():
+            return fn(*args, **kwargs)
+    return bound
+
+
+def run_profiled(request_profile, fn, *args, **kwargs):
+    """
+    Calls 'fn' under a request profile and saves the profile when it returns; without a profile 'fn' is just called.
+
+    Notes:
+    - The first parameter is not named 'profile', so a 'profile' keyword (the pipeline profile) is passed on to 'fn'.
+    """
+
+    if request_profile is None:
+        return fn(*args, **kwargs)
+    try:
+        with request_profile.attached():
+            return fn(*args, **kwargs)
+    finally:
+        request_profile.finish()
+
+
+def profile_stream(profile, events):
+    """
+    Profiles a stream of events step by step and saves the profile when the stream ends; without a profile the events are returned as they are.
+    """
+
+    if profile is None:
+        return events
+
+    def profiled():
+        try:
+            while True:
+                with profile.attached():
+                    try:
+                        event = next(events)
+                    except StopIteration:
+                        return
+                yield event
+        finally:
+            events.close()
+            profile.finish()
+    return profiled()
+
+
+class RequestProfile:
+    """
+    Sampling profile of one request, across the request thread and the pipeline threads working for it.
+
+    Notes:
+    - A sampler thread, started when the first thread attaches, reads the stacks of the attached threads every PROFILING_INTERVAL_MS milliseconds
+      ('sys._current_frames'), so the profiled code itself is not instrumented.
+    - 'span' blocks (pipeline stages, model waits and calls) build a timing tree of the request.
+    - 'finish' writes PROFILES_PATH/<request id>/ with a speedscope profile (one profile per thread), a folded-stack
+      flamegraph file and the timing tree, then prunes the oldest profiles beyond PROFILES_MAX.
+    """
+
+    def __init__(self, kind, meta=None, interval=PROFILING_INTERVAL_MS / 1000):
+        self.request_id = uuid.uuid4().hex
+        self.kind = kind
+        self.meta = meta or {}
+        self.interval = interval
+        self.started_at = time.time()
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._threads = {}
+        self._span_stacks = {}
+        self._spans = {}
+        self._frames = {}
+        self._samples = {}
+        self._stop = threading.Event()
+        self._finished = False
+        self._sampler = None
+
+    @contextmanager
+    def attached(self):
+        """
+        Marks the calling thread as working for this request for the duration of the block. The first attached
+        thread starts the sampler, so a profile that never runs (e.g. a stream that is never read) holds no thread.
+        """
+
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] = threading.current_thread().name
+            if self._sampler is None and not self._stop.is_set():
+                self._sampler = threading.Thread(target=self._sample, name=f"profiler-{self.request_id[:8]}", daemon=True)
+                self._sampler.start()
+        _thread_profiles[ident] = self
+        try:
+            yield self
+        finally:
+            _thread_profiles.pop(ident, None)
+            with self._lock:
+                self._threads.pop(ident, None)
+
+    @contextmanager
+    def span(self, name):
+        stack = self._span_stacks.setdefault(threading.get_ident(), [])
+        stack.append(name)
+        path = tuple(stack)
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start_time
+            stack.pop()
+            with self._lock:
+                seconds, calls = self._spans.get(path, (0.0, 0))
+                self._spans[path] = (seconds + elapsed, calls + 1)
+
+    def _sample(self):
+        last = time.monotonic()
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            with self._lock:
+                threads = dict(self._threads)
+            frames = sys._current_frames()
+            for ident, thread_name in threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(self._frames.setdefault((code.co_name, code.co_filename, code.co_firstlineno), len(self._frames)))
+                    frame = frame.f_back
+                samples = self._samples.setdefault(thread_name, {})
+                key = tuple(reversed(stack))
+                samples[key] = samples.get(key, 0.0) + (now - last)
+            last = now
+
+    def timing_tree(self):
+        """
+        Returns the span timings as a tree rooted at the request.
+
+        Returns:
+        - dict: {'name', 'seconds', 'calls', 'children'}; children are sorted by time spent.
+        """
+
+        root = {"name": self.kind, "seconds": round(time.monotonic() - self._start if not self._finished else self.meta["duration"], 4), "calls": 1, "children": []}
+        nodes = {(): root}
+        with self._lock:
+            spans = sorted(self._spans.items())
+        for path, (seconds, calls) in spans:
+            parent = nodes.get(path[:-1], root)
+            node = {"name": path[-1], "seconds": round(seconds, 4), "calls": calls, "children": []}
+            parent["children"].append(node)
+            nodes[path] = node
+        for node in nodes.values():
+            node["children"].sort(key=lambda child: -child["seconds"])
+        return root
+
+    def speedscope(self):
+        """
+        Returns the samples in the speedscope file format (https://www.speedscope.app).
+        """
+
+        frames = [{"name": name, "file": file, "line": line} for (name, file, line), _ in sorted(self._frames.items(), key=lambda item: item[1])]
+        profiles = []
+        for thread_name, samples in sorted(self._samples.items()):
+            stacks, weights = list(samples.keys()), list(samples.values())
+            profiles.append({"type": "sampled", "name": thread_name, "unit": "seconds", "startValue": 0, "endValue": round(sum(weights), 6),
+                             "samples": [list(stack) for stack in stacks], "weights": [round(weight, 6) for weight in weights]})
+        return {"$schema": "https://www.speedscope.app/file-format-schema.json", "name": f"{self.kind} {self.request_id}",
+                "activeProfileIndex": 0, "exporter": "data_extraction.profiling", "shared": {"frames": frames}, "profiles": profiles}
+
+    def folded(self):
+        """
+        Returns the samples as folded stacks ('thread;frame;frame <milliseconds>'), the input of flamegraph.pl and similar tools.
+        """
+
+        names = {index: f"{name} ({os.path.basename(file)}:{line})" for (name, file, line), index in self._frames.items()}
+        lines = []
+        for thread_name, samples in sorted(self._samples.items()):
+            for stack, weight in samples.items():
+                lines.append(";".join([thread_name] + [names[index] for index in stack]) + f" {max(int(weight * 1000), 1)}")
+        return "\n".join(lines) + "\n"
+
+    def finish(self):
+        """
+        Stops the sampler and saves the profile. Failures are logged, never raised to the request.
+        """
+
+        if self._finished:
+            return
+        self._stop.set()
+        with self._lock:
+            sampler = self._sampler
+        if sampler is not None:
+            sampler.join()
+        self.meta.update({"requestId": self.request_id, "kind": self.kind, "startedAt": self.started_at, "duration": round(time.monotonic() - self._start, 4),
+                          "samples": int(sum(len(samples) for samples in self._samples.values()))})
+        self._finished = True
+
+        try:
+            directory = os.path.join(PROFILES_PATH, self.request_id)
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, PROFILE_FILES["speedscope"]), "w") as f:
+                json.dump(self.speedscope(), f)
+            with open(os.path.join(directory, PROFILE_FILES["folded"]), "w") as f:
+                f.write(self.folded())
+            with open(os.path.join(directory, PROFILE_FILES["timing"]), "w") as f:
+                json.dump({**self.meta, "tree": self.timing_tree()}, f, default=str)
+            prune_profiles()
+            logger.print(f"profile {self.request_id} saved ({self.meta['duration']} s, {self.meta['samples']} stacks)")
+        except OSError as e:
+            logger.print(f"profile {self.request_id} could not be saved: {str(e)}")
+
+
+def list_profiles():
+    """
+    Lists the saved profiles, newest first.
+
+    Returns:
+    - list: The metadata of each profile (request ID, kind, path, user, trigger, start time, duration) with its timing tree.
+    """
+
+    if not os.path.isdir(PROFILES_PATH):
+        return []
+    res = []
+    for request_id in os.listdir(PROFILES_PATH):
+        try:
+            with open(os.path.join(PROFILES_PATH, request_id, PROFILE_FILES["timing"])) as f:
+                res.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return sorted(res, key=lambda profile: -profile.get("startedAt", 0))
+
+
+def profile_file(request_id, file_format):
+    """
+    Returns the path of a saved profile file.
+
+    Parameters:
+    - request_id (str): The profile's request ID.
+    - file_format (str): 'speedscope', 'folded' or 'timing'.
+
+    Returns:
+    - str or None: The path, or None if there is no such profile.
+    """
+
+    if file_format not in PROFILE_FILES or not request_id.isalnum():
+        return None
+    path = os.path.join(PROFILES_PATH, request_id, PROFILE_FILES[file_format])
+    return path if os.path.exists(path) else None
+
+
+def prune_profiles():
+    """
+    Deletes the oldest saved profiles beyond PROFILES_MAX.
+    """
+
+    if not os.path.isdir(PROFILES_PATH):
+        return
+    directories = [os.path.join(PROFILES_PATH, name) for name in os.listdir(PROFILES_PATH)]
+    directories = sorted((path for path in directories if os.path.isdir(path)), key=os.path.getmtime, reverse=True)
+    for path in directories[PROFILES_MAX:]:
+        shutil.rmtree(path, ignore_errors=True)
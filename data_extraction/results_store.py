@@ -0,0 +1,211 @@
+import hashlib
+import os
+import uuid
+from django.db import DatabaseError
+from custom_lib.logger import BaseLog
+from api_channel.settings import RESULTS_STORE
+from data_extraction.models import ExtractionResultModel
+logger = BaseLog()
+
+EXTRACTION = "EXTRACTION"
+VERIFICATION = "VERIFICATION"
+ANALYSIS = "ANALYSIS"
+
+# run details of a verification that stopped at its first match (see 'verification.VerificationOptions.run_info')
+EARLY_EXIT_INFO = ("matchedPage", "skippedPages")
+
+RESULT_FIELDS = ["id", "request_type", "content_hash", "options", "file_name", "page", "shipment_id", "delivery_id", "company_id", "company_match", "degraded", "result", "user_id", "created_at"]
+
+
+def file_content_hash(path):
+    """
+    Returns the SHA-256 of a document, read in chunks.
+
+    Parameters:
+    - path (str): The path to the document file.
+
+    Returns:
+    - str: The hex digest.
+    """
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_company_id(company_id):
+    """
+    Returns the company ID results are stored and looked up under: without leading zeros, as the stamp index keys it.
+    """
+
+    return str(company_id).lstrip('0') if company_id is not None else None
+
+
+def find_stored_results(request_type, content_hash, options, company_id=None):
+    """
+    Returns the stored page results of a document processed before with the same options.
+
+    Parameters:
+    - request_type (str): EXTRACTION, VERIFICATION or ANALYSIS.
+    - content_hash (str): The SHA-256 of the document.
+    - options (str): The request options the results depend on (see the views).
+    - company_id (str, optional): The company verified against (VERIFICATION and ANALYSIS only).
+
+    Returns:
+    - dict or None: The most recent complete (not degraded) run, or None if there is none: 'pages' (the page
+      results) and 'info' (the run details given to 'store_results', {} if none).
+    """
+
+    if not RESULTS_STORE:
+        return None
+
+    try:
+        rows = ExtractionResultModel.objects.filter(request_type=request_type, content_hash=content_hash, options=options, degraded=False)
+        if company_id is not None:
+            rows = rows.filter(company_id=normalize_company_id(company_id))
+        latest = rows.order_by("-id").values("run_id", "run_info").first()
+        if latest is None:
+            return None
+        return {"pages": list(rows.filter(run_id=latest["run_id"]).order_by("page").values_list("result", flat=True)), "info": latest["run_info"] or {}}
+    except DatabaseError as e:
+        logger.print(f"results store: lookup failed: {str(e)}")
+        return None
+
+
+def store_results(request_type, content_hash, pages, options, file_name=None, company_id=None, user_id=None, degraded=False, info=None):
+    """
+    Stores the page results of a request.
+
+    Parameters:
+    - request_type (str): EXTRACTION, VERIFICATION or ANALYSIS.
+    - content_hash (str): The SHA-256 of the document.
+    - pages (list or dict): The result returned to the client: a list of page results or a single page result.
+      Empty page results are skipped.
+    - options (str): The request options the results depend on.
+    - file_name (str, optional): The stored document name.
+    - company_id (str, optional): The company verified against.
+    - user_id (int, optional): The authenticated user.
+    - degraded (bool, optional): Whether the request ran degraded under its deadline; such results are never reused.
+    - info (dict, optional): Run details returned with reused results (see 'find_stored_results').
+
+    Notes:
+    - Failures are logged and never fail the request.
+    - A single page result is stored with 'single' set in the run details, so it is reused in the same shape.
+    """
+
+    if isinstance(pages, dict):
+        pages, info = [pages], {**(info or {}), "single": True}
+    if not RESULTS_STORE or not pages:
+        return
+
+    run_id = uuid.uuid4().hex
+    rows = [
+        ExtractionResultModel(
+            run_id=run_id,
+            request_type=request_type,
+            content_hash=content_hash,
+            options=options,
+            file_name=file_name,
+            page=page.get("page", 1),
+            shipment_id=page.get("shipmentId") or None,
+            delivery_id=page.get("deliveryId") or None,
+            company_id=normalize_company_id(company_id),
+            company_match=page.get("comapanyMatch", (page.get("verification") or {}).get("comapanyMatch")),
+            degraded=degraded,
+            result=page,
+            user_id=user_id,
+            run_info=info,
+        )
+        for page in pages if page
+    ]
+    try:
+        ExtractionResultModel.objects.bulk_create(rows)
+    except DatabaseError as e:
+        logger.print(f"results store: could not store {len(rows)} pages: {str(e)}")
+
+
+def store_stream(events, request_type, content_hash, options, file_name=None, company_id=None, user_id=None):
+    """
+    Passes stream events through and stores the page results once the stream completes.
+
+    Parameters:
+    - events (generator): The events of a streamed request.
+    - Other parameters as in 'store_results'.
+
+    Yields:
+    - dict: The events, unchanged. Nothing is stored if the stream ends with an error or is closed early.
+    """
+
+    pages = []
+    for event in events:
+        if event["event"] == "page":
+            pages.append(event["data"])
+        elif event["event"] == "summary":
+            summary = event["data"]
+            info = {key: summary[key] for key in EARLY_EXIT_INFO} if summary.get("matchedPage") is not None else None
+            store_results(request_type, content_hash, pages, options, file_name, company_id, user_id, degraded=bool(summary.get("degradations")), info=info)
+        yield event
+
+
+def stored_body(stored):
+    """
+    Returns the response body of a stored run: its page results, or its only page result if it was returned as one.
+    """
+
+    return stored["pages"][0] if stored["info"].get("single") else stored["pages"]
+
+
+def stored_events(stored):
+    """
+    Returns stored page results as stream events.
+
+    Parameters:
+    - stored (dict): The stored run (see 'find_stored_results').
+
+    Yields:
+    - dict: One 'page' event per page, then a 'summary' event with 'reused' set, and 'matchedPage' and 'skippedPages'
+      if the stored verification stopped early.
+    """
+
+    pages = stored["pages"]
+    for page in pages:
+        yield {"event": "page", "data": page}
+    early_exit = {key: stored["info"][key] for key in EARLY_EXIT_INFO if key in stored["info"]}
+    yield {"event": "summary", "data": {"pages": len(pages), "relevantPages": len(pages), "duration": 0, "degradations": [], "reused": True, **early_exit}}
+
+
+def query_results(filters, page=1, page_size=20):
+    """
+    Looks up stored results by the indexed columns, newest first.
+
+    Parameters:
+    - filters (dict): Any of 'shipment_id', 'delivery_id', 'content_hash', 'company_id', 'request_type' and 'user_id'.
+    - page (int, optional): The 1-based result page. Default is 1.
+    - page_size (int, optional): Results per page. Default is 20.
+
+    Returns:
+    - dict: 'count' (total matches), 'page', 'pageSize' and 'results' (the stored rows).
+    """
+
+    if "company_id" in filters:
+        filters = {**filters, "company_id": normalize_company_id(filters["company_id"])}
+    rows = ExtractionResultModel.objects.filter(**filters)
+    offset = (page - 1) * page_size
+    results = [
+        {"id": row["id"], "requestType": row["request_type"], "contentHash": row["content_hash"], "options": row["options"],
+         "fileName": row["file_name"], "page": row["page"], "shipmentId": row["shipment_id"], "deliveryId": row["delivery_id"],
+         "companyId": row["company_id"], "companyMatch": row["company_match"], "degraded": row["degraded"],
+         "result": row["result"], "userId": row["user_id"], "createdAt": row["created_at"]}
+        for row in rows.order_by("-id").values(*RESULT_FIELDS)[offset:offset + page_size]
+    ]
+    return {"count": rows.count(), "page": page, "pageSize": page_size, "results": results}
+
+
+def document_name(doc_path):
+    """
+    Returns the file name a stored document is recorded under.
+    """
+
+    return os.path.basename(doc_path)[:255]
@@ -0,0 +1,188 @@
+import json
+import os
+import threading
+from custom_lib.image_hash import dhash, hamming_distance
+from custom_lib.logger import BaseLog
+from api_channel.settings import ROI_DEFAULT_REGION, ROI_STORE_PATH, ROI_TEMPLATE_TOLERANCE, ROI_MIN_SAMPLES, ROI_MAX_AREA, ROI_MARGIN, STUB_MODELS
+logger = BaseLog()
+
+
+def ocr_word_boxes(image):
+    """
+    Runs the Tesseract OCR that the LayoutLM pipeline would otherwise run for every query.
+
+    Parameters:
+    - image (PIL Image): The page or region to read.
+
+    Returns:
+    - list: (word, box) pairs, boxes normalised to 0-1000 of the image, as accepted by the pipeline's 'word_boxes'.
+    """
+
+    if STUB_MODELS:
+        from data_extraction.stub_models import stub_word_boxes
+        return stub_word_boxes(image)
+
+    from transformers.pipelines.document_question_answering import apply_tesseract
+    words, boxes = apply_tesseract(image, lang=None, tesseract_config="")
+    return list(zip(words, boxes))
+
+
+def span_box(word_boxes, span):
+    """
+    Returns the box covering the words of an answer span.
+
+    Parameters:
+    - word_boxes (list): The (word, box) pairs the answer was extracted from.
+    - span (tuple): The (start, end) word indices of the answer, inclusive.
+
+    Returns:
+    - list or None: [x0, y0, x1, y1] as fractions of the image, or None if the span is out of range.
+    """
+
+    start, end = span
+    boxes = [box for _, box in word_boxes[start:end + 1]]
+    if not boxes:
+        return None
+    return [min(b[0] for b in boxes) / 1000, min(b[1] for b in boxes) / 1000, max(b[2] for b in boxes) / 1000, max(b[3] for b in boxes) / 1000]
+
+
+class RoiStore:
+    """
+    Learns where validated IDs are found on each document layout, so extraction can read a small region first.
+
+    Notes:
+    - Pages are grouped into templates by a 64-bit dHash of the page thumbnail; pages within 'tolerance' bits share a template.
+    - Each template keeps, per field, the union of the boxes (page fractions) where a valid answer was found.
+    - 'region' returns the union of the learned field boxes (plus a margin) once every field of the template has been seen
+      'min_samples' times, otherwise the default header region. Regions covering more than 'max_area' of the page are
+      not worth cropping and are reported as None.
+    - With 'path' set the learned templates are saved as JSON and loaded again on start.
+    """
+
+    def __init__(self, path=ROI_STORE_PATH, tolerance=ROI_TEMPLATE_TOLERANCE, min_samples=ROI_MIN_SAMPLES, max_templates=256):
+        self.path = path
+        self.tolerance = tolerance
+        self.min_samples = min_samples
+        self.max_templates = max_templates
+        self.default_region = [float(value) for value in ROI_DEFAULT_REGION.split(",")] if ROI_DEFAULT_REGION else None
+        self._templates = []
+        self._lock = threading.Lock()
+        self._updates = 0
+        self._counters = {"pages": 0, "learnedRegions": 0, "defaultRegions": 0, "fullPages": 0, "roiFields": 0, "fallbackFields": 0}
+        self._load()
+
+    def template_key(self, page):
+        """
+        Returns the layout signature of a page (see the class notes).
+        """
+
+        thumbnail = page.convert("L")
+        thumbnail.thumbnail((128, 128))
+        return dhash(thumbnail)
+
+    def region(self, page, fields, track=True):
+        """
+        Returns the region of a page to read first.
+
+        Parameters:
+        - page (PIL Image): The page.
+        - fields (list): The fields to extract.
+        - track (bool, optional): Whether the lookup counts in the page counters. Default is True.
+
+        Returns:
+        - tuple: (template key, pixel box (x0, y0, x1, y1) of the region or None to read the full page).
+        """
+
+        key = self.template_key(page)
+        with self._lock:
+            self._counters["pages"] += track
+            template = self._find(key)
+            learned = template and all(template["fields"].get(field, {}).get("count", 0) >= self.min_samples for field in fields)
+            if learned:
+                boxes = [template["fields"][field]["box"] for field in fields]
+                region = [min(b[0] for b in boxes) - ROI_MARGIN, min(b[1] for b in boxes) - ROI_MARGIN, max(b[2] for b in boxes) + ROI_MARGIN, max(b[3] for b in boxes) + ROI_MARGIN]
+            else:
+                region = self.default_region
+
+            if region is None or (min(region[2], 1) - max(region[0], 0)) * (min(region[3], 1) - max(region[1], 0)) > ROI_MAX_AREA:
+                self._counters["fullPages"] += track
+                return key, None
+            self._counters["learnedRegions" if learned else "defaultRegions"] += track
+
+        width, height = page.size
+        return key, (int(max(region[0], 0) * width), int(max(region[1], 0) * height), int(min(region[2], 1) * width), int(min(region[3], 1) * height))
+
+    def record(self, key, field, box):
+        """
+        Records where a valid answer of a field was found on a page.
+
+        Parameters:
+        - key (int): The template key returned by 'region'.
+        - field (str): The field name.
+        - box (list): [x0, y0, x1, y1] as fractions of the page.
+        """
+
+        with self._lock:
+            template = self._find(key)
+            if template is None:
+                template = {"key": key, "fields": {}}
+                self._templates.insert(0, template)
+                del self._templates[self.max_templates:]
+            learned = template["fields"].get(field)
+            if learned is None:
+                template["fields"][field] = {"box": list(box), "count": 1}
+            else:
+                old = learned["box"]
+                learned["box"] = [min(old[0], box[0]), min(old[1], box[1]), max(old[2], box[2]), max(old[3], box[3])]
+                learned["count"] += 1
+            self._updates += 1
+            save = self.path and self._updates % 20 == 0
+        if save:
+            self.save()
+
+    def count(self, counter, value=1):
+        with self._lock:
+            self._counters[counter] += value
+
+    def stats(self):
+        """
+        Returns the ROI counters: pages read through a learned or default region or as a full page, fields resolved
+        inside the region ('roiFields') or on the full page after the region failed ('fallbackFields'), and learned templates.
+        """
+
+        with self._lock:
+            return {**self._counters, "templates": len(self._templates)}
+
+    def save(self):
+        """
+        Writes the learned templates to 'path' (atomically).
+        """
+
+        with self._lock:
+            data = json.dumps([{"key": format(t["key"], "x"), "fields": t["fields"]} for t in self._templates])
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                f.write(data)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.print(f"ROI store: could not save {self.path}: {str(e)}")
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self._templates = [{"key": int(t["key"], 16), "fields": t["fields"]} for t in json.load(f)][:self.max_templates]
+            logger.print(f"ROI store: loaded {len(self._templates)} templates")
+        except (OSError, ValueError, KeyError) as e:
+            logger.print(f"ROI store: could not load {self.path}: {str(e)}")
+
+    def _find(self, key):
+        for index, template in enumerate(self._templates):
+            if hamming_distance(template["key"], key) <= self.tolerance:
+                if index:
+                    self._templates.insert(0, self._templates.pop(index))
+                return template
+        return None
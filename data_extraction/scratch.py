@@ -0,0 +1,314 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from custom_lib.logger import BaseLog
+from data_extraction.metrics import register_metrics
+from api_channel.settings import SCRATCH_DIR, SCRATCH_QUOTA_MB, SCRATCH_MAX_AGE, BATCH_SCRATCH_QUOTA_MB
+logger = BaseLog()
+
+WORKSPACE_PREFIX = "req-"
+
+_lock = threading.Lock()
+# workspace directory -> Workspace, for the requests this worker process is serving
+_workspaces = {}
+_counters = {"created": 0, "closed": 0, "expired": 0, "quotaExceeded": 0, "staleRemoved": 0, "peakBytes": 0}
+
+
+class ScratchBudget:
+    """
+    A quota shared by several workspaces, e.g. the documents of one batch: together their files may use at most
+    'quota' bytes, on top of the quota of each workspace.
+    """
+
+    def __init__(self, quota=BATCH_SCRATCH_QUOTA_MB * 2**20):
+        self.quota = quota
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def charge(self, size):
+        """
+        Adds 'size' bytes (negative to return them) and returns the bytes in use.
+        """
+
+        with self._lock:
+            self.used += size
+            return self.used
+
+
+class Workspace:
+    """
+    The scratch directory of one request: the stored document and every file derived from it (rendered pages,
+    normalized images) live in it, and 'close' removes it as a whole.
+
+    Notes:
+    - The directory is named 'req-<pid>-<random>', so a worker can recognise (and remove) the workspaces left behind by
+      a worker process that died (see 'remove_stale_workspaces').
+    - Usage is the size of the files tracked with 'track'; writing past 'quota' bytes, or past the quota of the
+      shared 'budget' the workspace draws from, raises ValueError(50023).
+    - A 'pinned' workspace (e.g. a document of a queued batch job) is never closed as expired.
+    """
+
+    def __init__(self, quota=SCRATCH_QUOTA_MB * 2**20, budget=None):
+        self.path = tempfile.mkdtemp(prefix=f"{WORKSPACE_PREFIX}{os.getpid()}-", dir=SCRATCH_DIR)
+        self.quota = quota
+        self.budget = budget
+        self.pinned = False
+        self.created = time.time()
+        self.used = 0
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def new_file(self, name=None, suffix=""):
+        """
+        Returns the path of a new file in the workspace: 'name' (its base name only) if given, else a unique name.
+        """
+
+        if name:
+            return os.path.join(self.path, os.path.basename(name) or "document")
+        handle, path = tempfile.mkstemp(suffix=suffix, dir=self.path)
+        os.close(handle)
+        return path
+
+    def charge(self, path, size):
+        """
+        Adds 'size' bytes written to 'path' to the workspace usage.
+
+        Exceptions:
+        - ValueError(50023): The usage exceeds the quota.
+        """
+
+        with self._lock:
+            self._sizes[path] = self._sizes.get(path, 0) + size
+            self.used += size
+            used = self.used
+        shared = self.budget.charge(size) if self.budget is not None else 0
+        total = used_bytes()
+        with _lock:
+            _counters["peakBytes"] = max(_counters["peakBytes"], total)
+        if used > self.quota or (self.budget is not None and shared > self.budget.quota):
+            with _lock:
+                _counters["quotaExceeded"] += 1
+            logger.print(f"scratch quota exceeded: {used} > {self.quota} bytes in {self.path}" if used > self.quota else
+                         f"scratch quota exceeded: {shared} > {self.budget.quota} bytes shared by {self.path}")
+            raise ValueError(50023)
+
+    def track(self, path):
+        """
+        Charges the size of a file just written to 'path' (see 'charge').
+        """
+
+        self.charge(path, os.path.getsize(path))
+
+    def remove(self, path):
+        """
+        Deletes a file of the workspace and returns its space to the quota.
+        """
+
+        with self._lock:
+            size = self._sizes.pop(path, 0)
+            self.used -= size
+        if self.budget is not None:
+            self.budget.charge(-size)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def close(self):
+        """
+        Removes the workspace directory and everything in it.
+        """
+
+        with _lock:
+            if _workspaces.pop(self.path, None) is not None:
+                _counters["closed"] += 1
+        with self._lock:
+            used, self.used = self.used, 0
+            self._sizes.clear()
+        if self.budget is not None:
+            self.budget.charge(-used)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def open_workspace(budget=None):
+    """
+    Creates the scratch workspace of a request under SCRATCH_DIR.
+
+    Parameters:
+    - budget (ScratchBudget, optional): A quota the workspace shares with others, e.g. the documents of a batch.
+
+    Returns:
+    - Workspace: The new workspace; close it with 'close_workspace' once the request is done.
+
+    Notes:
+    - Workspaces of this process older than SCRATCH_MAX_AGE seconds are closed first. They belong to requests that
+      never reached their cleanup, e.g. a stream the client dropped before it started.
+    """
+
+    close_expired_workspaces()
+    workspace = Workspace(budget=budget)
+    with _lock:
+        _workspaces[workspace.path] = workspace
+        _counters["created"] += 1
+    return workspace
+
+
+def close_expired_workspaces():
+    """
+    Closes the workspaces of this process that are older than SCRATCH_MAX_AGE seconds and not pinned.
+    """
+
+    if SCRATCH_MAX_AGE <= 0:
+        return
+    now = time.time()
+    with _lock:
+        expired = [workspace for workspace in _workspaces.values() if now - workspace.created > SCRATCH_MAX_AGE and not workspace.pinned]
+        _counters["expired"] += len(expired)
+    for workspace in expired:
+        logger.print(f"scratch: closing expired workspace {workspace.path}")
+        workspace.close()
+
+
+def workspace_of(path):
+    """
+    Returns the open workspace that contains 'path', or None if the file is not in a request workspace.
+    """
+
+    with _lock:
+        return _workspaces.get(os.path.dirname(os.path.abspath(path)))
+
+
+def close_workspace(doc_path):
+    """
+    Removes the workspace of a stored document, with every file derived from it; the document alone is deleted if it is
+    not in a workspace.
+    """
+
+    workspace = workspace_of(doc_path)
+    if workspace is not None:
+        workspace.close()
+    elif os.path.isfile(doc_path):
+        os.remove(doc_path)
+
+
+def pin_workspace(doc_path):
+    """
+    Keeps the workspace of a stored document from expiring (see 'close_expired_workspaces'), e.g. while its batch job
+    waits in the queue; 'close_workspace' still removes it.
+    """
+
+    workspace = workspace_of(doc_path)
+    if workspace is not None:
+        workspace.pinned = True
+
+
+def scratch_file(near, suffix=""):
+    """
+    Returns the path of a new scratch file for a file derived from 'near' (e.g. a page of the document).
+
+    Parameters:
+    - near (str): The document or page the new file is derived from.
+    - suffix (str, optional): The file extension, e.g. '.png'.
+
+    Returns:
+    - str: A new file in the workspace of 'near'; in SCRATCH_DIR if 'near' is not in a workspace (e.g. ingestion).
+
+    Notes:
+    - Call 'track_scratch_file' once the file is written and 'remove_scratch_file' once it is no longer needed.
+    """
+
+    workspace = workspace_of(near)
+    if workspace is not None:
+        return workspace.new_file(suffix=suffix)
+    handle, path = tempfile.mkstemp(suffix=suffix, dir=SCRATCH_DIR)
+    os.close(handle)
+    return path
+
+
+def track_scratch_file(path):
+    """
+    Charges a written scratch file to its workspace quota.
+
+    Exceptions:
+    - ValueError(50023): The request exceeds its scratch quota.
+    """
+
+    workspace = workspace_of(path)
+    if workspace is not None:
+        workspace.track(path)
+
+
+def remove_scratch_file(path):
+    """
+    Deletes a scratch file, returning its space to the workspace quota.
+    """
+
+    workspace = workspace_of(path)
+    if workspace is not None:
+        workspace.remove(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def used_bytes():
+    """
+    Returns the scratch space used by the open workspaces of this worker process.
+    """
+
+    with _lock:
+        workspaces = list(_workspaces.values())
+    return sum(workspace.used for workspace in workspaces)
+
+
+def remove_stale_workspaces():
+    """
+    Removes the workspaces of worker processes that no longer run (e.g. a worker killed mid-request).
+
+    Returns:
+    - int: The number of workspaces removed.
+    """
+
+    removed = 0
+    for name in os.listdir(SCRATCH_DIR):
+        pid = name[len(WORKSPACE_PREFIX):].split("-")[0]
+        if not name.startswith(WORKSPACE_PREFIX) or not pid.isdigit() or process_alive(int(pid)):
+            continue
+        shutil.rmtree(os.path.join(SCRATCH_DIR, name), ignore_errors=True)
+        removed += 1
+    with _lock:
+        _counters["staleRemoved"] += removed
+    if removed:
+        logger.print(f"scratch: removed {removed} stale workspaces from {SCRATCH_DIR}")
+    return removed
+
+
+def process_alive(pid):
+    """
+    Checks whether a process with the given PID exists.
+    """
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def scratch_stats():
+    """
+    Returns the scratch usage: open workspaces, bytes in use and peak, quota and free space of SCRATCH_DIR.
+    """
+
+    disk = shutil.disk_usage(SCRATCH_DIR)
+    with _lock:
+        counters = dict(_counters)
+        workspaces = len(_workspaces)
+    return {"path": SCRATCH_DIR, "quotaBytes": SCRATCH_QUOTA_MB * 2**20, "openWorkspaces": workspaces, "usedBytes": used_bytes(),
+            **counters, "filesystemFreeBytes": disk.free, "filesystemTotalBytes": disk.total}
+
+
+os.makedirs(SCRATCH_DIR, exist_ok=True)
+remove_stale_workspaces()
+register_metrics("scratch", scratch_stats)
@@ -1,8 +1,31 @@
 from rest_framework import serializers
+from api_channel.settings import BATCH_MAX_DOCUMENTS
 
 
-class IsStampDetailsRequiredSerializer(serializers.Serializer):
+class RequestOptionsSerializer(serializers.Serializer):
+    stream = serializers.ChoiceField(choices=["ndjson", "sse"], required=False)
+    deadline = serializers.FloatField(required=False, min_value=1)
+    reuse = serializers.BooleanField(required=False, default=False)
+
+
+class IsStampDetailsRequiredSerializer(RequestOptionsSerializer):
     boolStampDetection =  serializers.BooleanField(required=False, default=False)
+    mode = serializers.ChoiceField(choices=["fast", "balanced", "accurate"], required=False)
+
+
+class BatchOptionsSerializer(IsStampDetailsRequiredSerializer):
+    job = serializers.BooleanField(required=False, default=False)
+
+
+class VerificationOptionsSerializer(RequestOptionsSerializer):
+    stopOnFirstMatch = serializers.BooleanField(required=False, default=False)
+    pageOrder = serializers.ChoiceField(choices=["forward", "reverse", "edges"], required=False)
+    matchThreshold = serializers.FloatField(required=False, min_value=0, max_value=1)
+
+
+class AnalysisOptionsSerializer(RequestOptionsSerializer):
+    mode = serializers.ChoiceField(choices=["fast", "balanced", "accurate"], required=False)
+    matchThreshold = serializers.FloatField(required=False, min_value=0, max_value=1)
 
 
 class LoadInvoiceSerializer(serializers.Serializer):
@@ -22,6 +45,23 @@ class LoadInvoiceSerializer(serializers.Serializer):
         return attrs
     
 
+class BatchSerializer(serializers.Serializer):
+    files = serializers.ListField(child=serializers.FileField(), required=False)
+    urls = serializers.ListField(child=serializers.CharField(), required=False)
+
+    def validate(self, attrs):
+        files = attrs.get('files') or []
+        urls = attrs.get('urls') or []
+
+        if not files and not urls:
+            raise ValueError(50007)
+
+        if len(files) + len(urls) > BATCH_MAX_DOCUMENTS:
+            raise ValueError(50024)
+
+        return attrs
+
+
 class AddStampSerializer(serializers.Serializer):
     files = serializers.FileField(required=False)
     url = serializers.CharField(required=False)
@@ -74,6 +114,24 @@ class StampVerificationSerializer(serializers.Serializer):
 
 
 
+class AnalysisSerializer(serializers.Serializer):
+    files = serializers.FileField(required=False)
+    url = serializers.CharField(required=False)
+    companyId = serializers.CharField(required=True)
+
+    def validate(self, attrs):
+        files = attrs.get('files')
+        url = attrs.get('url')
+
+        if not files and not url:
+            raise ValueError(50007)
+
+        if files and url:
+            raise ValueError(50001)
+
+        return attrs
+
+
 class StampDetailSerializer(serializers.Serializer):
     companyId = serializers.CharField()
     boundingBoxCoordinates = serializers.ListField(child=serializers.FloatField())
@@ -84,6 +142,8 @@ class DataSerializer(serializers.Serializer):
     deliveryId = serializers.CharField()
     stampCount = serializers.IntegerField()
     stampDetails = StampDetailSerializer(many=True)
+    degradations = serializers.ListField(child=serializers.CharField(), required=False)
+    duplicateOf = serializers.IntegerField(required=False)
 
 class ResponseFormatSerializer(serializers.Serializer):
     errorCode = serializers.IntegerField()
@@ -92,6 +152,33 @@ class ResponseFormatSerializer(serializers.Serializer):
 
 
 
+class BatchDocumentSerializer(ResponseFormatSerializer):
+    document = serializers.IntegerField()
+    fileName = serializers.CharField()
+
+
+class BatchResponseFormatSerializer(serializers.Serializer):
+    errorCode = serializers.IntegerField()
+    errorMessage = serializers.CharField()
+    data = BatchDocumentSerializer(many=True)
+
+
+class BatchJobSerializer(serializers.Serializer):
+    jobId = serializers.CharField()
+    status = serializers.ChoiceField(choices=["QUEUED", "RUNNING", "DONE", "FAILED"])
+    documents = serializers.IntegerField()
+    completed = serializers.IntegerField()
+    results = BatchDocumentSerializer(many=True)
+    createdAt = serializers.DateTimeField()
+    updatedAt = serializers.DateTimeField()
+
+
+class BatchJobResponseFormatSerializer(serializers.Serializer):
+    errorCode = serializers.IntegerField()
+    errorMessage = serializers.CharField()
+    data = BatchJobSerializer()
+
+
 class StampVerificationDataSerializer(serializers.Serializer):
     page = serializers.IntegerField()
     comapanyMatch = serializers.BooleanField()
@@ -104,5 +191,57 @@ class StampVerificationResponseFormatSerializer(serializers.Serializer):
     data = StampVerificationDataSerializer()
 
 
+class VerificationResultSerializer(serializers.Serializer):
+    companyExist = serializers.BooleanField()
+    comapanyMatch = serializers.BooleanField()
+    boundingBoxCoordinates = serializers.ListField(child=serializers.ListField(child=serializers.FloatField()))
+
+
+class AnalysisDataSerializer(DataSerializer):
+    verification = VerificationResultSerializer()
 
 
+class AnalysisResponseFormatSerializer(serializers.Serializer):
+    errorCode = serializers.IntegerField()
+    errorMessage = serializers.CharField()
+    data = AnalysisDataSerializer(many=True)
+
+
+class ResultsQuerySerializer(serializers.Serializer):
+    shipmentId = serializers.CharField(required=False)
+    deliveryId = serializers.CharField(required=False)
+    contentHash = serializers.CharField(required=False)
+    companyId = serializers.CharField(required=False)
+    requestType = serializers.ChoiceField(choices=["EXTRACTION", "VERIFICATION", "ANALYSIS"], required=False)
+    page = serializers.IntegerField(required=False, default=1, min_value=1)
+    pageSize = serializers.IntegerField(required=False, default=20, min_value=1, max_value=100)
+
+
+class StoredResultSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    requestType = serializers.CharField()
+    contentHash = serializers.CharField()
+    options = serializers.CharField()
+    fileName = serializers.CharField()
+    page = serializers.IntegerField()
+    shipmentId = serializers.CharField()
+    deliveryId = serializers.CharField()
+    companyId = serializers.CharField()
+    companyMatch = serializers.BooleanField()
+    degraded = serializers.BooleanField()
+    result = serializers.JSONField()
+    userId = serializers.IntegerField()
+    createdAt = serializers.DateTimeField()
+
+
+class ResultsDataSerializer(serializers.Serializer):
+    count = serializers.IntegerField()
+    page = serializers.IntegerField()
+    pageSize = serializers.IntegerField()
+    results = StoredResultSerializer(many=True)
+
+
+class ResultsResponseFormatSerializer(serializers.Serializer):
+    errorCode = serializers.IntegerField()
+    errorMessage = serializers.CharField()
+    data = ResultsDataSerializer()
@@ -1,17 +1,36 @@
+import errno
 import os
 import re
-import tempfile
+import asyncio
 import requests
-import shutil
-from pdf2image import convert_from_path
 import cv2
 import numpy as np
-from stamp_detection.services import initiate_stamp_detection, document_classifer
-from data_extraction.paddleocr import data_extraction_by_paddleocr, extract_shipment_number, extract_delivery_number
+from PIL import Image
+from stamp_detection.services import initiate_stamp_detection, analyze_stamps, document_classifer, pdf_page_count, render_pdf_page, file_type_detection
+from data_extraction.deadline import SKIP_STAMP_DETECTION, SKIP_LAYOUTLM, PARTIAL_PAGES
+from data_extraction.profiles import get_profile
+from data_extraction.page_fingerprint import page_fingerprint, PageDeduplicator
+from data_extraction.pipeline import StagedPipeline, PipelineStage, PipelineMetrics
+from data_extraction.metrics import register_metrics
+from data_extraction.async_runtime import get_http_client
+from data_extraction.roi import RoiStore, ocr_word_boxes, span_box
+from data_extraction.image_normalization import normalize_image, release_normalized_image, to_original_stamp_data
+from data_extraction.scratch import open_workspace, scratch_file, track_scratch_file, remove_scratch_file
+from api_channel.settings import DUPLICATE_PAGE_DETECTION, PIPELINE_QUEUE_SIZE, PIPELINE_STAGE_WORKERS, ROI_EXTRACTION, VERIFICATION_MATCH_THRESHOLD
+from data_extraction.paddleocr import data_extraction_by_paddleocr
+from data_extraction.id_extraction import is_valid_id
+from data_extraction.ocr_engine import document_key
 from custom_lib.logger import BaseLog
 import time
 logger = BaseLog()
-from data_extraction.apps import gpu_model_pipe, cpu_model_pipe 
+from data_extraction.apps import model_registry
+
+pipeline_metrics = PipelineMetrics()
+register_metrics("pagePipeline", pipeline_metrics.stats)
+roi_store = RoiStore()
+register_metrics("roi", roi_store.stats)
+
+DOWNLOAD_CHUNK_SIZE = 1 << 20
 
 
 number_fields_dict = {
@@ -19,7 +38,7 @@ number_fields_dict = {
   "deliveryId": ["what is No entrega ?", "what is Delivery Note Number?", "what is No. remission?"]
 }
 
-def initialize_number_extraction_model(image, query, device):
+def initialize_number_extraction_model(image, query, device, word_boxes=None):
     """
     Initializes and utilizes the appropriate number extraction model based on the specified device.
 
@@ -27,28 +46,35 @@ def initialize_number_extraction_model(image, query, device):
     - image (Image): The input image.
     - query (str): The query string specifying the information to extract.
     - device (str): The device to use for model execution ("gpu" or "cpu").
+    - word_boxes (list, optional): Pre-computed (word, box) pairs of the image (see 'ocr_word_boxes'). LayoutLM then
+      skips its own OCR and only reads these words.
 
     Returns:
     - tuple: A tuple containing:
     - answer (str): The extracted answer from the model.
     - score (float): The confidence score associated with the answer.
     - use_model (str): The name of the model used for extraction.
+    - span (tuple or None): The (start, end) indices of the answer in 'word_boxes' (LayoutLM only).
     """
 
     if device.lower()=="gpu":
         use_model="ernie"
-        response = gpu_model_pipe([{"doc": image, "prompt": query}])
+        with model_registry.use("ernie") as gpu_model_pipe:
+            response = gpu_model_pipe([{"doc": image, "prompt": query}])
         result = response[0].get('result', [])
         score = result[0].get("prob", 0)
         answer = result[0].get("value", "")
+        span = None
 
     else:
         use_model="layoutlm"
-        result = cpu_model_pipe(image, query)
+        with model_registry.use("layoutlm") as cpu_model_pipe:
+            result = cpu_model_pipe(image, query, word_boxes=word_boxes) if word_boxes is not None else cpu_model_pipe(image, query)
         score = result[0].get("score", 0)
         answer = result[0].get("answer", "")
+        span = (result[0]["start"], result[0]["end"]) if "start" in result[0] else None
 
-    return answer, score, use_model if result else None
+    return answer, score, use_model if result else None, span
 
 
 def validate_id(key, answer, model):
@@ -64,10 +90,8 @@ def validate_id(key, answer, model):
     - bool: True if the extracted ID is valid, False otherwise.
     """
 
-    if key == "shipmentId" and model.lower()=="cpu":
-        return answer == extract_shipment_number(answer)
-    elif key == "deliveryId" and model.lower()=="cpu":
-        return answer == extract_delivery_number(answer)
+    if key in ("shipmentId", "deliveryId") and model.lower()=="cpu":
+        return is_valid_id(key, answer)
     else:
         return True
 
@@ -101,7 +125,7 @@ def is_valid_answer(answer, score, results, key, model):
             not (key=="deliveryId" and answer==results.get("shipmentId", "")))
            
 
-def process_queries(image, queries, key, results, device):
+def process_queries(image, queries, key, results, device, deadline=None, applied=None, word_boxes=None, spans=None):
     """
     Processes a set of queries for number extraction from an image.
 
@@ -111,23 +135,31 @@ def process_queries(image, queries, key, results, device):
     - key (str): The key representing the type of ID to extract (e.g., "shipmentId", "deliveryId").
     - results (dict): A dictionary to store the extracted results.
     - device (str): The device to use for model execution ("gpu" or "cpu").
+    - deadline (Deadline, optional): The request deadline; the ladder stops when LayoutLM is no longer allowed.
+    - applied (list, optional): The page's list of applied degradations.
+    - word_boxes (list, optional): Pre-computed (word, box) pairs of the image, shared by every query.
+    - spans (dict, optional): Receives the word span of the valid answer under 'key', when the model reports it.
 
     Returns:
     - bool: True if a valid answer is found for any of the queries, False otherwise.
     """
 
     for query in queries:
-        answer, score, use_model = initialize_number_extraction_model(image, query, device)
+        if deadline and not deadline.allow(SKIP_LAYOUTLM, applied):
+            return False
+        answer, score, use_model, span = initialize_number_extraction_model(image, query, device, word_boxes)
         if answer:
             validation_check = is_valid_answer(answer, score, results, key, device)
             logger.print(f"{use_model}: {key} --> {answer}, {validation_check}, {score}")
             if validation_check:
                 results[key] = answer
+                if spans is not None and span is not None:
+                    spans[key] = span
                 return True  
     return False
 
 
-def start_number_field_extraction(image, extraction_dict, device):
+def start_number_field_extraction(image, extraction_dict, device, deadline=None, applied=None):
     """
     Initiates the extraction of number fields from the given image using a set of predefined queries.
 
@@ -135,6 +167,8 @@ def start_number_field_extraction(image, extraction_dict, device):
     - image: The input image from which number fields are to be extracted.
     - extraction_dict: A dictionary containing keys representing field names and values as lists of queries for extraction.
     - device: The device information for image processing.
+    - deadline (Deadline, optional): The request deadline, checked before every query.
+    - applied (list, optional): The page's list of applied degradations.
 
     Returns:
     - dict: A dictionary containing the extracted number fields, where keys are field names and values are the extracted numbers.
@@ -150,7 +184,7 @@ def start_number_field_extraction(image, extraction_dict, device):
     results = {}
 
     for key, queries in extraction_dict.items():
-        found_result = process_queries(image, queries, key, results, device)
+        found_result = process_queries(image, queries, key, results, device, deadline, applied)
         if not found_result:
             results[key] = ""
 
@@ -159,7 +193,73 @@ def start_number_field_extraction(image, extraction_dict, device):
     return results
 
 
-def pdf_file_operation(file_path, device, is_stamp_details_required="False"):
+def roi_number_field_extraction(image_path, extraction_dict, device, deadline=None, applied=None):
+    """
+    Extracts the number fields from the learned region of interest of a page first, and from the full page only for the
+    fields whose answer in the region is missing or fails 'is_valid_answer'.
+
+    Parameters:
+    - image_path (str): The path to the page image.
+    - extraction_dict: A dictionary containing keys representing field names and values as lists of queries for extraction.
+    - device: The device information for image processing.
+    - deadline (Deadline, optional): The request deadline, checked before every query.
+    - applied (list, optional): The page's list of applied degradations.
+
+    Returns:
+    - dict: A dictionary containing the extracted number fields (empty strings for fields not found).
+
+    Notes:
+    - The region comes from 'roi_store' (learned per layout template, or the default header region). Only the words
+      inside it are OCR'd and passed to LayoutLM, so both the OCR area and the LayoutLM sequence are much smaller.
+    - OCR runs once per region or page and its words are shared by every query of the ladder.
+    - Where a valid answer was found is recorded in 'roi_store', so the region of each template narrows to the IDs.
+    """
+
+    with Image.open(image_path) as image:
+        page = image.convert("RGB")
+
+    results = {}
+    template, region = roi_store.region(page, list(extraction_dict))
+
+    if region:
+        crop = page.crop(region)
+        word_boxes = ocr_word_boxes(crop)
+        spans = {}
+        for key, queries in extraction_dict.items():
+            process_queries(crop, queries, key, results, device, deadline, applied, word_boxes, spans)
+
+        width, height = page.size
+        crop_width, crop_height = crop.size
+        for key, span in spans.items():
+            box = span_box(word_boxes, span)
+            if box:
+                roi_store.record(template, key, [(region[0] + box[0] * crop_width) / width, (region[1] + box[1] * crop_height) / height,
+                                                 (region[0] + box[2] * crop_width) / width, (region[1] + box[3] * crop_height) / height])
+        roi_store.count("roiFields", len(results))
+
+    missing = {key: queries for key, queries in extraction_dict.items() if key not in results}
+    if missing and (deadline is None or deadline.allow(SKIP_LAYOUTLM, applied)):
+        word_boxes = ocr_word_boxes(page)
+        spans = {}
+        for key, queries in missing.items():
+            process_queries(page, queries, key, results, device, deadline, applied, word_boxes, spans)
+
+        for key, span in spans.items():
+            box = span_box(word_boxes, span)
+            if box:
+                roi_store.record(template, key, box)
+        if region:
+            roi_store.count("fallbackFields", len(spans))
+
+    for key in extraction_dict:
+        results.setdefault(key, "")
+
+    logger.print(f"roi_number_field_extraction: {results}")
+
+    return results
+
+
+def pdf_file_operation(file_path, device, is_stamp_details_required="False", deadline=None, profile=None, company_id=None, match_threshold=VERIFICATION_MATCH_THRESHOLD):
     """
     Performs operations on a PDF file, extracting relevant data from its images.
 
@@ -167,49 +267,364 @@ def pdf_file_operation(file_path, device, is_stamp_details_required="False"):
     - file_path (str): The path to the PDF file.
     - device: The device information for image processing.
     - is_stamp_details_required (str, optional): Whether stamp details are required. Default is "False".
+    - deadline (Deadline, optional): The request deadline carried through every stage.
+    - profile (dict, optional): The pipeline profile of the requested mode (see 'PIPELINE_PROFILES'). Defaults to the default mode.
+    - company_id (str, optional): The company the stamps are also verified against (see 'page_stamp_data').
+    - match_threshold (float, optional): Cosine similarity above which a stamp matches the company. Defaults to VERIFICATION_MATCH_THRESHOLD.
     
     Returns:
     - list: A list containing the extracted data for each relevant image in the PDF.
 
     Notes:
-    - Uses 'convert_from_path' function from 'pdf2image' library to convert PDF pages to images.
-    - Iterates through the images, classifies them as relevant or not using 'document_classifier'.
-    - If classified as relevant, extracts data from the image using 'image_file_operation'.
-    - Deletes the original PDF file after processing.
+    - Collects the page results of 'iter_pdf_file_operation'.
 
     Exceptions:
     - Exception: Any exception that may occur during PDF conversion, document classification, image processing, or file deletion.
     """
 
     try:
-        res = []
+        return [event["data"] for event in iter_pdf_file_operation(file_path, device, is_stamp_details_required, deadline, profile, company_id, match_threshold) if event["event"] == "page"]
+
+    except Exception as e:
+        logger.print(f"Error occurred while extracting data: {str(e)}")
+        return []
 
-        pdf_images = convert_from_path(file_path)
-        for idx, image in enumerate(pdf_images, start=1):
 
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_image:
-                image_cv2 = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                cv2.imwrite(temp_image.name, image_cv2)
+def iter_pdf_file_operation(file_path, device, is_stamp_details_required="False", deadline=None, profile=None, company_id=None, match_threshold=VERIFICATION_MATCH_THRESHOLD):
+    """
+    Streams the data extraction of a PDF file page by page.
 
-                relevancy = document_classifer(temp_image.name)
-                if relevancy == "Relevant":
-                    data = image_file_operation(temp_image.name, device, is_stamp_details_required, idx, False)
-                    res.append(data)
+    Parameters:
+    - file_path (str): The path to the PDF file.
+    - device: The device information for image processing.
+    - is_stamp_details_required (str, optional): Whether stamp details are required. Default is "False".
+    - deadline (Deadline, optional): The request deadline; once it is nearly spent the remaining pages are skipped.
+    - profile (dict, optional): The pipeline profile of the requested mode; sets the render DPI and the page settings.
+    - company_id (str, optional): The company the stamps are also verified against (see 'page_stamp_data').
+    - match_threshold (float, optional): Cosine similarity above which a stamp matches the company. Defaults to VERIFICATION_MATCH_THRESHOLD.
 
-        return res
+    Yields:
+    - dict: Events with keys 'event' and 'data', in page order:
+    - page: the extracted data of a relevant page, as soon as it and every earlier page are done.
+    - progress: a page that was skipped ({'page', 'status': 'skipped', 'reason': 'notRelevant' or 'deadline'}).
+    - summary: the last event ({'pages', 'relevantPages', 'duplicatePages', 'duration', 'degradations'}).
 
-    except Exception as e:
-        logger.print(f"Error occurred while extracting data: {str(e)}")
-        return []
+    Notes:
+    - Pages flow through the staged pipeline of 'build_page_pipeline' (render -> classify -> extract -> stamps),
+      so rendering and inference of consecutive pages overlap; only relevant pages are extracted.
+    - A page that duplicates an earlier page of the document (same fingerprint, see 'PageDeduplicator') is not
+      processed again: it reuses the earlier page's result with its own page index and 'duplicateOf' set to the earlier page.
+    """
+
+    start_time = time.time()
+    profile = profile or get_profile()
+    pages = pdf_page_count(file_path)
+    relevant_pages = 0
+    duplicate_pages = 0
+    page_events = {}
+
+    pipeline = build_page_pipeline(device, is_stamp_details_required, deadline, profile, company_id, match_threshold)
+    for page in pipeline.run({"page": idx, "file_path": file_path} for idx in range(1, pages + 1)):
+        event = page_event(page, page_events)
+        if event["event"] == "error":
+            raise ValueError(event["data"]["errorCode"])
+
+        duplicate_pages += "duplicateOf" in page
+        relevant_pages += event["event"] == "page"
+        yield event
+
+    yield {"event": "summary", "data": {"pages": pages, "relevantPages": relevant_pages, "duplicatePages": duplicate_pages, "duration": time.time() - start_time, "degradations": deadline.degradations if deadline else []}}
+
+
+def iter_batch_file_operation(documents, device, is_stamp_details_required="False", deadline=None, profile=None):
+    """
+    Extracts the data of several documents through one shared page pipeline.
+
+    Parameters:
+    - documents (list): The stored documents, as dicts with 'document' (their index) and 'path'.
+    - device: The device information for image processing.
+    - is_stamp_details_required (str, optional): Whether stamp details are required. Default is "False".
+    - deadline (Deadline, optional): The deadline of the whole batch.
+    - profile (dict, optional): The pipeline profile of the requested mode.
+
+    Yields:
+    - dict: One event per document, as soon as its last page is done (documents that cannot be read come first):
+    - document: {'document', 'pages' (the results of its relevant pages, as 'pdf_file_operation' returns them),
+      'pageCount', 'relevantPages', 'duplicatePages'}.
+    - error: {'document', 'errorCode'} for a document that is unsupported, unreadable or too large.
+
+    Notes:
+    - The pages of all documents flow through the stages of a single 'build_page_pipeline', so a document's pages
+      are rendered while the pages of the previous one are classified and extracted, and every model stage is fed
+      from one queue instead of one small document at a time.
+    - An image document is one page that is normalized instead of rendered and is not classified, as in
+      'image_file_operation'.
+    """
+
+    profile = profile or get_profile()
+    plans = []
+    for document in documents:
+        try:
+            file_type = file_type_detection(document["path"])
+            plans.append((document, file_type, 1 if file_type == "Image" else pdf_page_count(document["path"])))
+        except Exception as e:
+            logger.print(f"batch: cannot process {document['path']}: {str(e)}")
+            yield {"event": "error", "data": {"document": document["document"], "errorCode": int(str(e)) if str(e).isdigit() else 50001}}
+
+    results = {document["document"]: {"pageCount": pages, "done": 0, "pages": [], "events": {}, "relevantPages": 0, "duplicatePages": 0, "errorCode": None}
+               for document, _, pages in plans}
+    for document, _, pages in plans:
+        if pages == 0:
+            yield {"event": "document", "data": {"document": document["document"], "pageCount": 0, "pages": [], "relevantPages": 0, "duplicatePages": 0}}
+
+    items = ({"document": document["document"], "file_path": document["path"], "page": idx, "image": file_type == "Image"}
+             for document, file_type, pages in plans for idx in range(1, pages + 1))
+
+    pipeline = build_page_pipeline(device, is_stamp_details_required, deadline, profile)
+    for page in pipeline.run(items):
+        result = results[page["document"]]
+        event = page_event(page, result["events"])
+        result["done"] += 1
+        result["duplicatePages"] += "duplicateOf" in page
+
+        if event["event"] == "error":
+            result["errorCode"] = result["errorCode"] or event["data"]["errorCode"]
+        elif event["event"] == "page":
+            result["relevantPages"] += 1
+            if event["data"]:
+                result["pages"].append(event["data"])
+
+        if result["done"] == result["pageCount"]:
+            if result["errorCode"]:
+                yield {"event": "error", "data": {"document": page["document"], "errorCode": result["errorCode"]}}
+            else:
+                yield {"event": "document", "data": {"document": page["document"], **{key: result[key] for key in ("pageCount", "pages", "relevantPages", "duplicatePages")}}}
+            del results[page["document"]]
+
+
+def page_event(page, page_events):
+    """
+    Turns a finished item of the page pipeline into its stream event and deletes its page image.
+
+    Parameters:
+    - page (dict): The finished item (see 'build_page_pipeline').
+    - page_events (dict): The events of the earlier pages of the same document by page index; the page's event is added.
+
+    Returns:
+    - dict: A 'page' event, a 'progress' event (skipped page) or an 'error' event ({'errorCode'}) for a page that
+      could not be prepared.
+    """
+
+    release_page_image(page)
+    idx = page["page"]
+
+    if "error" in page:
+        # recorded too: a page that failed in classify may be the original of a later duplicate
+        page_events[idx] = {"event": "error", "data": {"page": idx, "errorCode": page["error"]}}
+        return page_events[idx]
+
+    if "duplicateOf" in page:
+        event = page_events[page["duplicateOf"]]
+        return {"event": event["event"], "data": {**event["data"], "page": idx, "duplicateOf": page["duplicateOf"]}}
+
+    if "event" in page:
+        event = page["event"]
+    else:
+        data = page["data"]
+        if data:
+            data["duration"] = page["duration"]
+            if page["degradations"]:
+                data["degradations"] = page["degradations"]
+        event = {"event": "page", "data": data}
+
+    page_events[idx] = event
+    return event
+
+
+def release_page_image(page):
+    """
+    Deletes the page image of a pipeline item: the rendered PDF page, or the normalized copy of an image document.
+    """
+
+    if "normalized" in page:
+        release_normalized_image(page["normalized"])
+    elif page.get("image_path"):
+        remove_scratch_file(page["image_path"])
+
+
+def build_page_pipeline(device, is_stamp_details_required, deadline, profile, company_id=None, match_threshold=VERIFICATION_MATCH_THRESHOLD):
+    """
+    Builds the staged pipeline that processes document pages for 'iter_pdf_file_operation' and
+    'iter_batch_file_operation'.
+
+    Parameters:
+    - device: The device information for image processing.
+    - is_stamp_details_required (str): Whether stamp details are required.
+    - deadline (Deadline or None): The request deadline.
+    - profile (dict): The pipeline profile of the requested mode.
+    - company_id (str, optional): The company the stamps are also verified against.
+    - match_threshold (float, optional): Cosine similarity above which a stamp matches the company. Defaults to VERIFICATION_MATCH_THRESHOLD.
+
+    Returns:
+    - StagedPipeline: A pipeline whose items are dicts with the 1-based 'page' index and the 'file_path' of its document;
+      'image' marks an image document (one page, not rendered or classified). Finished items carry either 'event'
+      (a skipped page), 'duplicateOf' (a duplicate page), 'error' (the error code of a page that could not be prepared)
+      or 'data', 'duration' and 'degradations' (a relevant page), and 'image_path', the page image to delete once the
+      item is done (see 'page_event').
+
+    Notes:
+    - Stage workers come from PIPELINE_STAGE_WORKERS and queue sizes from PIPELINE_QUEUE_SIZE. More than one worker
+      only helps the render stage unless the stage's models have a pool of copies (MODEL_POOL_SIZES); otherwise
+      the workers take turns on the model.
+    - As in 'image_file_operation', a page whose extraction or stamp detection fails yields empty data. A page that
+      cannot be rendered or classified carries the 'error' code of a ValueError(<code>), otherwise 50001.
+    - Pages of different documents can share one pipeline; duplicate pages are only looked for within a document.
+    """
+
+    deduplicators = {}
+
+    def page_error(page, e):
+        # an error code raised as ValueError(<code>) is reported as is, anything else as 50001
+        code = str(e) if isinstance(e, ValueError) else ""
+        if not code.isdigit():
+            logger.print(f"Error occurred: {str(e)}")
+        page["error"] = int(code) if code.isdigit() else 50001
+        page["skip"] = True
+
+    def render(page):
+        idx = page["page"]
+        if deadline and not deadline.allow(PARTIAL_PAGES):
+            page["event"] = {"event": "progress", "data": {"page": idx, "status": "skipped", "reason": "deadline"}}
+            page["skip"] = True
+            return
+
+        try:
+            if page.get("image"):
+                page["normalized"] = normalize_image(page["file_path"])
+                page["image_path"] = page["normalized"]["path"]
+                return
+
+            image = render_pdf_page(page["file_path"], idx, dpi=profile["dpi"])
+
+            if DUPLICATE_PAGE_DETECTION:
+                deduplicator = deduplicators.setdefault(page["file_path"], PageDeduplicator())
+                fingerprint = page_fingerprint(image)
+                original = deduplicator.find(fingerprint, before=idx)
+                if original is not None:
+                    page["duplicateOf"] = original
+                    page["skip"] = True
+                    return
+                deduplicator.add(idx, fingerprint)
+
+            page["image_path"] = scratch_file(page["file_path"], '.png')
+            cv2.imwrite(page["image_path"], cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR))
+            track_scratch_file(page["image_path"])
+
+        except Exception as e:
+            page_error(page, e)
+
+    def classify(page):
+        if page.get("image"):
+            return
+        try:
+            relevant = document_classifer(page["image_path"]) == "Relevant"
+        except Exception as e:
+            page_error(page, e)
+            return
+        if not relevant:
+            page["event"] = {"event": "progress", "data": {"page": page["page"], "status": "skipped", "reason": "notRelevant"}}
+            page["skip"] = True
+
+    def extract(page):
+        start_time = time.time()
+        page["degradations"] = []
+        try:
+            ids = ids_extraction(page["image_path"], device, deadline, page["degradations"], profile)
+            page["data"] = {'page': page["page"], **ids}
+        except Exception as e:
+            logger.print(f"Error occurred: {str(e)}")
+            page["data"] = {}
+        page["duration"] = time.time() - start_time
+
+    def stamps(page):
+        if not page["data"] or is_stamp_details_required.lower() != "true":
+            return
+        if deadline and not deadline.allow(SKIP_STAMP_DETECTION, page["degradations"]):
+            return
+
+        start_time = time.time()
+        try:
+            stamp_data = page_stamp_data(page["image_path"], profile, company_id, match_threshold)
+            page["data"].update(to_original_stamp_data(stamp_data, page["normalized"]) if "normalized" in page else stamp_data)
+        except Exception as e:
+            logger.print(f"Error occurred: {str(e)}")
+            page["data"] = {}
+        page["duration"] += time.time() - start_time
+
+    return StagedPipeline(
+        [PipelineStage(name, fn, PIPELINE_STAGE_WORKERS.get(name, 1)) for name, fn in [("render", render), ("classify", classify), ("extract", extract), ("stamps", stamps)]],
+        queue_size=PIPELINE_QUEUE_SIZE,
+        metrics=pipeline_metrics,
+    )
+
+
+def iter_image_file_operation(image_path, device, is_stamp_details_required="False", deadline=None, profile=None, company_id=None, match_threshold=VERIFICATION_MATCH_THRESHOLD):
+    """
+    Streams the data extraction of a single image as one page event followed by the summary event.
+
+    Parameters:
+    - image_path (str): The path to the image file.
+    - device: The device information for image processing.
+    - is_stamp_details_required (str, optional): Whether stamp details are required. Default is "False".
+    - deadline (Deadline, optional): The request deadline carried through every stage.
+    - profile (dict, optional): The pipeline profile of the requested mode.
+    - company_id (str, optional): The company the stamps are also verified against.
+    - match_threshold (float, optional): Cosine similarity above which a stamp matches the company. Defaults to VERIFICATION_MATCH_THRESHOLD.
+
+    Yields:
+    - dict: A 'page' event and a 'summary' event (see 'iter_pdf_file_operation').
+    """
+
+    start_time = time.time()
+    yield {"event": "page", "data": image_file_operation(image_path, device, is_stamp_details_required, 1, False, deadline, profile, company_id, match_threshold)}
+    yield {"event": "summary", "data": {"pages": 1, "relevantPages": 1, "duplicatePages": 0, "duration": time.time() - start_time, "degradations": deadline.degradations if deadline else []}}
 
 
-def ids_extraction(image_path, device):
+def roi_paddleocr_extraction(image_path, profile=None):
+    """
+    Runs the PaddleOCR + regex fallback on the learned region of interest first, and on the full page only if the
+    region does not yield both IDs.
+
+    Parameters:
+    - image_path (str): The path to the page image.
+    - profile (dict, optional): The pipeline profile; sets the OCR detection size.
+
+    Returns:
+    - dict: A dictionary containing the extracted shipment and delivery IDs.
+    """
+
+    with Image.open(image_path) as image:
+        page = image.convert("RGB")
+
+    _, region = roi_store.region(page, list(number_fields_dict), track=False)
+    if region:
+        region_data = data_extraction_by_paddleocr(page, profile, document_key(image_path), region=region) or {}
+        if check_values_not_empty(region_data):
+            return region_data
+
+    return data_extraction_by_paddleocr(page, profile, document_key(image_path)) or {}
+
+
+def ids_extraction(image_path, device, deadline=None, applied=None, profile=None):
     """
     Extracts shipment and delivery IDs from an image using a multi-model approach.
 
     Parameters:
     - image_path (str): The path to the image file.
     - device (str): The device to use for model execution ("gpu" or "cpu").
+    - deadline (Deadline, optional): The request deadline. When the budget runs low the LayoutLM ladder is skipped (regex only).
+    - applied (list, optional): The page's list of applied degradations.
+    - profile (dict, optional): The pipeline profile; sets how much of the LayoutLM ladder runs and whether PaddleOCR is the fallback.
 
     Returns:
     - dict: A dictionary containing the extracted IDs, with keys:
@@ -217,7 +632,8 @@ def ids_extraction(image_path, device):
         - deliveryId (str): The extracted delivery ID.
 
     Steps:
-    1. Attempts to extract IDs using the primary number field extraction method (assumed to be LayoutLM based on context).
+    1. Attempts to extract IDs using the primary number field extraction method (assumed to be LayoutLM based on context),
+       reading the learned region of interest first on CPU (see 'roi_number_field_extraction').
     2. If the primary method fails to extract any IDs, employs a secondary method (PaddleOCR) as a fallback.
     3. Returns a dictionary containing the extracted IDs and any additional information.
     """
@@ -227,19 +643,49 @@ def ids_extraction(image_path, device):
         "deliveryId": "",
     }
 
-    extracted_data = start_number_field_extraction(image_path, number_fields_dict, device)
+    profile = profile or get_profile()
+    extraction_dict = {key: queries[:profile["max_queries"]] for key, queries in number_fields_dict.items()}
+
+    extracted_data = {}
+    if deadline is None or deadline.allow(SKIP_LAYOUTLM, applied):
+        if ROI_EXTRACTION and device.lower() == "cpu":
+            extracted_data = roi_number_field_extraction(image_path, extraction_dict, device, deadline, applied)
+        else:
+            extracted_data = start_number_field_extraction(image_path, extraction_dict, device, deadline, applied)
     default_data.update(extracted_data)
 
-    if not check_values_not_empty(extracted_data):
+    if not check_values_not_empty(extracted_data) and profile["paddleocr_fallback"]:
         logger.print(f"{device}-model failed, initiating PaddleOCR method")
-        paddleocr_data = data_extraction_by_paddleocr(image_path)
+        paddleocr_data = roi_paddleocr_extraction(image_path, profile) if ROI_EXTRACTION else data_extraction_by_paddleocr(image_path, profile)
         default_data.update(paddleocr_data)
 
     return default_data
 
 
 
-def image_file_operation(image_path, device, is_stamp_details_required="False", page_index=1, is_image=True):
+def page_stamp_data(image_path, profile, company_id=None, match_threshold=VERIFICATION_MATCH_THRESHOLD):
+    """
+    Runs stamp detection on a page.
+
+    Parameters:
+    - image_path (str): The path to the page image.
+    - profile (dict): The pipeline profile; sets the stamp detection input size and threshold.
+    - company_id (str, optional): When set, the detected stamps are also verified against this company from the same
+      detection and embeddings (see 'analyze_stamps').
+    - match_threshold (float, optional): Cosine similarity above which a stamp matches the company. Defaults to VERIFICATION_MATCH_THRESHOLD.
+
+    Returns:
+    - dict: 'stampCount' and 'stampDetails', plus 'verification' when 'company_id' is set.
+    """
+
+    if company_id is None:
+        stamp_data, _ = initiate_stamp_detection(image_path, imgsz=profile["yolo_imgsz"], confidence=profile["stamp_confidence"])
+        return stamp_data
+    return analyze_stamps(image_path, company_id, imgsz=profile["yolo_imgsz"], confidence=profile["stamp_confidence"], match_threshold=match_threshold)
+
+
+
+def image_file_operation(image_path, device, is_stamp_details_required="False", page_index=1, is_image=True, deadline=None, profile=None, company_id=None, match_threshold=VERIFICATION_MATCH_THRESHOLD):
     """
     Performs operations on an image file, extracting information and optionally detecting stamps.
 
@@ -249,29 +695,44 @@ def image_file_operation(image_path, device, is_stamp_details_required="False",
     - is_stamp_details_required (str, optional): Whether stamp details are required. Default is "False".
     - page_index (int, optional): The index of the page for processing. Default is 1.
     - is_image (bool, optional): Whether is the  image file or pdf file, accodingly return the data. Default is True.
+    - deadline (Deadline, optional): The request deadline. Stamp detection is the first stage skipped when the budget runs low.
+    - profile (dict, optional): The pipeline profile of the requested mode; sets the extraction ladder and the stamp detection input size and threshold.
+    - company_id (str, optional): The company the stamps are also verified against (see 'page_stamp_data').
+    - match_threshold (float, optional): Cosine similarity above which a stamp matches the company. Defaults to VERIFICATION_MATCH_THRESHOLD.
 
     Returns:
     - list or dict: If 'is_image' is True, returns a list containing the updated data as a dictionary. If 'is_image' is False, returns the updated data as a dictionary.
+      Pages processed in degraded mode carry the applied degradations under 'degradations'.
+
+    Notes:
+    - The image is normalized once ('normalize_image': EXIF orientation, RGB, downscaled to IMAGE_MAX_SIDE) and every
+      stage reads the normalized image. Stamp boxes are reported in the coordinates of the original image.
 
     Exceptions:
+    - ValueError(50022): The image has more pixels than IMAGE_MAX_PIXELS.
     - Exception: Any exception that may occur during the image processing and operations.
     """
 
+    normalized = normalize_image(image_path)
     try:
         start_time = time.time() 
 
-        ids = ids_extraction(image_path, device)
+        page_degradations = []
+        profile = profile or get_profile()
+
+        ids = ids_extraction(normalized["path"], device, deadline, page_degradations, profile)
         updated_data = {'page': page_index, **ids}
 
-        if is_stamp_details_required.lower()=="true":
+        if is_stamp_details_required.lower()=="true" and (deadline is None or deadline.allow(SKIP_STAMP_DETECTION, page_degradations)):
 
-            stamp_data, _ = initiate_stamp_detection(image_path)
-            updated_data.update(stamp_data)
+            updated_data.update(to_original_stamp_data(page_stamp_data(normalized["path"], profile, company_id, match_threshold), normalized))
 
         end_time = time.time() 
         duration = end_time - start_time 
 
         updated_data.update({"duration": duration})
+        if page_degradations:
+            updated_data["degradations"] = page_degradations
 
         if is_image:
             return [updated_data]
@@ -282,51 +743,60 @@ def image_file_operation(image_path, device, is_stamp_details_required="False",
         logger.print(f"Error occurred: {str(e)}")
         return {}
 
+    finally:
+        release_normalized_image(normalized)
+
 
 
-def download_store_docs(input_file, folder_name="documents"):
+def download_store_docs(input_file, budget=None):
     """
     Downloads and stores documents from either an uploaded file or a URL.
 
     Parameters:
     - input_file: The file to be downloaded, either an uploaded file or a URL.
-    - folder_name (str, optional): The name of the folder to store the downloaded documents. Default is "documents".
+    - budget (ScratchBudget, optional): A scratch quota the document shares with others, e.g. the documents of a batch.
 
     Returns:
-    - str: The path to the downloaded PDF file.
+    - str: The path to the stored document, in a new scratch workspace of the request.
+
+    Notes:
+    - Every request gets its own workspace (see 'scratch.Workspace'), so uploads with the same file name do not
+      overwrite each other. Remove it with 'close_workspace(doc_path)', which also removes every page or image
+      derived from the document.
+    - The workspace is on SCRATCH_DIR (tmpfs by default) and the document counts against SCRATCH_QUOTA_MB while
+      it is written, so an oversized download stops early.
 
     Exceptions:
-    - ValueError: Raised if the input format is invalid. Provide either an uploaded file or a URL.
-    - Exception: Any other exception that may occur during the download and storage process.
+    - ValueError(50015): The input is neither an uploaded file nor an https URL.
+    - ValueError(50014): The URL answered 403.
+    - ValueError(50016): The download failed.
+    - ValueError(50023): The document is larger than the scratch quota, or SCRATCH_DIR is full.
     """
 
+    workspace = open_workspace(budget)
     try:
-        if not os.path.exists(folder_name):
-            os.makedirs(folder_name)
-
         if hasattr(input_file, 'read'):
-            pdf_path = os.path.join(folder_name, input_file.name)
-
-            with open(pdf_path, 'wb') as pdf_file:
-                for chunk in input_file.chunks():
-                    pdf_file.write(chunk)
+            doc_path = workspace.new_file(input_file.name)
+            store_chunks(workspace, doc_path, input_file.chunks())
 
         elif isinstance(input_file, str) and input_file.startswith(('https://')):
-            response = requests.get(input_file)
+            response = requests.get(input_file, stream=True)
             response.raise_for_status()
 
-            file_name = input_file.split('/')[-1]
-            pdf_path = os.path.join(folder_name, file_name)
-
-            with open(pdf_path, 'wb') as pdf_file:
-                pdf_file.write(response.content)
+            doc_path = workspace.new_file(input_file.split('/')[-1])
+            store_chunks(workspace, doc_path, response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE))
 
         else:
             raise ValueError(50015)
 
-        return pdf_path
-    
+        return doc_path
+
+    except ValueError:
+        workspace.close()
+        raise
+
     except requests.exceptions.HTTPError as http_err:
+        workspace.close()
         if response.status_code == 403:
             logger.print(f"Error: Cannot handle URL '{response.status_code}'")
             raise ValueError(50014)
@@ -334,6 +804,84 @@ def download_store_docs(input_file, folder_name="documents"):
             raise http_err
 
     except Exception as e:
+        workspace.close()
+        logger.print(f"Download failed: Unable to retrieve document:'{str(e)}'")
+        raise ValueError(50016)
+
+
+def store_chunks(workspace, doc_path, chunks):
+    """
+    Writes the chunks of a document to its workspace, charging each chunk to the workspace quota before it is written.
+
+    Exceptions:
+    - ValueError(50023): The document exceeds the quota, or SCRATCH_DIR is full.
+    """
+
+    try:
+        with open(doc_path, 'wb') as doc_file:
+            for chunk in chunks:
+                workspace.charge(doc_path, len(chunk))
+                doc_file.write(chunk)
+    except OSError as e:
+        if e.errno != errno.ENOSPC:
+            raise
+        logger.print(f"scratch: no space left for {doc_path}")
+        raise ValueError(50023)
+
+
+async def download_store_docs_async(input_file):
+    """
+    Async variant of 'download_store_docs' for the async views.
+
+    Parameters:
+    - input_file: The file to be downloaded, either an uploaded file or a URL.
+
+    Returns:
+    - str: The path to the stored document, in a new scratch workspace of the request.
+
+    Notes:
+    - URLs are streamed to the workspace with the shared async HTTP client, so a slow remote server only holds this
+      request, not a worker thread. Uploaded files are written on a thread.
+
+    Exceptions:
+    - ValueError(50015): The input is neither an uploaded file nor an https URL.
+    - ValueError(50014): The URL answered 403.
+    - ValueError(50016): The download failed.
+    - ValueError(50023): The document is larger than the scratch quota, or SCRATCH_DIR is full.
+    """
+
+    if hasattr(input_file, 'read'):
+        return await asyncio.to_thread(download_store_docs, input_file)
+
+    if not (isinstance(input_file, str) and input_file.startswith('https://')):
+        raise ValueError(50015)
+
+    workspace = open_workspace()
+    try:
+        doc_path = workspace.new_file(input_file.split('/')[-1])
+
+        async with get_http_client().stream("GET", input_file) as response:
+            if response.status_code == 403:
+                logger.print(f"Error: Cannot handle URL '{response.status_code}'")
+                raise ValueError(50014)
+            response.raise_for_status()
+
+            with open(doc_path, 'wb') as doc_file:
+                async for chunk in response.aiter_bytes():
+                    workspace.charge(doc_path, len(chunk))
+                    doc_file.write(chunk)
+
+        return doc_path
+
+    except ValueError:
+        workspace.close()
+        raise
+
+    except Exception as e:
+        workspace.close()
+        if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+            logger.print(f"scratch: no space left for {doc_path}")
+            raise ValueError(50023)
         logger.print(f"Download failed: Unable to retrieve document:'{str(e)}'")
         raise ValueError(50016)
 
@@ -367,33 +915,3 @@ def check_values_not_empty(data):
 
     keys_to_check = ['deliveryId', "shipmentId"]
     return all(data.get(key) for key in keys_to_check)
-
-
-def delete_path(path):
-    """
-    Deletes a file or directory specified by the given path.
-
-    Parameters:
-    - path (str): The path to the file or directory to be deleted.
-
-    Notes:
-    - If the path points to a file, the file will be removed.
-    - If the path points to a directory, the entire directory and its contents will be recursively deleted.
-    - If the specified path does not exist or is not a valid file/directory, an error message is logged.
-
-    Exceptions:
-    - OSError: If an error occurs during the deletion process, an error message with details will be logged.
-    """
-
-    try:
-        if os.path.isfile(path):
-            os.remove(path)
-        elif os.path.isdir(path):
-            shutil.rmtree(path)
-        else:
-            logger.print(f"Error: '{path}' does not exist or is not a valid file/directory.")
-    except OSError as e:
-        logger.print(f"Error: {path} : {e.strerror}")
-
-
-
@@ -0,0 +1,231 @@
+import time
+import zlib
+from types import SimpleNamespace
+import numpy as np
+from PIL import Image
+from api_channel.settings import STUB_MODEL_LATENCY_MS
+
+# default simulated inference time per call, in milliseconds (override with STUB_MODEL_LATENCY_MS)
+DEFAULT_LATENCY_MS = {
+    "paddleocr": 400,
+    "layoutlm": 250,
+    "ernie": 250,
+    "metaclip": 60,
+    "stamp_detection": 120,
+    "document_classifier": 40,
+    "tesseract": 150,
+}
+EMBEDDING_DIMENSION = 512
+DOCUMENT_CLASSES = {0: "Not Relevant", 1: "Relevant"}
+
+
+def latency(name):
+    """
+    Returns the simulated inference time of a stub model in seconds.
+    """
+
+    return STUB_MODEL_LATENCY_MS.get(name, DEFAULT_LATENCY_MS.get(name, 0)) / 1000
+
+
+def simulate(name):
+    """
+    Waits for the inference time of a stub model. Sleeping releases the GIL, as the native inference of the real models does.
+    """
+
+    seconds = latency(name)
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+def as_image(source):
+    """
+    Opens a model input (path, PIL Image or array) as a PIL Image.
+    """
+
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, np.ndarray):
+        return Image.fromarray(source.astype(np.uint8))
+    with Image.open(source) as image:
+        image.load()
+        return image
+
+
+def content_seed(source):
+    """
+    Returns a seed derived from the content of an input image, so the same input always gets the same stub output.
+    """
+
+    thumbnail = as_image(source).convert("L").resize((16, 16))
+    return zlib.crc32(thumbnail.tobytes())
+
+
+def document_ids(seed):
+    """
+    Returns the (shipment ID, delivery ID) a stub reads on an image; both pass the ID rules of 'paddleocr.py'.
+    """
+
+    return f"47{seed % 10**8:08d}", f"85{(seed // 7) % 10**8:08d}"
+
+
+def stub_word_boxes(image):
+    """
+    Stub of 'roi.ocr_word_boxes': the labelled IDs of the image, boxes normalised to 0-1000.
+    """
+
+    simulate("tesseract")
+    shipment_id, delivery_id = document_ids(content_seed(image))
+    words = ["No.", "Embarque", shipment_id, "No", "entrega", delivery_id]
+    return [(word, [i * 150, 40, i * 150 + 140, 80]) for i, word in enumerate(words)]
+
+
+class StubOCR:
+    """
+    Stub of PaddleOCR: 'ocr' returns the labelled IDs of the image as two text lines.
+    """
+
+    def ocr(self, image, **kwargs):
+        simulate("paddleocr")
+        shipment_id, delivery_id = document_ids(content_seed(image))
+        lines = [f"No. Embarque {shipment_id}", f"No entrega {delivery_id}"]
+        return [[[[[10, 40 + 40 * i], [400, 40 + 40 * i], [400, 70 + 40 * i], [10, 70 + 40 * i]], (line, 0.98)] for i, line in enumerate(lines)]]
+
+
+class StubDocumentQA:
+    """
+    Stub of the LayoutLM document question answering pipeline: answers the shipment or delivery ID of the image.
+    """
+
+    def __call__(self, image, question, word_boxes=None, **kwargs):
+        simulate("layoutlm")
+        shipment_id, delivery_id = document_ids(content_seed(image))
+        answer = shipment_id if "Embarque" in question or "Shipment" in question else delivery_id
+        words = [word for word, _ in word_boxes] if word_boxes else []
+        position = words.index(answer) if answer in words else 0
+        return [{"score": 0.95, "answer": answer, "start": position, "end": position}]
+
+
+class StubTaskflow:
+    """
+    Stub of the ERNIE-Layout Taskflow: answers the prompt of each document as 'StubDocumentQA' does.
+    """
+
+    def __call__(self, inputs, **kwargs):
+        simulate("ernie")
+        res = []
+        for item in inputs:
+            shipment_id, delivery_id = document_ids(content_seed(item["doc"]))
+            answer = shipment_id if "Embarque" in item["prompt"] or "Shipment" in item["prompt"] else delivery_id
+            res.append({"prompt": item["prompt"], "result": [{"value": answer, "prob": 0.95}]})
+        return res
+
+
+class StubInputs(dict):
+    """
+    Preprocessed MetaCLIP inputs (a dict, as the processor's BatchFeature is).
+    """
+
+    def to(self, device):
+        return self
+
+
+class StubProcessor:
+    """
+    Stub of the MetaCLIP processor: keeps the content seed of each image.
+    """
+
+    def __call__(self, images, return_tensors="pt", **kwargs):
+        images = images if isinstance(images, list) else [images]
+        return StubInputs(seeds=[content_seed(image) for image in images])
+
+
+class StubCLIP:
+    """
+    Stub of the MetaCLIP model: 'get_image_features' returns a deterministic random unit vector per image content.
+    """
+
+    def get_image_features(self, seeds, **kwargs):
+        import torch
+        simulate("metaclip")
+        vectors = np.stack([np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSION) for seed in seeds]).astype(np.float32)
+        return torch.from_numpy(vectors / np.linalg.norm(vectors, axis=1, keepdims=True))
+
+
+class StubTensor:
+    """
+    The '.data' of YOLO boxes and probs: a tensor with 'tolist' and 'cpu().numpy()'.
+    """
+
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=np.float32)
+
+    def tolist(self):
+        return self.values.tolist()
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+
+class StubResult:
+    """
+    One YOLO result, with the 'boxes', 'probs' and 'names' read by the services.
+    """
+
+    def __init__(self, boxes=None, probs=None, names=None):
+        self.boxes = SimpleNamespace(data=StubTensor(boxes if boxes else np.zeros((0, 6))))
+        self.probs = SimpleNamespace(data=StubTensor(probs)) if probs is not None else None
+        self.names = names or {0: "stamp"}
+
+
+class StubStampDetector:
+    """
+    Stub of the YOLOv8 stamp detector: zero to two stamp boxes per image, placed by its content.
+    """
+
+    def __call__(self, source, imgsz=640, verbose=False, **kwargs):
+        simulate("stamp_detection")
+        image = as_image(source)
+        seed = content_seed(image)
+        width, height = image.size
+        boxes = []
+        for i in range(seed % 3):
+            x, y = (0.1 + 0.5 * i) * width, (0.6 + 0.05 * i) * height
+            boxes.append([x, y, x + 0.25 * width, y + 0.15 * height, 0.9, 0])
+        return [StubResult(boxes=boxes)]
+
+
+class StubDocumentClassifier:
+    """
+    Stub of the YOLOv8 document classifier: every page is relevant, so every page runs the whole pipeline.
+    """
+
+    def __call__(self, source, verbose=False, **kwargs):
+        simulate("document_classifier")
+        return [StubResult(probs=[0.02, 0.98], names=DOCUMENT_CLASSES)]
+
+
+STUB_FACTORIES = {
+    "paddleocr": StubOCR,
+    "layoutlm": StubDocumentQA,
+    "ernie": StubTaskflow,
+    "metaclip": lambda: (StubProcessor(), StubCLIP()),
+    "stamp_detection": StubStampDetector,
+    "document_classifier": StubDocumentClassifier,
+}
+
+
+def stub_loader(name):
+    """
+    Returns the loader of a model's stub, registered instead of the real model when STUB_MODELS is set.
+
+    Notes:
+    - The stubs take the real models' inputs and return outputs of the same shape, derived from the input content, so
+      a document always gives the same response. Each call takes the model's STUB_MODEL_LATENCY_MS.
+    - They load instantly and need no model files or GPU, so the web, auth and pipeline layers can be
+      load tested on their own (see the 'load_test' command).
+    """
+
+    return STUB_FACTORIES[name]
@@ -1,3 +1,554 @@
-from django.test import TestCase
+import os
+import random
+import socket
+import tempfile
+import time
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import numpy as np
+from PIL import Image
+from django.http import QueryDict
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from types import SimpleNamespace
+from data_extraction.deadline import Deadline, DEGRADATION_THRESHOLDS, SKIP_STAMP_DETECTION, SKIP_LAYOUTLM, PARTIAL_PAGES
+from data_extraction.model_registry import ModelRegistry
+from data_extraction.pipeline import StagedPipeline, PipelineStage, PipelineMetrics
+from data_extraction.verification import VerificationOptions, early_exit_response
+from data_extraction.models import ExtractionResultModel, BatchJobModel
+from data_extraction.batch import store_batch_documents, expand_zip, iter_batch_extraction, release_batch_documents, fail_orphaned_jobs, current_worker, QUEUED, RUNNING, DONE, FAILED
+from data_extraction.scratch import open_workspace, scratch_stats
+from data_extraction.results_store import VERIFICATION, EXTRACTION, find_stored_results, store_results, store_stream, stored_body, stored_events
+from data_extraction.id_extraction import rank_candidates, extract_ids
+from data_extraction.management.commands.benchmark_id_extraction import legacy_ids, FILLER
+from data_extraction.stub_models import stub_loader
+from stamp_detection.crop_cache import StampCropCache
+from stamp_detection.reference_cache import CompanyReferenceCache, normalize_rows
+from api_channel.settings import REQUEST_DEADLINE, VERIFICATION_PAGE_ORDER
 
-# Create your tests here.
+
+def query_request(query=""):
+    return SimpleNamespace(GET=QueryDict(query))
+
+
+class DeadlineTests(SimpleTestCase):
+
+    def test_full_budget_keeps_configured_thresholds(self):
+        self.assertEqual(Deadline(REQUEST_DEADLINE).thresholds, DEGRADATION_THRESHOLDS)
+
+    def test_short_budget_scales_thresholds(self):
+        deadline = Deadline(REQUEST_DEADLINE / 4)
+        for degradation, threshold in DEGRADATION_THRESHOLDS.items():
+            self.assertAlmostEqual(deadline.thresholds[degradation], threshold / 4)
+
+    def test_short_budget_starts_undegraded(self):
+        deadline = Deadline(20)
+        for degradation in (SKIP_STAMP_DETECTION, SKIP_LAYOUTLM, PARTIAL_PAGES):
+            self.assertTrue(deadline.allow(degradation))
+        self.assertEqual(deadline.degradations, [])
+
+    def test_spent_budget_degrades_in_order_once(self):
+        deadline = Deadline(REQUEST_DEADLINE)
+        deadline.expires_at -= REQUEST_DEADLINE
+        applied = []
+        self.assertFalse(deadline.allow(SKIP_STAMP_DETECTION, applied))
+        self.assertFalse(deadline.allow(PARTIAL_PAGES, applied))
+        self.assertFalse(deadline.allow(SKIP_STAMP_DETECTION, applied))
+        self.assertEqual(deadline.degradations, [SKIP_STAMP_DETECTION, PARTIAL_PAGES])
+        self.assertEqual(applied, [SKIP_STAMP_DETECTION, PARTIAL_PAGES])
+
+    def test_cancel_denies_every_stage(self):
+        deadline = Deadline(REQUEST_DEADLINE)
+        deadline.cancel()
+        self.assertEqual(deadline.remaining(), 0)
+        self.assertFalse(deadline.allow(PARTIAL_PAGES))
+
+    def test_from_request(self):
+        self.assertEqual(Deadline.from_request(query_request()).budget, REQUEST_DEADLINE)
+        self.assertEqual(Deadline.from_request(query_request("deadline=5")).budget, 5)
+        self.assertEqual(Deadline.from_request(query_request(f"deadline={REQUEST_DEADLINE * 2}")).budget, REQUEST_DEADLINE)
+
+    def test_from_request_rejects_invalid_budgets(self):
+        for value in ("0", "0.5", "-3", "nan", "soon"):
+            with self.assertRaisesMessage(ValueError, "50002"):
+                Deadline.from_request(query_request(f"deadline={value}"))
+
+
+def pipeline_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith("pipeline-")]
+
+
+class StagedPipelineTests(SimpleTestCase):
+
+    def test_multi_worker_stage_keeps_input_order(self):
+        rng = random.Random(0)
+        delays = [rng.random() * 0.01 for _ in range(30)]
+
+        def slow(item):
+            time.sleep(delays[item["n"]])
+            item["slow"] = True
+
+        pipeline = StagedPipeline([PipelineStage("double", lambda item: item.update(n2=item["n"] * 2)), PipelineStage("slow", slow, workers=4)])
+        output = list(pipeline.run({"n": n} for n in range(30)))
+        self.assertEqual([item["n"] for item in output], list(range(30)))
+        self.assertTrue(all(item["slow"] and item["n2"] == item["n"] * 2 for item in output))
+        self.assertEqual(pipeline.metrics.stats()["stages"]["slow"]["processed"], 30)
+
+    def test_stage_exception_is_reraised(self):
+        def fail(item):
+            if item["n"] == 3:
+                raise ValueError(50001)
+
+        pipeline = StagedPipeline([PipelineStage("fail", fail, workers=2)])
+        with self.assertRaisesMessage(ValueError, "50001"):
+            list(pipeline.run({"n": n} for n in range(10)))
+        self.assertEqual(pipeline_threads(), [])
+
+    def test_skipped_items_pass_through_untouched(self):
+        pipeline = StagedPipeline([PipelineStage("mark", lambda item: item.update(marked=True)), PipelineStage("count", lambda item: item.update(counted=True))])
+        output = list(pipeline.run({"n": n, "skip": n % 2 == 1} for n in range(6)))
+        self.assertEqual(output, [{"n": n, "skip": True} if n % 2 else {"n": n, "skip": False, "marked": True, "counted": True} for n in range(6)])
+        self.assertEqual(pipeline.metrics.stats()["stages"]["mark"]["processed"], 3)
+
+    def test_close_stops_threads_and_resets_depth(self):
+        metrics = PipelineMetrics()
+        pipeline = StagedPipeline([PipelineStage("first", lambda item: None, workers=2), PipelineStage("second", lambda item: time.sleep(0.01))], metrics=metrics)
+        run = pipeline.run({"n": n} for n in range(1000))
+        self.assertEqual(next(run)["n"], 0)
+        run.close()
+        self.assertEqual(pipeline_threads(), [])
+        stages = metrics.stats()["stages"]
+        self.assertEqual({name: stage["depth"] for name, stage in stages.items()}, {name: 0 for name in stages})
+        self.assertLessEqual(stages["second"]["processed"], 10)
+
+
+class GuardedCLIP:
+    """
+    The MetaCLIP stub, recording calls that overlap on the same instance.
+    """
+
+    def __init__(self, barrier=None):
+        self.preprocess, self.model = stub_loader("metaclip")()
+        self.barrier = barrier
+        self.busy = False
+        self.overlaps = 0
+
+    def get_image_features(self, **inputs):
+        if self.busy:
+            self.overlaps += 1
+        self.busy = True
+        try:
+            if self.barrier is not None:
+                self.barrier.wait()
+            return self.model.get_image_features(**inputs)
+        finally:
+            self.busy = False
+
+
+def stub_registry(pool_size=1, barrier=None):
+    instances = []
+
+    def load():
+        instances.append(GuardedCLIP(barrier))
+        return instances[-1]
+
+    registry = ModelRegistry()
+    registry.register("metaclip", load, pool_size=pool_size)
+    return registry, instances
+
+
+def embed(registry, image):
+    with registry.use("metaclip") as metaclip:
+        return metaclip.get_image_features(**metaclip.preprocess(images=image))[0].numpy()
+
+
+class ModelPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.images = [Image.new("RGB", (32, 32), (i * 40, 255 - i * 40, i * 13)) for i in range(6)]
+
+    def test_concurrent_use_matches_sequential_outputs(self):
+        for pool_size in (1, 3):
+            registry, instances = stub_registry(pool_size)
+            expected = [embed(registry, image) for image in self.images]
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                outputs = list(executor.map(lambda i: (i, embed(registry, self.images[i])), [i % 6 for i in range(48)]))
+            for i, output in outputs:
+                np.testing.assert_array_equal(output, expected[i])
+            self.assertEqual(sum(instance.overlaps for instance in instances), 0)
+            self.assertLessEqual(len(instances), pool_size)
+
+    def test_pool_runs_a_copy_per_thread(self):
+        barrier = threading.Barrier(3, timeout=10)
+        registry, instances = stub_registry(1, barrier)
+        registry.get("metaclip")
+        registry.set_pool_size("metaclip", 3)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            outputs = list(executor.map(lambda image: embed(registry, image), self.images[:3]))
+        self.assertEqual(len(outputs), 3)
+        self.assertEqual(len(instances), 3)
+        self.assertEqual(registry.pool_stats()["metaclip"]["size"], 3)
+
+
+class CompanyReferenceCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.fetches = 0
+
+    def fetch(self, vectors=((3, 4), (0, 2))):
+        self.fetches += 1
+        return [list(vector) for vector in vectors]
+
+    def test_hit_fetches_once(self):
+        cache = CompanyReferenceCache()
+        first = cache.get("123", self.fetch)
+        second = cache.get("123", self.fetch)
+        self.assertIs(first, second)
+        self.assertEqual(self.fetches, 1)
+        np.testing.assert_allclose(first, [[0.6, 0.8], [0, 1]])
+        cache.get("456", self.fetch)
+        self.assertEqual(self.fetches, 2)
+
+    def test_invalidate_refetches_and_discards_in_flight_fetches(self):
+        cache = CompanyReferenceCache()
+        cache.get("123", self.fetch)
+        _, version = cache.lookup("123")
+        cache.invalidate("123")
+        self.assertIsNone(cache.lookup("123")[0])
+        cache.store("123", self.fetch(), version)
+        self.assertIsNone(cache.lookup("123")[0])
+        cache.get("123", self.fetch)
+        self.assertIsNotNone(cache.lookup("123")[0])
+
+    def test_clear_discards_in_flight_fetches(self):
+        cache = CompanyReferenceCache()
+        cache.get("123", self.fetch)
+        _, version = cache.lookup("456")
+        cache.clear()
+        self.assertIsNone(cache.lookup("123")[0])
+        cache.store("456", self.fetch(), version)
+        self.assertIsNone(cache.lookup("456")[0])
+
+    def test_shared_version_change_and_ttl_expire_entries(self):
+        shared = [("namespace", 0)]
+        cache = CompanyReferenceCache(shared_version=lambda: shared[0])
+        cache.get("123", self.fetch)
+        shared[0] = ("namespace", 1)
+        self.assertIsNone(cache.lookup("123")[0])
+        cache.get("123", self.fetch)
+        self.assertEqual(self.fetches, 2)
+        cache.ttl = 0
+        self.assertIsNone(cache.lookup("123")[0])
+
+    def test_normalize_rows(self):
+        self.assertEqual(normalize_rows(np.zeros((0, 4))).shape, (0, 4))
+        self.assertEqual(normalize_rows([]).shape[0], 0)
+        matrix = normalize_rows([[0, 0, 0], [0, 3, 4]])
+        self.assertEqual(matrix.dtype, np.float32)
+        self.assertTrue(matrix.flags["C_CONTIGUOUS"])
+        np.testing.assert_allclose(matrix, [[0, 0, 0], [0, 0.6, 0.8]])
+        np.testing.assert_allclose(normalize_rows([2, 0]), [[1, 0]])
+
+
+class StampCropCacheTests(SimpleTestCase):
+
+    key = 0x0123456789ABCDEF
+    match = {"company_id": "123", "certainty": 0.9}
+
+    def test_exact_hit(self):
+        cache = StampCropCache(max_entries=4)
+        self.assertIsNone(cache.lookup(self.key))
+        cache.store(self.key, [1, 2], self.match)
+        entry = cache.lookup(self.key)
+        np.testing.assert_array_equal(entry["embedding"], [1, 2])
+        self.assertEqual(cache.valid_match(entry), self.match)
+        self.assertIsNone(cache.lookup(self.key ^ 1))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["matchesReused"]), (1, 2, 1))
+
+    def test_near_duplicate_hit(self):
+        cache = StampCropCache(max_entries=4, tolerance=2)
+        cache.store(self.key, [1, 2], self.match)
+        self.assertEqual(cache.valid_match(cache.lookup(self.key ^ (1 << 5 | 1 << 60))), self.match)
+        self.assertIsNone(cache.lookup(self.key ^ 0b111))
+        self.assertIsNone(StampCropCache(max_entries=4).lookup(self.key ^ 1))
+        self.assertEqual(cache.stats()["nearHits"], 1)
+
+    def test_persistent_hit(self):
+        path = os.path.join(tempfile.mkdtemp(), "crops.sqlite")
+        StampCropCache(max_entries=4, path=path).store(self.key, [1, 2], self.match)
+        cache = StampCropCache(max_entries=4, path=path)
+        entry = cache.lookup(self.key)
+        np.testing.assert_array_equal(entry["embedding"], [1, 2])
+        self.assertEqual(cache.valid_match(entry), self.match)
+        self.assertEqual(cache.stats()["persistentHits"], 1)
+        StampCropCache(max_entries=4, path=path).invalidate_matches()
+        self.assertIsNone(StampCropCache(max_entries=4, path=path).lookup(self.key)["match"])
+
+    def test_lru_eviction_cleans_buckets(self):
+        cache = StampCropCache(max_entries=2, tolerance=2)
+        keys = [self.key, self.key ^ (0b111 << 40), self.key ^ (0b111 << 10)]
+        cache.store(keys[0], [0])
+        cache.store(keys[1], [1])
+        cache.lookup(keys[0])
+        cache.store(keys[2], [2])
+        self.assertEqual(set(cache._entries), {keys[0], keys[2]})
+        self.assertEqual(set().union(*cache._buckets.values()), {keys[0], keys[2]})
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertIsNone(cache.lookup(keys[1]))
+
+    def test_match_expiry(self):
+        shared = [("namespace", 0)]
+        cache = StampCropCache(max_entries=4, shared_version=lambda: shared[0])
+        cache.store(self.key, [1, 2], self.match)
+        self.assertEqual(cache.valid_match(cache.lookup(self.key)), self.match)
+        cache.match_ttl = -1
+        self.assertIsNone(cache.valid_match(cache.lookup(self.key)))
+        cache.match_ttl = 3600
+        shared[0] = ("namespace", 1)
+        self.assertIsNone(cache.valid_match(cache.lookup(self.key)))
+        version = cache.match_version()
+        cache.invalidate_matches()
+        cache.store(self.key, [1, 2], self.match, version)
+        self.assertIsNone(cache.valid_match(cache.lookup(self.key)))
+        cache.store(self.key, [1, 2], self.match)
+        self.assertEqual(cache.valid_match(cache.lookup(self.key)), self.match)
+
+
+class UnmanagedTablesTestCase(TestCase):
+    """
+    A TestCase that creates the tables of unmanaged models (see 'MySql.sql') in the test database.
+    """
+
+    models = ()
+
+    @classmethod
+    def setUpClass(cls):
+        with connection.schema_editor() as editor:
+            for model in cls.models:
+                editor.create_model(model)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as editor:
+            for model in cls.models:
+                editor.delete_model(model)
+
+
+@mock.patch("data_extraction.results_store.RESULTS_STORE", True)
+class ResultsStoreTests(UnmanagedTablesTestCase):
+
+    models = (ExtractionResultModel,)
+
+    def test_single_page_round_trip(self):
+        page = {"page": 1, "shipmentId": "4712345678", "deliveryId": "8512345678"}
+        store_results(EXTRACTION, "a" * 64, page, "default", info={"matchedPage": 1, "skippedPages": []})
+        stored = find_stored_results(EXTRACTION, "a" * 64, "default")
+        self.assertEqual(stored_body(stored), page)
+        self.assertEqual(stored["info"], {"matchedPage": 1, "skippedPages": [], "single": True})
+        store_results(EXTRACTION, "b" * 64, [page, {}, {**page, "page": 3}], "default")
+        self.assertEqual(stored_body(find_stored_results(EXTRACTION, "b" * 64, "default")), [page, {**page, "page": 3}])
+
+    def test_degraded_runs_are_never_reused(self):
+        store_results(EXTRACTION, "a" * 64, [{"page": 1}], "default", degraded=True)
+        self.assertIsNone(find_stored_results(EXTRACTION, "a" * 64, "default"))
+        store_results(EXTRACTION, "a" * 64, [{"page": 1, "deliveryId": "8512345678"}], "default")
+        store_results(EXTRACTION, "a" * 64, [{"page": 1}], "default", degraded=True)
+        self.assertEqual(find_stored_results(EXTRACTION, "a" * 64, "default")["pages"], [{"page": 1, "deliveryId": "8512345678"}])
+        self.assertIsNone(find_stored_results(EXTRACTION, "a" * 64, "stopOnFirstMatch=reverse"))
+
+    def test_company_ids_are_normalized(self):
+        store_results(VERIFICATION, "a" * 64, [{"page": 1, "comapanyMatch": True}], "default", company_id="00123")
+        self.assertEqual(ExtractionResultModel.objects.get().company_id, "123")
+        for company_id in ("123", "0123", "00123"):
+            self.assertIsNotNone(find_stored_results(VERIFICATION, "a" * 64, "default", company_id))
+        self.assertIsNone(find_stored_results(VERIFICATION, "a" * 64, "default", "1230"))
+
+    def test_incomplete_streams_are_not_stored(self):
+        def events(end):
+            yield {"event": "page", "data": {"page": 1}}
+            if end == "raise":
+                raise ValueError(50001)
+            if end == "error":
+                yield {"event": "error", "data": {"errorCode": 50001}}
+            if end == "summary":
+                yield {"event": "summary", "data": {"pages": 1, "degradations": []}}
+
+        with self.assertRaises(ValueError):
+            list(store_stream(events("raise"), EXTRACTION, "a" * 64, "default"))
+        list(store_stream(events("error"), EXTRACTION, "a" * 64, "default"))
+        stream = store_stream(events("summary"), EXTRACTION, "a" * 64, "default")
+        next(stream)
+        stream.close()
+        self.assertFalse(ExtractionResultModel.objects.exists())
+        list(store_stream(events("summary"), EXTRACTION, "a" * 64, "default"))
+        self.assertEqual(find_stored_results(EXTRACTION, "a" * 64, "default")["pages"], [{"page": 1}])
+
+
+def zip_bytes(names):
+    path = os.path.join(tempfile.mkdtemp(), "archive.zip")
+    with zipfile.ZipFile(path, "w") as archive:
+        for name in names:
+            if name.endswith("/"):
+                archive.writestr(zipfile.ZipInfo(name), b"")
+            else:
+                archive.writestr(name, b"%PDF-1.4 " + name.encode())
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def dead_pid():
+    return next(pid for pid in range(4_000_000, 4_100_000) if not os.path.exists(f"/proc/{pid}"))
+
+
+class BatchTests(SimpleTestCase):
+
+    def test_zip_skips_folders_hidden_files_and_macosx(self):
+        workspace = open_workspace()
+        zip_path = workspace.new_file("docs.zip")
+        with open(zip_path, "wb") as f:
+            f.write(zip_bytes(["a.pdf", "scans/", "scans/b.pdf", ".hidden.pdf", "scans/.DS_Store", "__MACOSX/._a.pdf"]))
+        documents = expand_zip(zip_path, "docs.zip")
+        self.assertEqual([document["fileName"] for document in documents], ["docs.zip/a.pdf", "docs.zip/scans/b.pdf"])
+        self.assertFalse(os.path.exists(zip_path))
+        for document in documents:
+            with open(document["path"], "rb") as f:
+                self.assertTrue(f.read().endswith(document["fileName"].split("/", 1)[1].encode()))
+        release_batch_documents(documents)
+
+    def test_document_limit_applies_after_expansion(self):
+        open_workspaces = scratch_stats()["openWorkspaces"]
+        with mock.patch("data_extraction.batch.BATCH_MAX_DOCUMENTS", 2):
+            documents = store_batch_documents([SimpleUploadedFile("docs.zip", zip_bytes(["a.pdf", "b.pdf"]))], [])
+            self.assertEqual(len(documents), 2)
+            release_batch_documents(documents)
+            with self.assertRaisesMessage(ValueError, "50024"):
+                store_batch_documents([SimpleUploadedFile("docs.zip", zip_bytes(["a.pdf", "b.pdf"])), SimpleUploadedFile("c.pdf", b"%PDF-1.4")], [])
+            with self.assertRaisesMessage(ValueError, "50024"):
+                store_batch_documents([SimpleUploadedFile("docs.zip", zip_bytes(["a.pdf", "b.pdf", "c.pdf"]))], [])
+        self.assertEqual(scratch_stats()["openWorkspaces"], open_workspaces)
+
+    def test_failed_download_fails_only_its_document(self):
+        documents = store_batch_documents([SimpleUploadedFile("a.pdf", b"%PDF-1.4")], ["https://127.0.0.1:1/b.pdf", "http://example.com/c.pdf"])
+        self.assertEqual([(document["document"], document["fileName"], document.get("errorCode")) for document in documents],
+                         [(1, "a.pdf", None), (2, "b.pdf", 50016), (3, "c.pdf", 50015)])
+        self.assertTrue(os.path.exists(documents[0]["path"]))
+        release_batch_documents(documents)
+
+    def test_closing_the_extraction_releases_workspaces(self):
+        documents = store_batch_documents([SimpleUploadedFile("a.pdf", b"%PDF-1.4"), SimpleUploadedFile("b.pdf", b"%PDF-1.4")], ["ftp://example.com/c.pdf"])
+        events = iter_batch_extraction(documents)
+        self.assertEqual(next(events)["data"]["errorCode"], 50015)
+        self.assertTrue(all(os.path.exists(document["path"]) for document in documents[:2]))
+        events.close()
+        self.assertFalse(any(os.path.exists(document["path"]) for document in documents[:2]))
+
+
+class OrphanedJobTests(UnmanagedTablesTestCase):
+
+    models = (BatchJobModel,)
+
+    def job(self, status, worker):
+        return BatchJobModel.objects.create(id=os.urandom(16).hex(), status=status, options="", documents=1, results=[], worker=worker).id
+
+    def test_jobs_of_dead_or_replaced_workers_fail(self):
+        host, pid, started = current_worker().rsplit(":", 2)
+        live = self.job(RUNNING, current_worker())
+        dead = self.job(RUNNING, f"{host}:{dead_pid()}:123")
+        queued = self.job(QUEUED, f"{host}:{dead_pid()}:123")
+        reused_pid = self.job(RUNNING, f"{host}:{pid}:{started}0")
+        finished = self.job(DONE, f"{host}:{dead_pid()}:123")
+        other_host = self.job(RUNNING, f"other-{socket.gethostname()}:{dead_pid()}:123")
+        self.assertEqual(fail_orphaned_jobs(), 3)
+        statuses = dict(BatchJobModel.objects.values_list("id", "status"))
+        self.assertEqual([statuses[job] for job in (live, dead, queued, reused_pid, finished, other_host)], [RUNNING, FAILED, FAILED, FAILED, DONE, RUNNING])
+
+
+def ocr_line(text, x0, y0, x1, y1):
+    return [[[x0, y0], [x1, y0], [x1, y1], [x0, y1]], (text, 0.95)]
+
+
+class IdExtractionTests(SimpleTestCase):
+
+    def test_anchored_candidate_beats_earlier_decoy(self):
+        text = "Ref 8512345678 Cliente Material Peso Total Planta Transportista\nNo. Entrega: 8598765432"
+        ranked = rank_candidates(text)
+        self.assertEqual(ranked["deliveryId"][0]["value"], "8598765432")
+        self.assertEqual(ranked["deliveryId"][0]["anchor"], "Entrega")
+        self.assertGreater(ranked["deliveryId"][0]["scores"]["anchor"], ranked["deliveryId"][1]["scores"]["anchor"])
+
+    def test_orde_vetoes_shipment_ids(self):
+        self.assertEqual(rank_candidates("Orden de compra 4712345678 entrega 8512345678")["shipmentId"], [])
+        self.assertEqual(extract_ids("Orden de compra 4712345678 entrega 8512345678"), {"shipmentId": "", "deliveryId": "8512345678"})
+        self.assertEqual(extract_ids("x" * 300 + " Orden 4712345678")["shipmentId"], "4712345678")
+
+    def test_85_preferred_over_820(self):
+        self.assertEqual(extract_ids("8201234567 8512345678")["deliveryId"], "8512345678")
+        self.assertEqual(extract_ids("Entrega 8201234567 Cliente Material Peso Total 8512345678")["deliveryId"], "8512345678")
+        self.assertEqual(extract_ids("Entrega 8201234567")["deliveryId"], "8201234567")
+
+    def test_box_distance_differs_from_text_distance(self):
+        # 8512345678 follows the label in the text but sits far right of it; 8598765432 is on the line below the label
+        lines = [
+            ocr_line("No. Entrega", 0, 0, 110, 20),
+            ocr_line("8512345678", 900, 0, 1000, 20),
+            ocr_line(" ".join(FILLER * 3), 0, 600, 1000, 620),
+            ocr_line("8598765432", 0, 25, 100, 45),
+        ]
+        self.assertEqual(extract_ids(lines)["deliveryId"], "8598765432")
+        self.assertEqual(extract_ids("\n".join(line[1][0] for line in lines))["deliveryId"], "8512345678")
+
+    def test_parity_with_legacy_rules_on_single_candidate_pages(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            words = [rng.choice(FILLER) if rng.random() < 0.8 else str(rng.randrange(10**6)) for _ in range(rng.randint(5, 60))]
+            if rng.random() < 0.8:
+                words.insert(rng.randrange(len(words) + 1), f"{'0' * rng.randint(0, 2)}47{rng.randrange(10**8):08d}")
+            if rng.random() < 0.8:
+                words.insert(rng.randrange(len(words) + 1), rng.choice([f"85{rng.randrange(10**8):08d}", f"085{rng.randrange(10**8):08d}", f"820{rng.randrange(10**7):07d}"]))
+            if rng.random() < 0.2:
+                words.insert(0, "Orden")
+            text = " ".join(words)
+            self.assertEqual(extract_ids(text), legacy_ids(text), text)
+
+
+class VerificationOptionsTests(SimpleTestCase):
+
+    def test_order(self):
+        self.assertEqual(VerificationOptions(page_order="forward").order(5), [1, 2, 3, 4, 5])
+        self.assertEqual(VerificationOptions(page_order="reverse").order(5), [5, 4, 3, 2, 1])
+        self.assertEqual(VerificationOptions(page_order="edges").order(5), [5, 1, 4, 2, 3])
+        self.assertEqual(VerificationOptions(page_order="edges").order(4), [4, 1, 3, 2])
+        for page_order in ("forward", "reverse", "edges"):
+            self.assertEqual(VerificationOptions(page_order=page_order).order(1), [1])
+            self.assertEqual(VerificationOptions(page_order=page_order).order(0), [])
+
+    def test_default_order(self):
+        self.assertEqual(VerificationOptions().page_order, "forward")
+        self.assertEqual(VerificationOptions(stop_on_first_match=True).page_order, VERIFICATION_PAGE_ORDER)
+
+    def test_key(self):
+        self.assertEqual(VerificationOptions().key, "default")
+        self.assertEqual(VerificationOptions(page_order="reverse").key, "default")
+        self.assertEqual(VerificationOptions(stop_on_first_match=True, page_order="Edges").key, "stopOnFirstMatch=edges")
+        self.assertEqual(VerificationOptions(stop_on_first_match=True, page_order="reverse", match_threshold=0.85).key, "stopOnFirstMatch=reverse;matchThreshold=0.85")
+
+    def test_from_request_rejects_invalid_options(self):
+        for query in ("pageOrder=middle", "matchThreshold=1.5", "matchThreshold=-0.1", "matchThreshold=high"):
+            with self.assertRaisesMessage(ValueError, "50027"):
+                VerificationOptions.from_request(query_request(query))
+
+    def test_stored_early_exit_keeps_headers(self):
+        options = VerificationOptions(stop_on_first_match=True, page_order="reverse")
+        self.assertIsNone(options.run_info)
+        options.record_match(4, [3, 1, 2])
+        stored = {"pages": [{"page": 4}], "info": options.run_info}
+        self.assertEqual(early_exit_response({}, stored["info"]), {"X-Matched-Page": "4", "X-Skipped-Pages": "1,2,3"})
+        self.assertEqual(early_exit_response({}, {}), {})
+        summary = list(stored_events(stored))[-1]["data"]
+        self.assertEqual((summary["matchedPage"], summary["skippedPages"]), (4, [1, 2, 3]))
@@ -0,0 +1,116 @@
+from api_channel.settings import VERIFICATION_PAGE_ORDER, VERIFICATION_MATCH_THRESHOLD
+
+EARLY_EXIT = "earlyExit"
+
+# orders in which the pages of a PDF are verified:
+# - forward: first page to last.
+# - reverse: last page to first; stamps are usually on the last page.
+# - edges: last, first, second to last, second, ... towards the middle.
+PAGE_ORDERS = ("forward", "reverse", "edges")
+
+
+class VerificationOptions:
+    """
+    Stamp verification options of one request, carried through the page loop of a PDF.
+
+    Notes:
+    - With 'stop_on_first_match' the pages are verified in 'page_order' and the loop stops at the first page whose
+      stamps match the company; the page is recorded in 'matched_page' and the pages left unverified in
+      'skipped_pages'.
+    - Without it every page is verified, in 'page_order' as well.
+    """
+
+    def __init__(self, stop_on_first_match=False, page_order=None, match_threshold=VERIFICATION_MATCH_THRESHOLD):
+        page_order = (page_order or (VERIFICATION_PAGE_ORDER if stop_on_first_match else "forward")).lower()
+        if page_order not in PAGE_ORDERS or not 0 <= match_threshold <= 1:
+            raise ValueError(50027)
+        self.stop_on_first_match = stop_on_first_match
+        self.page_order = page_order
+        self.match_threshold = match_threshold
+        self.matched_page = None
+        self.skipped_pages = []
+
+    @classmethod
+    def from_request(cls, request):
+        """
+        Creates the options of a request from its 'stopOnFirstMatch', 'pageOrder' and 'matchThreshold' query parameters.
+
+        Parameters:
+        - request: The DRF or Django request.
+
+        Returns:
+        - VerificationOptions: The options.
+
+        Raises:
+        - ValueError(50027): If the page order is unknown or the threshold is not a number between 0 and 1.
+        """
+
+        query_params = getattr(request, "query_params", request.GET)
+        try:
+            match_threshold = float(query_params.get("matchThreshold", VERIFICATION_MATCH_THRESHOLD))
+        except ValueError:
+            raise ValueError(50027)
+        return cls(stop_on_first_match=(query_params.get("stopOnFirstMatch") or "False").lower() == "true",
+                   page_order=query_params.get("pageOrder"), match_threshold=match_threshold)
+
+    @property
+    def key(self):
+        """
+        Returns the results store options of the request: 'default' unless the options change the results.
+        """
+
+        options = []
+        if self.stop_on_first_match:
+            options.append(f"stopOnFirstMatch={self.page_order}")
+        if self.match_threshold != VERIFICATION_MATCH_THRESHOLD:
+            options.append(f"matchThreshold={self.match_threshold:g}")
+        return ";".join(options) or "default"
+
+    def order(self, pages):
+        """
+        Returns the 1-based page numbers of a document of 'pages' pages, in verification order.
+        """
+
+        if self.page_order == "reverse":
+            return list(range(pages, 0, -1))
+        if self.page_order == "edges":
+            return [page for pair in zip(range(pages, 0, -1), range(1, pages + 1)) for page in pair][:pages]
+        return list(range(1, pages + 1))
+
+    def record_match(self, page, remaining):
+        """
+        Records the page that ended the verification and the pages it left unverified.
+        """
+
+        self.matched_page = page
+        self.skipped_pages = sorted(remaining)
+
+    @property
+    def run_info(self):
+        """
+        Returns the early exit of the verification as results store run details ({'matchedPage', 'skippedPages'}),
+        or None if it did not stop early.
+        """
+
+        if self.matched_page is None:
+            return None
+        return {"matchedPage": self.matched_page, "skippedPages": self.skipped_pages}
+
+
+def early_exit_response(response, info):
+    """
+    Adds the 'X-Matched-Page' and 'X-Skipped-Pages' headers of a verification that stopped at its first match.
+
+    Parameters:
+    - response: The DRF or Django response.
+    - info (dict or None): The early exit of the verification: 'VerificationOptions.run_info' after the verification,
+      or the run details of a stored run. Without 'matchedPage' no header is added.
+
+    Returns:
+    - The response.
+    """
+
+    if (info or {}).get("matchedPage") is not None:
+        response["X-Matched-Page"] = str(info["matchedPage"])
+        response["X-Skipped-Pages"] = ",".join(str(page) for page in info["skippedPages"])
+    return response
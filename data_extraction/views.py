@@ -1,11 +1,73 @@
+import os
 from data_extraction.services import download_store_docs
-from custom_lib.api_view_class import AuthAPIView
+from data_extraction.scratch import close_workspace
+from custom_lib.api_view_class import AuthAPIView, GeneralAPIView
 from rest_framework.response import Response
-from data_extraction.serializer import LoadInvoiceSerializer,ResponseFormatSerializer, AddStampSerializer, StampVerificationSerializer, StampVerificationResponseFormatSerializer, IsStampDetailsRequiredSerializer, AddStampResponseFormatSerializer
+from data_extraction.serializer import LoadInvoiceSerializer,ResponseFormatSerializer, AddStampSerializer, StampVerificationSerializer, StampVerificationResponseFormatSerializer, IsStampDetailsRequiredSerializer, AddStampResponseFormatSerializer, VerificationOptionsSerializer, ResultsQuerySerializer, ResultsResponseFormatSerializer, AnalysisSerializer, AnalysisOptionsSerializer, AnalysisResponseFormatSerializer, BatchSerializer, BatchOptionsSerializer, BatchResponseFormatSerializer, BatchJobResponseFormatSerializer
 from drf_yasg.utils import swagger_auto_schema
+from drf_yasg import openapi
 from rest_framework.parsers import MultiPartParser
 from custom_lib.helper import create_swagger_params
-from data_extraction.helper import data_extraction, add_stamp, verifying_company, iterate_document_files
+from custom_lib.renderer import get_stream_format, stream_response
+from data_extraction.helper import data_extraction, add_stamp, verifying_company, iterate_document_files, data_extraction_stream, verifying_company_stream, document_analysis, document_analysis_stream
+from data_extraction.apps import model_registry
+from data_extraction.metrics import collect_metrics
+from data_extraction.deadline import Deadline
+from data_extraction.verification import VerificationOptions, early_exit_response
+from data_extraction.profiles import get_profile
+from data_extraction.results_store import EXTRACTION, VERIFICATION, ANALYSIS, file_content_hash, find_stored_results, store_results, store_stream, stored_events, stored_body, query_results, document_name
+from data_extraction.batch import store_batch_documents, batch_extraction, batch_extraction_stream, submit_batch_job, get_batch_job
+from data_extraction.profiling import start_profile, run_profiled, profile_stream, is_admin, list_profiles, profile_file, PROFILE_FILES, PROFILE_HEADER
+from django.http import FileResponse
+from api_channel.settings import DEFAULT_PIPELINE_MODE, VERIFICATION_MATCH_THRESHOLD
+
+def degraded_response(res, deadline):
+    """
+    Builds the JSON response of a pipeline result, listing the degradations applied under the request deadline.
+
+    Parameters:
+    - res: The result data.
+    - deadline (Deadline): The request deadline.
+
+    Returns:
+    - Response: The response, with an 'X-Degradations' header when any degradation was applied.
+    """
+
+    response = Response(res, status=200)
+    if deadline.degradations:
+        response["X-Degradations"] = ",".join(deadline.degradations)
+    return response
+
+
+def profiled_response(response, profile):
+    """
+    Adds the 'X-Profile-Id' header of a profiled request, the ID its profile is listed under (see 'Profiles').
+    """
+
+    if profile is not None:
+        response["X-Profile-Id"] = profile.request_id
+    return response
+
+
+def stored_response(stored, doc_path, stream_format):
+    """
+    Builds the response of a request answered from stored results, without running the models.
+
+    Parameters:
+    - stored (dict): The stored run (see 'find_stored_results').
+    - doc_path (str): The downloaded document; its workspace is removed here.
+    - stream_format (str or None): The requested stream format.
+
+    Returns:
+    - Response or StreamingHttpResponse: The stored results, with an 'X-Reused-Result' header, and the early-exit headers
+      of a stored verification that stopped at its first match (see 'early_exit_response').
+    """
+
+    close_workspace(doc_path)
+    response = stream_response(stored_events(stored), stream_format) if stream_format else Response(stored_body(stored), status=200)
+    response["X-Reused-Result"] = "true"
+    return early_exit_response(response, stored["info"])
+
 
 class DataExtraction(AuthAPIView):
     parser_classes = (MultiPartParser,)
@@ -29,11 +91,35 @@ class DataExtraction(AuthAPIView):
         data = serializer.validated_data
         file_or_url = data.get('files') or data.get('url')
         stamp = request.query_params.get('boolStampDetection') or "False"
+        mode = (request.query_params.get('mode') or DEFAULT_PIPELINE_MODE).lower()
+        profile = get_profile(mode)
+        reuse = (request.query_params.get('reuse') or "False").lower() == "true"
+
+        stream_format = get_stream_format(request)
+        deadline = Deadline.from_request(request)
 
         doc_path = download_store_docs(file_or_url)
-        res = data_extraction(doc_path, is_stamp_details_required=stamp)
+        store = {"request_type": EXTRACTION, "content_hash": file_content_hash(doc_path), "options": f"mode={mode};stamps={stamp.lower()}",
+                 "file_name": document_name(doc_path), "user_id": getattr(request, "user_id", None)}
+
+        stored = find_stored_results(EXTRACTION, store["content_hash"], store["options"]) if reuse else None
+        if stored is not None:
+            return stored_response(stored, doc_path, stream_format)
+
+        deadline.watch_client(request)
+        request_profile = start_profile(request, EXTRACTION)
+
+        if stream_format:
+            return profiled_response(stream_response(store_stream(profile_stream(request_profile, data_extraction_stream(doc_path, is_stamp_details_required=stamp, deadline=deadline, profile=profile)), **store), stream_format), request_profile)
+
+        try:
+            res = run_profiled(request_profile, data_extraction, doc_path, is_stamp_details_required=stamp, deadline=deadline, profile=profile)
+        finally:
+            deadline.close()
+
+        store_results(pages=res, degraded=bool(deadline.degradations), **store)
         
-        return Response(res, status=200)
+        return profiled_response(degraded_response(res, deadline), request_profile)
     
 
 class AddStamp(AuthAPIView):
@@ -71,6 +157,7 @@ class VerificationStamp(AuthAPIView):
             tags=['Stamp Verification'],
             manual_parameters=[create_swagger_params('Authorization',extra={"default":'Bearer XXXX'})],
             request_body=StampVerificationSerializer,
+            query_serializer=VerificationOptionsSerializer,
             operation_id="STAMP VERIFICATION API",
             security=[],
             responses={200: StampVerificationResponseFormatSerializer, 401: 'Unauthorized', 400: 'Bad Request'}
@@ -86,11 +173,241 @@ class VerificationStamp(AuthAPIView):
         data = serializer.validated_data
         file_or_url = data.get('files') or data.get('url')
         company_id = data.get("companyId")
+        reuse = (request.query_params.get('reuse') or "False").lower() == "true"
+        stream_format = get_stream_format(request)
+        deadline = Deadline.from_request(request)
+        options = VerificationOptions.from_request(request)
+
+        doc_path = download_store_docs(file_or_url)
+        store = {"request_type": VERIFICATION, "content_hash": file_content_hash(doc_path), "options": options.key,
+                 "file_name": document_name(doc_path), "company_id": str(company_id), "user_id": getattr(request, "user_id", None)}
+
+        stored = find_stored_results(VERIFICATION, store["content_hash"], store["options"], store["company_id"]) if reuse else None
+        if stored is not None:
+            return stored_response(stored, doc_path, stream_format)
+
+        deadline.watch_client(request)
+        request_profile = start_profile(request, VERIFICATION)
+
+        if stream_format:
+            return profiled_response(stream_response(store_stream(profile_stream(request_profile, verifying_company_stream(doc_path, company_id, deadline=deadline, options=options)), **store), stream_format), request_profile)
+
+        try:
+            res = run_profiled(request_profile, verifying_company, doc_path, company_id, deadline=deadline, options=options)
+        finally:
+            deadline.close()
+
+        store_results(pages=res, degraded=bool(deadline.degradations), info=options.run_info, **store)
+
+        return profiled_response(early_exit_response(degraded_response(res, deadline), options.run_info), request_profile)
+
+
+class DocumentAnalysis(AuthAPIView):
+    parser_classes = (MultiPartParser,)
+    @swagger_auto_schema(
+            tags=['Document Analysis'],
+            manual_parameters=[create_swagger_params('Authorization',extra={"default":'Bearer XXXX'})],
+            request_body=AnalysisSerializer,
+            query_serializer=AnalysisOptionsSerializer,
+            operation_id="DOCUMENT ANALYSIS API",
+            security=[],
+            responses={200: AnalysisResponseFormatSerializer, 401: 'Unauthorized', 400: 'Bad Request'}
+        )
+
+    def post(self,request):
+
+        serializer = AnalysisSerializer(data=request.data)
+
+        if not serializer.is_valid():
+            raise ValueError(50002)
+
+        data = serializer.validated_data
+        file_or_url = data.get('files') or data.get('url')
+        company_id = data.get("companyId")
+        mode = (request.query_params.get('mode') or DEFAULT_PIPELINE_MODE).lower()
+        profile = get_profile(mode)
+        reuse = (request.query_params.get('reuse') or "False").lower() == "true"
+
+        stream_format = get_stream_format(request)
+        deadline = Deadline.from_request(request)
+        match_threshold = VerificationOptions.from_request(request).match_threshold
+        options = f"mode={mode}" if match_threshold == VERIFICATION_MATCH_THRESHOLD else f"mode={mode};matchThreshold={match_threshold:g}"
 
         doc_path = download_store_docs(file_or_url)
+        store = {"request_type": ANALYSIS, "content_hash": file_content_hash(doc_path), "options": options,
+                 "file_name": document_name(doc_path), "company_id": str(company_id), "user_id": getattr(request, "user_id", None)}
+
+        stored = find_stored_results(ANALYSIS, store["content_hash"], store["options"], store["company_id"]) if reuse else None
+        if stored is not None:
+            return stored_response(stored, doc_path, stream_format)
+
+        deadline.watch_client(request)
 
-        res = verifying_company(doc_path, company_id)
+        if stream_format:
+            return stream_response(store_stream(document_analysis_stream(doc_path, company_id, deadline=deadline, profile=profile, match_threshold=match_threshold), **store), stream_format)
+
+        try:
+            res = document_analysis(doc_path, company_id, deadline=deadline, profile=profile, match_threshold=match_threshold)
+        finally:
+            deadline.close()
+
+        store_results(pages=res, degraded=bool(deadline.degradations), **store)
+
+        return degraded_response(res, deadline)
+
+
+class BatchDataExtraction(AuthAPIView):
+    parser_classes = (MultiPartParser,)
+    @swagger_auto_schema(
+            tags=['Data Extraction'],
+            manual_parameters=[create_swagger_params('Authorization',extra={"default":'Bearer XXXX'}),
+                               create_swagger_params('files', required=False, type="file", header_type="form", extra={"description": "A PDF, image or ZIP archive; repeat the field for more files"}),
+                               create_swagger_params('urls', required=False, type="array", header_type="form", extra={"items": openapi.Items(type=openapi.TYPE_STRING), "collection_format": "multi"})],
+            query_serializer=BatchOptionsSerializer,
+            operation_id="BATCH DATA EXTRACTION API",
+            security=[],
+            responses={200: BatchResponseFormatSerializer, 202: BatchJobResponseFormatSerializer, 401: 'Unauthorized', 400: 'Bad Request'}
+        )
+
+    def post(self,request):
+
+        serializer = BatchSerializer(data=request.data)
+
+        if not serializer.is_valid():
+            raise ValueError(50002)
+
+        data = serializer.validated_data
+        stamp = request.query_params.get('boolStampDetection') or "False"
+        mode = (request.query_params.get('mode') or DEFAULT_PIPELINE_MODE).lower()
+        profile = get_profile(mode)
+        job = (request.query_params.get('job') or "False").lower() == "true"
+        reuse = (request.query_params.get('reuse') or "False").lower() == "true"
+        options = f"mode={mode};stamps={stamp.lower()}"
+        user_id = getattr(request, "user_id", None)
+
+        stream_format = get_stream_format(request)
+        deadline = Deadline.from_request(request)
+
+        documents = store_batch_documents(data.get('files') or [], data.get('urls') or [])
+
+        if job:
+            return Response(submit_batch_job(documents, is_stamp_details_required=stamp, profile=profile, options=options, user_id=user_id, reuse=reuse), status=202)
+
+        deadline.watch_client(request)
+
+        if stream_format:
+            return stream_response(batch_extraction_stream(documents, is_stamp_details_required=stamp, deadline=deadline, profile=profile, options=options, user_id=user_id, reuse=reuse), stream_format)
+
+        res = batch_extraction(documents, is_stamp_details_required=stamp, deadline=deadline, profile=profile, options=options, user_id=user_id, reuse=reuse)
+
+        return degraded_response(res, deadline)
+
+
+class BatchJob(AuthAPIView):
+    @swagger_auto_schema(
+            tags=['Data Extraction'],
+            manual_parameters=[create_swagger_params('Authorization',extra={"default":'Bearer XXXX'})],
+            operation_id="BATCH JOB API",
+            security=[],
+            responses={200: BatchJobResponseFormatSerializer, 401: 'Unauthorized', 400: 'Bad Request'}
+        )
+
+    def get(self,request,job_id):
+
+        res = get_batch_job(job_id, getattr(request, "user_id", None))
 
         return Response(res, status=200)
 
 
+class ExtractionResults(AuthAPIView):
+    @swagger_auto_schema(
+            tags=['Results'],
+            manual_parameters=[create_swagger_params('Authorization',extra={"default":'Bearer XXXX'})],
+            query_serializer=ResultsQuerySerializer,
+            operation_id="EXTRACTION RESULTS API",
+            security=[],
+            responses={200: ResultsResponseFormatSerializer, 401: 'Unauthorized', 400: 'Bad Request'}
+        )
+
+    def get(self,request):
+
+        serializer = ResultsQuerySerializer(data=request.query_params)
+
+        if not serializer.is_valid():
+            raise ValueError(50002)
+
+        data = serializer.validated_data
+        columns = {"shipmentId": "shipment_id", "deliveryId": "delivery_id", "contentHash": "content_hash", "companyId": "company_id", "requestType": "request_type"}
+        filters = {column: data[key] for key, column in columns.items() if data.get(key)}
+        if not is_admin(request):
+            filters["user_id"] = request.user_id
+
+        res = query_results(filters, page=data["page"], page_size=data["pageSize"])
+
+        return Response(res, status=200)
+
+
+class ModelReadiness(GeneralAPIView):
+    @swagger_auto_schema(
+            tags=['Health'],
+            operation_id="MODEL READINESS API",
+            security=[],
+            responses={200: 'All required models are loaded', 503: 'Models are still loading'}
+        )
+
+    def get(self,request):
+
+        res = {"ready": model_registry.is_ready(), "models": model_registry.status()}
+
+        return Response(res, status=200 if res["ready"] else 503)
+
+
+class Metrics(GeneralAPIView):
+    @swagger_auto_schema(
+            tags=['Health'],
+            operation_id="METRICS API",
+            security=[],
+            responses={200: 'Metrics of this worker process'}
+        )
+
+    def get(self,request):
+
+        return Response(collect_metrics(), status=200)
+
+
+class Profiles(GeneralAPIView):
+    @swagger_auto_schema(
+            tags=['Health'],
+            manual_parameters=[create_swagger_params(PROFILE_HEADER)],
+            operation_id="PROFILES API",
+            security=[],
+            responses={200: 'The saved request profiles, newest first', 401: 'Unauthorized'}
+        )
+
+    def get(self,request):
+
+        if not is_admin(request):
+            raise ValueError(50020)
+
+        return Response(list_profiles(), status=200)
+
+
+class ProfileDownload(GeneralAPIView):
+    @swagger_auto_schema(
+            tags=['Health'],
+            manual_parameters=[create_swagger_params(PROFILE_HEADER), create_swagger_params('fileFormat', required=False, header_type="query", extra={"enum": list(PROFILE_FILES), "default": "speedscope"})],
+            operation_id="PROFILE DOWNLOAD API",
+            security=[],
+            responses={200: 'The profile file', 401: 'Unauthorized', 400: 'Bad Request'}
+        )
+
+    def get(self,request,request_id):
+
+        if not is_admin(request):
+            raise ValueError(50020)
+
+        path = profile_file(request_id, request.query_params.get('fileFormat') or "speedscope")
+        if path is None:
+            raise ValueError(50021)
+
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=f"{request_id}-{os.path.basename(path)}")
@@ -0,0 +1,27 @@
+"""
+Gunicorn configuration, read automatically from the working directory.
+
+With MODEL_PRELOAD=True the application (and the fork-safe models) is loaded once in the master and
+shared copy-on-write by the workers; see README "Preload Mode". Every worker sizes its thread pools
+to its share of CPU_CORE_BUDGET; see README "CPU Core Budget".
+"""
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+preload_app = os.environ.get('MODEL_PRELOAD', 'False').lower() == 'true'
+
+
+def pre_fork(server, worker):
+    # the CPU budget slot of the new worker: the lowest one no live worker holds, so a restarted worker takes over
+    # the cores of the worker it replaces ('worker.age' keeps counting up across restarts)
+    used = {getattr(live, "slot", None) for live in server.WORKERS.values()}
+    worker.slot = next(slot for slot in range(len(used) + 1) if slot not in used)
+
+
+def post_fork(server, worker):
+    from data_extraction.cpu_budget import apply_cpu_budget
+    apply_cpu_budget(worker_index=worker.slot, workers=server.cfg.workers)
+    if preload_app:
+        from data_extraction.apps import after_fork
+        after_fork()
@@ -0,0 +1,59 @@
+import asyncio
+from data_extraction.async_runtime import get_http_client
+
+
+class AsyncIndex:
+    """
+    Async client of the Pinecone index data plane (query and upsert) for the async views.
+
+    Notes:
+    - Requests go through the worker's shared async HTTP client, so waiting on the index never holds a thread.
+    - The index host and dimension are read once with the control-plane client ('pinecone.describe_index').
+    """
+
+    def __init__(self, pinecone, index_name, api_key):
+        self.pinecone = pinecone
+        self.index_name = index_name
+        self.api_key = api_key
+        self._description = None
+
+    async def describe(self):
+        """
+        Returns the (host, dimension) of the index.
+        """
+
+        if self._description is None:
+            description = await asyncio.to_thread(self.pinecone.describe_index, self.index_name)
+            host = description.host if description.host.startswith("https://") else f"https://{description.host}"
+            self._description = (host, description.dimension)
+        return self._description
+
+    async def _post(self, path, payload):
+        host, _ = await self.describe()
+        response = await get_http_client().post(f"{host}{path}", json=payload, headers={"Api-Key": self.api_key})
+        response.raise_for_status()
+        return response.json()
+
+    async def query(self, vector, top_k, namespace, filter=None, include_values=False, include_metadata=False):
+        """
+        Queries the index; the arguments and result are those of 'Index.query'.
+
+        Returns:
+        - dict: The response, with its 'matches'.
+        """
+
+        payload = {"vector": list(vector), "topK": top_k, "namespace": namespace, "includeValues": include_values, "includeMetadata": include_metadata}
+        if filter:
+            payload["filter"] = filter
+        return await self._post("/query", payload)
+
+    async def upsert(self, vectors, namespace):
+        """
+        Upserts (id, values, metadata) vectors into a namespace.
+
+        Returns:
+        - int: The number of vectors upserted.
+        """
+
+        payload = {"vectors": [{"id": vector_id, "values": list(values), "metadata": metadata} for vector_id, values, metadata in vectors], "namespace": namespace}
+        return (await self._post("/vectors/upsert", payload)).get("upsertedCount", 0)
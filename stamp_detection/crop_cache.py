@@ -0,0 +1,272 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from custom_lib.image_hash import phash, hamming_distance
+from custom_lib.logger import BaseLog
+logger = BaseLog()
+
+
+def crop_hash(crop):
+    """
+    Returns the cache key of a stamp crop: the 64-bit perceptual hash of the normalised crop.
+
+    Parameters:
+    - crop (PIL Image): The cropped stamp.
+
+    Returns:
+    - int: The unsigned 64-bit hash.
+    """
+
+    return phash(crop)
+
+
+def hash_chunks(key, parts):
+    """
+    Splits a 64-bit hash into 'parts' bit ranges of near-equal width.
+
+    Returns:
+    - list: (range index, bits of the range) pairs. Two hashes within parts - 1 bits of each other agree on at
+      least one range (pigeonhole), so the ranges index near duplicates.
+    """
+
+    chunks, start = [], 0
+    for index in range(parts):
+        width = 64 // parts + (index < 64 % parts)
+        chunks.append((index, (key >> start) & ((1 << width) - 1)))
+        start += width
+    return chunks
+
+
+def to_signed(key):
+    # sqlite integers are signed 64-bit
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+class StampCropCache:
+    """
+    Cache of MetaCLIP embeddings and index matches of stamp crops, keyed by the perceptual hash of the crop.
+
+    Notes:
+    - The same company stamp appears on many documents and on every page of a PDF; a hit skips the MetaCLIP
+      forward pass and, while the cached match is fresh, the index query.
+    - With 'tolerance' set, lookups accept near duplicates: a crop whose hash is within 'tolerance' bits of a cached
+      hash reuses that entry, embedding and match included. Off by default: stamps of different companies with a
+      similar layout can be that close and would get each other's company. Near duplicates are found through
+      'tolerance' + 1 bucket maps of hash bit ranges (see 'hash_chunks'), not by scanning every entry.
+    - The in-memory tier is an LRU of 'max_entries' crops. With 'path' set, entries are also written to a sqlite
+      file shared by all workers (exact-hash lookups only), which survives restarts.
+    - Cached matches are tagged with the match version they were made at (see 'match_version') and expire after
+      'match_ttl' seconds. 'invalidate_matches' (called after AddStamp, since a new reference stamp can change the
+      best match) bumps the version of this process; 'shared_version' is a callable returning a version shared by
+      every worker process (see 'NamespacePointer.version'), so a stamp added through one worker also drops the
+      matches the others cached. Embeddings only go stale when the embedding model changes, which comes with a
+      re-index into a new namespace: 'clear' then drops every entry.
+    """
+
+    def __init__(self, max_entries=2048, tolerance=0, match_ttl=3600, path="", max_persistent_entries=100000, shared_version=None):
+        self.max_entries = max_entries
+        self.tolerance = min(max(tolerance, 0), 63)
+        self.match_ttl = match_ttl
+        self.shared_version = shared_version
+        self.path = path
+        self.max_persistent_entries = max_persistent_entries
+        self._entries = OrderedDict()
+        # (range index, range bits) -> cached hashes with those bits
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._generation = 0
+        self._writes = 0
+        self._counters = {"lookups": 0, "hits": 0, "nearHits": 0, "persistentHits": 0, "misses": 0, "embeddingsReused": 0, "matchesReused": 0, "evictions": 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 or bool(self.path)
+
+    def lookup(self, key):
+        """
+        Finds the cache entry of a crop hash.
+
+        Parameters:
+        - key (int): The crop hash (see 'crop_hash').
+
+        Returns:
+        - dict or None: The entry with 'embedding' (np.ndarray), 'match', 'matched_at' and 'version', or None on a miss.
+        """
+
+        with self._lock:
+            self._counters["lookups"] += 1
+            entry = self._entries.get(key)
+            counter = "hits"
+            if entry is None and self.tolerance:
+                candidates = set().union(*(self._buckets.get(chunk, ()) for chunk in hash_chunks(key, self.tolerance + 1)))
+                nearest = min(candidates, key=lambda cached: hamming_distance(cached, key), default=None)
+                if nearest is not None and hamming_distance(nearest, key) <= self.tolerance:
+                    entry, key, counter = self._entries[nearest], nearest, "nearHits"
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counters[counter] += 1
+                self._counters["embeddingsReused"] += 1
+                return entry
+
+        entry = self._read_persistent(key)
+        with self._lock:
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["persistentHits"] += 1
+            self._counters["embeddingsReused"] += 1
+            self._put(key, entry)
+        return entry
+
+    def valid_match(self, entry):
+        """
+        Returns the cached index match of an entry if it is still fresh.
+
+        Parameters:
+        - entry (dict or None): An entry returned by 'lookup'.
+
+        Returns:
+        - dict or None: The cached match ({} when the index had no match), or None if there is none or it expired.
+        """
+
+        if not entry or entry["match"] is None:
+            return None
+        if entry["version"] != self.match_version() or time.time() - entry["matched_at"] > self.match_ttl:
+            return None
+        with self._lock:
+            self._counters["matchesReused"] += 1
+        return entry["match"]
+
+    def match_version(self):
+        """
+        Returns the current match version: the shared version and the invalidations of this process.
+        """
+
+        shared_version = self.shared_version() if self.shared_version else None
+        with self._lock:
+            return shared_version, self._generation
+
+    def store(self, key, embedding, match=None, version=None):
+        """
+        Stores the embedding of a crop and, optionally, its index match.
+
+        Parameters:
+        - key (int): The crop hash.
+        - embedding (list or np.ndarray): The MetaCLIP embedding of the crop.
+        - match (dict, optional): The top index match of the embedding. A cached match is kept when omitted.
+        - version (tuple, optional): The match version read before the index was queried, so a match made before an
+          invalidation is never reused. Defaults to the current version.
+        """
+
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        version = version or self.match_version()
+        with self._lock:
+            entry = self._entries.get(key) or {"embedding": embedding, "match": None, "matched_at": 0, "version": None}
+            entry["embedding"] = embedding
+            if match is not None:
+                entry["match"], entry["matched_at"], entry["version"] = match, time.time(), version
+            self._put(key, entry)
+        self._write_persistent(key, entry)
+
+    def invalidate_matches(self):
+        """
+        Drops every cached index match so the next lookups query the index again.
+        """
+
+        with self._lock:
+            self._generation += 1
+        self._execute("UPDATE stamp_crops SET match = NULL, matched_at = NULL")
+
+    def clear(self):
+        """
+        Drops every cached embedding and match, in memory and in the persistent tier.
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._generation += 1
+        self._execute("DELETE FROM stamp_crops")
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+        - dict: Lookup, hit and miss counts, 'embeddingsReused' (MetaCLIP passes saved), 'matchesReused'
+          (index queries saved), 'hitRate' and the current in-memory 'size'.
+        """
+
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+        hits = stats["hits"] + stats["nearHits"] + stats["persistentHits"]
+        stats["hitRate"] = round(hits / stats["lookups"], 4) if stats["lookups"] else 0.0
+        stats["persistent"] = bool(self.path)
+        return stats
+
+    def _put(self, key, entry):
+        if self.max_entries <= 0:
+            return
+        if key not in self._entries and self.tolerance:
+            for chunk in hash_chunks(key, self.tolerance + 1):
+                self._buckets.setdefault(chunk, set()).add(key)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+            if self.tolerance:
+                for chunk in hash_chunks(evicted, self.tolerance + 1):
+                    bucket = self._buckets[chunk]
+                    bucket.discard(evicted)
+                    if not bucket:
+                        del self._buckets[chunk]
+
+    def _connection(self):
+        if not self.path:
+            return None
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS stamp_crops (hash INTEGER PRIMARY KEY, embedding BLOB NOT NULL, match TEXT, matched_at REAL, updated_at REAL NOT NULL)")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def _execute(self, sql, params=()):
+        try:
+            connection = self._connection()
+            if connection is None:
+                return []
+            return connection.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            logger.print(f"stamp crop cache: persistent tier error: {str(e)}")
+            return []
+
+    def _read_persistent(self, key):
+        rows = self._execute("SELECT embedding, match, matched_at FROM stamp_crops WHERE hash = ?", (to_signed(key),))
+        if not rows:
+            return None
+        embedding, match, matched_at = rows[0]
+        # 'invalidate_matches' clears the stored matches of every worker, so a stored match is current
+        return {"embedding": np.frombuffer(embedding, dtype=np.float32).copy(), "match": json.loads(match) if match is not None else None,
+                "matched_at": matched_at or 0, "version": self.match_version() if match is not None else None}
+
+    def _write_persistent(self, key, entry):
+        if not self.path:
+            return
+        match = json.dumps(entry["match"]) if entry["match"] is not None else None
+        self._execute(
+            "INSERT OR REPLACE INTO stamp_crops (hash, embedding, match, matched_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (to_signed(key), entry["embedding"].tobytes(), match, entry["matched_at"] or None, time.time()),
+        )
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self._execute("DELETE FROM stamp_crops WHERE hash NOT IN (SELECT hash FROM stamp_crops ORDER BY updated_at DESC LIMIT ?)", (self.max_persistent_entries,))
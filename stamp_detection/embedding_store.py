@@ -0,0 +1,283 @@
+import json
+import os
+import threading
+import numpy as np
+from stamp_detection.reference_cache import normalize_rows
+
+STORE_DTYPES = ("float32", "float16", "int8")
+# rows scored per block, so casting the compact codes to float32 never needs a copy of the whole catalogue
+SCORE_BLOCK = 16384
+# stamps added after the store was built (AddStamp), one JSON line each; kept when the store is rebuilt
+ADDED_FILE = "added.jsonl"
+
+
+def quantize(vectors, dtype):
+    """
+    Encodes unit-length vectors in a compact dtype.
+
+    Parameters:
+    - vectors (np.ndarray): A (n, dim) float32 matrix of L2-normalised vectors.
+    - dtype (str): 'float32', 'float16' or 'int8'.
+
+    Returns:
+    - tuple: (codes, scales). For int8 each row is scaled symmetrically to [-127, 127] and 'scales' holds the
+      float32 factor that maps a code row back to the vector; for the float dtypes 'scales' is None.
+    """
+
+    if dtype not in STORE_DTYPES:
+        raise ValueError(f"Unknown catalogue dtype {dtype}")
+    if dtype != "int8":
+        return np.ascontiguousarray(vectors, dtype=dtype), None
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def approximate_scores(codes, scales, query):
+    """
+    Scores a query against quantized vectors, block by block.
+
+    Parameters:
+    - codes (np.ndarray): The (n, dim) codes.
+    - scales (np.ndarray or None): The int8 row scales.
+    - query (np.ndarray): A unit-length float32 query vector.
+
+    Returns:
+    - np.ndarray: The (n,) approximate cosine similarities.
+    """
+
+    scores = np.empty(codes.shape[0], dtype=np.float32)
+    for start in range(0, codes.shape[0], SCORE_BLOCK):
+        scores[start:start + SCORE_BLOCK] = codes[start:start + SCORE_BLOCK].astype(np.float32) @ query
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+class EmbeddingStore:
+    """
+    Local stamp catalogue with compact in-memory vectors and exact re-ranking.
+
+    Notes:
+    - Vectors are L2-normalised, so a dot product is the cosine score the index reports. Their original norms are
+      kept in 'norms'.
+    - The codes (float16 or int8 with per-row scales) are one contiguous array in memory: 2 or 1 byte per dimension
+      instead of 4 for float32 and about 32 for a Python list of floats.
+    - The full-precision vectors stay on disk ('vectors.f32') and are memory-mapped: 'search' scores every vector
+      with the codes, then re-scores only the best 'rerank' candidates exactly, so the returned scores equal float32 scores.
+    - A store directory holds 'vectors.f32', 'codes.npy', 'scales.npy' (int8 only), 'norms.npy' and 'meta.json'
+      with the vector IDs, company IDs, dtype and the index namespace the store stands in for.
+    - Vectors added with 'add' are appended to 'added.jsonl' and kept at full precision in 'added'; their rows follow
+      the built rows and are always scored exactly.
+    - Company IDs are zero-stripped, like the company IDs lookups are made with.
+    """
+
+    def __init__(self, path, ids, company_ids, codes, scales, norms, full, dtype, namespace=None):
+        self.path = path
+        self.ids = np.asarray(ids, dtype=str)
+        self.company_ids = np.asarray([str(company_id).lstrip('0') for company_id in company_ids], dtype=str)
+        self.codes = codes
+        self.scales = scales
+        self.norms = norms
+        self.full = full
+        self.dtype = dtype
+        self.namespace = namespace
+        self.added = np.zeros((0, full.shape[1]), dtype=np.float32)
+        self._lock = threading.Lock()
+        self._company_rows = {}
+        for row, company_id in enumerate(self.company_ids):
+            self._company_rows.setdefault(company_id, []).append(row)
+        self._company_rows = {company_id: np.asarray(rows, dtype=np.int64) for company_id, rows in self._company_rows.items()}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, path, ids, company_ids, vectors, dtype="int8", namespace=None):
+        """
+        Writes a store directory and loads it.
+
+        Parameters:
+        - path (str): The store directory. The files of an existing store are replaced by rename, so workers
+          that mapped the previous vectors keep reading them until they reload.
+        - ids (list): The vector IDs (as in the index).
+        - company_ids (list): The company ID of each vector.
+        - vectors (np.ndarray): The (n, dim) embeddings.
+        - dtype (str, optional): The in-memory dtype, 'float32', 'float16' or 'int8'. Default is 'int8'.
+        - namespace (str, optional): The index namespace the store stands in for.
+
+        Returns:
+        - EmbeddingStore: The loaded store.
+        """
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1).astype(np.float32)
+        full = normalize_rows(vectors)
+        codes, scales = quantize(full, dtype)
+
+        os.makedirs(path, exist_ok=True)
+        files = {"vectors.f32": full.tobytes(), "codes.npy": codes, "norms.npy": norms, "scales.npy": scales}
+        for name, data in files.items():
+            target = os.path.join(path, name)
+            if data is None:
+                if os.path.exists(target):
+                    os.remove(target)
+                continue
+            with open(f"{target}.tmp", "wb") as f:
+                if isinstance(data, bytes):
+                    f.write(data)
+                else:
+                    np.save(f, data)
+            os.replace(f"{target}.tmp", target)
+        with open(os.path.join(path, "meta.json.tmp"), "w") as f:
+            json.dump({"dtype": dtype, "dim": int(full.shape[1]), "namespace": namespace, "ids": list(ids), "companyIds": [str(company_id) for company_id in company_ids]}, f)
+        os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a store directory; the full-precision vectors are memory-mapped, not read. Torn lines of 'added.jsonl'
+        (from a worker killed while writing) are skipped.
+        """
+
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        count = len(meta["ids"])
+        full = np.memmap(os.path.join(path, "vectors.f32"), dtype=np.float32, mode="r", shape=(count, meta["dim"])) if count else np.zeros((0, meta["dim"]), dtype=np.float32)
+        scales_path = os.path.join(path, "scales.npy")
+        store = cls(
+            path,
+            meta["ids"],
+            meta["companyIds"],
+            np.load(os.path.join(path, "codes.npy")),
+            np.load(scales_path) if os.path.exists(scales_path) else None,
+            np.load(os.path.join(path, "norms.npy")),
+            full,
+            meta["dtype"],
+            meta.get("namespace"),
+        )
+
+        added = []
+        try:
+            with open(os.path.join(path, ADDED_FILE)) as f:
+                for line in f:
+                    try:
+                        added.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        if added:
+            store._append([entry["id"] for entry in added], [entry["companyId"] for entry in added], [entry["vector"] for entry in added])
+        return store
+
+    def add(self, vector_id, company_id, vector):
+        """
+        Adds a stamp to the store and records it in 'added.jsonl', so the stores loaded after it include the stamp.
+
+        Parameters:
+        - vector_id (str): The vector ID (as in the index).
+        - company_id (str): The company ID of the stamp.
+        - vector (list or np.ndarray): The embedding.
+
+        Raises:
+        - OSError: If 'added.jsonl' cannot be written; the stamp is not added.
+        """
+
+        with self._lock:
+            line = json.dumps({"id": str(vector_id), "companyId": str(company_id), "vector": np.asarray(vector, dtype=np.float32).tolist()}) + "\n"
+            with open(os.path.join(self.path, ADDED_FILE), "ab+") as f:
+                # start on a new line after a torn one
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = "\n" + line
+                f.write(line.encode())
+            self._append([vector_id], [company_id], [vector])
+
+    def _append(self, ids, company_ids, vectors):
+        first = len(self.ids)
+        company_ids = [str(company_id).lstrip('0') for company_id in company_ids]
+        # IDs first: a concurrent search only returns rows that are in 'added'
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=str)])
+        self.company_ids = np.concatenate([self.company_ids, np.asarray(company_ids, dtype=str)])
+        self.added = np.concatenate([self.added, normalize_rows(vectors)])
+        for row, company_id in enumerate(company_ids, start=first):
+            self._company_rows[company_id] = np.append(self._company_rows.get(company_id, np.zeros(0, dtype=np.int64)), row)
+
+    def _vectors(self, rows):
+        """
+        Returns the full-precision vectors of rows listed built rows first, as a (n, dim) float32 matrix.
+        """
+
+        built = self.codes.shape[0]
+        vectors = np.asarray(self.full[rows[rows < built]], dtype=np.float32)
+        if rows.shape[0] > vectors.shape[0]:
+            vectors = np.concatenate([vectors, self.added[rows[rows >= built] - built]])
+        return vectors
+
+    def has_company(self, company_id):
+        """
+        Returns True if the store holds stamps of a (zero-stripped) company ID.
+        """
+
+        return str(company_id) in self._company_rows
+
+    def search(self, query, top_k=1, rerank=32, company_id=None):
+        """
+        Finds the stored vectors most similar to a query.
+
+        Parameters:
+        - query (np.ndarray): The query embedding.
+        - top_k (int, optional): Number of results. Default is 1.
+        - rerank (int, optional): Candidates re-scored at full precision (at least 'top_k'). Default is 32.
+        - company_id (str, optional): Only search the vectors of this company.
+
+        Returns:
+        - list: (row, exact cosine score) pairs, best first.
+        """
+
+        query = normalize_rows(query)[0]
+        built = self.codes.shape[0]
+        added = np.arange(built, built + self.added.shape[0])
+        rows = self._company_rows.get(str(company_id), np.zeros(0, dtype=np.int64)) if company_id is not None else None
+        if rows is not None:
+            rows, added = rows[rows < built], rows[rows >= built]
+        codes = self.codes if rows is None else self.codes[rows]
+        scales = self.scales if rows is None or self.scales is None else self.scales[rows]
+
+        candidates = np.zeros(0, dtype=np.int64)
+        if codes.shape[0]:
+            scores = approximate_scores(codes, scales, query)
+            depth = min(max(rerank, top_k), scores.shape[0])
+            candidates = np.argpartition(-scores, depth - 1)[:depth]
+            if rows is not None:
+                candidates = rows[candidates]
+            # read the memory-mapped rows in file order
+            candidates = np.sort(candidates)
+        candidates = np.concatenate([candidates, added])
+        if candidates.shape[0] == 0:
+            return []
+
+        exact = self._vectors(candidates) @ query
+        order = np.argsort(-exact)[:top_k]
+        return [(int(candidates[i]), float(exact[i])) for i in order]
+
+    def company_vectors(self, company_id):
+        """
+        Returns the full-precision vectors of one company as a (n, dim) float32 matrix.
+        """
+
+        rows = self._company_rows.get(str(company_id))
+        if rows is None:
+            return np.zeros((0, self.full.shape[1]), dtype=np.float32)
+        return self._vectors(rows)
+
+    def memory_bytes(self):
+        """
+        Returns the bytes held in memory by the vectors (codes, scales, norms and added vectors; the memory-mapped vectors are not counted).
+        """
+
+        return self.codes.nbytes + self.norms.nbytes + self.added.nbytes + (self.scales.nbytes if self.scales is not None else 0)
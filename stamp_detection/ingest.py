@@ -0,0 +1,242 @@
+import csv
+import hashlib
+import json
+import os
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from stamp_detection.reference_cache import normalize_rows
+from stamp_detection.pinecone import generate_embeddings
+from custom_lib.logger import BaseLog
+logger = BaseLog()
+
+IMAGE_EXTENSIONS = ('.jpeg', '.jpg', '.png', '.gif', '.bmp', '.webp')
+
+
+def read_catalogue(source):
+    """
+    Lists the stamp images of a catalogue.
+
+    Parameters:
+    - source (str): Either a directory with one sub-directory per company ID holding that company's stamp images,
+      or a CSV manifest with 'path' and 'company_id' columns (relative paths are resolved against the manifest's directory).
+
+    Returns:
+    - list: (image path, company ID) pairs, in a stable order so runs can be resumed. Company IDs are stripped of
+      leading zeros, as stamp lookups strip them.
+    """
+
+    items = []
+    if os.path.isdir(source):
+        for company_dir_name in sorted(os.listdir(source)):
+            company_dir = os.path.join(source, company_dir_name)
+            if not os.path.isdir(company_dir):
+                continue
+            for name in sorted(os.listdir(company_dir)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    items.append((os.path.join(company_dir, name), company_dir_name.lstrip('0')))
+        return items
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, newline="") as f:
+        for row in csv.DictReader(f):
+            path, company_id = (row.get("path") or "").strip(), (row.get("company_id") or "").strip()
+            if path and company_id:
+                items.append((path if os.path.isabs(path) else os.path.join(base_dir, path), company_id.lstrip('0')))
+    return items
+
+
+def stamp_vector_id(path, company_id):
+    """
+    Returns the index ID of a catalogue stamp.
+
+    Parameters:
+    - path (str): The stamp image.
+    - company_id (str): The company of the stamp.
+
+    Returns:
+    - str: A UUID derived from the company ID and the image content, so ingesting the same image again overwrites
+      its vector instead of adding a copy.
+    """
+
+    with open(path, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    return str(uuid.uuid3(uuid.NAMESPACE_DNS, f"{company_id}/{digest}"))
+
+
+def load_stamp(path):
+    """
+    Opens a stamp image as RGB, the format stamp crops are embedded in at query time.
+    """
+
+    with Image.open(path) as image:
+        return image.convert("RGB")
+
+
+def embed_batch(batch):
+    """
+    Loads and embeds one batch of catalogue stamps in a single MetaCLIP forward pass.
+
+    Parameters:
+    - batch (list): (image path, company ID) pairs.
+
+    Returns:
+    - tuple: (the pairs that could be read, their embeddings as a (n, dim) matrix, the pairs that could not be read).
+    """
+
+    loaded, images, failed = [], [], []
+    for path, company_id in batch:
+        try:
+            images.append(load_stamp(path))
+            loaded.append((path, company_id))
+        except OSError:
+            failed.append((path, company_id))
+    return loaded, generate_embeddings(images) if images else [], failed
+
+
+def embed_catalogue(items, batch_size=32, workers=2):
+    """
+    Embeds catalogue stamps in batches on a pool of threads.
+
+    Parameters:
+    - items (list): (image path, company ID) pairs.
+    - batch_size (int, optional): Images per forward pass. Default is 32.
+    - workers (int, optional): Batches embedded concurrently. Default is 2.
+
+    Yields:
+    - tuple: The result of 'embed_batch' for each batch, in catalogue order. At most two batches per worker are
+      in flight, so memory stays bounded however large the catalogue is.
+    """
+
+    batch_size = max(batch_size, 1)
+    batches = (items[i:i + batch_size] for i in range(0, len(items), batch_size))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = deque(executor.submit(embed_batch, batch) for _, batch in zip(range(workers * 2), batches))
+        while futures:
+            result = futures.popleft().result()
+            batch = next(batches, None)
+            if batch is not None:
+                futures.append(executor.submit(embed_batch, batch))
+            yield result
+
+
+class CompanyDeduplicator:
+    """
+    Drops stamp vectors that are near-identical to a vector already kept for the same company.
+
+    Notes:
+    - Two vectors are duplicates when their cosine similarity is at least 'threshold'. Extra copies of the same
+      stamp add nothing to verification and only slow down the company's reference fetch.
+    - 'seed' loads the vectors a company already has in the target namespace (incremental or resumed runs).
+    """
+
+    def __init__(self, threshold=0.98):
+        self.threshold = threshold
+        self._kept = {}
+
+    def seeded(self, company_id):
+        return company_id in self._kept
+
+    def seed(self, company_id, vectors):
+        self._kept[company_id] = normalize_rows(np.asarray(vectors, dtype=np.float32)) if len(vectors) else None
+
+    def keep(self, company_id, embedding):
+        """
+        Returns whether a vector is new for its company, recording it if so.
+        """
+
+        vector = normalize_rows(embedding)
+        kept = self._kept.get(company_id)
+        if kept is not None and float((kept @ vector[0]).max()) >= self.threshold:
+            return False
+        self._kept[company_id] = vector if kept is None else np.vstack([kept, vector])
+        return True
+
+
+class IngestState:
+    """
+    Progress of an ingest run, recorded after every upserted batch so an interrupted run resumes where it stopped.
+
+    Notes:
+    - Records the target namespace, the catalogue paths already processed and the IDs of the vectors upserted.
+    - Each batch is appended to a journal next to the state file ('<path>.journal', one JSON line per batch), so
+      recording a batch costs the size of the batch. The journal is compacted into the state file once it holds
+      more entries than the state file, which keeps the total rewrite cost linear in the catalogue size.
+    - A journal line cut short by a crash is ignored; its batch is simply ingested again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.namespace = None
+        self.done = set()
+        self.vector_ids = set()
+        self.duplicates = 0
+        self._compacted_entries = 0
+        self._journal_entries = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.namespace = state["namespace"]
+            self.done = set(state["done"])
+            self.vector_ids = set(state.get("vectorIds", []))
+            self.duplicates = state.get("duplicates", 0)
+            self._compacted_entries = len(self.done) + len(self.vector_ids)
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        batch = json.loads(line)
+                    except ValueError:
+                        break
+                    self._apply(batch)
+
+    def _apply(self, batch):
+        self.done.update(batch["done"])
+        self.vector_ids.update(batch["vectorIds"])
+        self.duplicates += batch["duplicates"]
+        self._journal_entries += len(batch["done"]) + len(batch["vectorIds"])
+
+    def record(self, done, vector_ids, duplicates=0):
+        """
+        Records an upserted batch.
+
+        Parameters:
+        - done (list): The catalogue paths processed in the batch.
+        - vector_ids (list): The IDs of the vectors upserted.
+        - duplicates (int, optional): The stamps skipped as duplicates.
+        """
+
+        if not os.path.exists(self.path):
+            self.compact()
+        batch = {"done": list(done), "vectorIds": list(vector_ids), "duplicates": duplicates}
+        with open(self.journal_path, "a") as f:
+            f.write(json.dumps(batch) + "\n")
+        self._apply(batch)
+        if self._journal_entries > max(self._compacted_entries, 1000):
+            self.compact()
+
+    def compact(self):
+        """
+        Writes the whole state to the state file and empties the journal.
+        """
+
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"namespace": self.namespace, "done": sorted(self.done), "vectorIds": sorted(self.vector_ids), "duplicates": self.duplicates}, f)
+        os.replace(temp_path, self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._compacted_entries = len(self.done) + len(self.vector_ids)
+        self._journal_entries = 0
+
+    def remove(self):
+        """
+        Deletes the state file and its journal, so the next run starts over.
+        """
+
+        for path in (self.path, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,95 @@
+import threading
+import numpy as np
+from stamp_detection.reference_cache import normalize_rows
+
+
+class MemoryIndex:
+    """
+    In-process stand-in for the Pinecone index, used with STUB_MODELS so load tests need no live index.
+
+    Notes:
+    - Implements the calls the app makes ('query', 'upsert', 'describe_index_stats') with Pinecone's arguments and
+      response shapes: cosine scores, equality filters on metadata (a value or {'$eq': value}) and namespaces.
+    - Upserts are visible at once. Each worker process has its own index, so a stamp added through one worker is
+      not seen by the others.
+    """
+
+    def __init__(self, dimension):
+        self.dimension = dimension
+        self._namespaces = {}
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors, namespace=""):
+        """
+        Inserts or replaces (id, values, metadata) vectors or {'id', 'values', 'metadata'} dicts.
+
+        Returns:
+        - dict: {'upserted_count': number of vectors}.
+        """
+
+        with self._lock:
+            records = self._namespaces.setdefault(namespace, {})
+            for vector in vectors:
+                if isinstance(vector, dict):
+                    vector_id, values, metadata = vector["id"], vector["values"], vector.get("metadata", {})
+                else:
+                    vector_id, values, metadata = (tuple(vector) + ({},))[:3]
+                records[vector_id] = (np.asarray(values, dtype=np.float32), dict(metadata or {}))
+        return {"upserted_count": len(vectors)}
+
+    def query(self, vector, top_k, namespace="", filter=None, include_values=False, include_metadata=False, **kwargs):
+        """
+        Returns the 'top_k' vectors of a namespace most similar to 'vector' that match 'filter'.
+
+        Returns:
+        - dict: {'matches': [{'id', 'score', 'values', 'metadata'}], 'namespace'}, best match first.
+        """
+
+        with self._lock:
+            records = [(vector_id, values, metadata) for vector_id, (values, metadata) in self._namespaces.get(namespace, {}).items()
+                       if self._matches(metadata, filter)]
+        if not records:
+            return {"matches": [], "namespace": namespace}
+
+        scores = normalize_rows(np.stack([values for _, values, _ in records])) @ normalize_rows(vector)[0]
+        matches = []
+        for row in np.argsort(-scores)[:top_k]:
+            vector_id, values, metadata = records[row]
+            matches.append({"id": vector_id, "score": float(scores[row]), "values": values.tolist() if include_values else [],
+                            "metadata": metadata if include_metadata else None})
+        return {"matches": matches, "namespace": namespace}
+
+    def describe_index_stats(self):
+        """
+        Returns the dimension and the vector count of each namespace.
+        """
+
+        with self._lock:
+            namespaces = {name: {"vector_count": len(records)} for name, records in self._namespaces.items()}
+        return {"dimension": self.dimension, "namespaces": namespaces, "total_vector_count": sum(item["vector_count"] for item in namespaces.values())}
+
+    @staticmethod
+    def _matches(metadata, filter):
+        for key, condition in (filter or {}).items():
+            expected = condition.get("$eq") if isinstance(condition, dict) else condition
+            if str(metadata.get(key)) != str(expected):
+                return False
+        return True
+
+
+class AsyncMemoryIndex:
+    """
+    'AsyncIndex' interface over a 'MemoryIndex', for the async views.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    async def describe(self):
+        return None, self.index.dimension
+
+    async def query(self, vector, top_k, namespace, filter=None, include_values=False, include_metadata=False):
+        return self.index.query(vector, top_k, namespace=namespace, filter=filter, include_values=include_values, include_metadata=include_metadata)
+
+    async def upsert(self, vectors, namespace):
+        return self.index.upsert(vectors, namespace=namespace)["upserted_count"]
@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import time
+from custom_lib.logger import BaseLog
+from api_channel.settings import PINECONE_NAMESPACE, STAMP_NAMESPACE_PATH
+logger = BaseLog()
+
+
+class NamespacePointer:
+    """
+    The index namespace stamp lookups read from, shared by every worker process through a small JSON file.
+
+    Notes:
+    - Without 'path' the namespace is fixed to the 'default' argument, PINECONE_NAMESPACE unless given.
+    - 'switch' replaces the file atomically (write + rename), so a worker reads either the old or the new namespace,
+      never a partial state. Workers re-check the file at most every 'check_interval' seconds.
+    - 'touch' bumps the revision without changing the namespace, telling workers that stamps were added to it.
+    - Listeners registered with 'on_change' are called with the old and new state when a worker sees a change.
+    """
+
+    def __init__(self, path=STAMP_NAMESPACE_PATH, default=PINECONE_NAMESPACE, check_interval=5):
+        self.path = path
+        self.default = default
+        self.check_interval = check_interval
+        self._state = {"namespace": default, "revision": 0}
+        self._mtime = None
+        self._checked_at = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns the active namespace.
+        """
+
+        return self.state()["namespace"]
+
+    def version(self):
+        """
+        Returns the active (namespace, revision) pair; it changes in every worker when stamps are added or the namespace
+        is switched, so caches of index contents compare it to tell whether their entries are still current.
+        """
+
+        state = self.state()
+        return state["namespace"], state["revision"]
+
+    def state(self):
+        """
+        Returns the active pointer state.
+
+        Returns:
+        - dict: 'namespace', 'revision' and, once switched, 'previous' and 'switchedAt'.
+        """
+
+        if not self.path:
+            return self._state
+
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return self._state
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return self._state
+            if mtime == self._mtime:
+                return self._state
+            old, new = self._state, self._read()
+            self._mtime = mtime
+            if new is None:
+                return self._state
+            self._state = new
+            listeners = list(self._listeners) if (old["namespace"], old["revision"]) != (new["namespace"], new["revision"]) else []
+
+        for listener in listeners:
+            try:
+                listener(old, new)
+            except Exception as e:
+                logger.print(f"stamp namespace: listener failed: {str(e)}")
+        return new
+
+    def on_change(self, listener):
+        """
+        Registers a callable run with (old state, new state) when the pointer changes.
+        """
+
+        with self._lock:
+            self._listeners.append(listener)
+
+    def switch(self, namespace):
+        """
+        Points every worker at another namespace.
+
+        Parameters:
+        - namespace (str): The namespace to activate.
+
+        Returns:
+        - dict: The new pointer state.
+
+        Raises:
+        - ValueError: If no pointer file is configured (STAMP_NAMESPACE_PATH).
+        """
+
+        current = self._current()
+        return self._write({"namespace": namespace, "revision": current["revision"] + 1, "previous": current["namespace"], "switchedAt": time.time()})
+
+    def touch(self):
+        """
+        Bumps the revision of the active namespace so workers drop cached references and matches.
+        """
+
+        return self._write({**self._current(), "revision": self._current()["revision"] + 1})
+
+    def _current(self):
+        if not self.path:
+            raise ValueError(50019)
+        return self._read() or {"namespace": self.default, "revision": 0}
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            return {**state, "namespace": state["namespace"], "revision": int(state.get("revision", 0))}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.print(f"stamp namespace: could not read {self.path}: {str(e)}")
+            return None
+
+    def _write(self, state):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
+        with self._lock:
+            self._checked_at = 0
+        logger.print(f"stamp namespace: active namespace is {state['namespace']} (revision {state['revision']})")
+        return state
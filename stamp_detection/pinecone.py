@@ -1,27 +1,47 @@
 from PIL import Image
 from io import BytesIO
 import requests
-import tempfile
 from custom_lib.logger import BaseLog
 import torch
 from pinecone import Pinecone
-from api_channel.settings import PINECONE_API_KEY, PINECONE_INDEX_NAME
+from api_channel.settings import STUB_MODELS, PINECONE_API_KEY, PINECONE_INDEX_NAME, REFERENCE_CACHE_TTL, REFERENCE_CACHE_MAX_VECTORS, STAMP_CROP_CACHE_SIZE, STAMP_CROP_CACHE_TOLERANCE, STAMP_CROP_CACHE_PATH, STAMP_CATALOGUE_PATH, STAMP_CATALOGUE_RERANK, PINECONE_NAMESPACE, STAMP_NAMESPACE_PATH
+from stamp_detection.reference_cache import CompanyReferenceCache, normalize_rows
+from stamp_detection.crop_cache import StampCropCache, crop_hash
+from stamp_detection.namespace import NamespacePointer
+from stamp_detection.embedding_store import EmbeddingStore
+from stamp_detection.async_index import AsyncIndex
+from stamp_detection.memory_index import MemoryIndex, AsyncMemoryIndex
+from data_extraction.metrics import register_metrics
+from data_extraction.async_runtime import inference_executor
+import asyncio
 import datetime
 import uuid 
 import cv2
 import time
 import numpy as np
-from data_extraction.apps import metaClip_preprocess, metaClip_inference 
+from data_extraction.apps import model_registry
 
 
 logger = BaseLog()
 
+# seconds an upsert takes to become visible to index queries (the in-memory index of STUB_MODELS is immediate)
+STAMP_UPSERT_WAIT = 0 if STUB_MODELS else 15
+
+# seconds cached company references and stamp crop matches stay valid: without a pointer file (STAMP_NAMESPACE_PATH)
+# workers cannot tell each other about added stamps, so other workers then pick a new stamp up about as late as the index does
+STAMP_CACHE_TTL = REFERENCE_CACHE_TTL if STAMP_NAMESPACE_PATH else min(REFERENCE_CACHE_TTL, 15)
+
 # Force CPU mode for compatibility
 device=torch.device("cpu")
 
 # Initialize Pinecone only if API key is valid
 try:
-    if PINECONE_API_KEY and PINECONE_API_KEY not in ['', '*' * 10, 'your-pinecone-api-key']:
+    if STUB_MODELS:
+        from data_extraction.stub_models import EMBEDDING_DIMENSION
+        pinecone = None
+        index = MemoryIndex(EMBEDDING_DIMENSION)
+        logger.print("⚠️  STUB_MODELS is set: stamps are stored in an in-memory index")
+    elif PINECONE_API_KEY and PINECONE_API_KEY not in ['', '*' * 10, 'your-pinecone-api-key']:
         pinecone = Pinecone(api_key=PINECONE_API_KEY)
         index = pinecone.Index(PINECONE_INDEX_NAME)
         logger.print("✅ Pinecone initialized successfully")
@@ -34,6 +54,97 @@ except Exception as e:
     index = None
     logger.print(f"⚠️  Pinecone initialization failed: {str(e)}. Stamp detection features disabled.")
 
+if isinstance(index, MemoryIndex):
+    async_index = AsyncMemoryIndex(index)
+else:
+    async_index = AsyncIndex(pinecone, PINECONE_INDEX_NAME, PINECONE_API_KEY) if index is not None else None
+
+
+
+def load_local_catalogue():
+    """
+    Loads the local stamp catalogue (STAMP_CATALOGUE_PATH), or returns None if none is configured or it cannot be read.
+    """
+
+    if not STAMP_CATALOGUE_PATH:
+        return None
+    try:
+        store = EmbeddingStore.load(STAMP_CATALOGUE_PATH)
+        logger.print(f"✅ Local stamp catalogue loaded: {len(store)} stamps of namespace {store.namespace or PINECONE_NAMESPACE} ({store.dtype}, {store.memory_bytes() / 2**20:.1f} MiB)")
+        return store
+    except Exception as e:
+        logger.print(f"⚠️  Local stamp catalogue could not be loaded from {STAMP_CATALOGUE_PATH}: {str(e)}")
+        return None
+
+# Local stamp catalogue: while its namespace is active, stamp identification and company references are read from it instead of the index
+local_catalogue = load_local_catalogue()
+
+namespace_pointer = NamespacePointer()
+company_reference_cache = CompanyReferenceCache(ttl=STAMP_CACHE_TTL, max_vectors=REFERENCE_CACHE_MAX_VECTORS, shared_version=namespace_pointer.version)
+stamp_crop_cache = StampCropCache(max_entries=STAMP_CROP_CACHE_SIZE, tolerance=STAMP_CROP_CACHE_TOLERANCE, match_ttl=STAMP_CACHE_TTL, path=STAMP_CROP_CACHE_PATH, shared_version=namespace_pointer.version)
+register_metrics("stampCropCache", stamp_crop_cache.stats)
+
+
+def on_namespace_change(old, new):
+    """
+    Drops the caches that depend on the index contents when the active namespace changes or stamps were ingested into it,
+    and reloads the local stamp catalogue, which may have been rebuilt or extended.
+    """
+
+    global local_catalogue
+    local_catalogue = load_local_catalogue()
+    company_reference_cache.clear()
+    if old["namespace"] != new["namespace"]:
+        stamp_crop_cache.clear()
+    else:
+        stamp_crop_cache.invalidate_matches()
+
+namespace_pointer.on_change(on_namespace_change)
+
+
+def active_namespace():
+    """
+    Returns the index namespace stamps are read from and added to (see 'NamespacePointer').
+    """
+
+    return namespace_pointer.get()
+
+
+
+def active_catalogue():
+    """
+    Returns the local stamp catalogue if it was built for the active namespace, otherwise None (the index is used).
+
+    Notes:
+    - A catalogue built without a namespace stands in for PINECONE_NAMESPACE.
+    """
+
+    namespace = active_namespace()
+    catalogue = local_catalogue
+    if catalogue is None or (catalogue.namespace or PINECONE_NAMESPACE) != namespace:
+        return None
+    return catalogue
+
+
+
+def add_to_local_catalogue(vector):
+    """
+    Adds a new stamp vector (see 'new_stamp_vector') to the active local catalogue.
+
+    Notes:
+    - A catalogue that cannot be written is left unchanged; the stamp is still in the index.
+    - The other workers reload the catalogue when 'invalidate_company_stamps' bumps the pointer revision.
+    """
+
+    catalogue = active_catalogue()
+    if catalogue is None:
+        return
+    vector_id, values, metadata = vector
+    try:
+        catalogue.add(vector_id, metadata['company_id'], values)
+    except OSError as e:
+        logger.print(f"⚠️  Stamp {vector_id} could not be added to the local stamp catalogue: {str(e)}")
+
 
 def generate_embedding(image):
     """
@@ -43,23 +154,146 @@ def generate_embedding(image):
     - image: The input image for which the embedding will be generated.
 
     Returns:
-    - list: The embedding of the image as a list.
+    - np.ndarray: The float32 embedding of the image.
 
     Notes:
     - Assumes the existence of a pre-trained model ('model') and a device ('device').
     - Uses 'preprocess' function to prepare the image for the model.
     - Extracts image features using the model's 'get_image_features' method.
-    - Converts the image features to a list and returns it.
+    - The embedding stays a NumPy array; it is only converted to a list when sent to the index.
     """
     
-    if metaClip_preprocess is None or metaClip_inference is None:
-        logger.print("⚠️  MetaCLIP model not available, cannot generate embedding")
-        raise Exception("MetaCLIP model not loaded. Image similarity features unavailable in CPU mode.")
+    with model_registry.use("metaclip") as metaclip:
+        if metaclip is None:
+            logger.print("⚠️  MetaCLIP model not available, cannot generate embedding")
+            raise Exception("MetaCLIP model not loaded. Image similarity features unavailable in CPU mode.")
+        metaClip_preprocess, metaClip_inference = metaclip
+
+        with torch.no_grad():
+            inputs = metaClip_preprocess(images=image, return_tensors="pt").to(device)
+            image_features = metaClip_inference.get_image_features(**inputs)
+            return image_features[0].cpu().numpy().astype(np.float32)
+
+
+
+def generate_embeddings(images):
+    """
+    Generates embeddings for several images in a single forward pass.
+
+    Parameters:
+    - images (list): The input images (PIL Images or arrays).
+
+    Returns:
+    - np.ndarray: A (len(images), dim) float32 matrix of image embeddings.
+    """
+
+    with model_registry.use("metaclip") as metaclip:
+        if metaclip is None:
+            logger.print("⚠️  MetaCLIP model not available, cannot generate embedding")
+            raise Exception("MetaCLIP model not loaded. Image similarity features unavailable in CPU mode.")
+        metaClip_preprocess, metaClip_inference = metaclip
+
+        with torch.no_grad():
+            inputs = metaClip_preprocess(images=images, return_tensors="pt").to(device)
+            image_features = metaClip_inference.get_image_features(**inputs)
+            return image_features.cpu().numpy().astype(np.float32)
+
+
+
+def embed_crops(crops):
+    """
+    Returns the embeddings of stamp crops, reusing cached embeddings of crops seen before.
+
+    Parameters:
+    - crops (list): The cropped stamps (PIL Images).
+
+    Returns:
+    - np.ndarray: A (len(crops), dim) float32 matrix of image embeddings.
+
+    Notes:
+    - Only the crops missing from 'stamp_crop_cache' go through MetaCLIP, in a single forward pass.
+    """
+
+    if not stamp_crop_cache.enabled:
+        return generate_embeddings(crops)
+
+    keys = [crop_hash(crop) for crop in crops]
+    entries = [stamp_crop_cache.lookup(key) for key in keys]
+    missing = [i for i, entry in enumerate(entries) if entry is None]
+
+    embeddings = [entry["embedding"] if entry else None for entry in entries]
+    if missing:
+        for i, embedding in zip(missing, generate_embeddings([crops[i] for i in missing])):
+            stamp_crop_cache.store(keys[i], embedding)
+            embeddings[i] = embedding
+    return np.stack(embeddings).astype(np.float32)
+
+
+
+def query_top_match(embedding):
+    """
+    Queries the index for the stamp most similar to an embedding.
+
+    Parameters:
+    - embedding (np.ndarray): The stamp embedding.
 
-    with torch.no_grad():
-        inputs = metaClip_preprocess(images=image, return_tensors="pt").to(device)
-        image_features = metaClip_inference.get_image_features(**inputs)
-        return image_features.tolist()[0]
+    Returns:
+    - dict: The 'certainty' score, 'company_id' and 'image_id' of the best match, or an empty dict if the index has none.
+
+    Notes:
+    - With a local catalogue of the active namespace (STAMP_CATALOGUE_PATH) the match is searched there, re-ranked at full precision.
+    """
+
+    catalogue = active_catalogue()
+    if catalogue is not None:
+        matches = catalogue.search(embedding, top_k=1, rerank=STAMP_CATALOGUE_RERANK)
+        if not matches:
+            return {}
+        row, score = matches[0]
+        return {'certainty': score, 'company_id': str(catalogue.company_ids[row]), 'image_id': str(catalogue.ids[row])}
+
+    results = index.query(namespace=active_namespace(), vector=np.asarray(embedding).tolist(), top_k=1, include_metadata=True)
+    if not results['matches']:
+        return {}
+    return {'certainty': results['matches'][0]['score'],
+            'company_id': results['matches'][0]['metadata']['company_id'],
+            'image_id': results['matches'][0]['id'],
+            }
+
+
+
+def search_similar_crop(crop, threshold, embedding=None):
+    """
+    Identifies the company of a stamp crop, reusing the cached embedding and match of a near-identical crop.
+
+    Parameters:
+    - crop (PIL Image): The cropped stamp.
+    - threshold: The similarity threshold below which a match is considered invalid.
+    - embedding (np.ndarray, optional): The embedding of the crop if it was already computed (see 'embed_crops').
+
+    Returns:
+    - dict: The best match (see 'query_top_match'), or an empty dict if its score is below the threshold.
+    """
+
+    if index is None and active_catalogue() is None:
+        logger.print("⚠️  Pinecone not available, cannot search similar images")
+        return {}
+
+    key = crop_hash(crop) if stamp_crop_cache.enabled else None
+    entry = stamp_crop_cache.lookup(key) if key is not None else None
+    match = stamp_crop_cache.valid_match(entry)
+
+    if match is None:
+        version = stamp_crop_cache.match_version()
+        if entry:
+            embedding = entry["embedding"]
+        elif embedding is None:
+            embedding = generate_embedding(crop)
+        match = query_top_match(embedding)
+        if key is not None:
+            stamp_crop_cache.store(key, embedding, match, version)
+
+    return (match if match and match['certainty'] >= threshold else {})
 
 
 
@@ -88,7 +322,7 @@ def search_similar_image(test_image_path: str, threshold):
     with Image.open(test_image_path) as img:
         embedding = generate_embedding(img)
 
-    results = index.query(namespace="namespace", vector=embedding, top_k=1, include_values=True, include_metadata=True)
+    results = index.query(namespace=active_namespace(), vector=embedding.tolist(), top_k=1, include_values=True, include_metadata=True)
 
     res = {'certainty': results['matches'][0]['score'],
             'company_id': results['matches'][0]['metadata']['company_id'],
@@ -104,7 +338,7 @@ def get_top_match_company_ids(image_path, company_id, top_k=10, score_threshold=
     Gets the top matching company IDs based on the similarity of the provided image with a given company ID.
 
     Parameters:
-    - image_path (str): The file path to the image for which similarity is to be checked.
+    - image_path (str or Image): The image for which similarity is to be checked, as a file path or a PIL Image.
     - company_id: The company ID for which similarity is being checked.
     - top_k (int, optional): The maximum number of top matches to retrieve. Default is 10.
     - score_threshold (float, optional): The similarity score threshold below which a match is considered invalid. Default is 0.6.
@@ -124,8 +358,8 @@ def get_top_match_company_ids(image_path, company_id, top_k=10, score_threshold=
 
     try:
         stripped_company_id = company_id.lstrip('0')
-        embedding = generate_embedding(Image.open(image_path))
-        query_response = index.query(vector=embedding, top_k=top_k, include_metadata=True, filter={"company_id": stripped_company_id}, namespace="namespace")
+        embedding = generate_embedding(image_path if isinstance(image_path, Image.Image) else Image.open(image_path))
+        query_response = index.query(vector=embedding.tolist(), top_k=top_k, include_metadata=True, filter={"company_id": stripped_company_id}, namespace=active_namespace())
         matches = query_response.get("matches", [])
         existence = True if len(matches)>0 else False
         filtered_matches = [match["metadata"]["company_id"] for match in matches if match["score"] > score_threshold]
@@ -136,6 +370,101 @@ def get_top_match_company_ids(image_path, company_id, top_k=10, score_threshold=
 
 
 
+def fetch_company_reference_vectors(company_id, probe_vector, namespace=None):
+    """
+    Fetches the reference stamp vectors stored in the index for one company.
+
+    Parameters:
+    - company_id (str): The normalised (zero-stripped) company ID.
+    - probe_vector (np.ndarray): Any vector of the index dimension, used as the query vector of the filtered fetch.
+    - namespace (str, optional): The namespace to read. Defaults to the active namespace.
+
+    Returns:
+    - list or np.ndarray: The reference embeddings of the company (at most 'REFERENCE_CACHE_MAX_VECTORS'); read from the
+      local catalogue of the active namespace when no other namespace is asked for and the catalogue has stamps of the company.
+    """
+
+    catalogue = active_catalogue() if namespace is None else None
+    if catalogue is not None and (catalogue.has_company(company_id) or index is None):
+        return catalogue.company_vectors(company_id)[:company_reference_cache.max_vectors]
+
+    query_response = index.query(vector=np.asarray(probe_vector).tolist(), top_k=company_reference_cache.max_vectors, include_values=True, filter={"company_id": company_id}, namespace=namespace or active_namespace())
+    return [match["values"] for match in query_response.get("matches", [])]
+
+
+
+async def prefetch_company_references(company_id):
+    """
+    Loads the reference vectors of a company into 'company_reference_cache' with the async index client.
+
+    Parameters:
+    - company_id (str): The ID of the company to verify against.
+
+    Notes:
+    - Called by the async views before verification, so 'match_company_references' finds the references cached
+      instead of waiting on the index from the inference executor.
+    - The filtered fetch uses a constant probe vector; a company with more than 'REFERENCE_CACHE_MAX_VECTORS'
+      references may get a different subset than a fetch probed with a detected stamp.
+    - Nothing is fetched without an index or for a company the local catalogue has stamps of; a failed fetch is left to
+      the synchronous path.
+    """
+
+    stripped_company_id = str(company_id).lstrip('0')
+    catalogue = active_catalogue()
+    if async_index is None or (catalogue is not None and catalogue.has_company(stripped_company_id)):
+        return
+
+    matrix, version = company_reference_cache.lookup(stripped_company_id)
+    if matrix is not None:
+        return
+
+    try:
+        _, dimension = await async_index.describe()
+        query_response = await async_index.query(np.ones(dimension, dtype=np.float32).tolist(), top_k=company_reference_cache.max_vectors, namespace=active_namespace(),
+                                                 filter={"company_id": stripped_company_id}, include_values=True)
+        company_reference_cache.store(stripped_company_id, [match["values"] for match in query_response.get("matches", [])], version)
+    except Exception as e:
+        logger.print(f"error occured when prefetching company references: {str(e)}")
+
+
+
+def match_company_references(embeddings, company_id, score_threshold=0.7):
+    """
+    Scores embeddings of detected stamps against the cached reference stamps of a company.
+
+    Parameters:
+    - embeddings (np.ndarray): A (n, dim) matrix with one embedding per detected box.
+    - company_id (str): The ID of the company to verify against.
+    - score_threshold (float, optional): Cosine similarity above which a box matches the company. Default is 0.7.
+
+    Returns:
+    - tuple: A tuple containing two elements:
+    - bool: True if the company has reference stamps in the index, False otherwise.
+    - list: One boolean per embedding, True where the box matches one of the company's reference stamps.
+
+    Notes:
+    - Reference vectors are fetched once per company and cache version, then scoring is a local matrix product
+      with the same semantics as the filtered index query (cosine score strictly above 'score_threshold').
+    """
+
+    if index is None and active_catalogue() is None:
+        logger.print("⚠️  Pinecone not available, cannot get company IDs")
+        return False, [False] * len(embeddings)
+
+    try:
+        stripped_company_id = company_id.lstrip('0')
+        queries = normalize_rows(embeddings)
+        references = company_reference_cache.get(stripped_company_id, lambda: fetch_company_reference_vectors(stripped_company_id, queries[0]))
+        if references.shape[0] == 0:
+            return False, [False] * len(queries)
+        scores = queries @ references.T
+        return True, (scores.max(axis=1) > score_threshold).tolist()
+    except Exception as e:
+        logger.print(f"error occured when matching company references: {str(e)}")
+        return False, [False] * len(embeddings)
+
+
+
 def get_company_id_similarity(image, bbox, for_company_id_verification=False, company_id="", threshold = 0.7):
     """
     Retrieves similarity information for a company ID within a cropped image region.
@@ -159,15 +488,11 @@ def get_company_id_similarity(image, bbox, for_company_id_verification=False, co
     try:
         image_path = get_bounding_box_image(image, bbox)
 
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
-            temp_file_path = temp_file.name
-            image_path.save(temp_file_path, format='PNG')
+        if for_company_id_verification:
+            existence, filter_res = get_top_match_company_ids(image_path, company_id)
+            return existence, filter_res
 
-            if for_company_id_verification:
-                existence, filter_res = get_top_match_company_ids(temp_file_path, company_id)
-                return existence, filter_res
-
-            filter_res = search_similar_image(temp_file_path, threshold = threshold)
+        filter_res = search_similar_crop(image_path, threshold = threshold)
 
         return False, filter_res
     except Exception as e:
@@ -240,7 +565,9 @@ def insert_new_stamp_image_company_name(stamp_image, company_id):
     - Generates a unique stamp ID using the current timestamp and the provided company ID.
     - Encodes the stamp ID using a UUID algorithm.
     - Inserts the stamp image, its embedding, and the associated company ID into the database.
-    - Pauses for 15 seconds to allow time for the database operation to complete.
+    - Pauses for 'STAMP_UPSERT_WAIT' seconds to allow time for the database operation to complete.
+    - Adds the stamp to the local catalogue of the active namespace, if one is loaded (see 'add_to_local_catalogue').
+    - Invalidates the cached reference vectors of the company and the cached stamp crop matches so lookups pick up the new stamp.
     - Deletes the original stamp image file.
 
     Exceptions:
@@ -251,11 +578,66 @@ def insert_new_stamp_image_company_name(stamp_image, company_id):
         logger.warning("Pinecone index not available - insert_new_stamp_image_company_name cannot execute")
         return None
 
+    vector = new_stamp_vector(stamp_image, company_id)
+    index.upsert(vectors=[vector], namespace=active_namespace())
+    time.sleep(STAMP_UPSERT_WAIT)
+    add_to_local_catalogue(vector)
+    invalidate_company_stamps(company_id)
+    
+    return vector[0]
+
+
+
+async def insert_new_stamp_image_company_name_async(stamp_image, company_id):
+    """
+    Async variant of 'insert_new_stamp_image_company_name' for the async views.
+
+    Notes:
+    - The embedding runs on the inference executor; the upsert and the wait for it to become visible do not hold a thread.
+    """
+
+    if async_index is None:
+        logger.print("⚠️  Pinecone index not available - insert_new_stamp_image_company_name_async cannot execute")
+        return None
+
+    vector = await inference_executor.run(new_stamp_vector, stamp_image, company_id)
+    await async_index.upsert([vector], namespace=active_namespace())
+    await asyncio.sleep(STAMP_UPSERT_WAIT)
+    add_to_local_catalogue(vector)
+    invalidate_company_stamps(company_id)
+
+    return vector[0]
+
+
+
+def new_stamp_vector(stamp_image, company_id):
+    """
+    Embeds a new stamp image and builds its index vector.
+
+    Returns:
+    - tuple: (encoded stamp ID, embedding as a list, metadata with the company ID).
+    """
+
     img = cv2.cvtColor(np.array(Image.open(stamp_image)), cv2.COLOR_RGB2BGR)
     stamp_id = f"{company_id}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')[:-3]}"
     encoded_stamp_id = str(uuid.uuid3(uuid.NAMESPACE_DNS, stamp_id))
-    upsert_data = [(encoded_stamp_id, generate_embedding(img), {'company_id' : str(company_id)})]
-    index.upsert(vectors=upsert_data, namespace="namespace")
-    time.sleep(15)
-    
-    return encoded_stamp_id
\ No newline at end of file
+    return (encoded_stamp_id, generate_embedding(img).tolist(), {'company_id' : str(company_id)})
+
+
+
+def invalidate_company_stamps(company_id):
+    """
+    Drops the cached reference vectors of a company and the cached stamp crop matches after a stamp was added.
+
+    Notes:
+    - With a pointer file (STAMP_NAMESPACE_PATH) its revision is bumped, so every worker drops its cached references
+      and matches within the pointer check interval and reloads the local catalogue.
+    """
+
+    company_reference_cache.invalidate(str(company_id).lstrip('0'))
+    stamp_crop_cache.invalidate_matches()
+    if namespace_pointer.path:
+        try:
+            namespace_pointer.touch()
+        except OSError as e:
+            logger.print(f"⚠️  Stamp namespace pointer could not be bumped after adding a stamp of company {company_id}: {str(e)}")
@@ -0,0 +1,125 @@
+import threading
+import time
+import numpy as np
+from custom_lib.logger import BaseLog
+logger = BaseLog()
+
+
+class CompanyReferenceCache:
+    """
+    Per-company cache of reference stamp embeddings used by stamp verification.
+
+    Notes:
+    - Each company's reference vectors are kept as one contiguous, L2-normalised float32 matrix,
+      so scoring every detected box against a company is a single matrix-vector product.
+    - Entries are versioned: 'invalidate' bumps the company version (called after AddStamp) and the
+      next lookup refetches from the index. 'clear' drops every company at once (namespace switch).
+    - 'shared_version' is a callable returning a version shared by every worker process (see
+      'NamespacePointer.version'); entries cached under another shared version are stale, so a stamp added
+      through one worker is picked up by the others. Entries also expire after 'ttl' seconds.
+    """
+
+    def __init__(self, ttl=3600, max_vectors=1000, shared_version=None):
+        self.ttl = ttl
+        self.max_vectors = max_vectors
+        self.shared_version = shared_version
+        self._entries = {}
+        self._versions = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, company_id, fetch_fn):
+        """
+        Returns the reference matrix of a company, fetching it once per version.
+
+        Parameters:
+        - company_id (str): The normalised company ID.
+        - fetch_fn (callable): Called on a miss; must return a list of reference vectors for the company.
+
+        Returns:
+        - np.ndarray: A (n, dim) float32 matrix of L2-normalised reference embeddings (n may be 0).
+        """
+
+        matrix, version = self.lookup(company_id)
+        if matrix is not None:
+            return matrix
+        return self.store(company_id, fetch_fn(), version)
+
+    def lookup(self, company_id):
+        """
+        Returns the cached reference matrix of a company, for callers that fetch the vectors themselves (async views).
+
+        Parameters:
+        - company_id (str): The normalised company ID.
+
+        Returns:
+        - tuple: (the matrix, or None if it is missing or stale; the version to pass to 'store' after fetching).
+        """
+
+        shared_version = self.shared_version() if self.shared_version else None
+        with self._lock:
+            version = (shared_version, self._generation, self._versions.get(company_id, 0))
+            entry = self._entries.get(company_id)
+
+        if entry and entry["version"] == version and time.monotonic() - entry["loaded_at"] < self.ttl:
+            return entry["matrix"], version
+        return None, version
+
+    def store(self, company_id, vectors, version):
+        """
+        Caches the reference vectors of a company fetched at 'version' (see 'lookup'); they are dropped if the
+        company was invalidated in the meantime.
+
+        Returns:
+        - np.ndarray: The L2-normalised reference matrix.
+        """
+
+        matrix = normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+        shared_version = self.shared_version() if self.shared_version else None
+        with self._lock:
+            if (shared_version, self._generation, self._versions.get(company_id, 0)) == version:
+                self._entries[company_id] = {"matrix": matrix, "version": version, "loaded_at": time.monotonic()}
+
+        logger.print(f"reference cache: loaded {matrix.shape[0]} stamp vectors for company {company_id}")
+        return matrix
+
+    def invalidate(self, company_id):
+        """
+        Drops the cached references of a company and bumps its version so in-flight fetches are discarded.
+
+        Parameters:
+        - company_id (str): The normalised company ID.
+        """
+
+        with self._lock:
+            self._versions[company_id] = self._versions.get(company_id, 0) + 1
+            self._entries.pop(company_id, None)
+
+    def clear(self):
+        """
+        Drops the cached references of every company; in-flight fetches are discarded.
+        """
+
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+def normalize_rows(matrix):
+    """
+    L2-normalises the rows of a matrix so that dot products equal cosine similarity.
+
+    Parameters:
+    - matrix (np.ndarray): A 1-D vector or 2-D matrix of embeddings.
+
+    Returns:
+    - np.ndarray: A contiguous float32 2-D matrix with unit-length rows (zero rows are left as zeros).
+    """
+
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    if matrix.size == 0:
+        return np.zeros((0, matrix.shape[-1]), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms)
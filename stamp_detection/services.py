@@ -2,21 +2,28 @@ import os
 import cv2
 import numpy as np
 from PIL import Image
-from stamp_detection.pinecone import get_company_id_similarity
-from pdf2image import convert_from_path
-import tempfile
+from stamp_detection.pinecone import get_company_id_similarity, get_bounding_box_image, embed_crops, match_company_references, search_similar_crop
+from pdf2image import convert_from_path, pdfinfo_from_path
+import time
 from custom_lib.logger import BaseLog
-from data_extraction.apps import stamp_detection_model, document_classifier_model 
+from data_extraction.deadline import PARTIAL_PAGES
+from data_extraction.apps import model_registry
+from data_extraction.image_normalization import normalize_image, release_normalized_image, to_original_stamp_data
+from data_extraction.scratch import scratch_file, track_scratch_file, remove_scratch_file
+from data_extraction.verification import VerificationOptions, EARLY_EXIT
+from api_channel.settings import VERIFICATION_MATCH_THRESHOLD
 logger = BaseLog()
 
 
  
-def initiate_stamp_detection(image_path):
+def initiate_stamp_detection(image_path, imgsz=640, confidence=0.35):
     """
     Initiates stamp detection on the given image and extracts relevant stamp details.
 
     Parameters:
     - image_path (str): The path to the image for stamp detection.
+    - imgsz (int, optional): Input size of the stamp detection model. Default is 640.
+    - confidence (float, optional): Minimum confidence of a detected stamp box. Default is 0.35.
 
     Returns:
     - tuple: A tuple containing two elements:
@@ -27,26 +34,27 @@ def initiate_stamp_detection(image_path):
     - Exception: Any exception that may occur during stamp detection, company ID similarity check, or data extraction.
     """
 
-    new_result = stamp_detection_model(image_path)
-    
-    bounding_boxes = new_result[0].boxes.data.tolist()
+    with model_registry.use("stamp_detection") as stamp_detection_model:
+        new_result = stamp_detection_model(image_path, imgsz=imgsz)
+        bounding_boxes = new_result[0].boxes.data.tolist()
 
-    filtered_bounding_boxes = [item for item in bounding_boxes if item[4] > 0.35]
+    filtered_bounding_boxes = [item for item in bounding_boxes if item[4] > confidence]
 
     stamp_details_list = []
-    for box in filtered_bounding_boxes:
+    with Image.open(image_path) as image:
+        for box in filtered_bounding_boxes:
 
-        _, stamp_data = get_company_id_similarity(image_path, box[:6])
+            _, stamp_data = get_company_id_similarity(image, box[:6])
 
-        if not stamp_data: 
-            logger.print(f"Empty stamp_data for box: {box[:6]}")
-            continue
+            if not stamp_data: 
+                logger.print(f"Empty stamp_data for box: {box[:6]}")
+                continue
 
-        stamp_details = {
-            'companyId': stamp_data.get("company_id", ""),  
-            'boundingBoxCoordinates': box[:4]
-        }
-        stamp_details_list.append(stamp_details)
+            stamp_details = {
+                'companyId': stamp_data.get("company_id", ""),  
+                'boundingBoxCoordinates': box[:4]
+            }
+            stamp_details_list.append(stamp_details)
     combined_data = {
         'stampCount': len(bounding_boxes),
         'stampDetails': stamp_details_list
@@ -54,13 +62,14 @@ def initiate_stamp_detection(image_path):
     return combined_data, bounding_boxes
 
 
-def verifying_company_id_function(image_path, company_id):
+def verifying_company_id_function(image_path, company_id, match_threshold=VERIFICATION_MATCH_THRESHOLD):
     """
-    Verifies the presence and match of a company ID within an image using a stamp detection model and a company ID similarity function.
+    Verifies the presence and match of a company ID within an image using a stamp detection model and the cached reference stamps of the company.
 
     Parameters:
     - image_path (str): The path to the image file.
     - company_id (int): The ID of the company to be verified.
+    - match_threshold (float, optional): Cosine similarity above which a stamp matches the company. Defaults to VERIFICATION_MATCH_THRESHOLD.
 
     Returns:
     - dict: A dictionary containing verification results, including:
@@ -69,26 +78,25 @@ def verifying_company_id_function(image_path, company_id):
     - boundingBoxCoordinates (list): A list of bounding box coordinates (x1, y1, x2, y2) for detected company IDs.
     """
     try: 
-        new_result = stamp_detection_model(image_path)
-        
-        bounding_boxes = new_result[0].boxes.data.tolist()
+        with model_registry.use("stamp_detection") as stamp_detection_model:
+            new_result = stamp_detection_model(image_path)
+            bounding_boxes = new_result[0].boxes.data.tolist()
 
         filtered_bounding_boxes = [item for item in bounding_boxes if item[4] > 0.35]
 
-        company_ids = []
+        existence = False
         bounding_boxes = []
-        for box in filtered_bounding_boxes:
-
-            existence, company_id = get_company_id_similarity(image_path, box[:6], for_company_id_verification=True, company_id=company_id)
+        if filtered_bounding_boxes:
+            with Image.open(image_path) as image:
+                crops = [get_bounding_box_image(image, box[:6]) for box in filtered_bounding_boxes]
+                embeddings = embed_crops(crops)
 
-            if company_id:
-
-                company_ids.extend(company_id)
-                bounding_boxes.append(box[:4])
+            existence, box_matches = match_company_references(embeddings, company_id, match_threshold)
+            bounding_boxes = [box[:4] for box, matched in zip(filtered_bounding_boxes, box_matches) if matched]
 
         combined_data = {
             'companyExist': existence,
-            'comapanyMatch': True if len(company_ids)> 0 else False,
+            'comapanyMatch': True if len(bounding_boxes)> 0 else False,
             'boundingBoxCoordinates': bounding_boxes
         }
         return combined_data
@@ -104,7 +112,69 @@ def verifying_company_id_function(image_path, company_id):
 
 
 
-def image_file_operation_for_stamp_id_verfication(image_path, company_id, page_index=1, is_image = True):
+def analyze_stamps(image_path, company_id, imgsz=640, confidence=0.35, match_threshold=VERIFICATION_MATCH_THRESHOLD):
+    """
+    Identifies the stamps of an image and verifies them against a company with a single detection and embedding pass.
+
+    Parameters:
+    - image_path (str): The path to the image.
+    - company_id (str): The ID of the company to verify against.
+    - imgsz (int, optional): Input size of the stamp detection model. Default is 640.
+    - confidence (float, optional): Minimum confidence of a detected stamp box. Default is 0.35.
+    - match_threshold (float, optional): Cosine similarity above which a stamp matches the company, as in
+      'verifying_company_id_function'. Defaults to VERIFICATION_MATCH_THRESHOLD.
+
+    Returns:
+    - dict: A dictionary containing:
+    - stampCount, stampDetails: The identification result, as returned by 'initiate_stamp_detection'.
+    - verification (dict): The verification result, as returned by 'verifying_company_id_function'.
+
+    Notes:
+    - The stamp model runs once and every crop is embedded once ('embed_crops'). Identification queries the index with
+      those embeddings and verification scores the same embeddings against the company's cached reference stamps.
+    """
+
+    with model_registry.use("stamp_detection") as stamp_detection_model:
+        new_result = stamp_detection_model(image_path, imgsz=imgsz)
+        bounding_boxes = new_result[0].boxes.data.tolist()
+
+    filtered_bounding_boxes = [item for item in bounding_boxes if item[4] > confidence]
+
+    stamp_details_list = []
+    existence = False
+    matched_boxes = []
+    if filtered_bounding_boxes:
+        with Image.open(image_path) as image:
+            crops = [get_bounding_box_image(image, box[:6]) for box in filtered_bounding_boxes]
+            embeddings = embed_crops(crops)
+
+        for box, crop, embedding in zip(filtered_bounding_boxes, crops, embeddings):
+            stamp_data = search_similar_crop(crop, threshold=0.7, embedding=embedding)
+
+            if not stamp_data:
+                logger.print(f"Empty stamp_data for box: {box[:6]}")
+                continue
+
+            stamp_details_list.append({
+                'companyId': stamp_data.get("company_id", ""),
+                'boundingBoxCoordinates': box[:4]
+            })
+
+        existence, box_matches = match_company_references(embeddings, company_id, match_threshold)
+        matched_boxes = [box[:4] for box, matched in zip(filtered_bounding_boxes, box_matches) if matched]
+
+    return {
+        'stampCount': len(bounding_boxes),
+        'stampDetails': stamp_details_list,
+        'verification': {
+            'companyExist': existence,
+            'comapanyMatch': True if len(matched_boxes) > 0 else False,
+            'boundingBoxCoordinates': matched_boxes
+        }
+    }
+
+
+def image_file_operation_for_stamp_id_verfication(image_path, company_id, page_index=1, is_image = True, match_threshold=VERIFICATION_MATCH_THRESHOLD):
     """
     Processes an image file for stamp ID verification, extracting relevant information.
 
@@ -113,6 +183,7 @@ def image_file_operation_for_stamp_id_verfication(image_path, company_id, page_i
     - company_id (int): The ID of the company associated with the document.
     - page_index (int, optional): The page number of the image within a multi-page document. Defaults to 1.
     - is_image (bool, optional): Flag indicating whether the input file is a standalone image or part of a larger document. Defaults to True.
+    - match_threshold (float, optional): Cosine similarity above which a stamp matches the company (see 'verifying_company_id_function').
 
     Returns:
     - list or dict: If is_image is True, returns a list containing a single dictionary with the extracted information. Otherwise, returns a dictionary directly. The structure of the dictionary is:
@@ -122,11 +193,16 @@ def image_file_operation_for_stamp_id_verfication(image_path, company_id, page_i
     - other_extracted_data (dict): Any other extracted information from the image.
 
     Raises:
+    - ValueError(50022): The image has more pixels than IMAGE_MAX_PIXELS.
     - Exception: If an error occurs while processing the image file.
+
+    Notes:
+    - The stamp model reads the normalized image (see 'normalize_image'); boxes are reported in original coordinates.
     """
 
+    normalized = normalize_image(image_path)
     try:
-        res = verifying_company_id_function(image_path, company_id)
+        res = to_original_stamp_data(verifying_company_id_function(normalized["path"], company_id, match_threshold), normalized)
 
         data_dict = {"page": page_index, **res}
 
@@ -136,15 +212,19 @@ def image_file_operation_for_stamp_id_verfication(image_path, company_id, page_i
         return data_dict
     except Exception as e:
         logger.print("error while processing single image file", str(e))
+    finally:
+        release_normalized_image(normalized)
 
 
-def pdf_file_operation_for_stamp_id_verification(file_path, company_id):
+def pdf_file_operation_for_stamp_id_verification(file_path, company_id, deadline=None, options=None):
     """
     Processes a PDF file for stamp ID verification, extracting relevant information from relevant pages.
 
     Parameters:
     file_path (str): The path to the PDF file.
     company_id (int): The ID of the company associated with the document.
+    deadline (Deadline, optional): The request deadline; once it is nearly spent the remaining pages are skipped.
+    options (VerificationOptions, optional): The page order, match threshold and early exit of the request.
 
     Returns:
     list: A list of dictionaries, where each dictionary contains the extracted information from a relevant page. Each dictionary contains:
@@ -155,28 +235,136 @@ def pdf_file_operation_for_stamp_id_verification(file_path, company_id):
 
     Raises:
     ValueError: If an error occurs while processing the PDF file. 
-    
+
+    Notes:
+    - The pages are listed in page number order, whatever order they were verified in.
     """
     try:
-        res = []
+        pages = [event["data"] for event in iter_pdf_file_operation_for_stamp_id_verification(file_path, company_id, deadline, options) if event["event"] == "page"]
+        return sorted(pages, key=lambda page: page["page"])
+
+    except Exception as e:
+        logger.print(f"Error occurred while get ids: {str(e)}")
+        return []
+
+
+def iter_pdf_file_operation_for_stamp_id_verification(file_path, company_id, deadline=None, options=None):
+    """
+    Streams the stamp ID verification of a PDF file page by page.
 
-        pdf_images = convert_from_path(file_path)
-        for idx, image in enumerate(pdf_images, start=1):
+    Parameters:
+    - file_path (str): The path to the PDF file.
+    - company_id (int): The ID of the company associated with the document.
+    - deadline (Deadline, optional): The request deadline; once it is nearly spent the remaining pages are skipped.
+    - options (VerificationOptions, optional): The page order, match threshold and early exit of the request.
+      Defaults to every page, first to last.
+
+    Yields:
+    - dict: Events with keys 'event' and 'data':
+    - page: the verification result of a relevant page, as soon as it is done.
+    - progress: a page that was skipped ({'page', 'status': 'skipped', 'reason': 'notRelevant', 'deadline' or
+      'earlyExit'}).
+    - summary: the last event ({'pages', 'relevantPages', 'duration', 'degradations'}, plus 'matchedPage' and
+      'skippedPages' with 'stopOnFirstMatch').
+
+    Notes:
+    - With 'stopOnFirstMatch' the first page whose stamps match the company ends the loop; the pages not verified yet
+      are reported as skipped with reason 'earlyExit' and recorded in the options.
+    """
 
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_image:
-                image_cv2 = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                cv2.imwrite(temp_image.name, image_cv2)
+    start_time = time.time()
+    options = options or VerificationOptions()
+    pages = pdf_page_count(file_path)
+    order = options.order(pages)
+    relevant_pages = 0
 
-                relevancy = document_classifer(temp_image.name)
-                if relevancy == "Relevant":
-                    res_dict = image_file_operation_for_stamp_id_verfication(temp_image.name, company_id, idx, False)  
-                    res.append(res_dict) 
+    for position, idx in enumerate(order):
+        if deadline and not deadline.allow(PARTIAL_PAGES):
+            yield {"event": "progress", "data": {"page": idx, "status": "skipped", "reason": "deadline"}}
+            continue
 
-        return res
+        image = render_pdf_page(file_path, idx)
 
-    except Exception as e:
-        logger.print(f"Error occurred while get ids: {str(e)}")
-        return []
+        page_path = scratch_file(file_path, '.png')
+        try:
+            cv2.imwrite(page_path, cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR))
+            track_scratch_file(page_path)
+
+            relevancy = document_classifer(page_path)
+            res_dict = image_file_operation_for_stamp_id_verfication(page_path, company_id, idx, False, options.match_threshold) if relevancy == "Relevant" else None
+        finally:
+            remove_scratch_file(page_path)
+
+        if res_dict is not None:
+            relevant_pages += 1
+            yield {"event": "page", "data": res_dict}
+        else:
+            yield {"event": "progress", "data": {"page": idx, "status": "skipped", "reason": "notRelevant"}}
+
+        if options.stop_on_first_match and res_dict is not None and res_dict["comapanyMatch"]:
+            options.record_match(idx, order[position + 1:])
+            for skipped in options.skipped_pages:
+                yield {"event": "progress", "data": {"page": skipped, "status": "skipped", "reason": EARLY_EXIT}}
+            break
+
+    summary = {"pages": pages, "relevantPages": relevant_pages, "duration": time.time() - start_time, "degradations": deadline.degradations if deadline else []}
+    if options.stop_on_first_match:
+        summary.update({"matchedPage": options.matched_page, "skippedPages": options.skipped_pages})
+    yield {"event": "summary", "data": summary}
+
+
+def iter_image_file_operation_for_stamp_id_verification(image_path, company_id, deadline=None, options=None):
+    """
+    Streams the stamp ID verification of a single image as one page event followed by the summary event.
+
+    Parameters:
+    - image_path (str): The path to the image file.
+    - company_id (int): The ID of the company associated with the document.
+    - deadline (Deadline, optional): Unused for a single image; accepted for symmetry with the PDF variant.
+    - options (VerificationOptions, optional): The match threshold of the request; page order and early exit do not
+      apply to a single page.
+
+    Yields:
+    - dict: A 'page' event and a 'summary' event (see 'iter_pdf_file_operation_for_stamp_id_verification').
+    """
+
+    start_time = time.time()
+    options = options or VerificationOptions()
+    yield {"event": "page", "data": image_file_operation_for_stamp_id_verfication(image_path, company_id, 1, False, options.match_threshold)}
+    yield {"event": "summary", "data": {"pages": 1, "relevantPages": 1, "duration": time.time() - start_time, "degradations": []}}
+
+
+def pdf_page_count(file_path):
+    """
+    Returns the number of pages of a PDF without rendering it.
+
+    Parameters:
+    - file_path (str): The path to the PDF file.
+
+    Returns:
+    - int: The page count.
+    """
+
+    return pdfinfo_from_path(file_path)["Pages"]
+
+
+def render_pdf_page(file_path, page_index, dpi=200):
+    """
+    Renders a single page of a PDF.
+
+    Parameters:
+    - file_path (str): The path to the PDF file.
+    - page_index (int): The 1-based page index.
+    - dpi (int, optional): The render resolution. Default is 200 (the pdf2image default).
+
+    Returns:
+    - PIL Image: The rendered page.
+
+    Notes:
+    - Rendering page by page keeps one rendered page in memory at a time, so peak memory does not grow with the page count.
+    """
+
+    return convert_from_path(file_path, dpi=dpi, first_page=page_index, last_page=page_index)[0]
 
 
 def document_classifer(image_path):
@@ -194,9 +382,10 @@ def document_classifer(image_path):
     """
 
     try:
-        res = document_classifier_model(image_path)
-        probs = res[0].probs.data.tolist()
-        label = res[0].names[np.argmax(probs)]
+        with model_registry.use("document_classifier") as document_classifier_model:
+            res = document_classifier_model(image_path)
+            probs = res[0].probs.data.tolist()
+            label = res[0].names[np.argmax(probs)]
         return label
     
     except Exception as e: